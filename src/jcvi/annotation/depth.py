@@ -5,10 +5,16 @@
 From genomeCovergeBed results, initialize the count array, set cutoffs
 and optimize against the truth, to determine the cutoff for incorporating
 RNA-seq into annotation pipelines.
+
+The count array is a flat uint8 file of per-base depth (saturating at 255),
+with the contig offsets in a tab-delimited sidecar `binfile.idx`.
 """
 
+from io import BytesIO
 from itertools import groupby
 import os.path as op
+import re
+import shutil
 import sys
 
 import numpy as np
@@ -16,6 +22,11 @@ import numpy as np
 from ..apps.base import ActionDispatcher, OptionParser, logger
 from ..formats.base import BaseFile, must_open
 from ..formats.sizes import Sizes
+from ..utils.profiler import span
+
+# Header lines of bedGraph files
+HEADER_PREFIXES = (b"track", b"browser")
+HEADER_LINES = re.compile(rb"^(?:track|browser)\b[^\n]*\n?", re.M)
 
 
 class BinFile(BaseFile):
@@ -30,6 +41,20 @@ class BinFile(BaseFile):
             binfile
         ), "Binary file `{0}` not found. Rerun depth.count().".format(binfile)
         self.dtype = dtype
+        self.idxfile = binfile + ".idx"
+
+    @property
+    def offsets(self):
+        """
+        Contig => (offset, length) in the count array, from `binfile.idx`.
+        """
+        assert op.exists(self.idxfile), "Index `{0}` not found".format(self.idxfile)
+        offsets = {}
+        with open(self.idxfile) as fp:
+            for row in fp:
+                ctg, offset, length = row.split()
+                offsets[ctg] = (int(offset), int(length))
+        return offsets
 
     @property
     def array(self):
@@ -150,52 +175,195 @@ def merge(args):
     logger.debug("Compact array back to uint8 with size {0}".format(fastasize))
     merged_ar = np.array(merged_ar, dtype=np.uint8)
     merged_ar.tofile(mergedbin)
+    if op.exists(b.idxfile):
+        shutil.copyfile(b.idxfile, mergedbin + ".idx")
     logger.debug("Merged array written to `{0}`".format(mergedbin))
 
 
 def query(args):
     """
-    %prog query binfile fastafile ctgID baseID
+    %prog query binfile [fastafile] ctgID baseID
 
-    Get the depth at a particular base.
+    Get the depth at a particular base. The contig offsets are read from
+    binfile.idx, or computed from the fastafile when given.
     """
     p = OptionParser(query.__doc__)
     opts, args = p.parse_args(args)
 
-    if len(args) != 4:
+    if len(args) not in (3, 4):
         sys.exit(not p.print_help())
 
-    binfile, fastafile, ctgID, baseID = args
+    binfile, ctgID, baseID = args[0], args[-2], args[-1]
     b = BinFile(binfile)
     ar = b.mmarray
 
-    fastasize, sizes, offsets = get_offsets(fastafile)
-    oi = offsets[ctgID] + int(baseID) - 1
+    if len(args) == 4:
+        fastasize, sizes, offsets = get_offsets(args[1])
+        offset = offsets[ctgID]
+    else:
+        offset, _ = b.offsets[ctgID]
+    oi = offset + int(baseID) - 1
     print("\t".join((ctgID, baseID, str(ar[oi]))))
 
 
-def update_array(ar, coveragefile, offsets):
-    fp = open(coveragefile)
-    logger.debug("Parse file `{0}`".format(coveragefile))
-    for k, rows in groupby(fp, key=(lambda x: x.split()[0])):
-        rows = list(rows)
-        offset = offsets[k]
-        ctglen = len(rows)
+def saturating_add(ar, idx, counts):
+    """
+    Add counts to ar[idx], capping at the max of the array dtype.
+    """
+    cap = np.iinfo(ar.dtype).max
+    ar[idx] = np.minimum(ar[idx].astype(np.int64) + counts, cap)
+
+
+def add_ranges(ar, starts, ends, values, maxbases=1 << 24):
+    """
+    Add values to ar[starts[i]:ends[i]], capping at the max of the array
+    dtype. Ranges are expanded into base indices in batches of at most
+    `maxbases` bases.
+    """
+    lengths = ends - starts
+    batch = np.cumsum(lengths) // maxbases
+    for b in np.unique(batch):
+        sel = batch == b
+        s, n, v = starts[sel], lengths[sel], values[sel]
+        total = n.sum()
+        shift = np.repeat(s - (np.cumsum(n) - n), n)
+        saturating_add(ar, shift + np.arange(total), np.repeat(v, n))
+
 
-        if ctglen < 100000:
-            sys.stdout.write(".")
-        else:
-            print(k, offset)
+def iter_blocks(filename, blocksize=64 * 1024 * 1024):
+    """
+    Read a text file in blocks of about `blocksize` bytes, cut at line ends.
+    """
+    leftover = b""
+    with open(filename, "rb") as fp:
+        while True:
+            block = fp.read(blocksize)
+            if not block:
+                break
+            block = leftover + block
+            cut = block.rfind(b"\n") + 1
+            block, leftover = block[:cut], block[cut:]
+            if block:
+                yield block
+    if leftover.strip():
+        yield leftover
+
+
+def iter_columns(filename, dtypes, blocksize=64 * 1024 * 1024):
+    """
+    Parse whitespace-delimited rows in blocks with `np.loadtxt`, yielding one
+    numpy array per column for each block. The first column holds the contig
+    names (as bytes), the other columns are of `dtypes`. The `track` and
+    `browser` lines of bedGraph files are skipped.
+    """
+    for block in iter_blocks(filename, blocksize=blocksize):
+        if block.startswith(HEADER_PREFIXES) or any(
+            b"\n" + x in block for x in HEADER_PREFIXES
+        ):
+            block = HEADER_LINES.sub(b"", block)
+            if not block.strip():
+                continue
+        # Names are no longer than the longest line of the block
+        newlines = np.flatnonzero(np.frombuffer(block, np.uint8) == ord("\n"))
+        width = int(np.diff(newlines, prepend=-1, append=len(block)).max())
+        dtype = [("f0", "S{0}".format(width))] + [
+            ("f{0}".format(i + 1), x) for i, x in enumerate(dtypes)
+        ]
+        rows = np.loadtxt(BytesIO(block), dtype=dtype, comments="#", ndmin=1)
+        yield [rows[name] for name, _ in dtype]
 
-        # assert ctglen == sizes[k]
-        for i, row in enumerate(rows):
-            ctgID, baseID, count = row.split()
-            oi = offset + i
-            newcount = ar[oi] + int(count)
-            if newcount > 255:
-                newcount = 255
 
-            ar[oi] = newcount
+def contig_runs(names):
+    """
+    Split an array of contig names into (name, start, end) runs.
+    """
+    breaks = np.flatnonzero(names[1:] != names[:-1]) + 1
+    bounds = np.concatenate(([0], breaks, [len(names)]))
+    for a, b in zip(bounds[:-1], bounds[1:]):
+        yield names[a].decode(), a, b
+
+
+def guess_coverage_format(coveragefile):
+    """
+    Tell `genomeCoverageBed -d` output (perbase) from bedgraph or BAM.
+    """
+    if coveragefile.endswith((".bam", ".cram")):
+        return "bam"
+    with open(coveragefile) as fp:
+        for row in fp:
+            if row.startswith(("#", "track", "browser")):
+                continue
+            return "bedgraph" if len(row.split()) == 4 else "perbase"
+    return "perbase"
+
+
+def update_array(ar, coveragefile, offsets, format=None):
+    """
+    Add the depth in coveragefile onto the count array ar, where contigs
+    start at `offsets`. Text input is parsed in blocks with numpy, and BAM
+    depth is computed with pysam.
+    """
+    format = format or guess_coverage_format(coveragefile)
+    logger.debug("Parse file `%s` (%s)", coveragefile, format)
+
+    if format == "bam":
+        update_array_bam(ar, coveragefile, offsets)
+        return
+
+    if format == "bedgraph":
+        dtypes = (np.int64, np.int64, float)
+    else:
+        dtypes = (np.int64, np.int64)
+    with span("depth.update_array") as stage:
+        for columns in iter_columns(coveragefile, dtypes):
+            names = columns[0]
+            stage.add(len(names))
+            if format == "bedgraph":
+                starts, ends = columns[1], columns[2]
+                values = columns[3].astype(np.int64)
+            else:
+                bases, counts = columns[1], columns[2]
+            for ctg, a, b in contig_runs(names):
+                offset = offsets[ctg]
+                if format == "bedgraph":
+                    add_ranges(
+                        ar, offset + starts[a:b], offset + ends[a:b], values[a:b]
+                    )
+                else:
+                    # 1-based positions
+                    saturating_add(ar, offset + bases[a:b] - 1, counts[a:b])
+
+
+def update_array_bam(ar, bamfile, offsets, window=1000000):
+    """
+    Add per-base read depth from bamfile onto the count array.
+    """
+    import pysam
+
+    with pysam.AlignmentFile(bamfile) as bam, span("depth.update_array_bam") as stage:
+        for ctg, ctglen in zip(bam.references, bam.lengths):
+            if ctg not in offsets:
+                continue
+            offset = offsets[ctg]
+            stage.add(ctglen)
+            for start in range(0, ctglen, window):
+                end = min(start + window, ctglen)
+                acgt = bam.count_coverage(ctg, start, end, quality_threshold=0)
+                depth = np.sum(acgt, axis=0, dtype=np.int64)
+                saturating_add(ar, np.arange(offset + start, offset + end), depth)
+
+
+def write_offsets(binfile, fastafile):
+    """
+    Write the contig offsets of the count array into binfile.idx.
+    """
+    idxfile = binfile + ".idx"
+    s = Sizes(fastafile)
+    offsets = s.cumsizes_mapping
+    with open(idxfile, "w") as fw:
+        for ctg, ctglen in s.iter_sizes():
+            print("\t".join(str(x) for x in (ctg, offsets[ctg], ctglen)), file=fw)
+    return idxfile
 
 
 def get_offsets(fastafile):
@@ -211,9 +379,14 @@ def count(args):
     %prog count t.coveragePerBase fastafile
 
     Serialize the genomeCoverage results. The coordinate system of the count array
-    will be based on the fastafile.
+    will be based on the fastafile. Input can also be a bedgraph or a BAM file.
     """
     p = OptionParser(count.__doc__)
+    p.add_argument(
+        "--format",
+        choices=("perbase", "bedgraph", "bam"),
+        help="Input format, guessed from the file if not given",
+    )
     opts, args = p.parse_args(args)
 
     if len(args) != 2:
@@ -228,12 +401,15 @@ def count(args):
 
     fastasize, sizes, offsets = get_offsets(fastafile)
     logger.debug("Initialize array of uint8 with size {0}".format(fastasize))
-    ar = np.zeros(fastasize, dtype=np.uint8)
+    ar = np.memmap(countsfile, dtype=np.uint8, mode="w+", shape=(fastasize,))
 
-    update_array(ar, coveragefile, offsets)
+    update_array(ar, coveragefile, offsets, format=opts.format)
 
-    ar.tofile(countsfile)
+    ar.flush()
+    del ar
+    write_offsets(countsfile, fastafile)
     logger.debug("Array written to `{0}`".format(countsfile))
+    return countsfile
 
 
 if __name__ == "__main__":
@@ -162,8 +162,6 @@ def trimUTR(args):
     `python -m jcvi.formats.gff fixboundaries` on the resultant GFF3
     to adjust the boundaries of all parent 'gene' features
     """
-    import gffutils
-
     from jcvi.formats.base import SetFile
 
     p = OptionParser(trimUTR.__doc__)
@@ -267,7 +265,7 @@ def trimUTR(args):
                                                 extras.add(exon)
                         else:
                             refc = None
-                    except gffutils.exceptions.FeatureNotFoundError:
+                    except KeyError:
                         pass
                 start, end = get_cds_minmax(gff, cid, level=1)
                 if cid in trimrange:
@@ -13,7 +13,6 @@ from configparser import (
 )
 import errno
 import fnmatch
-from http.client import HTTPSConnection
 import logging
 import os
 import os.path as op
@@ -26,11 +25,6 @@ import sys
 import time
 from time import ctime
 from typing import Collection, List, Optional, Tuple, Union
-from urllib.parse import urlencode
-
-from natsort import natsorted
-from rich.console import Console
-from rich.logging import RichHandler
 
 from .. import __copyright__
 from .. import __version__ as version
@@ -42,6 +36,25 @@ JCVIHELP = f"JCVI utility libraries {version} [{__copyright__}]\n"
 TextCollection = Union[str, List[str], Tuple[str, ...]]
 
 
+class LazyRichHandler(logging.Handler):
+    """
+    Handler that only imports `rich` when the first record is emitted, so that
+    importing jcvi modules (and `--help`) stays fast.
+    """
+
+    def __init__(self, level=logging.NOTSET):
+        super().__init__(level)
+        self.handler = None
+
+    def emit(self, record):
+        if self.handler is None:
+            from rich.console import Console
+            from rich.logging import RichHandler
+
+            self.handler = RichHandler(console=Console(stderr=True))
+        self.handler.handle(record)
+
+
 def get_logger(name: str, level: int = logging.DEBUG):
     """
     Return a logger with a default ColoredFormatter.
@@ -49,7 +62,7 @@ def get_logger(name: str, level: int = logging.DEBUG):
     log = logging.getLogger(name)
     if log.hasHandlers():
         log.handlers.clear()
-    log.addHandler(RichHandler(console=Console(stderr=True)))
+    log.addHandler(LazyRichHandler())
     log.propagate = False
     log.setLevel(level)
     return log
@@ -127,7 +140,43 @@ class ActionDispatcher(object):
             )
             self.print_help()
 
-        globals[action](sys.argv[2:])
+        global _dispatching
+        args = sys.argv[2:]
+        report, args = pop_profile_report(args)
+        dispatching, _dispatching = _dispatching, True
+        try:
+            if report:
+                from ..utils.profiler import run_profiled
+
+                module = op.basename(sys.argv[0]).replace(".py", "")
+                name = "{0} {1}".format(module, action)
+                run_profiled(globals[action], args, report, name=name)
+                return
+
+            globals[action](args)
+        finally:
+            _dispatching = dispatching
+
+
+# Set while ActionDispatcher.dispatch() runs an action, which handles the
+# --profile_report option
+_dispatching = False
+
+
+def pop_profile_report(args: List[str]) -> Tuple[Optional[str], List[str]]:
+    """
+    Take the global --profile_report option out of the action arguments.
+    """
+    report, rest = None, []
+    args = iter(args)
+    for arg in args:
+        if arg == "--profile_report":
+            report = next(args, None)
+        elif arg.startswith("--profile_report="):
+            report = arg.split("=", 1)[1]
+        else:
+            rest.append(arg)
+    return report, rest
 
 
 class OptionParser(ArgumentParser):
@@ -139,6 +188,12 @@ class OptionParser(ArgumentParser):
     def __init__(self, doc: Optional[str]):
         usage = doc.replace("%prog", "%(prog)s") if doc else None
         super().__init__(usage=usage, epilog=JCVIHELP)
+        # Handled by ActionDispatcher.dispatch(), only listed for its actions
+        if _dispatching:
+            self.add_argument(
+                "--profile_report",
+                help="Profile the action, write time and memory report to this JSON",
+            )
 
     def parse_args(self, args=None):
         """
@@ -170,6 +225,8 @@ class OptionParser(ArgumentParser):
         if o.type == "choice":
             if o.default is None:
                 default_tag = "guess"
+            from natsort import natsorted
+
             ctext = "|".join(natsorted(str(x) for x in o.choices))
             if len(ctext) > 100:
                 ctext = ctext[:100] + " ... "
@@ -1270,6 +1327,8 @@ def glob(pathname, pattern=None):
     """
     import glob as gl
 
+    from natsort import natsorted
+
     if pattern:
         pathname = op.join(pathname, pattern)
     return natsorted(gl.glob(pathname))
@@ -1281,6 +1340,8 @@ def iglob(pathname, patterns):
 
     >>> iglob("apps", "*.py,*.pyc")
     """
+    from natsort import natsorted
+
     matches = []
     patterns = patterns.split(",") if "," in patterns else listify(patterns)
     for root, dirnames, filenames in os.walk(pathname):
@@ -1322,6 +1383,17 @@ def mkdir(dirname, overwrite=False):
     return True
 
 
+def user_cache_dir(*subdirs) -> str:
+    """
+    Per-user cache directory, $XDG_CACHE_HOME/jcvi or ~/.cache/jcvi, with the
+    subdirectories created with mode 0700.
+    """
+    root = os.environ.get("XDG_CACHE_HOME") or op.join(op.expanduser("~"), ".cache")
+    path = op.join(root, "jcvi", *subdirs)
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    return path
+
+
 def is_newer_file(a, b):
     """
     Check if the file a is newer than file b
@@ -1357,15 +1429,22 @@ def last_updated(a: str) -> float:
     return time.time() - op.getmtime(a)
 
 
-def need_update(a: TextCollection, b: TextCollection, warn: bool = False) -> bool:
+def need_update(
+    a: TextCollection, b: TextCollection, warn: bool = False, params=None
+) -> bool:
     """
     Check if file a is newer than file b and decide whether or not to update
     file b. Can generalize to two lists.
 
+    When the build cache is enabled (see `jcvi.apps.cache`), the decision is
+    based on the contents of a and the params instead, and missing outputs
+    from an earlier run are restored from the cache.
+
     Args:
         a: file or list of files
         b: file or list of files
         warn: whether or not to print warning message
+        params: command parameters that change b, used by the build cache
 
     Returns:
         True if file a is newer than file b
@@ -1378,6 +1457,10 @@ def need_update(a: TextCollection, b: TextCollection, warn: bool = False) -> boo
         or all((os.stat(x).st_size == 0 for x in b))
         or any(is_newer_file(x, y) for x in a for y in b)
     )
+    if os.environ.get("JCVI_CACHE"):
+        from .cache import get_build_cache
+
+        should_update = get_build_cache().need_update(a, b, should_update, params)
     if (not should_update) and warn:
         logger.debug("File `%s` found. Computation skipped.", ", ".join(b))
     return should_update
@@ -1740,6 +1823,9 @@ def pushover(
 
         timestamp = int(time())
 
+    from http.client import HTTPSConnection
+    from urllib.parse import urlencode
+
     retry, expire = (300, 3600) if priority == 2 else (None, None)
 
     conn = HTTPSConnection("api.pushover.net:443")
@@ -1771,6 +1857,9 @@ def nma(description, apikey, event="JCVI: Job Monitor", priority=0):
     """
     assert -2 <= priority <= 2, "Priority should be an int() between -2 and 2"
 
+    from http.client import HTTPSConnection
+    from urllib.parse import urlencode
+
     conn = HTTPSConnection("www.notifymyandroid.com")
     conn.request(
         "POST",
@@ -1796,6 +1885,8 @@ def pushbullet(body, apikey, device, title="JCVI: Job Monitor"):
     <https://www.pushbullet.com/api>
     """
     import base64
+    from http.client import HTTPSConnection
+    from urllib.parse import urlencode
 
     headers = {}
     auth = base64.encodestring("{0}:".format(apikey).encode("utf-8")).strip()
@@ -0,0 +1,329 @@
+"""
+Content-hash build cache for pipeline steps guarded by `need_update()`.
+
+The cache is opt-in, enabled by pointing the environment variable JCVI_CACHE
+to a cache directory:
+
+$ export JCVI_CACHE=~/.cache/jcvi
+
+Each step is keyed by the content digests of its inputs, the names of its
+outputs and the command parameters. A step whose inputs are unchanged is
+skipped even if the inputs were touched or copied (which breaks the mtime
+checks), and missing outputs are restored from the cache directory.
+"""
+
+import atexit
+import hashlib
+import json
+import os
+import os.path as op
+import shutil
+import sys
+import time
+from typing import Dict, List, Optional
+
+from .base import ActionDispatcher, OptionParser, TextCollection, listify, logger
+
+CACHE_ENV = "JCVI_CACHE"
+CHUNK_SIZE = 1 << 20
+
+
+def main():
+
+    actions = (
+        ("status", "summarize the steps and objects in the build cache"),
+        ("purge", "remove cached objects not accessed recently"),
+    )
+    p = ActionDispatcher(actions)
+    p.dispatch(globals())
+
+
+def new_hasher():
+    """
+    Return (name, hasher), using xxhash when it is installed.
+    """
+    try:
+        import xxhash
+
+        return "xxh3", xxhash.xxh3_128()
+    except ImportError:
+        return "blake2b", hashlib.blake2b(digest_size=16)
+
+
+def file_digest(filename: str) -> str:
+    """
+    Digest of the file contents, read in chunks, prefixed with the algorithm.
+    """
+    name, h = new_hasher()
+    with open(filename, "rb") as fp:
+        while True:
+            chunk = fp.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            h.update(chunk)
+    return f"{name}:{h.hexdigest()}"
+
+
+class BuildCache(object):
+    """
+    Manifest of file digests and completed steps, plus a store of the output
+    files under `cachedir/objects`, addressed by digest.
+
+    The digest of each file is memoized by path, size and mtime, so a file is
+    only hashed again after it changes. New entries are written back to
+    `cachedir/manifest.json` at exit.
+    """
+
+    def __init__(self, cachedir: str):
+        self.cachedir = cachedir
+        self.manifest = op.join(cachedir, "manifest.json")
+        self.objectdir = op.join(cachedir, "objects")
+        os.makedirs(self.objectdir, exist_ok=True)
+        self.files: Dict[str, list] = {}
+        self.steps: Dict[str, dict] = {}
+        self.pending: Dict[str, Dict[str, int]] = {}
+        self.dirty = False
+        self.load()
+
+    def load(self):
+        if not op.exists(self.manifest):
+            return
+        with open(self.manifest, encoding="utf-8") as fp:
+            data = json.load(fp)
+        self.files.update(data.get("files", {}))
+        self.steps.update(data.get("steps", {}))
+
+    def save(self):
+        """
+        Merge with the manifest on disk (other processes may have added to it)
+        and replace it atomically.
+        """
+        files, steps = self.files, self.steps
+        self.files, self.steps = {}, {}
+        self.load()
+        self.files.update(files)
+        self.steps.update(steps)
+        tmpfile = f"{self.manifest}.{os.getpid()}.tmp"
+        with open(tmpfile, "w", encoding="utf-8") as fw:
+            json.dump({"files": self.files, "steps": self.steps}, fw)
+        os.replace(tmpfile, self.manifest)
+        self.dirty = False
+
+    def digest(self, filename: str) -> str:
+        path = op.abspath(filename)
+        st = os.stat(path)
+        memo = self.files.get(path)
+        if memo and memo[0] == st.st_size and memo[1] == st.st_mtime_ns:
+            return memo[2]
+        digest = file_digest(path)
+        self.files[path] = [st.st_size, st.st_mtime_ns, digest]
+        self.dirty = True
+        return digest
+
+    def step_key(self, inputs: List[str], outputs: List[str], params=None) -> str:
+        """
+        Key of a step, from the contents of the inputs, the names of the outputs
+        and the command parameters.
+        """
+        data = {
+            "inputs": [self.digest(x) for x in inputs],
+            "outputs": [op.normpath(x) for x in outputs],
+            "params": params,
+        }
+        return hashlib.sha256(
+            json.dumps(data, sort_keys=True, default=str).encode()
+        ).hexdigest()
+
+    def object_path(self, digest: str) -> str:
+        name, hexdigest = digest.split(":", 1)
+        return op.join(self.objectdir, hexdigest[:2], f"{name}-{hexdigest[2:]}")
+
+    def outputs_match(self, step: dict) -> bool:
+        return all(
+            op.exists(x) and self.digest(x) == digest
+            for x, digest in step["outputs"].items()
+        )
+
+    def produced_by_other_step(self, outputs: List[str]) -> bool:
+        """
+        Check if the current outputs were recorded by a step with different
+        inputs or parameters.
+        """
+        current = {}
+        for x in outputs:
+            if op.exists(x):
+                current[x] = self.digest(x)
+        return any(
+            current.get(x) == digest
+            for step in self.steps.values()
+            for x, digest in step["outputs"].items()
+        )
+
+    def restore(self, step: dict) -> bool:
+        """
+        Copy the outputs of the step back from the object store.
+        """
+        objects = [self.object_path(x) for x in step["outputs"].values()]
+        if not all(op.exists(x) for x in objects):
+            return False
+        for output, obj in zip(step["outputs"], objects):
+            outdir = op.dirname(output)
+            if outdir:
+                os.makedirs(outdir, exist_ok=True)
+            shutil.copyfile(obj, output)
+            os.utime(obj)  # Mark object as recently used
+            logger.debug("Restore `%s` from build cache", output)
+        return True
+
+    def record(self, key: str, outputs: List[str]):
+        """
+        Store the outputs of a completed step.
+        """
+        digests = {}
+        for output in outputs:
+            digest = self.digest(output)
+            obj = self.object_path(digest)
+            if not op.exists(obj):
+                os.makedirs(op.dirname(obj), exist_ok=True)
+                tmpfile = f"{obj}.{os.getpid()}.tmp"
+                shutil.copyfile(output, tmpfile)
+                os.replace(tmpfile, obj)
+            digests[output] = digest
+        self.steps[key] = {"outputs": digests, "time": time.time()}
+        self.dirty = True
+
+    def need_update(
+        self, a: TextCollection, b: TextCollection, stale: bool, params=None
+    ) -> bool:
+        """
+        Refine the decision `stale` from the mtime checks in `need_update()`.
+        Returns False when the step with the same inputs and parameters has
+        been completed before and its outputs are present or restored, or when
+        the outputs are up to date and not from a cached step. Otherwise the
+        step is expected to run, and its outputs are recorded at exit.
+        """
+        inputs, outputs = listify(a), listify(b)
+        if not all(op.isfile(x) for x in inputs):
+            return stale
+        key = self.step_key(inputs, outputs, params)
+        step = self.steps.get(key)
+        if step:
+            if self.outputs_match(step):
+                logger.debug("Inputs of `%s` unchanged", ", ".join(outputs))
+                return False
+            if stale and self.restore(step):
+                return False
+        if not stale and not self.produced_by_other_step(outputs):
+            # Up to date by mtime, built before the cache was enabled
+            self.record(key, outputs)
+            return False
+        self.pending[key] = {
+            x: os.stat(x).st_mtime_ns if op.exists(x) else -1 for x in outputs
+        }
+        return True
+
+    def commit(self):
+        """
+        Record the pending steps whose outputs have been written since, and
+        save the manifest.
+        """
+        for key, mtimes in self.pending.items():
+            if all(
+                op.isfile(x) and os.stat(x).st_size and os.stat(x).st_mtime_ns > t
+                for x, t in mtimes.items()
+            ):
+                self.record(key, list(mtimes))
+        self.pending.clear()
+        if self.dirty:
+            self.save()
+
+
+_build_cache: Dict[str, BuildCache] = {}
+
+
+def get_build_cache(cachedir: Optional[str] = None) -> Optional[BuildCache]:
+    """
+    Return the build cache at `cachedir`, or at $JCVI_CACHE if not given. None
+    if the cache is not enabled.
+    """
+    cachedir = cachedir or os.environ.get(CACHE_ENV)
+    if not cachedir:
+        return None
+    cachedir = op.abspath(op.expanduser(cachedir))
+    if cachedir not in _build_cache:
+        cache = _build_cache[cachedir] = BuildCache(cachedir)
+        atexit.register(cache.commit)
+    return _build_cache[cachedir]
+
+
+def status(args):
+    """
+    %prog status [cachedir]
+
+    Summarize the steps and objects in the build cache, $JCVI_CACHE by default.
+    """
+    p = OptionParser(status.__doc__)
+    opts, args = p.parse_args(args)
+
+    if len(args) > 1:
+        sys.exit(not p.print_help())
+
+    cache = get_build_cache(args[0] if args else None)
+    if cache is None:
+        sys.exit(f"Build cache not enabled, set ${CACHE_ENV} or pass cachedir")
+
+    nobjects = size = 0
+    for dirpath, _, filenames in os.walk(cache.objectdir):
+        for filename in filenames:
+            nobjects += 1
+            size += op.getsize(op.join(dirpath, filename))
+    print(f"Cache directory: {cache.cachedir}")
+    print(f"Steps: {len(cache.steps)}")
+    print(f"Files hashed: {len(cache.files)}")
+    print(f"Objects: {nobjects} ({size} bytes)")
+
+
+def purge(args):
+    """
+    %prog purge [cachedir]
+
+    Remove cached objects that have not been stored or restored in the last
+    --days, and the steps that refer to them.
+    """
+    p = OptionParser(purge.__doc__)
+    p.add_argument(
+        "--days", default=30, type=float, help="Keep objects used in the last days"
+    )
+    opts, args = p.parse_args(args)
+
+    if len(args) > 1:
+        sys.exit(not p.print_help())
+
+    cache = get_build_cache(args[0] if args else None)
+    if cache is None:
+        sys.exit(f"Build cache not enabled, set ${CACHE_ENV} or pass cachedir")
+
+    cutoff = time.time() - opts.days * 86400
+    removed = 0
+    for dirpath, _, filenames in os.walk(cache.objectdir):
+        for filename in filenames:
+            path = op.join(dirpath, filename)
+            if op.getmtime(path) < cutoff:
+                os.remove(path)
+                removed += 1
+    cache.steps = {
+        k: v
+        for k, v in cache.steps.items()
+        if all(op.exists(cache.object_path(x)) for x in v["outputs"].values())
+    }
+    # Write the pruned steps directly, instead of merging into the manifest
+    tmpfile = f"{cache.manifest}.{os.getpid()}.tmp"
+    with open(tmpfile, "w", encoding="utf-8") as fw:
+        json.dump({"files": cache.files, "steps": cache.steps}, fw)
+    os.replace(tmpfile, cache.manifest)
+    cache.dirty = False
+    logger.info("Removed %d objects, %d steps remain", removed, len(cache.steps))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,399 @@
+"""
+Persistent worker for many small jcvi invocations.
+
+Every `python -m jcvi...` call imports the package and parses the reference
+files again, which dominates the run time of short actions. The daemon keeps
+jcvi imported and the parsed reference files (Bed, Sizes, Fasta) in an LRU
+cache, and runs the actions sent by the client over a Unix socket:
+
+$ python -m jcvi.apps.daemon start &
+$ python -m jcvi.apps.daemon run formats.fasta extract ref.fasta chr1:1-1000
+$ python -m jcvi.apps.daemon stop
+
+The client passes its stdin, stdout and stderr to the daemon, which runs the
+action in the working directory and environment of the client, and returns the
+exit status. Requests are run one at a time. The client runs the action itself
+if the daemon is not running.
+
+The socket is kept in a directory only accessible to the user, and both ends
+check that the other side runs as the same user, since the client hands over
+its environment and its std streams.
+"""
+
+import array
+from contextlib import contextmanager
+from importlib import import_module
+from inspect import signature
+import json
+import os
+import os.path as op
+import socket
+import stat
+import struct
+import sys
+import tempfile
+import time
+import traceback
+from typing import List, Optional, Sequence
+
+from .base import ActionDispatcher, OptionParser, getusername, logger
+
+SOCKET_ENV = "JCVI_DAEMON_SOCKET"
+PRELOAD = ("formats.base", "formats.bed", "formats.fasta", "formats.gff")
+
+
+def main():
+
+    actions = (
+        ("start", "start the daemon in the foreground"),
+        ("stop", "stop the daemon"),
+        ("status", "show the requests and cache statistics of the daemon"),
+        ("run", "run a jcvi action in the daemon"),
+    )
+    p = ActionDispatcher(actions)
+    p.dispatch(globals())
+
+
+def private_dir(path: str) -> str:
+    """
+    Create the directory with mode 0700 if missing, and check that it is owned
+    by the user and not accessible to others.
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid():
+        raise PermissionError("`{0}` is not a directory owned by the user".format(path))
+    if st.st_mode & 0o077:
+        raise PermissionError("`{0}` is accessible to other users".format(path))
+    return path
+
+
+def default_socket() -> str:
+    """
+    Socket path from $JCVI_DAEMON_SOCKET, or in a per-user private directory,
+    $XDG_RUNTIME_DIR or a 0700 directory in the temp dir.
+    """
+    socketfile = os.environ.get(SOCKET_ENV)
+    if socketfile:
+        return socketfile
+    rundir = os.environ.get("XDG_RUNTIME_DIR") or op.join(
+        tempfile.gettempdir(), "jcvi-{0}".format(getusername())
+    )
+    return op.join(private_dir(rundir), "jcvi-daemon.sock")
+
+
+def peer_uid(sock: socket.socket) -> Optional[int]:
+    """
+    User id of the process at the other end of the Unix socket, None where
+    SO_PEERCRED is not available.
+    """
+    if not hasattr(socket, "SO_PEERCRED"):
+        return None
+    creds = sock.getsockopt(
+        socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i")
+    )
+    _, uid, _ = struct.unpack("3i", creds)
+    return uid
+
+
+def check_owner(socketfile: str, sock: socket.socket):
+    """
+    Raise PermissionError unless the socket file, and the process listening
+    on it, belong to the user.
+    """
+    uid = os.stat(socketfile).st_uid
+    if uid == os.getuid() and peer_uid(sock) is not None:
+        uid = peer_uid(sock)
+    if uid != os.getuid():
+        raise PermissionError(
+            "jcvi daemon socket `{0}` belongs to another user (uid {1})".format(
+                socketfile, uid
+            )
+        )
+
+
+def send_request(socketfile: str, request: dict, fds: Sequence[int] = ()) -> dict:
+    """
+    Send the request as one line of JSON, with the file descriptors attached
+    to the first byte, and wait for the reply. Nothing is sent unless the
+    daemon runs as the same user.
+    """
+    data = (json.dumps(request) + "\n").encode()
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socketfile)
+        check_owner(socketfile, sock)
+        ancdata = []
+        if fds:
+            ancdata = [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array("i", fds))]
+        sock.sendmsg([data[:1]], ancdata)
+        sock.sendall(data[1:])
+        with sock.makefile("rb") as fp:
+            reply = fp.readline()
+    if not reply:
+        raise ConnectionError("No reply from jcvi daemon at `{0}`".format(socketfile))
+    return json.loads(reply)
+
+
+def recv_request(conn: socket.socket):
+    """
+    Receive a request sent by send_request(). Returns (fds, request).
+    """
+    fds = array.array("i")
+    msg, ancdata, _, _ = conn.recvmsg(1, socket.CMSG_SPACE(3 * fds.itemsize))
+    for level, kind, data in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(data[: len(data) - (len(data) % fds.itemsize)])
+    with conn.makefile("rb") as fp:
+        line = msg + fp.readline()
+    return list(fds), json.loads(line)
+
+
+def run_action(argv: List[str]) -> int:
+    """
+    Run `python -m jcvi.<module> <action> <args>` in this process, and return
+    the exit status.
+    """
+    module_name, args = argv[0], argv[1:]
+    if not module_name.startswith("jcvi."):
+        module_name = "jcvi." + module_name
+    saved_argv = sys.argv
+    try:
+        module = import_module(module_name)
+        sys.argv = [module.__file__] + args
+        if signature(module.main).parameters:
+            module.main(args)
+        else:
+            module.main()
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            return int(e.code or 0)
+        print(e.code, file=sys.stderr)
+        return 1
+    except Exception:
+        traceback.print_exc()
+        return 1
+    finally:
+        sys.argv = saved_argv
+    return 0
+
+
+@contextmanager
+def client_context(fds: Sequence[int], cwd: str, env: dict):
+    """
+    Run in the working directory and environment of the client, with its
+    stdin, stdout and stderr. The std streams are reopened, so that actions
+    that close them do not affect the next request.
+    """
+    saved_streams = sys.stdin, sys.stdout, sys.stderr
+    saved_fds = [os.dup(i) for i in range(3)]
+    saved_cwd, saved_env = os.getcwd(), dict(os.environ)
+    for stream in saved_streams[1:]:
+        stream.flush()
+    try:
+        for i, fd in enumerate(fds):
+            os.dup2(fd, i)
+        sys.stdin = open(0, closefd=False)
+        sys.stdout = open(1, "w", closefd=False)
+        sys.stderr = open(2, "w", closefd=False)
+        os.chdir(cwd)
+        os.environ.clear()
+        os.environ.update(env)
+        yield
+    finally:
+        for stream in (sys.stdin, sys.stdout, sys.stderr):
+            if stream not in saved_streams:
+                try:
+                    stream.close()
+                except OSError:  # Client went away
+                    pass
+        os.environ.clear()
+        os.environ.update(saved_env)
+        os.chdir(saved_cwd)
+        sys.stdin, sys.stdout, sys.stderr = saved_streams
+        for i, fd in enumerate(saved_fds):
+            os.dup2(fd, i)
+            os.close(fd)
+
+
+class Daemon(object):
+    def __init__(self, socketfile: str, cache_size: int = 32):
+        from ..formats.base import enable_file_cache
+
+        self.socketfile = socketfile
+        self.cache = enable_file_cache(cache_size)
+        self.started = time.time()
+        self.requests = 0
+
+    def status(self) -> dict:
+        return {
+            "pid": os.getpid(),
+            "socket": self.socketfile,
+            "uptime": round(time.time() - self.started, 1),
+            "requests": self.requests,
+            "cache": self.cache.stats(),
+        }
+
+    def handle(self, conn: socket.socket) -> bool:
+        """
+        Serve one request. Returns False when the daemon is asked to stop.
+        """
+        uid = peer_uid(conn)
+        if uid is not None and uid != os.getuid():
+            raise PermissionError("Request from another user (uid {0})".format(uid))
+        fds, request = recv_request(conn)
+        command = request.get("command", "run")
+        try:
+            if command == "run":
+                self.requests += 1
+                with client_context(fds, request["cwd"], request["env"]):
+                    reply = {"status": run_action(request["argv"])}
+            elif command == "status":
+                reply = self.status()
+            elif command == "stop":
+                reply = {"status": 0}
+            else:
+                reply = {"status": 1, "error": "Unknown command `{0}`".format(command)}
+        finally:
+            for fd in fds:
+                os.close(fd)
+        try:
+            conn.sendall((json.dumps(reply) + "\n").encode())
+        except OSError:  # Client went away
+            logger.debug("Client gone before the reply to `%s`", command)
+        return command != "stop"
+
+    def serve(self):
+        socketfile = self.socketfile
+        if op.lexists(socketfile):
+            try:
+                send_request(socketfile, {"command": "status"})
+                sys.exit("jcvi daemon already running at `{0}`".format(socketfile))
+            except PermissionError as e:
+                sys.exit(str(e))
+            except OSError:
+                pass
+            try:
+                os.remove(socketfile)  # Stale socket
+            except PermissionError:
+                sys.exit("Cannot remove stale socket `{0}`".format(socketfile))
+
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+            server.bind(socketfile)
+            os.chmod(socketfile, 0o600)
+            server.listen()
+            logger.info("jcvi daemon listening on `%s`", socketfile)
+            try:
+                while True:
+                    conn, _ = server.accept()
+                    with conn:
+                        try:
+                            if not self.handle(conn):
+                                break
+                        except (OSError, ValueError) as e:
+                            logger.error("Bad request: %s", e)
+            finally:
+                os.remove(socketfile)
+        logger.info("jcvi daemon stopped after %d requests", self.requests)
+
+
+def start(args):
+    """
+    %prog start
+
+    Start the daemon in the foreground, and preload the modules of the common
+    actions. Stop it with `%prog stop`.
+    """
+    p = OptionParser(start.__doc__)
+    p.add_argument("--socket", default=default_socket(), help="Unix socket path")
+    p.add_argument(
+        "--cache_size",
+        default=32,
+        type=int,
+        help="Number of parsed files to keep in the cache",
+    )
+    p.add_argument(
+        "--preload",
+        default=",".join(PRELOAD),
+        help="Modules to import at start, comma-separated",
+    )
+    opts, args = p.parse_args(args)
+
+    if len(args) != 0:
+        sys.exit(not p.print_help())
+
+    for module_name in opts.preload.split(","):
+        if module_name:
+            import_module("jcvi." + module_name)
+    Daemon(opts.socket, cache_size=opts.cache_size).serve()
+
+
+def stop(args):
+    """
+    %prog stop
+
+    Stop the daemon after the running request.
+    """
+    p = OptionParser(stop.__doc__)
+    p.add_argument("--socket", default=default_socket(), help="Unix socket path")
+    opts, args = p.parse_args(args)
+
+    if len(args) != 0:
+        sys.exit(not p.print_help())
+
+    try:
+        send_request(opts.socket, {"command": "stop"})
+    except PermissionError as e:
+        sys.exit(str(e))
+    except OSError:
+        sys.exit("jcvi daemon not running at `{0}`".format(opts.socket))
+
+
+def status(args):
+    """
+    %prog status
+
+    Show the requests served and the file cache statistics of the daemon.
+    """
+    p = OptionParser(status.__doc__)
+    p.add_argument("--socket", default=default_socket(), help="Unix socket path")
+    opts, args = p.parse_args(args)
+
+    if len(args) != 0:
+        sys.exit(not p.print_help())
+
+    try:
+        reply = send_request(opts.socket, {"command": "status"})
+    except PermissionError as e:
+        sys.exit(str(e))
+    except OSError:
+        sys.exit("jcvi daemon not running at `{0}`".format(opts.socket))
+    print(json.dumps(reply, indent=2))
+
+
+def run(args):
+    """
+    %prog run module action [args]
+
+    Run `python -m jcvi.<module> <action> <args>` in the daemon, e.g.
+    `%prog run formats.bed merge a.bed b.bed`. The arguments are passed
+    through as is, and the socket is taken from $JCVI_DAEMON_SOCKET. The
+    action runs in this process if the daemon is not running.
+    """
+    p = OptionParser(run.__doc__)
+    if len(args) < 2 or args[0] in ("-h", "--help"):
+        sys.exit(not p.print_help())
+
+    request = {"argv": args, "cwd": os.getcwd(), "env": dict(os.environ)}
+    try:
+        reply = send_request(default_socket(), request, fds=(0, 1, 2))
+    except (FileNotFoundError, ConnectionRefusedError):
+        logger.debug("jcvi daemon not running, run `%s` locally", " ".join(args))
+        sys.exit(run_action(args))
+    except PermissionError as e:
+        logger.warning("%s, run `%s` locally", e, " ".join(args))
+        sys.exit(run_action(args))
+    sys.exit(reply["status"])
+
+
+if __name__ == "__main__":
+    main()
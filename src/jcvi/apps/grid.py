@@ -2,28 +2,43 @@
 Codes to submit multiple jobs to JCVI grid engine
 """
 
-from multiprocessing import (
-    Pool,
-    Process,
-    Value,
-    cpu_count,
-    get_context,
-    set_start_method,
-)
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from functools import partial
+import hashlib
+from multiprocessing import Pool, Process, Value, cpu_count, get_context
 from multiprocessing.queues import Queue
+import os
 import os.path as op
-import platform
+import pickle
+from queue import SimpleQueue
 import re
+import shlex
+import subprocess
 import sys
+import time
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 
 from ..formats.base import must_open, write_file
 from .base import (
     ActionDispatcher,
     OptionParser,
     backup,
+    getusername,
     listify,
     logger,
     mkdir,
+    need_update,
     popen,
     sh,
 )
@@ -167,7 +182,34 @@ class MakeManager(list):
         fw.close()
         logger.debug("Makefile written to `{0}`.".format(self.makefile))
 
-    def run(self, cpus=1):
+    def graph(self):
+        """
+        Convert the rules to a TaskGraph, with the dependencies between rules
+        from their sources and targets. Task names carry a hash of the
+        commands and targets, so that the status of a rule from a previous run
+        is not taken for another rule with the same number.
+        """
+        graph = TaskGraph()
+        for d in self:
+            digest = hashlib.sha1("\0".join(d.cmds + d.target).encode()).hexdigest()
+            graph.add(
+                "rule{0}-{1}".format(d.id, digest[:10]),
+                " && ".join(d.cmds),
+                inputs=d.source,
+                outputs=d.target,
+            )
+        return graph
+
+    def run(self, cpus=1, executor=None):
+        """
+        Run the rules with `make`, or through an Executor, e.g. to submit them
+        to a cluster.
+        """
+        if executor:
+            states = executor.run(self.graph())
+            failed = [x for x, state in states.items() if state != "done"]
+            assert not failed, "Rules failed: {0}".format(", ".join(failed))
+            return
         if not op.exists(self.makefile):
             self.write()
         cmd = "make -j {0} -f {1}".format(cpus, self.makefile)
@@ -202,74 +244,113 @@ class Jobs(list):
         self.join()
 
 
-class Poison:
-    pass
+def map_batch(target: Callable, batch: list) -> list:
+    return [target(x) for x in batch]
 
 
-class WriteJobs(object):
+def stream_map(
+    target: Callable,
+    items: Iterable,
+    cpus: int = cpu_count(),
+    ordered: bool = True,
+    batch_size: int = 1,
+    max_inflight: Optional[int] = None,
+) -> Iterator:
     """
-    Runs multiple function calls, but write to the same file.
-
-    Producer-consumer model.
+    Map target over items in a pool of processes, and yield the results.
+
+    The items are read lazily and sent to the workers in batches of
+    `batch_size`, which cuts the IPC overhead of many small items. At most
+    `max_inflight` batches (default: 2 per worker) are in flight, i.e. sent
+    but not yet yielded, so memory stays flat however many items there are.
+    With `ordered`, the results are yielded in the order of the items;
+    otherwise as soon as each batch finishes.
     """
+    from more_itertools import chunked
 
-    def __init__(self, target, args, filename, cpus=cpu_count()):
-        # macOS starts process with fork by default: https://zhuanlan.zhihu.com/p/144771768
-        if platform.system() == "Darwin":
-            set_start_method("fork")
+    if cpus <= 1:
+        yield from map(target, items)
+        return
+
+    max_inflight = max_inflight or 2 * cpus
+    finished = SimpleQueue()
+    pending = {}  # Finished batches waiting for their turn, by sequence number
+    nsent = nyielded = 0
+    batches = chunked(items, batch_size)
+    with Pool(cpus) as pool:
+        while True:
+            while nsent - nyielded < max_inflight:
+                batch = next(batches, None)
+                if batch is None:
+                    break
+                pool.apply_async(
+                    map_batch,
+                    (target, batch),
+                    callback=partial(put_result, finished, nsent),
+                    error_callback=partial(put_result, finished, nsent),
+                )
+                nsent += 1
+            if nyielded == nsent:
+                break
+
+            seq, results = finished.get()
+            if isinstance(results, BaseException):
+                raise results
+            pending[seq] = results
+            while pending:
+                seq = nyielded if ordered else next(iter(pending))
+                if seq not in pending:
+                    break
+                yield from pending.pop(seq)
+                nyielded += 1
 
-        workerq = Queue()
-        writerq = Queue()
 
-        for a in args:
-            workerq.put(a)
+def put_result(queue, seq, results):
+    queue.put((seq, results))
 
-        cpus = min(cpus, len(args))
-        for i in range(cpus):
-            workerq.put(Poison())
 
-        self.worker = Jobs(work, args=[(workerq, writerq, target)] * cpus)
-        self.writer = Process(target=write, args=(workerq, writerq, filename, cpus))
+class WriteJobs(object):
+    """
+    Runs multiple function calls, but write to the same file.
+
+    The results are written by the main process as they stream from the
+    workers, see `stream_map()`. Empty results are skipped.
+    """
+
+    def __init__(
+        self,
+        target,
+        args,
+        filename,
+        cpus=cpu_count(),
+        ordered=True,
+        batch_size=1,
+    ):
+        self.target = target
+        self.args = args
+        self.filename = filename
+        self.cpus = cpus
+        self.ordered = ordered
+        self.batch_size = batch_size
 
     def run(self):
-        self.worker.start()
-        self.writer.start()
-        self.worker.join()
-        self.writer.join()
-
-
-def work(queue_in, queue_out, target):
-    while True:
-        a = queue_in.get()
-        if isinstance(a, Poison):
-            break
-        res = target(a)
-        queue_out.put(res)
-    queue_out.put(Poison())
-
-
-def write(queue_in, queue_out, filename, cpus):
-    from rich.progress import Progress
-
-    fw = must_open(filename, "w")
-    isize = queue_in.qsize()
-    logger.debug("A total of {0} items to compute.".format(isize))
-    isize = isize or 1
-    poisons = 0
-    with Progress() as progress:
-        task = progress.add_task("[green]Processing ...", total=isize)
-        while True:
-            res = queue_out.get()
-            qsize = queue_in.qsize()
-            progress.update(task, completed=isize - qsize)
-            if isinstance(res, Poison):
-                poisons += 1
-                if poisons == cpus:  # wait all workers finish
-                    break
-            elif res:
-                print(res, file=fw)
-                fw.flush()
-    fw.close()
+        from rich.progress import Progress
+
+        total = len(self.args) if hasattr(self.args, "__len__") else None
+        logger.debug("A total of %s items to compute.", total or "unknown")
+        results = stream_map(
+            self.target,
+            self.args,
+            cpus=self.cpus,
+            ordered=self.ordered,
+            batch_size=self.batch_size,
+        )
+        with must_open(self.filename, "w") as fw, Progress() as progress:
+            task = progress.add_task("[green]Processing ...", total=total)
+            for res in results:
+                if res:
+                    print(res, file=fw)
+                progress.advance(task)
 
 
 class GridOpts(dict):
@@ -419,6 +500,591 @@ class Grid(list):
             pi.start()
 
 
+@dataclass
+class Task:
+    """
+    A unit of work in a TaskGraph, either a shell command or a function called
+    with args. The resource hints are passed to the cluster scheduler, and
+    tasks with a short `runtime` (estimated seconds) are packed together into
+    one job.
+    """
+
+    name: str
+    cmd: Union[str, Callable]
+    args: tuple = ()
+    deps: List[str] = field(default_factory=list)
+    inputs: List[str] = field(default_factory=list)
+    outputs: List[str] = field(default_factory=list)
+    cpus: int = 1
+    mem: Optional[str] = None
+    walltime: Optional[str] = None
+    runtime: Optional[float] = None
+    retries: int = 0
+
+    @property
+    def resources(self) -> Tuple[int, Optional[str], Optional[str]]:
+        return self.cpus, self.mem, self.walltime
+
+    def run(self) -> int:
+        """
+        Run the task in the current process and return the exit status.
+        """
+        if callable(self.cmd):
+            self.cmd(*self.args)
+            return 0
+        return subprocess.call(self.cmd, shell=True)
+
+
+def run_task(task: Task) -> int:
+    return task.run()
+
+
+def run_pickled_task(filename: str):
+    """
+    Run a function task on a cluster node, see `ClusterExecutor.task_script()`.
+    """
+    with open(filename, "rb") as fp:
+        task = pickle.load(fp)
+    sys.exit(task.run())
+
+
+class TaskGraph(dict):
+    """
+    Tasks keyed by name. A task depends on the tasks listed in its `deps`, and
+    on the tasks whose outputs are among its inputs.
+    """
+
+    def add(self, name: str, cmd: Union[str, Callable], **kwargs) -> Task:
+        assert name not in self, "Duplicate task `{0}`".format(name)
+        for key in ("deps", "inputs", "outputs"):
+            if key in kwargs:
+                kwargs[key] = listify(kwargs[key])
+        if "args" in kwargs:
+            kwargs["args"] = tuple(listify(kwargs["args"]))
+        task = self[name] = Task(name, cmd, **kwargs)
+        return task
+
+    def dependencies(self) -> Dict[str, Set[str]]:
+        producers = {x: task.name for task in self.values() for x in task.outputs}
+        deps = {}
+        for task in self.values():
+            d = set(task.deps) | {producers[x] for x in task.inputs if x in producers}
+            d.discard(task.name)
+            missing = d - set(self)
+            if missing:
+                raise ValueError(
+                    "Task `{0}` depends on unknown tasks: {1}".format(
+                        task.name, ", ".join(sorted(missing))
+                    )
+                )
+            deps[task.name] = d
+        return deps
+
+    def toposort(self) -> List[str]:
+        """
+        Order the tasks so that each comes after its dependencies, keeping the
+        insertion order otherwise.
+        """
+        deps = self.dependencies()
+        children = defaultdict(list)
+        for name, d in deps.items():
+            for x in d:
+                children[x].append(name)
+        indegree = {name: len(d) for name, d in deps.items()}
+        order = [name for name in self if not indegree[name]]
+        for name in order:
+            for child in children[name]:
+                indegree[child] -= 1
+                if not indegree[child]:
+                    order.append(child)
+        if len(order) < len(self):
+            cycle = sorted(name for name in self if indegree[name])
+            raise ValueError("Cyclic dependencies among: {0}".format(", ".join(cycle)))
+        return order
+
+
+class StatusDB(object):
+    """
+    Status of the tasks in a sqlite database, kept across runs so that a rerun
+    skips the tasks that are done.
+    """
+
+    def __init__(self, filename: str):
+        import sqlite3
+
+        self.conn = sqlite3.connect(filename)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS tasks (name TEXT PRIMARY KEY, state TEXT, "
+            "attempts INTEGER, jobid TEXT, returncode INTEGER, updated REAL, "
+            "error TEXT)"
+        )
+        self.conn.commit()
+
+    def update(
+        self,
+        name: str,
+        state: str,
+        jobid: Optional[str] = None,
+        returncode: Optional[int] = None,
+        error: str = "",
+    ):
+        attempt = int(state == "running")
+        self.conn.execute(
+            "INSERT OR IGNORE INTO tasks (name, attempts) VALUES (?, 0)", (name,)
+        )
+        self.conn.execute(
+            "UPDATE tasks SET state=?, attempts=attempts+?, "
+            "jobid=COALESCE(?, jobid), returncode=?, updated=?, error=? WHERE name=?",
+            (state, attempt, jobid, returncode, time.time(), error, name),
+        )
+        self.conn.commit()
+
+    def states(self) -> Dict[str, str]:
+        return dict(self.conn.execute("SELECT name, state FROM tasks"))
+
+    def rows(self) -> List[tuple]:
+        return list(
+            self.conn.execute(
+                "SELECT name, state, attempts, jobid, returncode, error "
+                "FROM tasks ORDER BY updated"
+            )
+        )
+
+    def close(self):
+        self.conn.close()
+
+
+class Executor(object):
+    """
+    Run a TaskGraph, submitting the tasks whose dependencies are done.
+    Backends implement `submit()`, which returns the jobids of the tasks it
+    accepted, and `poll()`, which waits and then yields the finished tasks as
+    (name, returncode, error).
+    """
+
+    def __init__(self, workdir: str = "jcvi-executor"):
+        mkdir(workdir)
+        self.workdir = workdir
+        self.db = StatusDB(op.join(workdir, "status.db"))
+
+    def submit(self, tasks: List[Task]) -> Dict[str, str]:
+        raise NotImplementedError
+
+    def poll(self) -> Iterator[Tuple[str, int, str]]:
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def run(self, graph: TaskGraph, resume: bool = True) -> Dict[str, str]:
+        """
+        Run the tasks and return their final states: done, failed, or skipped
+        when a dependency failed. With `resume`, the tasks that are done in the
+        status database are not run again. Tasks whose outputs are up to date
+        with their inputs are not run either.
+        """
+        order = graph.toposort()
+        deps = graph.dependencies()
+        done = self.db.states() if resume else {}
+        state = {
+            name: "done" if done.get(name) == "done" else "pending" for name in order
+        }
+        attempts = Counter()
+        nrunning = 0
+        try:
+            while True:
+                ready = []
+                for name in order:
+                    if state[name] != "pending":
+                        continue
+                    dstates = [state[x] for x in deps[name]]
+                    if "failed" in dstates or "skipped" in dstates:
+                        state[name] = "skipped"
+                        self.db.update(name, "skipped", error="dependency failed")
+                    elif all(x == "done" for x in dstates):
+                        task = graph[name]
+                        if task.outputs and not need_update(task.inputs, task.outputs):
+                            state[name] = "done"
+                            self.db.update(name, "done", returncode=0)
+                        else:
+                            ready.append(task)
+                if not ready and not nrunning:
+                    break
+
+                for name, jobid in self.submit(ready).items():
+                    state[name] = "running"
+                    attempts[name] += 1
+                    nrunning += 1
+                    self.db.update(name, "running", jobid=jobid)
+
+                for name, returncode, error in self.poll():
+                    nrunning -= 1
+                    if returncode == 0:
+                        state[name] = "done"
+                    elif attempts[name] <= graph[name].retries:
+                        logger.warning("Task `%s` failed (%s), retry", name, error)
+                        state[name] = "pending"
+                    else:
+                        logger.error("Task `%s` failed (%s)", name, error)
+                        state[name] = "failed"
+                    self.db.update(
+                        name, state[name], returncode=returncode, error=error
+                    )
+        finally:
+            self.close()
+
+        counts = Counter(state.values())
+        logger.info(
+            "Tasks: %s", ", ".join("{0} {1}".format(n, x) for x, n in counts.items())
+        )
+        return state
+
+
+class LocalExecutor(Executor):
+    """
+    Run the tasks in a local process pool, with no more than `cpus` in use
+    according to the resource hints.
+    """
+
+    def __init__(self, cpus: int = cpu_count(), workdir: str = "jcvi-executor"):
+        super().__init__(workdir)
+        self.cpus = cpus
+        self.pool = None
+        self.futures = {}
+
+    def submit(self, tasks):
+        from concurrent.futures import ProcessPoolExecutor
+
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(self.cpus)
+        used = sum(task.cpus for task in self.futures.values())
+        submitted = {}
+        for task in tasks:
+            if used and used + task.cpus > self.cpus:
+                continue
+            self.futures[self.pool.submit(run_task, task)] = task
+            used += task.cpus
+            submitted[task.name] = "local"
+        return submitted
+
+    def poll(self):
+        from concurrent.futures import FIRST_COMPLETED, wait
+
+        finished, _ = wait(self.futures, return_when=FIRST_COMPLETED)
+        for future in finished:
+            task = self.futures.pop(future)
+            try:
+                returncode = future.result()
+                error = "exit status {0}".format(returncode) if returncode else ""
+            except Exception as e:
+                returncode, error = 1, "{0}: {1}".format(type(e).__name__, e)
+            yield task.name, returncode, error
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+
+class Scheduler(object):
+    """
+    Adapter for the submit and queue commands of a cluster scheduler. Jobs are
+    submitted as arrays, and each array task finds its index in `index_var`.
+    """
+
+    name = ""
+    index_var = ""
+
+    def submit_args(
+        self,
+        name: str,
+        size: int,
+        cpus: int,
+        mem: Optional[str],
+        walltime: Optional[str],
+        logdir: str,
+    ) -> List[str]:
+        raise NotImplementedError
+
+    def active_args(self) -> List[str]:
+        return ["qstat", "-u", getusername()]
+
+    def parse_jobid(self, output: str) -> str:
+        return re.match(r"\s*(\d+)", output).group(1)
+
+    def parse_active(self, output: str) -> Set[str]:
+        jobids = set()
+        for row in output.splitlines():
+            m = re.match(r"\s*(\d+)", row)
+            if m:
+                jobids.add(m.group(1))
+        return jobids
+
+    def submit(
+        self,
+        script: str,
+        name: str,
+        size: int = 1,
+        cpus: int = 1,
+        mem: Optional[str] = None,
+        walltime: Optional[str] = None,
+        logdir: str = ".",
+        extra: Optional[str] = None,
+    ) -> str:
+        args = self.submit_args(name, size, cpus, mem, walltime, logdir)
+        if extra:
+            args += shlex.split(extra)
+        output = subprocess.check_output(args + [script], text=True)
+        return self.parse_jobid(output)
+
+    def active(self, jobids: Set[str]) -> Optional[Set[str]]:
+        """
+        Return the jobids that are still queued or running, or None if the
+        queue cannot be read.
+        """
+        try:
+            output = subprocess.check_output(self.active_args(), text=True)
+        except (OSError, subprocess.CalledProcessError) as e:
+            logger.warning("Cannot read the %s queue: %s", self.name, e)
+            return None
+        return self.parse_active(output) & set(jobids)
+
+
+class SlurmScheduler(Scheduler):
+    name = "slurm"
+    index_var = "SLURM_ARRAY_TASK_ID"
+
+    def submit_args(self, name, size, cpus, mem, walltime, logdir):
+        args = ["sbatch", "--parsable", "-J", name, "-c", str(cpus)]
+        args += ["-o", op.join(logdir, "%x.%A_%a.out")]
+        if size > 1:
+            args += ["--array=1-{0}".format(size)]
+        if mem:
+            args += ["--mem={0}".format(mem)]
+        if walltime:
+            args += ["--time={0}".format(walltime)]
+        return args
+
+    def active_args(self):
+        return ["squeue", "-h", "-o", "%F", "-u", getusername()]
+
+
+class SGEScheduler(Scheduler):
+    name = "sge"
+    index_var = "SGE_TASK_ID"
+
+    def submit_args(self, name, size, cpus, mem, walltime, logdir):
+        args = ["qsub", "-terse", "-cwd", "-N", name, "-o", logdir, "-e", logdir]
+        if size > 1:
+            args += ["-t", "1-{0}".format(size)]
+        if cpus > 1:
+            args += ["-pe", "threaded", str(cpus)]
+        if mem:
+            args += ["-l", "h_vmem={0}".format(mem)]
+        if walltime:
+            args += ["-l", "h_rt={0}".format(walltime)]
+        return args
+
+
+class PBSScheduler(Scheduler):
+    name = "pbs"
+    index_var = "PBS_ARRAY_INDEX"
+
+    def submit_args(self, name, size, cpus, mem, walltime, logdir):
+        args = ["qsub", "-N", name, "-o", logdir, "-e", logdir]
+        if size > 1:
+            args += ["-J", "1-{0}".format(size)]
+        select = "select=1:ncpus={0}".format(cpus)
+        if mem:
+            select += ":mem={0}".format(mem)
+        args += ["-l", select]
+        if walltime:
+            args += ["-l", "walltime={0}".format(walltime)]
+        return args
+
+
+SCHEDULERS = {x.name: x for x in (SlurmScheduler, SGEScheduler, PBSScheduler)}
+
+# Jobs that are not arrays run line 1, SGE sets SGE_TASK_ID=undefined for them
+ARRAY_SCRIPT = """#!/bin/sh
+cd {0}
+INDEX=${{{1}:-1}}
+case $INDEX in ''|*[!0-9]*) INDEX=1 ;; esac
+CMD=`awk "NR==$INDEX" {2}`
+$CMD
+"""
+
+
+class ClusterExecutor(Executor):
+    """
+    Submit the tasks to a cluster scheduler as job arrays, one array per set
+    of resource hints. Tasks with a `runtime` hint are packed so that each
+    array task runs for about `batch_runtime` seconds, which saves the
+    scheduling overhead of many tiny jobs. Each task writes its exit status to
+    a file in the workdir, which is polled every `poll_interval` seconds.
+    """
+
+    def __init__(
+        self,
+        scheduler: Scheduler,
+        workdir: str = "jcvi-executor",
+        batch_runtime: float = 600,
+        poll_interval: float = 30,
+        extra: Optional[str] = None,
+    ):
+        super().__init__(workdir)
+        self.scheduler = scheduler
+        self.batch_runtime = batch_runtime
+        self.poll_interval = poll_interval
+        self.extra = extra
+        self.nbatches = 0
+        self.jobs = {}
+        for subdir in ("tasks", "logs"):
+            mkdir(op.join(workdir, subdir))
+
+    def pack(self, tasks: List[Task]) -> Iterator[Tuple[tuple, List[List[Task]]]]:
+        """
+        Group the tasks by resources, and pack each group into chunks that run
+        for about `batch_runtime` seconds. Tasks without a runtime hint are
+        in a chunk of their own.
+        """
+        groups = defaultdict(list)
+        for task in tasks:
+            groups[task.resources].append(task)
+        for resources, group in groups.items():
+            chunks, chunk, total = [], [], 0
+            for task in group:
+                runtime = task.runtime or self.batch_runtime
+                if chunk and total + runtime > self.batch_runtime:
+                    chunks.append(chunk)
+                    chunk, total = [], 0
+                chunk.append(task)
+                total += runtime
+            chunks.append(chunk)
+            yield resources, chunks
+
+    def rcfile(self, name: str) -> str:
+        return op.abspath(op.join(self.workdir, "tasks", name + ".rc"))
+
+    def task_script(self, task: Task) -> str:
+        rcfile = self.rcfile(task.name)
+        if op.exists(rcfile):
+            os.remove(rcfile)
+        cmd = task.cmd
+        if callable(cmd):
+            pklfile = op.abspath(op.join(self.workdir, "tasks", task.name + ".pkl"))
+            with open(pklfile, "wb") as fw:
+                pickle.dump(task, fw)
+            code = "from jcvi.apps.grid import run_pickled_task; "
+            code += "run_pickled_task({0!r})".format(pklfile)
+            cmd = " ".join(shlex.quote(x) for x in (sys.executable, "-c", code))
+        return "(\n{0}\n)\necho $? > {1}.tmp && mv {1}.tmp {1}\n".format(cmd, rcfile)
+
+    def submit(self, tasks):
+        submitted = {}
+        for (cpus, mem, walltime), chunks in self.pack(tasks):
+            self.nbatches += 1
+            batch = "jcvi{0}_{1}".format(os.getpid(), self.nbatches)
+            prefix = op.abspath(op.join(self.workdir, "tasks", batch))
+            with open(prefix + ".list", "w") as fw:
+                for i, chunk in enumerate(chunks, 1):
+                    chunkfile = "{0}.{1}.sh".format(prefix, i)
+                    with open(chunkfile, "w") as fc:
+                        for task in chunk:
+                            print(self.task_script(task), file=fc)
+                    print("sh {0}".format(chunkfile), file=fw)
+            script = prefix + ".sh"
+            with open(script, "w") as fw:
+                fw.write(
+                    ARRAY_SCRIPT.format(
+                        os.getcwd(), self.scheduler.index_var, prefix + ".list"
+                    )
+                )
+            jobid = self.scheduler.submit(
+                script,
+                batch,
+                size=len(chunks),
+                cpus=cpus,
+                mem=mem,
+                walltime=walltime,
+                logdir=op.abspath(op.join(self.workdir, "logs")),
+                extra=self.extra,
+            )
+            logger.debug(
+                "Submitted %d tasks in %d jobs as %s `%s`",
+                sum(len(x) for x in chunks),
+                len(chunks),
+                self.scheduler.name,
+                jobid,
+            )
+            for chunk in chunks:
+                for task in chunk:
+                    self.jobs[task.name] = submitted[task.name] = jobid
+        return submitted
+
+    def poll(self):
+        time.sleep(self.poll_interval)
+        # Read the queue before the status files, so a job that is no longer
+        # active has written the status of all its tasks
+        active = self.scheduler.active(set(self.jobs.values()))
+        for name, jobid in list(self.jobs.items()):
+            rcfile = self.rcfile(name)
+            if op.exists(rcfile):
+                with open(rcfile) as fp:
+                    returncode = int(fp.read().strip() or 1)
+                error = "exit status {0}".format(returncode) if returncode else ""
+            elif active is not None and jobid not in active:
+                returncode, error = 1, "job {0} ended without status".format(jobid)
+            else:
+                continue
+            del self.jobs[name]
+            yield name, returncode, error
+
+
+def get_executor(
+    backend: str = "local",
+    cpus: int = cpu_count(),
+    workdir: str = "jcvi-executor",
+    **kwargs,
+) -> Executor:
+    """
+    Return a LocalExecutor, or a ClusterExecutor for one of the SCHEDULERS.
+    """
+    if backend == "local":
+        return LocalExecutor(cpus=cpus, workdir=workdir)
+    if backend not in SCHEDULERS:
+        raise ValueError("Unknown backend `{0}`".format(backend))
+    return ClusterExecutor(SCHEDULERS[backend](), workdir=workdir, **kwargs)
+
+
+def read_tasks(filename: str, **kwargs) -> TaskGraph:
+    """
+    Read tasks, one per line, either a plain command or three tab-separated
+    columns: name, comma-separated names of the tasks it depends on (`.` for
+    none), and command. Plain commands are named by a hash of the command, so
+    that the status of a task from a previous run still applies after lines
+    are added or removed. The keyword arguments are the resource hints shared
+    by all tasks.
+    """
+    graph = TaskGraph()
+    seen = defaultdict(int)
+    with must_open(filename) as fp:
+        for row in fp:
+            row = row.rstrip("\n")
+            if not row.strip() or row.startswith("#"):
+                continue
+            atoms = row.split("\t", 2)
+            if len(atoms) == 3:
+                name, deps, cmd = atoms
+                deps = [] if deps == "." else deps.split(",")
+            else:
+                digest = hashlib.sha1(row.encode()).hexdigest()[:10]
+                seen[digest] += 1
+                name, deps, cmd = "task-{0}.{1}".format(digest, seen[digest]), [], row
+            graph.add(name, cmd, deps=deps, **kwargs)
+    return graph
+
+
 PBS_STANZA = """
 #PBS -q {0}
 #PBS -J 1-{1}
@@ -449,6 +1115,8 @@ def main():
         ("run", "run a normal command on grid"),
         ("array", "run an array job"),
         ("kill", "wrapper around the `qdel` command"),
+        ("dag", "run a graph of tasks locally or on a cluster scheduler"),
+        ("status", "show the status of the tasks run by `dag`"),
     )
 
     p = ActionDispatcher(actions)
@@ -656,5 +1324,108 @@ def kill(args):
         sh("qdel {0}".format(",".join(valid_jobids)))
 
 
+def dag(args):
+    """
+    %prog dag tasks.txt
+
+    Run a graph of tasks, one per line, either a plain command or three
+    tab-separated columns: task name, comma-separated names of the tasks it
+    depends on (`.` for none), and command, e.g.
+
+    grape.peach  .  python -m jcvi.compara.catalog ortholog grape peach
+    grape.peach.pdf  grape.peach  python -m jcvi.graphics.dotplot grape.peach.anchors
+
+    Tasks run in a local process pool, or are submitted as job arrays to the
+    --backend scheduler. Tiny tasks, with --runtime well below
+    --batch_runtime, are packed together in each array job. The task status is
+    kept in --workdir, so that a rerun skips the tasks that are done.
+    """
+    p = OptionParser(dag.__doc__)
+    p.add_argument(
+        "--backend",
+        default="local",
+        choices=["local"] + sorted(SCHEDULERS),
+        help="Run tasks on",
+    )
+    p.add_argument("--workdir", default="jcvi-executor", help="Task status folder")
+    p.add_argument("--task_cpus", default=1, type=int, help="CPUs used by each task")
+    p.add_argument("--mem", help="Memory requested for each task, e.g. 4G")
+    p.add_argument("--walltime", help="Time limit of each task, e.g. 2:00:00")
+    p.add_argument(
+        "--runtime", type=float, help="Estimated seconds for each task, for packing"
+    )
+    p.add_argument(
+        "--batch_runtime",
+        default=600,
+        type=float,
+        help="Pack tasks into jobs of about these many seconds",
+    )
+    p.add_argument("--retries", default=0, type=int, help="Retry failed tasks")
+    p.add_argument(
+        "--poll", default=30, type=float, help="Seconds between cluster queue checks"
+    )
+    p.add_argument(
+        "--restart", default=False, action="store_true", help="Rerun tasks done before"
+    )
+    p.set_cpus()
+    p.set_params(prog="the scheduler")
+    opts, args = p.parse_args(args)
+
+    if len(args) != 1:
+        sys.exit(not p.print_help())
+
+    (tasksfile,) = args
+    graph = read_tasks(
+        tasksfile,
+        cpus=opts.task_cpus,
+        mem=opts.mem,
+        walltime=opts.walltime,
+        runtime=opts.runtime,
+        retries=opts.retries,
+    )
+    kwargs = {}
+    if opts.backend != "local":
+        kwargs = dict(
+            batch_runtime=opts.batch_runtime, poll_interval=opts.poll, extra=opts.extra
+        )
+    executor = get_executor(
+        opts.backend, cpus=opts.cpus, workdir=opts.workdir, **kwargs
+    )
+    states = executor.run(graph, resume=not opts.restart)
+    if any(x != "done" for x in states.values()):
+        sys.exit(1)
+
+
+def status(args):
+    """
+    %prog status [workdir]
+
+    Show the status of the tasks run by `dag`, as a tab-separated table of
+    name, state, attempts, jobid, exit status and error.
+    """
+    p = OptionParser(status.__doc__)
+    p.set_outfile()
+    opts, args = p.parse_args(args)
+
+    if len(args) > 1:
+        sys.exit(not p.print_help())
+
+    workdir = args[0] if args else "jcvi-executor"
+    dbfile = op.join(workdir, "status.db")
+    if not op.exists(dbfile):
+        sys.exit("Status database `{0}` not found".format(dbfile))
+
+    db = StatusDB(dbfile)
+    rows = db.rows()
+    db.close()
+    with must_open(opts.outfile, "w") as fw:
+        for row in rows:
+            print("\t".join("" if x is None else str(x) for x in row), file=fw)
+    counts = Counter(row[1] for row in rows)
+    logger.info(
+        "Tasks: %s", ", ".join("{0} {1}".format(n, x) for x, n in counts.items())
+    )
+
+
 if __name__ == "__main__":
     main()
@@ -36,7 +36,7 @@ def score_evaluate_M(array.array[int] tour,
                      np.ndarray[int, ndim=1] tour_sizes=None,
                      np.ndarray[int, ndim=2] tour_M=None):
     cdef np.ndarray[int, ndim=1] sizes_oo = tour_sizes[tour]
-    cdef np.ndarray[int, ndim=1] sizes_cum = np.cumsum(sizes_oo) - sizes_oo // 2
+    cdef np.ndarray[np.int64_t, ndim=1] sizes_cum = np.cumsum(sizes_oo, dtype=np.int64) - sizes_oo // 2
 
     cdef double s = 0.0
     cdef int size = len(tour)
@@ -61,7 +61,7 @@ def score_evaluate_P(array.array[int] tour,
                      np.ndarray[int, ndim=1] tour_sizes=None,
                      np.ndarray[int, ndim=3] tour_P=None):
     cdef np.ndarray[int, ndim=1] sizes_oo = tour_sizes[tour]
-    cdef np.ndarray[int, ndim=1] sizes_cum = np.cumsum(sizes_oo)
+    cdef np.ndarray[np.int64_t, ndim=1] sizes_cum = np.cumsum(sizes_oo, dtype=np.int64)
 
     cdef double s = 0.0
     cdef int size = len(tour)
@@ -85,7 +85,7 @@ def score_evaluate_Q(array.array[int] tour,
                      np.ndarray[int, ndim=1] tour_sizes=None,
                      np.ndarray[int, ndim=3] tour_Q=None):
     cdef np.ndarray[int, ndim=1] sizes_oo = tour_sizes[tour]
-    cdef np.ndarray[int, ndim=1] sizes_cum = np.cumsum(sizes_oo)
+    cdef np.ndarray[np.int64_t, ndim=1] sizes_cum = np.cumsum(sizes_oo, dtype=np.int64)
 
     cdef double s = 0.0
     cdef int size = len(tour)
@@ -10,54 +10,58 @@ Provide coverage QC for assembled sequences:
 
 from collections import defaultdict
 
-from ..apps.base import ActionDispatcher, logger, need_update, sh
+import numpy as np
+
+from ..apps.base import ActionDispatcher, logger
 from ..formats.base import BaseFile, must_open
-from ..formats.bed import BedLine, sort
+from ..formats.bed import BedLine, read_bed_intervals
+from ..formats.sam import depth_runs
 from ..formats.sizes import Sizes
 
 
 class Coverage(BaseFile):
     """
-    Three-column .coverage file, often generated by `genomeCoverageBed -d`
-    contigID baseID coverage
+    Base coverage of the features in a bedfile, as `genomeCoverageBed -bg`
+    would report, computed in memory with a difference array per sequence.
     """
 
     def __init__(self, bedfile, sizesfile):
-
-        bedfile = sort([bedfile])
-        coveragefile = bedfile + ".coverage"
-        if need_update(bedfile, coveragefile):
-            cmd = "genomeCoverageBed"
-            cmd += " -bg -i {0} -g {1}".format(bedfile, sizesfile)
-            sh(cmd, outfile=coveragefile)
-
+        super().__init__(bedfile)
         self.sizes = Sizes(sizesfile).mapping
+        self.intervals = read_bed_intervals(bedfile)
 
-        filename = coveragefile
-        assert filename.endswith(".coverage")
-        super().__init__(filename)
+    def get_depth(self, ctg):
+        size = self.sizes[ctg]
+        if ctg not in self.intervals:
+            return np.zeros(size, dtype=int)
+        starts, ends, _ = self.intervals[ctg]
+        # Drop intervals past the end of the sequence, clip the rest
+        inside = starts < size
+        starts, ends = starts[inside], np.minimum(ends[inside], size)
+        d = np.bincount(starts, minlength=size + 1)
+        d -= np.bincount(ends, minlength=size + 1)
+        return np.cumsum(d[:size])
+
+    def iter_bedgraph(self):
+        """
+        Yield (seqid, start, end, coverage) for the covered intervals.
+        """
+        for ctg in sorted(self.intervals):
+            if ctg not in self.sizes:
+                continue
+            starts, ends, values = depth_runs(self.get_depth(ctg))
+            for start, end, value in zip(starts, ends, values):
+                yield ctg, start, end, value
 
     def get_plot_data(self, ctg, bins=None):
-        import numpy as np
-
         from jcvi.algorithms.matrix import chunk_average
 
-        fp = open(self.filename)
         size = self.sizes[ctg]
-
-        data = np.zeros((size,), dtype=int)
-        for row in fp:
-            seqid, start, end, cov = row.split()
-            if seqid != ctg:
-                continue
-
-            start, end = int(start), int(end)
-            cov = int(cov)
-            data[start:end] = cov
+        data = self.get_depth(ctg)
 
         bases = np.arange(1, size + 1)
         if bins:
-            window = size / bins
+            window = max(size // bins, 1)
             bases = bases[::window]
             data = chunk_average(data, window)
 
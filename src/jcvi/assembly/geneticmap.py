@@ -6,28 +6,20 @@ Use genetic map to break chimeric scaffolds, order and orient scaffolds onto
 chromosomes.
 """
 
-from itertools import combinations, groupby
+from itertools import groupby
+import os
 import os.path as op
 from random import sample
+import shutil
 import sys
-from typing import Tuple
+import tempfile
+from typing import List, Optional, Tuple
 
 import numpy as np
-import seaborn as sns
 
-from ..algorithms.formula import calc_ldscore
-from ..algorithms.matrix import symmetrize
 from ..apps.base import ActionDispatcher, OptionParser, logger, need_update
 from ..formats.base import BaseFile, LineFile, must_open, read_block
 from ..formats.bed import Bed, fastaFromBed
-from ..graphics.base import (
-    Rectangle,
-    draw_cmap,
-    normalize_axes,
-    plot_heatmap,
-    plt,
-    savefig,
-)
 
 MSTheader = """population_type {0}
 population_name LG
@@ -108,17 +100,37 @@ class MSTMapLine(object):
         return "\t".join(str(x) for x in (self.seqid, self.pos - 1, self.pos, self.id))
 
 
+def read_mstmap_header(fp) -> Tuple[List[str], int]:
+    """
+    Skip to the `locus_name` header of the MSTmap, return the header and the
+    column where the genotypes start.
+    """
+    startidx = 1
+    header = []
+    for row in fp:
+        if row.startswith("locus_name"):
+            if row.split()[1] == "seqid":
+                startidx = 3
+            header = row.split()
+            break
+    return header, startidx
+
+
+def iter_mstmap(filename: str):
+    """
+    Stream the markers of the MSTmap as MSTMapLine.
+    """
+    with open(filename) as fp:
+        header, startidx = read_mstmap_header(fp)
+        for row in fp:
+            yield MSTMapLine(row, startidx=startidx)
+
+
 class MSTMap(LineFile):
     def __init__(self, filename):
         super().__init__(filename)
         fp = open(filename)
-        startidx = 1
-        for row in fp:
-            if row.startswith("locus_name"):
-                if row.split()[1] == "seqid":
-                    startidx = 3
-                self.header = row.split()
-                break
+        self.header, startidx = read_mstmap_header(fp)
 
         for row in fp:
             self.append(MSTMapLine(row, startidx=startidx))
@@ -129,6 +141,10 @@ class MSTMap(LineFile):
             "Map contains %d markers in %d individuals", self.nmarkers, self.nind
         )
 
+    @property
+    def matrix(self) -> np.ndarray:
+        return marker_matrix([x.genotype for x in self])
+
 
 class MSTMatrix(object):
     def __init__(self, matrix, markerheader, population_type, missing_threshold):
@@ -144,20 +160,49 @@ class MSTMatrix(object):
         )
 
     def write(self, filename="stdout", header=True):
+        write_mstmap(
+            self.matrix,
+            self.markerheader,
+            self.population_type,
+            self.missing_threshold,
+            filename=filename,
+            header=header,
+        )
+
+
+def write_mstmap(
+    rows,
+    markerheader: List[str],
+    population_type: str,
+    missing_threshold: float,
+    filename: str = "stdout",
+    header: bool = True,
+) -> int:
+    """
+    Write the MSTmap input from an iterable of rows, without holding them in
+    memory. The run parameters need the number of markers up front, so the
+    rows are spooled to a temporary file first. Returns the number of markers.
+    """
+    nind = len(markerheader) - 1
+    nmarkers = 0
+    with tempfile.TemporaryFile("w+") as spool:
+        for m in rows:
+            assert len(m) == nind + 1
+            print("\t".join(m), file=spool)
+            nmarkers += 1
+        spool.seek(0)
         fw = must_open(filename, "w")
         if header:
             print(
-                MSTheader.format(
-                    self.population_type,
-                    self.missing_threshold,
-                    self.ngenotypes,
-                    self.nind,
-                ),
+                MSTheader.format(population_type, missing_threshold, nmarkers, nind),
                 file=fw,
             )
-        print("\t".join(self.markerheader), file=fw)
-        for m in self.matrix:
-            print("\t".join(m), file=fw)
+        print("\t".join(markerheader), file=fw)
+        shutil.copyfileobj(spool, fw)
+        if fw is not sys.stdout:
+            fw.close()
+    logger.debug("Wrote %d markers and %d individuals.", nmarkers, nind)
+    return nmarkers
 
 
 def main():
@@ -339,43 +384,134 @@ def dotplot(args):
     fig.clear()
 
 
-def read_subsampled_matrix(mstmap: str, subsample: int) -> Tuple[np.ndarray, str, int]:
+def marker_matrix(genotypes: List[str]) -> np.ndarray:
     """
-    Read the subsampled matrix from file if it exists, otherwise calculate it.
+    Stack the genotype strings of the markers into a matrix (markers x
+    individuals) of their characters as uint8.
     """
-    data = MSTMap(mstmap)
+    nind = len(genotypes[0])
+    data = "".join(genotypes).encode()
+    return np.frombuffer(data, dtype=np.uint8).reshape(-1, nind)
 
-    # Take random subsample while keeping marker order
-    if subsample < data.nmarkers:
-        data = [data[x] for x in sorted(sample(range(len(data)), subsample))]
-    else:
-        logger.debug("Use all markers, --subsample ignored")
 
-    nmarkers = len(data)
+def ld_block(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """
+    `calc_ldscore()` between all rows of a and all rows of b, with products
+    of the indicator matrices of A and B genotypes.
+    """
+    aA, aB = (a == ord("A")).astype(np.float32), (a == ord("B")).astype(np.float32)
+    bA, bB = (b == ord("A")).astype(np.float32), (b == ord("B")).astype(np.float32)
+    c_aa, c_ab = aA @ bA.T, aA @ bB.T
+    c_ba, c_bb = aB @ bA.T, aB @ bB.T
+    total = c_aa + c_ab + c_ba + c_bb
+    with np.errstate(divide="ignore", invalid="ignore"):
+        f = 1.0 / total
+        x_aa = c_aa * f
+        p_a = (c_aa + c_ab) * f
+        q_a = (c_aa + c_ba) * f
+        p_b = (c_ba + c_bb) * f
+        q_b = (c_ab + c_bb) * f
+        D = x_aa - p_a * q_a
+        denominator = p_a * p_b * q_a * q_b
+        r2 = D * D / denominator
+    return np.where((total > 0) & (denominator > 0), r2, 0)
+
+
+def ld_matrix(
+    M: np.ndarray, block: int = 1024, out: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    Pairwise `calc_ldscore()` between the rows of the marker matrix, computed
+    tile by tile over the upper triangle, so that M and `out` can both be
+    memory-mapped. Diagonal is 0.
+    """
+    n = M.shape[0]
+    R = np.zeros((n, n), dtype=float) if out is None else out
+    for i in range(0, n, block):
+        a = np.asarray(M[i : i + block])
+        for j in range(i, n, block):
+            b = a if i == j else np.asarray(M[j : j + block])
+            r2 = ld_block(a, b)
+            R[i : i + block, j : j + block] = r2
+            R[j : j + block, i : i + block] = r2.T
+    np.fill_diagonal(R, 0)
+    return R
+
+
+def mstmap_cache(mstmap: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Genotype matrix (markers x individuals, as uint8) and marker ids of the
+    MSTmap, memory-mapped from `.genotypes.npy` and `.markers.npy` next to
+    the map. The cache is built in two streaming passes when missing or older
+    than the map.
+    """
+    genofile = mstmap + ".genotypes.npy"
+    markersfile = mstmap + ".markers.npy"
+    if need_update(mstmap, (genofile, markersfile)):
+        nmarkers = nind = idwidth = 0
+        for x in iter_mstmap(mstmap):
+            nmarkers += 1
+            nind = len(x)
+            idwidth = max(idwidth, len(x.id))
+
+        tmpfile = genofile + ".tmp.npy"
+        G = np.lib.format.open_memmap(
+            tmpfile, mode="w+", dtype=np.uint8, shape=(nmarkers, nind)
+        )
+        ids = np.empty(nmarkers, dtype="S{}".format(max(idwidth, 1)))
+        for i, x in enumerate(iter_mstmap(mstmap)):
+            G[i] = np.frombuffer(x.genotype.encode(), dtype=np.uint8)
+            ids[i] = x.id.encode()
+        G.flush()
+        del G
+        os.replace(tmpfile, genofile)
+        np.save(markersfile, ids)
+        logger.debug(
+            "Cache %d markers x %d individuals in `%s`", nmarkers, nind, genofile
+        )
+
+    return np.load(genofile, mmap_mode="r"), np.load(markersfile, mmap_mode="r")
+
+
+def read_subsampled_matrix(mstmap: str, subsample: int) -> Tuple[np.ndarray, str, int]:
+    """
+    Read the subsampled matrix from file if it exists, otherwise calculate it.
+    Only the subsampled rows of the cached genotype matrix are read, and the
+    LD matrix is written to disk as it is computed.
+    """
     markerbedfile = mstmap + ".subsample.bed"
     ldmatrix = mstmap + ".subsample.matrix"
     if need_update(mstmap, (ldmatrix, markerbedfile)):
+        G, ids = mstmap_cache(mstmap)
+
+        # Take random subsample while keeping marker order
+        if subsample < G.shape[0]:
+            idx = np.array(sorted(sample(range(G.shape[0]), subsample)), dtype=int)
+        else:
+            logger.debug("Use all markers, --subsample ignored")
+            idx = np.arange(G.shape[0])
+
+        nmarkers = len(idx)
         with open(markerbedfile, "w", encoding="utf-8") as fw:
-            print("\n".join(x.bedline for x in data), file=fw)
+            for marker in ids[idx]:
+                marker = marker.decode()
+                seqid, pos = marker.split(".")
+                pos = int(pos)
+                print("\t".join(str(x) for x in (seqid, pos - 1, pos, marker)), file=fw)
             logger.debug(
                 "Write marker set of size %d to file `%s`.", nmarkers, markerbedfile
             )
 
-        M = np.zeros((nmarkers, nmarkers), dtype=float)
-        for i, j in combinations(range(nmarkers), 2):
-            a = data[i]
-            b = data[j]
-            M[i, j] = calc_ldscore(a.genotype, b.genotype)
-
-        M = symmetrize(M)
-
         logger.debug("Write LD matrix to file `%s`.", ldmatrix)
-        M.tofile(ldmatrix)
+        M = np.memmap(ldmatrix, dtype=float, mode="w+", shape=(nmarkers, nmarkers))
+        ld_matrix(G[idx], out=M)
+        M.flush()
     else:
         nmarkers = len(Bed(markerbedfile))
-        M = np.fromfile(ldmatrix, dtype=float).reshape(nmarkers, nmarkers)
         logger.debug("LD matrix `%s` exists (%dx%d).", ldmatrix, nmarkers, nmarkers)
 
+    M = np.memmap(ldmatrix, dtype=float, mode="r", shape=(nmarkers, nmarkers))
+
     return M, markerbedfile, nmarkers
 
 
@@ -383,6 +519,10 @@ def draw_geneticmap_heatmap(root, ax, mstmap: str, subsample: int):
     """
     Draw the heatmap of the genetic map.
     """
+    import seaborn as sns
+
+    from ..graphics.base import Rectangle, draw_cmap, normalize_axes, plot_heatmap
+
     M, markerbedfile, nmarkers = read_subsampled_matrix(mstmap, subsample)
 
     # Plot chromosomes breaks
@@ -433,6 +573,8 @@ def heatmap(args):
 
     Calculate pairwise linkage disequilibrium given MSTmap.
     """
+    from ..graphics.base import plt, savefig
+
     p = OptionParser(heatmap.__doc__)
     p.add_argument(
         "--subsample",
@@ -650,6 +792,17 @@ def hamming_distance(a, b, ignore=None):
     return dist
 
 
+def row_hamming(A: np.ndarray, B: np.ndarray, ignore: Optional[str] = None):
+    """
+    Vectorized `hamming_distance()` between the corresponding rows of two
+    marker matrices.
+    """
+    diff = A != B
+    if ignore:
+        diff &= (A != ord(ignore)) & (B != ord(ignore))
+    return diff.sum(axis=1)
+
+
 OK, BREAK, END = range(3)
 
 
@@ -671,8 +824,6 @@ def breakpoint(args):
     Find scaffold breakpoints using genetic map. Use variation.vcf.mstmap() to
     generate the input for this routine.
     """
-    from more_itertools import pairwise
-
     p = OptionParser(breakpoint.__doc__)
     p.add_argument(
         "--diff",
@@ -688,27 +839,25 @@ def breakpoint(args):
     (mstmap,) = args
     diff = opts.diff
     data = MSTMap(mstmap)
+    M = data.matrix
+    seqids = np.array([x.seqid for x in data])
+    max_allowed = data.nind * diff
 
-    # Remove singleton markers (avoid double cross-over)
-    good = []
-    nsingletons = 0
-    for i in range(1, len(data) - 1):
-        a = data[i]
-        left_label, left_rr = check_markers(data[i - 1], a, diff)
-        right_label, right_rr = check_markers(a, data[i + 1], diff)
-
-        if left_label == BREAK and right_label == BREAK:
-            nsingletons += 1
-            continue
+    def is_break(idx):
+        # Same as `check_markers()` between consecutive markers in idx
+        a, b = idx[:-1], idx[1:]
+        d = row_hamming(M[a], M[b], ignore="-")
+        return (seqids[a] == seqids[b]) & (d > max_allowed)
 
-        good.append(a)
-
-    logger.debug("A total of %d singleton markers removed.", nsingletons)
-
-    for a, b in pairwise(good):
-        label, rr = check_markers(a, b, diff)
-        if label == BREAK:
-            print("\t".join(str(x) for x in rr))
+    # Remove singleton markers (avoid double cross-over)
+    breaks = is_break(np.arange(len(data)))
+    singleton = breaks[:-1] & breaks[1:]
+    good = np.arange(1, len(data) - 1)[~singleton]
+    logger.debug("A total of %d singleton markers removed.", singleton.sum())
+
+    for i in np.flatnonzero(is_break(good)):
+        a, b = data[good[i]], data[good[i + 1]]
+        print("\t".join(str(x) for x in (a.seqid, a.pos, b.pos)))
 
 
 if __name__ == "__main__":
@@ -47,6 +47,7 @@ from ..graphics.base import (
 )
 from ..graphics.dotplot import dotplot
 from ..utils.cbook import gene_name
+from ..utils.profiler import span
 from .allmaps import make_movie
 
 # Map orientations to ints
@@ -157,6 +158,7 @@ class CLMFile:
         # Initially all contigs are considered active
         self.active = set(_tigs)
 
+    @span("hic.parse_clm")
     def parse_clm(self):
         clmfile = self.clmfile
         logger.debug("Parse clmfile `%s`", clmfile)
@@ -1007,42 +1009,44 @@ def bam2mat(args):
     # Check all reads, rules borrowed from LACHESIS
     # https://github.com/shendurelab/LACHESIS/blob/master/src/GenomeLinkMatrix.cc#L1476
     j = k = 0
-    for c in bamfile:
-        j += 1
-        if j % 100000 == 0:
-            print("{} reads counted".format(j), file=sys.stderr)
+    with span("hic.bam2mat") as stage:
+        for c in bamfile:
+            j += 1
+            if j % 10000000 == 0:
+                logger.debug("%d reads counted", j)
 
-        if c.is_qcfail and c.is_duplicate:
-            continue
-        if c.is_secondary and c.is_supplementary:
-            continue
-        if c.mapping_quality == 0:
-            continue
-        if not c.is_paired:
-            continue
-        if c.is_read2:  # Take only one read
-            continue
+            if c.is_qcfail and c.is_duplicate:
+                continue
+            if c.is_secondary and c.is_supplementary:
+                continue
+            if c.mapping_quality == 0:
+                continue
+            if not c.is_paired:
+                continue
+            if c.is_read2:  # Take only one read
+                continue
 
-        # pysam v0.8.3 does not support keyword reference_name
-        achr = bamfile.getrname(c.reference_id)
-        apos = c.reference_start
-        bchr = bamfile.getrname(c.next_reference_id)
-        bpos = c.next_reference_start
-        if achr not in seqstarts or bchr not in seqstarts:
-            continue
-        if achr == bchr:
-            dist = abs(apos - bpos)
-            if dist < minsize:
+            # pysam v0.8.3 does not support keyword reference_name
+            achr = bamfile.getrname(c.reference_id)
+            apos = c.reference_start
+            bchr = bamfile.getrname(c.next_reference_id)
+            bpos = c.next_reference_start
+            if achr not in seqstarts or bchr not in seqstarts:
                 continue
-            db = distbin_number(dist)
-            B[db] += 1
+            if achr == bchr:
+                dist = abs(apos - bpos)
+                if dist < minsize:
+                    continue
+                db = distbin_number(dist)
+                B[db] += 1
 
-        abin, bbin = bin_number(achr, apos), bin_number(bchr, bpos)
-        A[abin, bbin] += 1
-        if abin != bbin:
-            A[bbin, abin] += 1
+            abin, bbin = bin_number(achr, apos), bin_number(bchr, bpos)
+            A[abin, bbin] += 1
+            if abin != bbin:
+                A[bbin, abin] += 1
 
-        k += 1
+            k += 1
+        stage.add(j)
 
     logger.debug("Total reads counted: %s", percentage(2 * k, j))
     bamfile.close()
@@ -1342,9 +1346,11 @@ def optimize_ordering(fwtour, clm, phase, cpus):
     callbacki = partial(callback, phase=phase, oo=oo)
     toolbox = GA_setup(tour)
     toolbox.register("evaluate", score_evaluate_M, tour_sizes=tour_sizes, tour_M=tour_M)
-    tour, tour_fitness = GA_run(
-        toolbox, ngen=1000, npop=100, cpus=cpus, callback=callbacki
-    )
+    with span("hic.optimize_ordering") as stage:
+        stage.add(len(tour))
+        tour, tour_fitness = GA_run(
+            toolbox, ngen=1000, npop=100, cpus=cpus, callback=callbacki
+        )
     clm.tour = tour
 
     return tour
@@ -1362,11 +1368,13 @@ def optimize_orientations(fwtour, clm, phase, cpus):
     print_tour(
         fwtour, tour, "FLIPALL{}".format(phase), tour_contigs, oo, signs=clm.signs
     )
-    tag1 = clm.flip_whole(tour)
+    with span("hic.flip_whole"):
+        tag1 = clm.flip_whole(tour)
     print_tour(
         fwtour, tour, "FLIPWHOLE{}".format(phase), tour_contigs, oo, signs=clm.signs
     )
-    tag2 = clm.flip_one(tour)
+    with span("hic.flip_one"):
+        tag2 = clm.flip_one(tour)
     print_tour(
         fwtour, tour, "FLIPONE{}".format(phase), tour_contigs, oo, signs=clm.signs
     )
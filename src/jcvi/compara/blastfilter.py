@@ -30,6 +30,7 @@ from ..compara.synteny import check_beds
 from ..formats.blast import Blast
 from ..utils.cbook import gene_name
 from ..utils.grouper import Grouper
+from ..utils.profiler import span
 
 
 def blastfilter_main(blast_file, p, opts):
@@ -45,8 +46,10 @@ def blastfilter_main(blast_file, p, opts):
     logger.debug(
         "Load BLAST file `{}` (total {} lines)".format(blast_file, total_lines)
     )
-    bl = Blast(blast_file)
-    blasts = sorted(list(bl), key=lambda b: b.score, reverse=True)
+    with span("blastfilter.parse") as stage:
+        bl = Blast(blast_file)
+        blasts = sorted(list(bl), key=lambda b: b.score, reverse=True)
+        stage.add(len(blasts))
 
     filtered_blasts = []
     seen = set()
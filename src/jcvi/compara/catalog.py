@@ -700,7 +700,7 @@ def ortholog(args):
     pprefix = ".".join((aprefix, bprefix))
     qprefix = ".".join((bprefix, aprefix))
     last = pprefix + ".last"
-    if need_update((afasta, bfasta), last, warn=True):
+    if need_update((afasta, bfasta), last, warn=True, params=(align_soft, dbtype)):
         if align_soft == "blast":
             blast_main([bfasta, afasta, cpus_flag], dbtype)
         elif dbtype == "prot" and align_soft == "diamond_blastp":
@@ -718,7 +718,8 @@ def ortholog(args):
         last = lastself
 
     filtered_last = last + ".filtered"
-    if need_update(last, filtered_last, warn=True):
+    filter_params = (ccscore, opts.tandem_Nmax, exclude, opts.no_strip_names)
+    if need_update(last, filtered_last, warn=True, params=filter_params):
         dargs = [
             last,
             f"--cscore={ccscore}",
@@ -23,6 +23,7 @@ from ..algorithms.lpsolve import MIPDataModel
 from ..apps.base import OptionParser, logger
 from ..compara.synteny import _score, check_beds
 from ..formats.base import must_open
+from ..utils.profiler import span
 from .base import AnchorFile
 
 
@@ -151,8 +152,10 @@ def solve_lp(
     if self_match:
         constraints_x = constraints_y = constraints_x | constraints_y
 
-    data = create_data_model(nodes, constraints_x, qa, constraints_y, qb)
-    return data.solve(work_dir=work_dir, verbose=verbose)
+    with span("quota.solve_lp") as stage:
+        stage.add(len(clusters))
+        data = create_data_model(nodes, constraints_x, qa, constraints_y, qb)
+        return data.solve(work_dir=work_dir, verbose=verbose)
 
 
 def read_clusters(qa_file, qorder, sorder):
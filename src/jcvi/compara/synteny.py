@@ -17,6 +17,7 @@ from ..formats.bed import Bed, BedLine
 from ..formats.blast import Blast
 from ..utils.cbook import gene_name, human_size
 from ..utils.grouper import Grouper
+from ..utils.profiler import span
 from ..utils.range import range_chain
 from .base import AnchorFile
 
@@ -256,39 +257,41 @@ def read_blast(blast_file, qorder, sorder, is_self=False, ostrip=True):
     """Read the blast and convert name into coordinates"""
     filtered_blast = []
     seen = set()
-    bl = Blast(blast_file)
-    for b in bl:
-        query, subject = b.query, b.subject
-        if is_self and query == subject:
-            continue
-        if ostrip:
-            query, subject = gene_name(query), gene_name(subject)
-        if query not in qorder or subject not in sorder:
-            continue
+    with span("synteny.read_blast") as stage:
+        bl = Blast(blast_file)
+        for b in bl:
+            stage.add()
+            query, subject = b.query, b.subject
+            if is_self and query == subject:
+                continue
+            if ostrip:
+                query, subject = gene_name(query), gene_name(subject)
+            if query not in qorder or subject not in sorder:
+                continue
 
-        qi, q = qorder[query]
-        si, s = sorder[subject]
+            qi, q = qorder[query]
+            si, s = sorder[subject]
 
-        if is_self:
-            # remove redundant a<->b to one side when doing self-self BLAST
-            if qi > si:
-                query, subject = subject, query
-                qi, si = si, qi
-                q, s = s, q
-            # Too close to diagonal! possible tandem repeats
-            if q.seqid == s.seqid and si - qi < 40:
-                continue
+            if is_self:
+                # remove redundant a<->b to one side when doing self-self BLAST
+                if qi > si:
+                    query, subject = subject, query
+                    qi, si = si, qi
+                    q, s = s, q
+                # Too close to diagonal! possible tandem repeats
+                if q.seqid == s.seqid and si - qi < 40:
+                    continue
 
-        key = query, subject
-        if key in seen:
-            continue
-        seen.add(key)
+            key = query, subject
+            if key in seen:
+                continue
+            seen.add(key)
 
-        b.qseqid, b.sseqid = q.seqid, s.seqid
-        b.qi, b.si = qi, si
-        b.query, b.subject = query, subject
+            b.qseqid, b.sseqid = q.seqid, s.seqid
+            b.qi, b.si = qi, si
+            b.query, b.subject = query, subject
 
-        filtered_blast.append(b)
+            filtered_blast.append(b)
 
     logger.debug(
         "A total of %d BLAST imported from `%s`.", len(filtered_blast), blast_file
@@ -441,13 +444,15 @@ def batch_scan(points, xdist=20, ydist=20, N=5, is_self=False, intrabound=300):
     chr_pair_points = group_hits(points)
 
     clusters = []
-    for chr_pair in sorted(chr_pair_points.keys()):
-        points = chr_pair_points[chr_pair]
-        clusters.extend(
-            synteny_scan(
-                points, xdist, ydist, N, is_self=is_self, intrabound=intrabound
+    with span("synteny.scan") as stage:
+        for chr_pair in sorted(chr_pair_points.keys()):
+            points = chr_pair_points[chr_pair]
+            stage.add(len(points))
+            clusters.extend(
+                synteny_scan(
+                    points, xdist, ydist, N, is_self=is_self, intrabound=intrabound
+                )
             )
-        )
 
     return clusters
 
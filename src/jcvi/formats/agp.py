@@ -1061,7 +1061,6 @@ def infer(args):
     but can be useful when distributor does not ship an AGP file.
     """
     from jcvi.apps.grid import WriteJobs
-    from jcvi.formats.bed import sort
 
     p = OptionParser(infer.__doc__)
     p.set_cpus()
@@ -1076,15 +1075,14 @@ def infer(args):
         scaffolds = Fasta(scaffoldsf, lazy=True)
         genome = Fasta(genomef)
         genome = genome.tostring()
-        args = [
+        args = (
             (scaffold_name, scaffold, genome)
             for scaffold_name, scaffold in scaffolds.iteritems_ordered()
-        ]
+        )
 
         pool = WriteJobs(map_one_scaffold, args, inferbed, cpus=opts.cpus)
         pool.run()
 
-    sort([inferbed, "-i"])
     bed = Bed(inferbed)
     inferagpbed = "infer.bed"
     fw = open(inferagpbed, "w")
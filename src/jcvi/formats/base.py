@@ -2,20 +2,26 @@
 # -*- coding: UTF-8 -*-
 
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import copy
 import fileinput
 import gzip
+import hashlib
+import heapq
 from itertools import cycle, groupby, islice
 import math
+from multiprocessing import Pool
 import os
 from os import PathLike
 import os.path as op
 from pathlib import Path
 import shutil
+import struct
 import sys
 import tempfile
-from typing import IO, Iterable, Sequence, Union
+from typing import IO, Iterable, Optional, Sequence, Union
 
-from Bio import SeqIO
+import numpy as np
 
 from ..apps.base import (
     ActionDispatcher,
@@ -24,9 +30,9 @@ from ..apps.base import (
     logger,
     mkdir,
     need_update,
-    popen,
     sh,
 )
+from .compress import compression_type, open_compressed
 
 FastaExt = ("fasta", "fa", "fna", "cds", "pep", "faa", "fsa", "seq", "nt", "aa")
 FastqExt = ("fastq", "fq")
@@ -131,6 +137,71 @@ class SetFile(BaseFile, set):
             self.update(keys)
 
 
+class FileCache(object):
+    """
+    LRU cache of parsed files for long-running processes, such as the jcvi
+    daemon. Entries are keyed by the class, the path and the arguments, and are
+    dropped when the size or mtime of the file changes.
+
+    Callers get a shallow copy, so the container can be sorted or extended, but
+    the records are shared and must not be modified in place.
+    """
+
+    def __init__(self, maxsize: int = 32):
+        self.maxsize = maxsize
+        self.entries: OrderedDict = OrderedDict()
+        self.hits = self.misses = 0
+
+    def get(self, cls, filename: str, **kwargs):
+        path = op.abspath(filename)
+        st = os.stat(path)
+        stamp = (st.st_size, st.st_mtime_ns)
+        key = (cls, path, tuple(sorted(kwargs.items())))
+        try:
+            entry = self.entries.get(key)
+        except TypeError:  # Unhashable arguments
+            return cls(filename, **kwargs)
+        if entry and entry[0] == stamp:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return copy.copy(entry[1])
+
+        self.misses += 1
+        obj = cls(filename, **kwargs)
+        self.entries[key] = (stamp, obj)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+        return copy.copy(obj)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self.entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+_file_cache: Optional[FileCache] = None
+
+
+def enable_file_cache(maxsize: int = 32) -> FileCache:
+    global _file_cache
+    _file_cache = FileCache(maxsize)
+    return _file_cache
+
+
+def load_cached(cls, filename: str, **kwargs):
+    """
+    Parse the file with `cls(filename, **kwargs)`, through the file cache if it
+    is enabled. Use it for reference files that are only read.
+    """
+    if _file_cache is None or not op.isfile(filename):
+        return cls(filename, **kwargs)
+    return _file_cache.get(cls, filename, **kwargs)
+
+
 class FileMerger:
     """
     Merge files like `cat * > outfile`, with gzip-aware behavior:
@@ -284,11 +355,312 @@ class FileMerger:
                     pass
 
 
+_sort_key = None
+
+
+def _init_sort_worker(key):
+    """
+    Keep the sort key in the `FileSorter` worker process, so that a key with
+    state (e.g. `GffSortKey`) is sent once per worker and not with every run.
+    """
+    global _sort_key
+    _sort_key = key
+
+
+def _sort_run(runfile):
+    """
+    Sort one run file in place, used by `FileSorter` worker processes.
+    """
+    with open(runfile) as fp:
+        lines = fp.readlines()
+    lines.sort(key=_sort_key)
+    with open(runfile, "w") as fw:
+        fw.writelines(lines)
+    return runfile
+
+
+class FileSorter(object):
+    """
+    External merge sort for line-based files, with bounded memory:
+
+    - Lines are read in chunks of about `buffer_size` bytes, each chunk is
+      sorted by `key` and written to a temporary run file. With `cpus` > 1
+      the runs are sorted in a pool of worker processes while reading goes on.
+    - Runs are then k-way merged (at most `max_runs` files at a time).
+    - Header lines (starting with any of `header_prefixes`) are kept on top,
+      and everything after `stop_line` (e.g. ##FASTA in GFF) is copied as is
+      to the end.
+
+    `key` must be picklable if `cpus` > 1, e.g. a module-level function, and
+    is sent once to each worker process. Ties keep their input order. With `unique`, only
+    the first of the lines with equal keys is kept, as in `sort -u`.
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        key=None,
+        tmpdir: Optional[str] = None,
+        cpus: int = 1,
+        buffer_size: int = 256 * 1024 * 1024,
+        max_runs: int = 128,
+        header_prefixes: Sequence[str] = ("#",),
+        stop_line: Optional[str] = None,
+        unique: bool = False,
+    ):
+        self.filename = filename
+        self.key = key
+        self.tmpdir = tmpdir
+        self.cpus = max(cpus, 1)
+        self.buffer_size = buffer_size
+        self.max_runs = max(max_runs, 2)
+        self.header_prefixes = tuple(header_prefixes)
+        self.stop_line = stop_line
+        self.unique = unique
+
+    def sort(self, outfile: str = "stdout") -> str:
+        """
+        Sort the input into `outfile`, which may be the input file itself.
+        """
+        workdir = tempfile.mkdtemp(prefix="jcvi-sort-", dir=self.tmpdir)
+        try:
+            header, runs, tail = self._make_runs(workdir)
+            while len(runs) > self.max_runs:
+                runs = self._merge_pass(runs, workdir)
+
+            inplace = outfile == self.filename
+            target = op.join(workdir, "sorted") if inplace else outfile
+            fw = must_open(target, "wt")
+            fw.writelines(header)
+            self._merge(runs, fw)
+            if tail:
+                with open(tail) as fp:
+                    shutil.copyfileobj(fp, fw)
+            if fw is not sys.stdout:
+                fw.close()
+            if inplace:
+                shutil.move(target, outfile)
+        finally:
+            cleanup(workdir)
+
+        logger.debug("Sorted `%s` into `%s`", self.filename, outfile)
+        return outfile
+
+    def _make_runs(self, workdir):
+        header, runs, tail = [], [], None
+        chunk, chunk_size = [], 0
+        pool = None
+        if self.cpus > 1:
+            pool = Pool(self.cpus, initializer=_init_sort_worker, initargs=(self.key,))
+        pending = []
+
+        def flush():
+            runfile = op.join(workdir, "run{0:05d}".format(len(runs)))
+            runs.append(runfile)
+            if pool is None:
+                chunk.sort(key=self.key)
+                with open(runfile, "w") as fw:
+                    fw.writelines(chunk)
+                return
+            with open(runfile, "w") as fw:
+                fw.writelines(chunk)
+            pending.append(pool.apply_async(_sort_run, (runfile,)))
+            # Bound the number of unsorted runs waiting on the workers
+            while len(pending) > self.cpus:
+                pending.pop(0).get()
+
+        fp = must_open(self.filename)
+        for line in fp:
+            if not line.strip():
+                continue
+            if self.stop_line and line.rstrip() == self.stop_line:
+                tail = op.join(workdir, "tail")
+                with open(tail, "w") as fw:
+                    fw.write(line)
+                    shutil.copyfileobj(fp, fw)
+                break
+            if line.startswith(self.header_prefixes):
+                header.append(line)
+                continue
+            if line[-1] != "\n":
+                line += "\n"
+            chunk.append(line)
+            chunk_size += len(line)
+            if chunk_size >= self.buffer_size:
+                flush()
+                chunk, chunk_size = [], 0
+        if fp is not sys.stdin:
+            fp.close()
+        if chunk:
+            flush()
+
+        if pool is not None:
+            for r in pending:
+                r.get()
+            pool.close()
+            pool.join()
+        logger.debug("%d sorted runs written to `%s`", len(runs), workdir)
+        return header, runs, tail
+
+    def _merge(self, runs, fw):
+        fps = [open(x) for x in runs]
+        last = None
+        for line in heapq.merge(*fps, key=self.key):
+            if self.unique:
+                k = self.key(line) if self.key else line
+                if k == last:
+                    continue
+                last = k
+            fw.write(line)
+        for fp in fps:
+            fp.close()
+
+    def _merge_pass(self, runs, workdir):
+        merged = []
+        for i in range(0, len(runs), self.max_runs):
+            group = runs[i : i + self.max_runs]
+            runfile = op.join(workdir, "merge{0:05d}".format(len(merged)))
+            with open(runfile, "w") as fw:
+                self._merge(group, fw)
+            cleanup(group)
+            merged.append(runfile)
+        # Make sure the next pass does not clash with the old run names
+        renamed = []
+        for i, runfile in enumerate(merged):
+            newfile = op.join(workdir, "run{0:05d}".format(i))
+            os.replace(runfile, newfile)
+            renamed.append(newfile)
+        return renamed
+
+
+class RecordIndex(object):
+    """
+    Byte offsets of the record boundaries in a FASTA, FASTQ (4-line records)
+    or text file (one record per line), found by scanning raw bytes without
+    parsing the records. The last offset is the file size, so record i spans
+    `offsets[i]:offsets[i + 1]`.
+
+    The offsets are cached next to the file (`filename.offsets`) as raw int64
+    behind a small header, and memory-mapped on later use as long as the file
+    size and mtime are unchanged.
+    """
+
+    magic = b"JCVIOFF1"
+    header = struct.Struct("<8sqq8s")
+    chunk_size = 64 * 1024 * 1024
+
+    def __init__(self, filename, format="fasta"):
+        assert format in ("fasta", "fastq", "txt"), f"Cannot index format {format}"
+        self.filename = filename
+        self.format = format
+        self.idxfile = filename + ".offsets"
+        self.offsets = self._load()
+        if self.offsets is None:
+            self.offsets = self._build()
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    def _stamp(self):
+        st = os.stat(self.filename)
+        return self.header.pack(
+            self.magic, st.st_size, st.st_mtime_ns, self.format.encode()
+        )
+
+    def _load(self):
+        if not op.exists(self.idxfile):
+            return None
+        with open(self.idxfile, "rb") as fp:
+            stamp = fp.read(self.header.size)
+        if stamp != self._stamp():
+            logger.debug("Index `%s` is stale, rebuilding", self.idxfile)
+            return None
+        logger.debug("Load record offsets from `%s`", self.idxfile)
+        return np.memmap(self.idxfile, dtype="<i8", mode="r", offset=self.header.size)
+
+    def _scan(self):
+        """
+        Yield arrays of record start offsets, one per chunk read.
+        """
+        fastq = self.format == "fastq"
+        pos = nlines = 0
+        prev = b"\n"
+        with open(self.filename, "rb") as fp:
+            while True:
+                chunk = fp.read(self.chunk_size)
+                if not chunk:
+                    break
+                arr = np.frombuffer(chunk, dtype=np.uint8)
+                starts = np.flatnonzero(arr == 10) + 1
+                starts = starts[starts < len(arr)]
+                if prev == b"\n":
+                    starts = np.concatenate(([0], starts))
+                if self.format == "fasta":
+                    starts = starts[arr[starts] == ord(">")]
+                elif fastq:
+                    first = -nlines % 4
+                    nlines += len(starts)
+                    starts = starts[first::4]
+                    if not (arr[starts] == ord("@")).all():
+                        raise ValueError(
+                            f"`{self.filename}` is not a FASTQ file with 4-line records"
+                        )
+                yield starts.astype(np.int64) + pos
+                prev = chunk[-1:]
+                pos += len(chunk)
+        yield np.array([pos], dtype=np.int64)
+
+    def _build(self):
+        logger.debug("Index record offsets in `%s`", self.filename)
+        stamp = self._stamp()
+        try:
+            fw = open(self.idxfile + ".tmp", "wb")
+        except OSError:
+            return np.concatenate(list(self._scan()))
+
+        with fw:
+            fw.write(stamp)
+            for starts in self._scan():
+                fw.write(starts.astype("<i8").tobytes())
+        os.replace(self.idxfile + ".tmp", self.idxfile)
+        return self._load()
+
+
+def _copy_range(filename, outfile, start, end):
+    """
+    Copy bytes [start, end) of filename into outfile.
+    """
+    with open(filename, "rb") as fp, open(outfile, "wb") as fw:
+        size = end - start
+        if hasattr(os, "copy_file_range"):
+            offset = start
+            while size > 0:
+                copied = os.copy_file_range(fp.fileno(), fw.fileno(), size, offset)
+                if not copied:
+                    break
+                offset += copied
+                size -= copied
+        fp.seek(end - size)
+        while size > 0:
+            buf = fp.read(min(size, RecordIndex.chunk_size))
+            if not buf:
+                break
+            fw.write(buf)
+            size -= len(buf)
+    return outfile
+
+
 class FileSplitter(object):
-    def __init__(self, filename, outputdir=None, format="fasta", mode="cycle"):
+    def __init__(self, filename, outputdir=None, format="fasta", mode="cycle", cpus=1):
         self.filename = filename
         self.outputdir = outputdir
         self.mode = mode
+        self.cpus = cpus
+        self._index = None
 
         format = format or self._guess_format(filename)
         logger.debug("format is %s", format)
@@ -305,6 +677,8 @@ class FileSplitter(object):
 
     def _open(self, filename):
         if self.klass == "seqio":
+            from Bio import SeqIO
+
             handle = SeqIO.parse(open(filename), self.format)
         elif self.klass == "clust":
             from jcvi.apps.uclust import ClustFile
@@ -314,8 +688,21 @@ class FileSplitter(object):
             handle = open(filename)
         return handle
 
+    @property
+    def index(self):
+        """
+        Record offsets of the input, None if records have to be parsed.
+        """
+        if self.klass == "clust" or compression_type(self.filename):
+            return None
+        if self._index is None:
+            self._index = RecordIndex(self.filename, self.format)
+        return self._index
+
     @property
     def num_records(self):
+        if self.index is not None:
+            return len(self.index)
         handle = self._open(self.filename)
         return sum(1 for x in handle)
 
@@ -365,6 +752,8 @@ class FileSplitter(object):
 
     def write(self, fw, batch):
         if self.klass == "seqio":
+            from Bio import SeqIO
+
             SeqIO.write(batch, fw, self.format)
         elif self.klass == "clust":
             for b in batch:
@@ -394,6 +783,10 @@ class FileSplitter(object):
             logger.error("file %s already existed, skip file splitting", self.names[0])
             return
 
+        if self.index is not None:
+            self._split_offsets(N)
+            return
+
         filehandles = [open(x, "w") for x in self.names]
 
         if mode == "batch":
@@ -428,6 +821,83 @@ class FileSplitter(object):
         for fw in filehandles:
             fw.close()
 
+    def _assign(self, N):
+        """
+        Output file index for each record, for modes `cycle` and `optimal`.
+        """
+        n = len(self.index)
+        if self.mode == "cycle":
+            return np.arange(n) % N
+
+        # Greedy LPT as in split(), using the record sizes in bytes
+        labels = np.empty(n, dtype=np.int32)
+        heap = [(0, i) for i in range(N)]
+        for j, size in enumerate(self.index.lengths.tolist()):
+            endtime, i = heap[0]
+            labels[j] = i
+            heapq.heapreplace(heap, (endtime + size, i))
+        return labels
+
+    def _split_offsets(self, N):
+        """
+        Split by copying raw byte ranges given by the record index, with the
+        output files written by `cpus` threads.
+        """
+        offsets = self.index.offsets
+        n = len(self.index)
+        with ThreadPoolExecutor(self.cpus) as executor:
+            if self.mode == "batch":
+                batch_size = math.ceil(n / float(N))
+                bounds = [min(i * batch_size, n) for i in range(N + 1)]
+                jobs = [
+                    executor.submit(
+                        _copy_range,
+                        self.filename,
+                        name,
+                        int(offsets[bounds[i]]),
+                        int(offsets[bounds[i + 1]]),
+                    )
+                    for i, name in enumerate(self.names)
+                ]
+                for job in jobs:
+                    logger.debug("write records to %s", job.result())
+                return
+
+            labels = self._assign(N)
+            filehandles = [open(x, "wb") for x in self.names]
+            with open(self.filename, "rb") as fp:
+                i = 0
+                while i < n:
+                    # Read as many whole records as fit in one chunk
+                    j = np.searchsorted(
+                        offsets, offsets[i] + RecordIndex.chunk_size, side="right"
+                    )
+                    j = min(max(j - 1, i + 1), n)
+                    start = int(offsets[i])
+                    fp.seek(start)
+                    view = memoryview(fp.read(int(offsets[j]) - start))
+                    # Slice out the runs of consecutive records that go to the
+                    # same output file
+                    chunk_labels = labels[i:j]
+                    cuts = np.flatnonzero(np.diff(chunk_labels)) + 1
+                    run_starts = np.concatenate(([0], cuts))
+                    run_ends = np.concatenate((cuts, [j - i]))
+                    pieces = [[] for _ in range(N)]
+                    for a, b, k in zip(
+                        (offsets[i + run_starts] - start).tolist(),
+                        (offsets[i + run_ends] - start).tolist(),
+                        chunk_labels[run_starts].tolist(),
+                    ):
+                        pieces[k].append(view[a:b])
+                    list(
+                        executor.map(
+                            lambda k: filehandles[k].writelines(pieces[k]), range(N)
+                        )
+                    )
+                    i = j
+            for fw in filehandles:
+                fw.close()
+
 
 def longest_unique_prefix(query, targets, remove_self=True):
     """
@@ -468,6 +938,18 @@ def timestamp():
     return "{0}{1:02d}{2:02d}".format(dt.now().year, dt.now().month, dt.now().day)
 
 
+def file_checksum(filename: str, blocksize: int = 1 << 20) -> str:
+    """
+    Compute the blake2b hexdigest of the file content, reading in chunks of
+    `blocksize` bytes so memory stays flat on large files.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    with open(filename, "rb") as fp:
+        for chunk in iter(lambda: fp.read(blocksize), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
 def must_open(
     filename: str,
     mode: str = "r",
@@ -478,20 +960,28 @@ def must_open(
     """
     Accepts filename and returns filehandle.
 
-    Checks on multiple files, stdin/stdout/stderr, .gz or .bz2 file.
+    Checks on multiple files, stdin/stdout/stderr, .gz, .bz2 or .zst file, and
+    streams s3:// objects.
+
+    Compressed files are handled by `formats.compress.open_compressed()`. They
+    are read in text mode unless `mode` has "b", and written in binary mode
+    unless `mode` has "t", as with gzip.open().
     """
     if isinstance(filename, list):
         assert "r" in mode
 
-        if filename[0].endswith((".gz", ".bz2")):
-            filename = " ".join(filename)  # allow opening multiple gz/bz2 files
-        else:
-            return fileinput.input(filename)
+        if any(compression_type(x) for x in filename):
+            # allow opening multiple gz/bz2/zst files
+            return fileinput.input(filename, openhook=open_compressed)
+        return fileinput.input(filename)
+
+    if compression_type(filename) and not any(x in mode for x in "rbt"):
+        mode += "b"
 
     if filename.startswith("s3://"):
-        from jcvi.utils.aws import pull_from_s3
+        from jcvi.utils.aws import open_s3
 
-        filename = pull_from_s3(filename)
+        return open_s3(filename, mode)
 
     if filename in ("-", "stdin"):
         assert "r" in mode
@@ -510,22 +1000,8 @@ def must_open(
 
         fp = NamedTemporaryFile(mode=mode, delete=False)
 
-    elif filename.endswith(".gz"):
-        import gzip
-
-        if "r" in mode:
-            fp = gzip.open(filename, mode + "t")
-        elif "w" in mode:
-            fp = gzip.open(filename, mode)
-
-    elif filename.endswith(".bz2"):
-        if "r" in mode:
-            cmd = f"bzcat {filename}"
-            fp = popen(cmd, debug=False)
-        elif "w" in mode:
-            import bz2
-
-            fp = bz2.BZ2File(filename, mode)
+    elif compression_type(filename):
+        fp = open_compressed(filename, mode)
 
     else:
         if checkexists:
@@ -1039,6 +1515,7 @@ def split(args):
     p.add_argument(
         "--format", choices=("fasta", "fastq", "txt", "clust"), help="input file format"
     )
+    p.set_cpus(cpus=1)
 
     opts, args = p.parse_args(args)
 
@@ -1046,7 +1523,9 @@ def split(args):
         sys.exit(not p.print_help())
 
     filename, outdir, N = args
-    fs = FileSplitter(filename, outputdir=outdir, format=opts.format, mode=opts.mode)
+    fs = FileSplitter(
+        filename, outputdir=outdir, format=opts.format, mode=opts.mode, cpus=opts.cpus
+    )
 
     if opts.all:
         logger.debug("option -all override N")
@@ -33,7 +33,15 @@ from ..utils.range import (
     range_intersect,
     range_union,
 )
-from .base import DictFile, LineFile, get_number, is_number, must_open
+from .base import (
+    DictFile,
+    FileSorter,
+    LineFile,
+    get_number,
+    is_number,
+    load_cached,
+    must_open,
+)
 from .sizes import Sizes
 
 
@@ -518,7 +526,7 @@ def gaps(args):
         sys.exit(not p.print_help())
 
     inputbed, ref_fasta = args
-    ref_sizes = Sizes(ref_fasta).mapping
+    ref_sizes = load_cached(Sizes, ref_fasta).mapping
     minsize = opts.minsize
     fw = must_open(opts.outfile, "w")
     na_in = set(opts.na_in.split(",")) if opts.na_in else set()
@@ -790,7 +798,7 @@ def density(args):
 
     bedfile, fastafile = args
     bed = Bed(bedfile)
-    sizes = Sizes(fastafile).mapping
+    sizes = load_cached(Sizes, fastafile).mapping
     header = "seqid features size density_per_Mb".split()
     print("\t".join(header))
     for seqid, bb in bed.sub_beds():
@@ -819,7 +827,7 @@ def filter_bedpe(bedpe, filtered, ref, rc=False, rlen=None, minlen=2000, maxlen=
     logger.debug(
         "Filter criteria: innie%s, %d <= insertsize <= %d", tag, minlen, maxlen
     )
-    sizes = Sizes(ref).mapping
+    sizes = load_cached(Sizes, ref).mapping
     fp = must_open(bedpe)
     fw = must_open(filtered, "w")
     retained = total = 0
@@ -1199,7 +1207,7 @@ def longest(args):
     minsize = opts.minsize
     prec = opts.precedence
     mergedbed = mergeBed(bedfile, nms=True)
-    sizes = Sizes(fastafile).mapping
+    sizes = load_cached(Sizes, fastafile).mapping
     bed = Bed(mergedbed)
 
     pf = bedfile.rsplit(".", 1)[0]
@@ -1381,7 +1389,7 @@ def uniq(args):
     bed = Bed(bedfile)
 
     if opts.sizes:
-        sizes = Sizes(opts.sizes).mapping
+        sizes = load_cached(Sizes, opts.sizes).mapping
         ranges = [
             Range(x.seqid, x.start, x.end, sizes[x.accn], i) for i, x in enumerate(bed)
         ]
@@ -1418,36 +1426,209 @@ def uniq(args):
     return uniqbedfile
 
 
-def subtractbins(binfile1, binfile2):
-    from jcvi.graphics.landscape import BinFile
+def get_nbins(clen: int, shift: int) -> Tuple[int, int]:
+    """
+    Get the number of bins for a given chromosome length and shift.
+    """
+    nbins, last_bin = divmod(clen, shift)
+    if last_bin:
+        nbins += 1
+    return nbins, last_bin
 
-    abin = BinFile(binfile1)
-    bbin = BinFile(binfile2)
 
-    assert len(abin) == len(bbin)
+def read_bed_intervals(bedfile: str, score: bool = False) -> dict:
+    """
+    Read bedfile into seqid => (starts, ends, scores) arrays, with 0-based
+    half-open coordinates, without building a BedLine for each row.
+    """
+    rows = defaultdict(lambda: ([], [], []))
+    with must_open(bedfile) as fp:
+        for row in fp:
+            if row.startswith(("#", "track", "browser")) or not row.strip():
+                continue
+            args = row.rstrip("\n").split("\t")
+            starts, ends, scores = rows[args[0]]
+            starts.append(int(args[1]))
+            ends.append(int(args[2]))
+            if score:
+                scores.append(float(args[4]) if len(args) > 4 else 0.0)
 
-    fw = open(binfile1, "w")
+    return {
+        seqid: (
+            np.array(starts, dtype=np.int64),
+            np.array(ends, dtype=np.int64),
+            np.array(scores, dtype=float) if score else None,
+        )
+        for seqid, (starts, ends, scores) in rows.items()
+    }
 
-    for a, b in zip(abin, bbin):
-        assert a.chr == b.chr
-        assert a.binlen == b.binlen
 
-        a.subtract(b)
-        print(a, file=fw)
+def merge_intervals(starts, ends, scores=None):
+    """
+    Merge overlapping and book-ended intervals, like `mergeBed`. Scores of the
+    merged intervals are the median of their members.
+    """
+    if len(starts) == 0:
+        return starts, ends, scores
+    order = np.lexsort((ends, starts))
+    starts, ends = starts[order], ends[order]
+    reach = np.maximum.accumulate(ends)
+    new = np.ones(len(starts), dtype=bool)
+    new[1:] = starts[1:] > reach[:-1]
+    idx = np.flatnonzero(new)
+    mstarts = starts[idx]
+    mends = np.maximum.reduceat(ends, idx)
+    if scores is None:
+        return mstarts, mends, None
+
+    # Median of each group, from the scores sorted within groups
+    group = np.cumsum(new) - 1
+    scores = scores[order]
+    sorted_scores = scores[np.lexsort((scores, group))]
+    counts = np.diff(np.append(idx, len(starts)))
+    lo = sorted_scores[idx + (counts - 1) // 2]
+    hi = sorted_scores[idx + counts // 2]
+    return mstarts, mends, (lo + hi) / 2
+
+
+def subtract_intervals(starts, ends, gstarts, gends, seqlen, scores=None):
+    """
+    Remove the gaps (sorted, merged intervals) from the intervals, like
+    intersecting with the complement of the gaps. Intervals are split where
+    they span a gap.
+    """
+    astarts = np.concatenate(([0], gends))
+    aends = np.concatenate((gstarts, [seqlen]))
+    keep = aends > astarts
+    astarts, aends = astarts[keep], aends[keep]
+
+    lo = np.searchsorted(aends, starts, side="right")
+    hi = np.searchsorted(astarts, ends, side="left")
+    npieces = np.maximum(hi - lo, 0)
+    which = np.repeat(np.arange(len(starts)), npieces)
+    first = np.repeat(lo, npieces)
+    offset = np.arange(len(which)) - np.repeat(np.cumsum(npieces) - npieces, npieces)
+    allowed = first + offset
+    pstarts = np.maximum(starts[which], astarts[allowed])
+    pends = np.minimum(ends[which], aends[allowed])
+    return pstarts, pends, (None if scores is None else scores[which])
+
+
+def bin_span(starts, ends, binsize: int, nbins: int):
+    """
+    Number of bases covered by the intervals in each bin.
+    """
+    size = nbins + 1
+    sb = starts // binsize
+    eb = (ends - 1) // binsize
+    first_end = np.minimum(ends, (sb + 1) * binsize)
+    a = np.bincount(sb, weights=first_end - starts, minlength=size)
+    multi = eb > sb
+    sbm, ebm = sb[multi], eb[multi]
+    a += np.bincount(ebm, weights=ends[multi] - ebm * binsize, minlength=size)
+    # Bins fully inside an interval, accumulated as a difference array
+    full = np.full(len(sbm), binsize, dtype=float)
+    d = np.bincount(sbm + 1, weights=full, minlength=size)
+    d -= np.bincount(ebm, weights=full, minlength=size)
+    a += np.cumsum(d)
+    return a[:nbins]
+
+
+def bin_count(starts, ends, binsize: int, nbins: int, weights=None):
+    """
+    Number of intervals (or the sum of their weights) that touch each bin.
+    """
+    size = nbins + 1
+    sb = starts // binsize
+    eb = (ends - 1) // binsize
+    if weights is None:
+        weights = np.ones(len(starts))
+    d = np.bincount(sb, weights=weights, minlength=size)
+    d -= np.bincount(eb + 1, weights=weights, minlength=size + 1)[:size]
+    return np.cumsum(d)[:nbins]
+
+
+def bin_bed(
+    bedfile: str,
+    sizes: dict,
+    binsize: int = 100000,
+    mode: str = "span",
+    merge: bool = True,
+    subtract: Optional[str] = None,
+) -> dict:
+    """
+    Bin the features in bedfile into consecutive windows along each sequence
+    in sizes (seqid => length). Returns seqid => (values, bases), where values
+    are the span, count or score of the features in each bin, and bases is
+    the bin size minus the bases in the `subtract` bedfile.
+    """
+    assert mode in ("span", "count", "score")
+    features = read_bed_intervals(bedfile, score=(mode == "score"))
+    gaps = read_bed_intervals(subtract) if subtract else {}
+    empty = np.zeros(0, dtype=np.int64)
+
+    binned = OrderedDict()
+    for seqid, seqlen in sorted(sizes.items()):
+        nbins, _ = get_nbins(seqlen, binsize)
+        bases = np.full(nbins, binsize, dtype=np.int64)
+        bases[-1] = seqlen - (nbins - 1) * binsize
+
+        starts, ends, scores = features.get(seqid, (empty, empty, None))
+        ends = np.minimum(ends, seqlen)
+        keep = ends > starts
+        starts, ends = starts[keep], ends[keep]
+        if scores is not None:
+            scores = scores[keep]
+        if merge:
+            starts, ends, scores = merge_intervals(starts, ends, scores)
+
+        if seqid in gaps:
+            gstarts, gends, _ = gaps[seqid]
+            gstarts, gends, _ = merge_intervals(gstarts, np.minimum(gends, seqlen))
+            starts, ends, scores = subtract_intervals(
+                starts, ends, gstarts, gends, seqlen, scores
+            )
+            bases -= bin_span(gstarts, gends, binsize, nbins).astype(np.int64)
 
-    fw.close()
+        if mode == "span":
+            values = bin_span(starts, ends, binsize, nbins)
+        else:
+            values = bin_count(starts, ends, binsize, nbins, weights=scores)
+        binned[seqid] = (values, bases)
 
-    return binfile1
+    return binned
 
 
-def get_nbins(clen: int, shift: int) -> Tuple[int, int]:
+def write_bins(binfile: str, binned: dict, binsize: int, mode: str):
     """
-    Get the number of bins for a given chromosome length and shift.
+    Save the output of `bin_bed()` into .bins.npz.
     """
-    nbins, last_bin = divmod(clen, shift)
-    if last_bin:
-        nbins += 1
-    return nbins, last_bin
+    seqids = list(binned.keys())
+    lengths = [len(values) for values, _ in binned.values()]
+    np.savez(
+        binfile,
+        seqids=np.array(seqids, dtype=str),
+        offsets=np.concatenate(([0], np.cumsum(lengths))).astype(np.int64),
+        values=np.concatenate([values for values, _ in binned.values()]),
+        bases=np.concatenate([bases for _, bases in binned.values()]),
+        binsize=binsize,
+        mode=mode,
+    )
+    return binfile
+
+
+def read_bins(binfile: str) -> dict:
+    """
+    Load .bins.npz written by `write_bins()` into seqid => (values, bases).
+    """
+    binned = OrderedDict()
+    with np.load(binfile) as data:
+        offsets = data["offsets"]
+        values, bases = data["values"], data["bases"]
+        for i, seqid in enumerate(data["seqids"]):
+            a, b = offsets[i], offsets[i + 1]
+            binned[str(seqid)] = (values[a:b], bases[a:b])
+    return binned
 
 
 def bins(args):
@@ -1455,7 +1636,8 @@ def bins(args):
     %prog bins bedfile fastafile
 
     Bin bed lengths into each consecutive window. Use --subtract to remove bases
-    from window, e.g. --subtract gaps.bed ignores the gap sequences.
+    from window, e.g. --subtract gaps.bed ignores the gap sequences. Bins are
+    written to bedfile.BINSIZE.MODE.bins.npz.
     """
 
     p = OptionParser(bins.__doc__)
@@ -1482,72 +1664,23 @@ def bins(args):
 
     binsize = opts.binsize
     binfile = bedfile + ".{0}".format(binsize)
-    binfile += ".{0}.bins".format(mode)
+    binfile += ".{0}.bins.npz".format(mode)
 
-    if not need_update(bedfile, binfile):
+    infiles = [bedfile, subtract] if subtract else [bedfile]
+    if not need_update(infiles, binfile, params=(binsize, mode, opts.nomerge)):
         return binfile
 
-    sz = Sizes(fastafile)
-    sizesfile = sz.filename
-    sizes = sz.mapping
-    fw = open(binfile, "w")
-    scores = "median" if mode == "score" else None
-    if not opts.nomerge:
-        bedfile = mergeBed(bedfile, nms=True, scores=scores)
-    if subtract:
-        subtractmerge = mergeBed(subtract)
-        subtract_complement = complementBed(subtractmerge, sizesfile)
-        bedfile = intersectBed(bedfile, subtract_complement)
-
-    bedfile = sort([bedfile, "-i"])
-
-    bed = Bed(bedfile)
-    sbdict = dict(bed.sub_beds())
-    for chr, chr_len in sorted(sizes.items()):
-        chr_len = sizes[chr]
-        subbeds = sbdict.get(chr, [])
-        nbins, last_bin = get_nbins(chr_len, binsize)
-
-        a = np.zeros(nbins)  # values
-        b = np.zeros(nbins, dtype=int)  # bases
-        c = np.zeros(nbins, dtype=int)  # count
-        b[:-1] = binsize
-        b[-1] = last_bin
-
-        for bb in subbeds:
-            start, end = bb.start, bb.end
-            startbin = start // binsize
-            endbin = end // binsize
-
-            assert startbin <= endbin
-            c[startbin : endbin + 1] += 1
-
-            if mode == "score":
-                a[startbin : endbin + 1] += float(bb.score)
-
-            elif mode == "span":
-                if startbin == endbin:
-                    a[startbin] += end - start + 1
-
-                if startbin < endbin:
-                    firstsize = (startbin + 1) * binsize - start + 1
-                    lastsize = end - endbin * binsize
-                    a[startbin] += firstsize
-                    if startbin + 1 < endbin:
-                        a[startbin + 1 : endbin] += binsize
-                    a[endbin] += lastsize
-
-        if mode == "count":
-            a = c
-
-        for xa, xb in zip(a, b):
-            print("\t".join(str(x) for x in (chr, xa, xb)), file=fw)
-
-    fw.close()
-
-    if subtract:
-        subtractbinfile = bins([subtract, fastafile, "--binsize={0}".format(binsize)])
-        binfile = subtractbins(binfile, subtractbinfile)
+    sizes = load_cached(Sizes, fastafile).mapping
+    binned = bin_bed(
+        bedfile,
+        sizes,
+        binsize=binsize,
+        mode=mode,
+        merge=not opts.nomerge,
+        subtract=subtract,
+    )
+    write_bins(binfile, binned, binsize, mode)
+    logger.debug("Bins written to `%s`", binfile)
 
     return binfile
 
@@ -1979,15 +2112,11 @@ def sample(args):
         return
 
     c = Coverage(bedfile, sizesfile)
-    coveragefile = c.filename
     samplecoveragefile = pf + ".sample.coverage"
     fw = open(samplecoveragefile, "w")
-    fp = open(coveragefile)
-    for row in fp:
-        seqid, start, end, cov = row.split()
-        cov = int(cov)
+    for seqid, start, end, cov in c.iter_bedgraph():
         if cov <= opts.max:
-            fw.write(row)
+            print("\t".join(str(x) for x in (seqid, start, end, cov)), file=fw)
     fw.close()
 
     samplebedfile = pf + ".sample.bed"
@@ -2306,12 +2435,37 @@ def summary(args):
         print("\t".join((seqid, str(bs))))
 
 
+def bed_sort_key(row):
+    """
+    Sort key for a raw BED line: seqid, start, end, accn.
+    """
+    atoms = row.rstrip("\n").split("\t", 4)
+    return atoms[0], int(atoms[1]), int(atoms[2]), atoms[3] if len(atoms) > 3 else ""
+
+
+def bed_natsort_key(row):
+    """
+    Sort key for a raw BED line, using natural order of seqids (chr1, chr2, ...).
+    """
+    seqid, start, end, accn = bed_sort_key(row)
+    return natsort_key(seqid), start, end, accn
+
+
+def bed_accn_sort_key(row):
+    """
+    Sort key for a raw BED line, sorting on accession first.
+    """
+    seqid, start, end, accn = bed_sort_key(row)
+    return accn, seqid, start, end
+
+
 def sort(args):
     """
     %prog sort bedfile
 
-    Sort bed file to have ascending order of seqid, then start. It uses the
-    `sort` command.
+    Sort bed file to have ascending order of seqid, then start. This is an
+    external merge sort, so memory use is bounded by `--buffer_size`
+    regardless of the size of the file.
     """
     p = OptionParser(sort.__doc__)
     p.add_argument(
@@ -2327,7 +2481,7 @@ def sort(args):
         dest="unique",
         default=False,
         action="store_true",
-        help="Uniqify the bed file",
+        help="Uniqify the bed file, keep one line per seqid, start, end and accn",
     )
     p.add_argument(
         "--accn",
@@ -2341,8 +2495,15 @@ def sort(args):
         action="store_true",
         help="Numerically sort seqid column, e.g. chr1,chr2,...",
     )
+    p.add_argument(
+        "--buffer_size",
+        default=256,
+        type=int,
+        help="Size of sorted runs kept in memory, in MB",
+    )
     p.set_outfile(outfile=None)
     p.set_tmpdir()
+    p.set_cpus(cpus=1)
     opts, args = p.parse_args(args)
 
     if len(args) != 1:
@@ -2351,33 +2512,36 @@ def sort(args):
     (bedfile,) = args
     inplace = opts.inplace
 
-    if opts.num:
-        bed = Bed(bedfile)
-        bed.print_to_file(opts.outfile or "stdout", sorted=True)
-        return
-
-    if not inplace and ".sorted." in bedfile:
+    sortedbed = opts.outfile
+    if opts.num and not inplace:
+        sortedbed = opts.outfile or "stdout"
+    elif not inplace and ".sorted." in bedfile:
         return bedfile
 
-    sortedbed = opts.outfile
     if inplace:
         sortedbed = bedfile
-    elif opts.outfile is None:
+    elif sortedbed is None:
         pf, sf = op.basename(bedfile).rsplit(".", 1)
         sortedbed = pf + ".sorted." + sf
 
-    sortopt = (
-        "-k1,1 -k2,2n -k3,3n -k4,4" if not opts.accn else "-k4,4 -k1,1 -k2,2n -k3,3n"
-    )
-    cmd = "sort"
-    if opts.tmpdir:
-        cmd += " -T {0}".format(opts.tmpdir)
-    if opts.unique:
-        cmd += " -u"
-    cmd += " {0} {1} -o {2}".format(sortopt, bedfile, sortedbed)
+    if opts.accn:
+        key = bed_accn_sort_key
+    elif opts.num:
+        key = bed_natsort_key
+    else:
+        key = bed_sort_key
 
     if inplace or need_update(bedfile, sortedbed):
-        sh(cmd)
+        sorter = FileSorter(
+            bedfile,
+            key=key,
+            tmpdir=opts.tmpdir,
+            cpus=opts.cpus,
+            buffer_size=opts.buffer_size * 1024 * 1024,
+            header_prefixes=("#", "track", "browser"),
+            unique=opts.unique,
+        )
+        sorter.sort(sortedbed)
 
     return sortedbed
 
@@ -13,6 +13,7 @@ from ..compara.base import AnchorFile
 from ..utils.cbook import percentage
 from ..utils.grouper import Grouper
 from ..utils.orderedcollections import OrderedDict
+from ..utils.profiler import span
 from ..utils.range import range_distance
 from .base import BaseFile, LineFile, must_open
 from .bed import Bed
@@ -337,34 +338,36 @@ def filter(args):
     blastfile = opts.outfile or blastfile
     newblastfile = filtered_blastfile_name(blastfile, pctid, hitlen, inverse)
     fw = must_open(newblastfile, "w")
-    for row in fp:
-        if row[0] == "#":
-            continue
-        c = BlastLine(row)
+    with span("blast.filter") as stage:
+        for row in fp:
+            if row[0] == "#":
+                continue
+            c = BlastLine(row)
+            stage.add()
 
-        if ids:
-            if c.query in ids and c.subject in ids:
-                noids = False
+            if ids:
+                if c.query in ids and c.subject in ids:
+                    noids = False
+                else:
+                    noids = True
             else:
-                noids = True
-        else:
-            noids = None
-
-        remove = (
-            c.score < score
-            or c.pctid < pctid
-            or c.hitlen < hitlen
-            or c.evalue > evalue
-            or noids
-        )
+                noids = None
+
+            remove = (
+                c.score < score
+                or c.pctid < pctid
+                or c.hitlen < hitlen
+                or c.evalue > evalue
+                or noids
+            )
 
-        if inverse:
-            remove = not remove
+            if inverse:
+                remove = not remove
 
-        remove = remove or (noself and c.query == c.subject)
+            remove = remove or (noself and c.query == c.subject)
 
-        if not remove:
-            print(row.rstrip(), file=fw)
+            if not remove:
+                print(row.rstrip(), file=fw)
 
     fw.close()
 
@@ -0,0 +1,714 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+Compressed file I/O behind `formats.base.must_open()`: multi-threaded BGZF,
+gzip, bzip2 and zstd, using pigz/bgzip/lbzip2/zstd when they are available.
+
+The number of threads and the buffer size can be set with the environment
+variables JCVI_IO_THREADS and JCVI_IO_BUFFER (in bytes).
+"""
+
+from bisect import bisect_right
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import gzip
+import io
+import os
+import os.path as op
+import signal
+import struct
+import subprocess
+import sys
+import zlib
+
+from ..apps.base import ActionDispatcher, OptionParser, logger, which
+
+GZIP_SUFFIXES = (".gz", ".bgz", ".bgzf", ".gzip")
+BZ2_SUFFIXES = (".bz2",)
+ZSTD_SUFFIXES = (".zst", ".zstd")
+
+# BGZF blocks hold at most 64 KB, htslib fills them with 0xff00 bytes
+BGZF_BLOCK_SIZE = 0xFF00
+BGZF_MAX_BLOCK_SIZE = 0x10000
+BGZF_HEADER = b"\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00"
+BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+
+def default_threads() -> int:
+    """
+    Number of threads used for (de)compression.
+    """
+    threads = os.environ.get("JCVI_IO_THREADS")
+    if threads:
+        return max(int(threads), 1)
+    return min(4, os.cpu_count() or 1)
+
+
+def default_buffer_size() -> int:
+    """
+    Size of the buffer placed in front of compressed streams.
+    """
+    return int(os.environ.get("JCVI_IO_BUFFER", 1024 * 1024))
+
+
+def compression_type(filename: str):
+    """
+    Return one of 'gzip', 'bz2', 'zstd' based on the file extension, or None.
+    """
+    if not isinstance(filename, str):
+        return None
+    name = filename.lower()
+    if name.endswith(GZIP_SUFFIXES):
+        return "gzip"
+    if name.endswith(BZ2_SUFFIXES):
+        return "bz2"
+    if name.endswith(ZSTD_SUFFIXES):
+        return "zstd"
+    return None
+
+
+@lru_cache(maxsize=None)
+def find_exe(*programs):
+    """
+    Return the path to the first available program, or None.
+    """
+    for program in programs:
+        path = which(program)
+        if path:
+            return path
+    return None
+
+
+def is_bgzf(filename: str) -> bool:
+    """
+    Check if the file starts with a BGZF block, i.e. is a gzip file with the
+    `BC` extra subfield.
+    """
+    with open(filename, "rb") as fp:
+        header = fp.read(18)
+    return _parse_bgzf_header(header) is not None
+
+
+def _parse_bgzf_header(header: bytes):
+    """
+    Return (header length, total block size) for a BGZF block header, or None
+    if this is not a BGZF block.
+    """
+    if len(header) < 18 or header[:4] != b"\x1f\x8b\x08\x04":
+        return None
+    (xlen,) = struct.unpack("<H", header[10:12])
+    extra = header[12 : 12 + xlen]
+    pos = 0
+    while pos + 4 <= len(extra):
+        si1, si2, slen = (
+            extra[pos],
+            extra[pos + 1],
+            struct.unpack("<H", extra[pos + 2 : pos + 4])[0],
+        )
+        if si1 == 66 and si2 == 67 and slen == 2:  # "BC"
+            (bsize,) = struct.unpack("<H", extra[pos + 4 : pos + 6])
+            return 12 + xlen, bsize + 1
+        pos += 4 + slen
+    return None
+
+
+def _deflate(data: bytes, level: int) -> bytes:
+    c = zlib.compressobj(level, zlib.DEFLATED, -15)
+    cdata = c.compress(data) + c.flush()
+    bsize = len(BGZF_HEADER) + 2 + len(cdata) + 8
+    crc = zlib.crc32(data) & 0xFFFFFFFF
+    return b"".join(
+        (
+            BGZF_HEADER,
+            struct.pack("<H", bsize - 1),
+            cdata,
+            struct.pack("<II", crc, len(data) & 0xFFFFFFFF),
+        )
+    )
+
+
+def _inflate(cdata: bytes, isize: int) -> bytes:
+    data = zlib.decompress(cdata, -15)
+    assert len(data) == isize, "BGZF block size mismatch"
+    return data
+
+
+def read_gzi(gzifile: str):
+    """
+    Read a bgzip .gzi index into a list of (compressed, uncompressed) offsets,
+    including the implicit first block at (0, 0).
+    """
+    with open(gzifile, "rb") as fp:
+        (n,) = struct.unpack("<Q", fp.read(8))
+        data = struct.unpack("<{0}Q".format(2 * n), fp.read(16 * n))
+    return [(0, 0)] + list(zip(data[::2], data[1::2]))
+
+
+def write_gzi(gzifile: str, entries):
+    """
+    Write a list of (compressed, uncompressed) block offsets as a bgzip .gzi
+    index.
+    """
+    entries = [x for x in entries if x != (0, 0)]
+    with open(gzifile, "wb") as fw:
+        fw.write(struct.pack("<Q", len(entries)))
+        for coffset, uoffset in entries:
+            fw.write(struct.pack("<QQ", coffset, uoffset))
+
+
+class BgzfWriter(io.RawIOBase):
+    """
+    Binary BGZF writer that deflates blocks in a thread pool (zlib releases
+    the GIL), writing them out in order. With `index=True` a bgzip-compatible
+    .gzi index is written next to the file. Blocks can also be written to an
+    open binary `fileobj`, such as an S3 upload.
+    """
+
+    def __init__(
+        self, filename, mode="wb", threads=None, level=6, index=False, fileobj=None
+    ):
+        super().__init__()
+        self.filename = filename
+        self.fp = fileobj or open(
+            filename, mode.replace("t", "").replace("b", "") + "b"
+        )
+        self.threads = threads or default_threads()
+        self.level = level
+        self.index = index
+        self.entries = []
+        self._buffer = bytearray()
+        self._pending = deque()
+        self._coffset = self.fp.tell()
+        self._uoffset = 0
+        self._executor = ThreadPoolExecutor(self.threads) if self.threads > 1 else None
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._buffer.extend(b)
+        while len(self._buffer) >= BGZF_BLOCK_SIZE:
+            self._submit(bytes(self._buffer[:BGZF_BLOCK_SIZE]))
+            del self._buffer[:BGZF_BLOCK_SIZE]
+        return len(b)
+
+    def _submit(self, data):
+        if self._executor is None:
+            self._write_block(_deflate(data, self.level), len(data))
+            return
+        self._pending.append(
+            (self._executor.submit(_deflate, data, self.level), len(data))
+        )
+        while len(self._pending) > self.threads * 4:
+            self._drain_one()
+
+    def _drain_one(self):
+        future, size = self._pending.popleft()
+        self._write_block(future.result(), size)
+
+    def _write_block(self, block, size):
+        self.entries.append((self._coffset, self._uoffset))
+        self.fp.write(block)
+        self._coffset += len(block)
+        self._uoffset += size
+
+    def close(self):
+        if self.closed:
+            return
+        if self._buffer:
+            self._submit(bytes(self._buffer))
+            self._buffer.clear()
+        while self._pending:
+            self._drain_one()
+        if self._executor is not None:
+            self._executor.shutdown()
+        self.fp.write(BGZF_EOF)
+        self.fp.close()
+        if self.index:
+            write_gzi(self.filename + ".gzi", self.entries)
+        super().close()
+
+
+class BgzfReader(io.RawIOBase):
+    """
+    Binary BGZF reader that inflates blocks ahead in a thread pool.
+
+    Supports virtual offsets (`tell_virtual()` / `seek_virtual()`, as used by
+    BAM/tabix indices) and seeking to uncompressed offsets through a .gzi
+    index, which is read from disk when present or built by scanning the
+    block headers. Instead of a file name, any seekable binary `fileobj` can be
+    read.
+    """
+
+    def __init__(self, filename, threads=None, fileobj=None):
+        super().__init__()
+        self.filename = filename
+        self.fileobj = fileobj
+        self.fp = fileobj or open(filename, "rb")
+        self.threads = threads or default_threads()
+        self._executor = ThreadPoolExecutor(self.threads) if self.threads > 1 else None
+        self._entries = None
+        self._uoffsets = None
+        self._reset(0)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def _reset(self, coffset):
+        self.fp.seek(coffset)
+        self._next_coffset = coffset
+        self._pending = deque()
+        self._block = b""
+        self._block_coffset = coffset
+        self._block_uoffset = 0 if coffset == 0 else None
+        self._within = 0
+        self._eof = False
+
+    def _read_raw_block(self):
+        coffset = self._next_coffset
+        header = self.fp.read(18)
+        if not header:
+            return None
+        parsed = _parse_bgzf_header(header)
+        if parsed is None:
+            raise ValueError(
+                "`{0}` is not BGZF at offset {1}".format(self.filename, coffset)
+            )
+        hlen, bsize = parsed
+        rest = self.fp.read(bsize - 18)
+        block = header + rest
+        cdata = block[hlen:-8]
+        (isize,) = struct.unpack("<I", block[-4:])
+        self._next_coffset = coffset + bsize
+        return coffset, cdata, isize
+
+    def _fill(self):
+        while len(self._pending) < max(self.threads * 4, 1):
+            raw = self._read_raw_block()
+            if raw is None:
+                break
+            coffset, cdata, isize = raw
+            if self._executor is None:
+                self._pending.append((coffset, isize, _inflate(cdata, isize)))
+            else:
+                self._pending.append(
+                    (coffset, isize, self._executor.submit(_inflate, cdata, isize))
+                )
+
+    def _next_block(self):
+        if not self._pending:
+            self._fill()
+        if not self._pending:
+            self._eof = True
+            return False
+        coffset, isize, data = self._pending.popleft()
+        if self._block_uoffset is not None:
+            self._block_uoffset += len(self._block)
+        self._block = data if isinstance(data, bytes) else data.result()
+        self._block_coffset = coffset
+        self._within = 0
+        self._fill()
+        return True
+
+    def readinto(self, b):
+        view = memoryview(b)
+        n = 0
+        while n < len(view):
+            if self._within >= len(self._block):
+                if self._eof or not self._next_block():
+                    break
+                continue
+            k = min(len(view) - n, len(self._block) - self._within)
+            view[n : n + k] = self._block[self._within : self._within + k]
+            self._within += k
+            n += k
+        return n
+
+    def tell_virtual(self):
+        """
+        Virtual offset of the current position: compressed block offset in
+        the upper 48 bits and offset within the block in the lower 16 bits.
+        """
+        if self._block and self._within >= len(self._block):
+            coffset = self._pending[0][0] if self._pending else self._next_coffset
+            return coffset << 16
+        return (self._block_coffset << 16) | self._within
+
+    def seek_virtual(self, voffset):
+        """
+        Move to a virtual offset, see `tell_virtual()`.
+        """
+        coffset, within = voffset >> 16, voffset & 0xFFFF
+        self._reset(coffset)
+        if self._next_block():
+            self._within = within
+        return voffset
+
+    def _uoffset_of(self, coffset):
+        """
+        Uncompressed offset of the block at `coffset`. Blocks missing from the
+        index (empty blocks, or a stale .gzi) are found by scanning the block
+        headers from the closest indexed block.
+        """
+        entries = self.entries
+        i = bisect_right(entries, (coffset, float("inf"))) - 1
+        c, u = entries[i] if i >= 0 else (0, 0)
+        fp = self.fp
+        pos = fp.tell()
+        while c < coffset:
+            fp.seek(c)
+            parsed = _parse_bgzf_header(fp.read(18))
+            if parsed is None:
+                break
+            _, bsize = parsed
+            fp.seek(c + bsize - 4)
+            (isize,) = struct.unpack("<I", fp.read(4))
+            c += bsize
+            u += isize
+        fp.seek(pos)
+        if c != coffset:
+            raise ValueError(
+                "Offset {0} of `{1}` is not at a BGZF block boundary".format(
+                    coffset, self.filename
+                )
+            )
+        return u
+
+    @property
+    def entries(self):
+        """
+        List of (compressed, uncompressed) offsets of every block.
+        """
+        if self._entries is None:
+            gzifile = self.filename + ".gzi"
+            if (
+                self.fileobj is None
+                and op.exists(gzifile)
+                and op.getmtime(gzifile) >= op.getmtime(self.filename)
+            ):
+                self._entries = read_gzi(gzifile)
+            else:
+                self._entries = self.build_index()
+        return self._entries
+
+    def build_index(self):
+        """
+        Scan the block headers and return the (compressed, uncompressed)
+        offsets of all blocks.
+        """
+        entries = []
+        coffset = uoffset = 0
+        fp = self.fp
+        pos = fp.tell()
+        while True:
+            fp.seek(coffset)
+            header = fp.read(18)
+            if not header:
+                break
+            parsed = _parse_bgzf_header(header)
+            if parsed is None:
+                raise ValueError("`{0}` is not BGZF".format(self.filename))
+            hlen, bsize = parsed
+            fp.seek(coffset + bsize - 4)
+            (isize,) = struct.unpack("<I", fp.read(4))
+            if isize:
+                entries.append((coffset, uoffset))
+            coffset += bsize
+            uoffset += isize
+        fp.seek(pos)
+        return entries
+
+    def tell(self):
+        if self._block_uoffset is None:
+            self._block_uoffset = self._uoffset_of(self._block_coffset)
+        return self._block_uoffset + self._within
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.tell()
+        elif whence != io.SEEK_SET:
+            raise io.UnsupportedOperation("BGZF can only seek from start or current")
+        if self._uoffsets is None:
+            self._uoffsets = [u for _, u in self.entries]
+        i = bisect_right(self._uoffsets, offset) - 1
+        coffset, uoffset = self.entries[i] if i >= 0 else (0, 0)
+        self._reset(coffset)
+        self._block_uoffset = uoffset
+        if self._next_block():
+            self._within = offset - uoffset
+        return offset
+
+    def close(self):
+        if self.closed:
+            return
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+        self.fp.close()
+        super().close()
+
+
+class ProcessStream(io.RawIOBase):
+    """
+    Raw stream over the stdin or stdout of an external (de)compressor; closing
+    it waits for the process. A process that fails raises OSError, at the end
+    of the stream when reading or on close.
+    """
+
+    def __init__(self, cmd, filename, mode):
+        super().__init__()
+        self.mode = mode
+        self.cmd = cmd
+        self.returncode = None
+        if "r" in mode:
+            self.proc = subprocess.Popen(
+                cmd + [filename], stdout=subprocess.PIPE, bufsize=0
+            )
+            self.pipe = self.proc.stdout
+            self.outfile = None
+        else:
+            self.outfile = open(filename, "ab" if "a" in mode else "wb")
+            self.proc = subprocess.Popen(
+                cmd, stdin=subprocess.PIPE, stdout=self.outfile, bufsize=0
+            )
+            self.pipe = self.proc.stdin
+        logger.debug("Stream `%s` through `%s`", filename, " ".join(cmd))
+
+    def readable(self):
+        return "r" in self.mode
+
+    def writable(self):
+        return "r" not in self.mode
+
+    def readinto(self, b):
+        n = self.pipe.readinto(b)
+        if n == 0 and self.returncode is None:
+            # Truncated or corrupt input shows only in the exit status
+            self.returncode = self.proc.wait()
+            self._check()
+        return n
+
+    def write(self, b):
+        return self.pipe.write(b)
+
+    def _check(self):
+        if self.returncode:
+            raise OSError(
+                "`{0}` exited with code {1}".format(" ".join(self.cmd), self.returncode)
+            )
+
+    def close(self):
+        if self.closed:
+            return
+        checked = self.returncode is not None
+        self.pipe.close()
+        self.returncode = self.proc.wait()
+        if self.outfile is not None:
+            self.outfile.close()
+        super().close()
+        # Closing a reader before the end kills the process with SIGPIPE
+        if checked or ("r" in self.mode and self.returncode == -signal.SIGPIPE):
+            return
+        self._check()
+
+
+def _open_zstd(filename, mode, threads):
+    try:
+        import zstandard
+    except ImportError:
+        zstandard = None
+
+    if zstandard is not None:
+        if "r" in mode:
+            return zstandard.ZstdDecompressor().stream_reader(open(filename, "rb"))
+        fw = open(filename, "ab" if "a" in mode else "wb")
+        return zstandard.ZstdCompressor(threads=threads).stream_writer(fw)
+
+    zstd = find_exe("zstd")
+    if zstd is None:
+        raise ImportError(
+            "Reading or writing `{0}` needs the `zstandard` module or `zstd`".format(
+                filename
+            )
+        )
+    if "r" in mode:
+        return ProcessStream([zstd, "-dc"], filename, mode)
+    return ProcessStream([zstd, "-c", "-T{0}".format(threads)], filename, mode)
+
+
+def _open_raw(filename, mode, threads, index):
+    kind = compression_type(filename)
+    reading = "r" in mode
+    if kind == "gzip":
+        if reading:
+            if is_bgzf(filename):
+                return BgzfReader(filename, threads=threads)
+            pigz = find_exe("pigz")
+            if pigz:
+                return ProcessStream([pigz, "-dc"], filename, mode)
+            return gzip.open(filename, "rb")
+        bgzip = find_exe("bgzip")
+        if bgzip and not index:
+            return ProcessStream([bgzip, "-c", "-@", str(threads)], filename, mode)
+        return BgzfWriter(filename, mode=mode, threads=threads, index=index)
+
+    if kind == "bz2":
+        exe = find_exe("lbzip2", "pbzip2")
+        if exe:
+            flags = ["-dc"] if reading else ["-c"]
+            if op.basename(exe) == "lbzip2":
+                flags += ["-n", str(threads)]
+            else:
+                flags += ["-p{0}".format(threads)]
+            return ProcessStream([exe] + flags, filename, mode)
+        import bz2
+
+        return bz2.open(filename, "rb" if reading else ("ab" if "a" in mode else "wb"))
+
+    if kind == "zstd":
+        return _open_zstd(filename, mode, threads)
+
+    raise ValueError("`{0}` is not a compressed file".format(filename))
+
+
+def _open_fileobj(filename, fileobj, mode, threads):
+    """
+    Wrap an open binary stream, for files that are not on the local disk.
+    """
+    kind = compression_type(filename)
+    reading = "r" in mode
+    if kind == "gzip":
+        if reading:
+            header = fileobj.read(18)
+            fileobj.seek(0)
+            if _parse_bgzf_header(header) is not None:
+                return BgzfReader(filename, threads=threads, fileobj=fileobj)
+            return gzip.GzipFile(fileobj=fileobj, mode="rb")
+        return BgzfWriter(filename, threads=threads, fileobj=fileobj)
+
+    if kind == "bz2":
+        import bz2
+
+        return bz2.BZ2File(fileobj, "rb" if reading else "wb")
+
+    if kind == "zstd":
+        import zstandard
+
+        if reading:
+            return zstandard.ZstdDecompressor().stream_reader(fileobj)
+        return zstandard.ZstdCompressor(threads=threads).stream_writer(fileobj)
+
+    raise ValueError("`{0}` is not a compressed file".format(filename))
+
+
+def open_compressed(
+    filename: str,
+    mode: str = "r",
+    threads=None,
+    buffer_size=None,
+    index: bool = False,
+    encoding: str = "utf-8",
+    fileobj=None,
+):
+    """
+    Open a gzip/BGZF, bzip2 or zstd file, in text mode unless `mode` has "b".
+
+    Reading BGZF and writing gzip use BGZF blocks (de)compressed on `threads`
+    threads, or bgzip/pigz when found on the PATH. Gzip files written here are
+    BGZF, so they can be indexed (set `index=True` to also write a .gzi).
+
+    With `fileobj`, the compressed data is read from or written to that binary
+    stream, and `filename` is only used to pick the compression.
+    """
+    threads = threads or default_threads()
+    buffer_size = buffer_size or default_buffer_size()
+    if fileobj is not None:
+        raw = _open_fileobj(filename, fileobj, mode, threads)
+    else:
+        raw = _open_raw(filename, mode, threads, index)
+    if "r" in mode:
+        handle = (
+            raw
+            if isinstance(raw, io.BufferedIOBase)
+            else io.BufferedReader(raw, buffer_size)
+        )
+    else:
+        handle = (
+            raw
+            if isinstance(raw, io.BufferedIOBase)
+            else io.BufferedWriter(raw, buffer_size)
+        )
+    if "b" in mode:
+        return handle
+    return io.TextIOWrapper(handle, encoding=encoding)
+
+
+def main():
+    actions = (
+        ("bgzip", "compress a file into BGZF using multiple threads"),
+        ("index", "build a bgzip-compatible .gzi index for a BGZF file"),
+    )
+    p = ActionDispatcher(actions)
+    p.dispatch(globals())
+
+
+def bgzip(args):
+    """
+    %prog bgzip file
+
+    Compress file into file.gz in BGZF format, which can be read as regular
+    gzip and supports random access.
+    """
+    p = OptionParser(bgzip.__doc__)
+    p.add_argument(
+        "--index", default=False, action="store_true", help="Also write .gzi index"
+    )
+    p.set_cpus(cpus=default_threads())
+    p.set_outfile(outfile=None)
+    opts, args = p.parse_args(args)
+
+    if len(args) != 1:
+        sys.exit(not p.print_help())
+
+    (filename,) = args
+    outfile = opts.outfile or filename + ".gz"
+    with open(filename, "rb") as fp, open_compressed(
+        outfile, "wb", threads=opts.cpus, index=opts.index
+    ) as fw:
+        while True:
+            data = fp.read(default_buffer_size())
+            if not data:
+                break
+            fw.write(data)
+    logger.debug("BGZF written to `%s`", outfile)
+    return outfile
+
+
+def index(args):
+    """
+    %prog index file.gz
+
+    Write the block offsets of a BGZF file to file.gz.gzi.
+    """
+    p = OptionParser(index.__doc__)
+    opts, args = p.parse_args(args)
+
+    if len(args) != 1:
+        sys.exit(not p.print_help())
+
+    (filename,) = args
+    reader = BgzfReader(filename, threads=1)
+    entries = reader.build_index()
+    reader.close()
+    gzifile = filename + ".gzi"
+    write_gzi(gzifile, entries)
+    logger.debug("%d blocks indexed in `%s`", len(entries), gzifile)
+    return gzifile
+
+
+if __name__ == "__main__":
+    main()
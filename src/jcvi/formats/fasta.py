@@ -21,7 +21,7 @@ from ..apps.base import ActionDispatcher, OptionParser, cleanup, logger, need_up
 from ..utils.cbook import percentage
 from ..utils.console import printf
 from ..utils.table import write_csv
-from .base import BaseFile, DictFile, must_open
+from .base import BaseFile, DictFile, load_cached, must_open
 from .bed import Bed
 
 
@@ -2083,13 +2083,13 @@ def extract(args):
         fastafile, query = args
     elif len(args) == 1 and opts.bed:
         (fastafile,) = args
-        bedaccns = Bed(opts.bed).accns
+        bedaccns = load_cached(Bed, opts.bed).accns
     else:
         sys.exit(p.print_help())
 
     if opts.bed:
         fw = must_open(opts.outfile, "w")
-        f = Fasta(fastafile)
+        f = load_cached(Fasta, fastafile)
         for accn in bedaccns:
             try:
                 rec = f[accn]
@@ -2163,7 +2163,7 @@ def extract(args):
             rec = SeqRecord(seq, id=newid, description=k)
             SeqIO.write([rec], fw, "fasta")
     else:
-        f = Fasta(fastafile)
+        f = load_cached(Fasta, fastafile)
         try:
             seq = f.sequence(feature, asstring=False)
         except AssertionError as e:
@@ -2562,10 +2562,11 @@ def write_gaps_bed(inputfasta, prefix, mingap, cpus):
     from jcvi.formats.bed import sort
 
     bedfile = prefix + ".gaps.bed"
-    f = Fasta(inputfasta)
-    recs = list(rec for k, rec in f.iteritems())
-    pool = WriteJobs(write_gaps_worker, recs, bedfile, cpus=cpus)
-    pool.run()
+    # Stream the records, results are written in the order of the input
+    with must_open(inputfasta) as fp:
+        recs = SeqIO.parse(fp, "fasta")
+        pool = WriteJobs(write_gaps_worker, recs, bedfile, cpus=cpus)
+        pool.run()
 
     sort([bedfile, "-i"])
 
@@ -2573,13 +2574,13 @@ def write_gaps_bed(inputfasta, prefix, mingap, cpus):
     nbedfile = prefix + ".{0}N.bed".format(mingap)
 
     gapnum = 0
-    fw = open(nbedfile, "w")
-    for b in bed:
-        if b.span < mingap:
-            continue
-        gapnum += 1
-        gapname = "gap.{0:05d}".format(gapnum)
-        print("\t".join(str(x) for x in (b, gapname, b.span)), file=fw)
+    with open(nbedfile, "w") as fw:
+        for b in bed:
+            if b.span < mingap:
+                continue
+            gapnum += 1
+            gapname = "gap.{0:05d}".format(gapnum)
+            print("\t".join(str(x) for x in (b, gapname, b.span)), file=fw)
 
     shutil.move(nbedfile, bedfile)
     logger.debug("Write gap (>={0}bp) locations to `{1}`.".format(mingap, bedfile))
@@ -2,29 +2,44 @@
 # -*- coding: UTF-8 -*-
 
 from collections import defaultdict
+import gzip
+import hashlib
+import io
 import os
 import os.path as op
 import re
 import sys
 from urllib.parse import quote, unquote
 
+import numpy as np
+
 from ..annotation.reformat import atg_name
 from ..apps.base import (
     ActionDispatcher,
     OptionParser,
     cleanup,
     flatten,
+    listify,
     logger,
     mkdir,
     need_update,
     parse_multi_values,
     sh,
+    user_cache_dir,
 )
 from ..utils.cbook import AutoVivification
 from ..utils.orderedcollections import DefaultOrderedDict, OrderedDict, parse_qs
-from ..utils.range import Range, range_minmax
-from .base import DictFile, LineFile, is_number, must_open
-from .bed import Bed, BedLine, natsorted
+from ..utils.range import Range, range_merge, range_minmax
+from .base import (
+    DictFile,
+    FileSorter,
+    LineFile,
+    file_checksum,
+    is_number,
+    must_open,
+)
+from .bed import Bed, BedLine, natsort_key, natsorted
+from .compress import BgzfReader, is_bgzf
 from .fasta import Fasta, SeqIO
 
 Valid_strands = ("+", "-", "?", ".")
@@ -447,6 +462,509 @@ class GffFeatureTracker(object):
         return self.symbolstore[parent]
 
 
+class GffFeature(GffLine):
+    """
+    GffLine returned by `GffIndex`, with the attribute aliases used by
+    gffutils features (`featuretype`, `chrom`, `stop`, `frame`) so that
+    callers can use either interchangeably. Edits to `attributes` are
+    reflected when the feature is printed.
+
+    With `attr_order`, the attributes are printed in that order, as gffutils
+    prints them in the order the keys first appear in the file.
+    """
+
+    def __init__(self, sline, id=None, attr_order=None, **kwargs):
+        super().__init__(sline, **kwargs)
+        self._id = id
+        if attr_order is not None:
+            rank = {k: i for i, k in enumerate(attr_order)}
+            keys = sorted(self.attributes, key=lambda k: rank.get(k, len(rank)))
+            if keys != list(self.attributes):
+                for k in keys:
+                    self.attributes[k] = self.attributes.pop(k)
+                self.update_attributes(gff3=self.gff3, urlquote=False)
+        self._attributes = {k: list(v) for k, v in self.attributes.items()}
+
+    def __getitem__(self, key):
+        return self.attributes[key]
+
+    def __str__(self):
+        if self.attributes != self._attributes:
+            self.update_attributes(gff3=self.gff3, urlquote=False)
+            self._attributes = {k: list(v) for k, v in self.attributes.items()}
+        return super().__str__()
+
+    @property
+    def id(self):
+        return self._id if self._id is not None else self.accn
+
+    @property
+    def featuretype(self):
+        return self.type
+
+    @property
+    def chrom(self):
+        return self.seqid
+
+    @property
+    def frame(self):
+        return self.phase
+
+    @property
+    def stop(self):
+        return self.end
+
+    @stop.setter
+    def stop(self, value):
+        self.end = value
+
+
+class GffIndex(object):
+    """
+    Native feature store for GFF3 files, used in place of a gffutils sqlite
+    database for hierarchy and coordinate queries.
+
+    The index is built in a single pass over the file. It holds the
+    parent -> children adjacency as CSR arrays, a type index, and a sorted
+    coordinate index per seqid. The arrays are saved as a binary sidecar
+    (`gff_file.idx.npz`) that is keyed by the file checksum, so it is only
+    rebuilt when the content changes. The sidecar goes to the user cache dir
+    when the directory of the GFF file is not writable. Features are read back
+    from the file by their byte offsets and returned as `GffFeature` objects.
+    BGZF inputs are read by block, and other gzip inputs are decompressed into
+    memory once, since seeking backwards in them reads from the start.
+    """
+
+    version = 2
+
+    def __init__(self, gff_file, key="ID", parent_key="Parent"):
+        self.filename = gff_file
+        self.key = key
+        self.parent_key = parent_key
+        self.idxfile = gff_file + ".idx.npz"
+
+        arrays = self._load()
+        if arrays is None and not self._writable():
+            self.idxfile = self._cache_file()
+            arrays = self._load()
+        if arrays is None:
+            logger.debug("Indexing `%s`", gff_file)
+            arrays = self._build()
+            self._save(arrays)
+        else:
+            logger.debug("Load index `%s`", self.idxfile)
+
+        self.gff3 = bool(arrays["gff3"])
+        self.offsets = arrays["offsets"]
+        self.line_index = arrays["line_index"]
+        self.ids = arrays["ids"]
+        self.seqid_names = arrays["seqid_names"]
+        self.seqid_codes = arrays["seqid_codes"]
+        self.type_names = arrays["type_names"]
+        self.type_codes = arrays["type_codes"]
+        self.starts = arrays["starts"]
+        self.ends = arrays["ends"]
+        self.strands = arrays["strands"]
+        self.children_indptr = arrays["children_indptr"]
+        self.children_indices = arrays["children_indices"]
+        self.parents_indptr = arrays["parents_indptr"]
+        self.parents_indices = arrays["parents_indices"]
+        self.type_order = arrays["type_order"]
+        self.type_indptr = arrays["type_indptr"]
+        self.region_order = arrays["region_order"]
+        self.region_indptr = arrays["region_indptr"]
+        self.region_maxspan = arrays["region_maxspan"]
+        self.attr_order = [str(x) for x in arrays["attr_order"]]
+
+        self._id_index = None
+        self._type_lookup = {str(x): i for i, x in enumerate(self.type_names)}
+        self._seqid_lookup = {str(x): i for i, x in enumerate(self.seqid_names)}
+        self._fp = None
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __contains__(self, id):
+        return id in self.id_index
+
+    def __getitem__(self, id):
+        return self._feature(self._get_index(id))
+
+    @property
+    def id_index(self):
+        if self._id_index is None:
+            self._id_index = {str(x): i for i, x in enumerate(self.ids)}
+        return self._id_index
+
+    def _open(self, seekable=True):
+        filename = self.filename
+        if not filename.endswith(".gz"):
+            return open(filename, "rb")
+        if is_bgzf(filename):
+            return io.BufferedReader(BgzfReader(filename, threads=1))
+        if not seekable:
+            return gzip.open(filename, "rb")
+        with gzip.open(filename, "rb") as fp:
+            return io.BytesIO(fp.read())
+
+    def _writable(self):
+        if op.exists(self.idxfile):
+            return os.access(self.idxfile, os.W_OK)
+        return os.access(op.dirname(op.abspath(self.idxfile)), os.W_OK)
+
+    def _cache_file(self):
+        digest = hashlib.sha1(op.abspath(self.filename).encode()).hexdigest()
+        return op.join(user_cache_dir("gff"), digest + ".idx.npz")
+
+    def _signature(self):
+        st = os.stat(self.filename)
+        return st.st_size, st.st_mtime
+
+    def _load(self):
+        if not op.exists(self.idxfile):
+            return None
+        try:
+            arrays = dict(np.load(self.idxfile))
+        except (OSError, ValueError):
+            return None
+        if int(arrays.get("version", -1)) != self.version:
+            return None
+        size, mtime = self._signature()
+        if int(arrays["size"]) != size:
+            return None
+        if float(arrays["mtime"]) == mtime:
+            return arrays
+        # Same size but touched or copied: trust the index if content matches
+        if str(arrays["checksum"]) != file_checksum(self.filename):
+            return None
+        return arrays
+
+    def _save(self, arrays):
+        size, mtime = self._signature()
+        arrays["version"] = np.array(self.version)
+        arrays["size"] = np.array(size)
+        arrays["mtime"] = np.array(mtime)
+        arrays["checksum"] = np.array(file_checksum(self.filename))
+        tmpfile = self.idxfile + ".tmp.npz"
+        try:
+            np.savez(tmpfile, **arrays)
+            os.replace(tmpfile, self.idxfile)
+        except OSError as e:
+            logger.error("Cannot write index `%s`: %s", self.idxfile, e)
+            cleanup(tmpfile)
+
+    def _build(self):
+        offsets, line_index, ids = [], [], []
+        seqid_codes, type_codes, starts, ends, strands = [], [], [], [], []
+        seqid_lookup, type_lookup, attr_order = {}, {}, {}
+        id_index = {}
+        edges = []
+        gff3 = None
+
+        fp = self._open(seekable=False)
+        offset = 0
+        for idx, line in enumerate(fp):
+            pos = offset
+            offset += len(line)
+            row = line.decode("utf-8").strip()
+            if not row:
+                continue
+            if row[0] == "#":
+                if row == FastaTag:
+                    break
+                continue
+            if gff3 is None:
+                gff3 = "=" in GffLine(row).attributes_text
+            g = GffLine(
+                row,
+                key=self.key,
+                parent_key=self.parent_key,
+                line_index=idx,
+                gff3=gff3,
+            )
+            i = len(offsets)
+            accn = g.accn
+            # Mimic gffutils merge_strategy="create_unique" for duplicate IDs
+            uid, n = accn, 0
+            while uid in id_index:
+                n += 1
+                uid = "{0}_{1}".format(accn, n)
+            id_index[uid] = i
+
+            offsets.append(pos)
+            line_index.append(idx)
+            ids.append(uid)
+            seqid_codes.append(seqid_lookup.setdefault(g.seqid, len(seqid_lookup)))
+            type_codes.append(type_lookup.setdefault(g.type, len(type_lookup)))
+            starts.append(g.start)
+            ends.append(g.end)
+            strands.append(g.strand)
+            for k in g.attributes:
+                attr_order.setdefault(k, len(attr_order))
+            if gff3:
+                for parent in g.attributes.get(self.parent_key, []):
+                    edges.append((quote(parent, safe=safechars), i))
+        fp.close()
+
+        n = len(offsets)
+        pairs = [(id_index[p], c) for p, c in edges if p in id_index]
+        parents = np.array([p for p, c in pairs], dtype=np.int64)
+        children = np.array([c for p, c in pairs], dtype=np.int64)
+        children_indptr, children_indices = _csr(parents, children, n)
+        parents_indptr, parents_indices = _csr(children, parents, n)
+
+        seqid_codes = np.array(seqid_codes, dtype=np.int32)
+        type_codes = np.array(type_codes, dtype=np.int32)
+        starts = np.array(starts, dtype=np.int64)
+        ends = np.array(ends, dtype=np.int64)
+        type_indptr, type_order = _csr(type_codes, np.arange(n), len(type_lookup))
+        region_order = np.lexsort((starts, seqid_codes))
+        region_indptr = np.searchsorted(
+            seqid_codes[region_order], np.arange(len(seqid_lookup) + 1)
+        )
+        region_maxspan = np.zeros(len(seqid_lookup), dtype=np.int64)
+        np.maximum.at(region_maxspan, seqid_codes, ends - starts + 1)
+
+        return {
+            "gff3": np.array(bool(gff3)),
+            "offsets": np.array(offsets, dtype=np.int64),
+            "line_index": np.array(line_index, dtype=np.int64),
+            "ids": np.array(ids, dtype=str),
+            "seqid_names": np.array(list(seqid_lookup), dtype=str),
+            "seqid_codes": seqid_codes,
+            "type_names": np.array(list(type_lookup), dtype=str),
+            "type_codes": type_codes,
+            "starts": starts,
+            "ends": ends,
+            "strands": np.array(strands, dtype=str),
+            "children_indptr": children_indptr,
+            "children_indices": children_indices,
+            "parents_indptr": parents_indptr,
+            "parents_indices": parents_indices,
+            "type_order": type_order,
+            "type_indptr": type_indptr,
+            "region_order": region_order,
+            "region_indptr": region_indptr,
+            "region_maxspan": region_maxspan,
+            "attr_order": np.array(list(attr_order), dtype=str),
+        }
+
+    def _get_index(self, id):
+        if isinstance(id, GffLine):
+            id = id.id
+        try:
+            return self.id_index[id]
+        except KeyError:
+            raise KeyError("Feature `{0}` not found in `{1}`".format(id, self.filename))
+
+    def _feature(self, i):
+        if self._fp is None:
+            self._fp = self._open()
+        self._fp.seek(int(self.offsets[i]))
+        row = self._fp.readline().decode("utf-8")
+        return GffFeature(
+            row,
+            id=str(self.ids[i]),
+            key=self.key,
+            parent_key=self.parent_key,
+            line_index=int(self.line_index[i]),
+            gff3=self.gff3,
+            attr_order=self.attr_order,
+        )
+
+    def _value(self, i, key):
+        if key == "seqid":
+            return str(self.seqid_names[self.seqid_codes[i]])
+        if key == "start":
+            return int(self.starts[i])
+        if key in ("end", "stop"):
+            return int(self.ends[i])
+        if key == "featuretype":
+            return str(self.type_names[self.type_codes[i]])
+        if key == "strand":
+            return str(self.strands[i])
+        if key == "id":
+            return str(self.ids[i])
+        raise ValueError("Cannot order features by `{0}`".format(key))
+
+    def _type_mask(self, indices, featuretype):
+        if featuretype is None:
+            return indices
+        codes = [
+            self._type_lookup[x] for x in listify(featuretype) if x in self._type_lookup
+        ]
+        return [i for i in indices if self.type_codes[i] in codes]
+
+    def _iter(self, indices, featuretype=None, order_by=None, reverse=False):
+        indices = self._type_mask(list(indices), featuretype)
+        if order_by:
+            # Ties are broken by the feature id, as in a gffutils database
+            keys = list(listify(order_by)) + ["id"]
+            indices.sort(
+                key=lambda i: tuple(self._value(i, k) for k in keys), reverse=reverse
+            )
+        elif reverse:
+            indices.reverse()
+        for i in indices:
+            yield self._feature(i)
+
+    def _walk(self, i, indptr, indices, level=None):
+        """
+        Breadth-first traversal of the adjacency; level=None returns all
+        descendants, otherwise only those exactly `level` steps away.
+        """
+        seen, frontier, found = {i}, [i], []
+        depth = 0
+        while frontier:
+            depth += 1
+            if level is not None and depth > level:
+                break
+            following = []
+            for j in frontier:
+                for k in indices[indptr[j] : indptr[j + 1]]:
+                    k = int(k)
+                    if k in seen:
+                        continue
+                    seen.add(k)
+                    following.append(k)
+            if level is None or depth == level:
+                found.extend(following)
+            frontier = following
+        return found
+
+    def children(self, id, level=None, featuretype=None, order_by=None, reverse=False):
+        """
+        Iterate over the descendants of a feature, in file order unless
+        `order_by` is given.
+        """
+        i = self._get_index(id)
+        indices = self._walk(i, self.children_indptr, self.children_indices, level)
+        return self._iter(indices, featuretype, order_by, reverse)
+
+    def parents(self, id, level=None, featuretype=None, order_by=None, reverse=False):
+        """
+        Iterate over the ancestors of a feature.
+        """
+        i = self._get_index(id)
+        indices = self._walk(i, self.parents_indptr, self.parents_indices, level)
+        return self._iter(indices, featuretype, order_by, reverse)
+
+    def children_bp(self, id, child_featuretype="exon", merge=False):
+        """
+        Total length of the children of a given type.
+        """
+        ranges = [
+            (c.seqid, c.start, c.end)
+            for c in self.children(id, featuretype=child_featuretype)
+        ]
+        if merge:
+            ranges = range_merge(ranges)
+        return sum(end - start + 1 for seqid, start, end in ranges)
+
+    def iter_by_type(self, featuretype, order_by=None, reverse=False):
+        """
+        Iterate over features of one or more types, in file order unless
+        `order_by` is given.
+        """
+        indices = []
+        for ftype in listify(featuretype):
+            if ftype not in self._type_lookup:
+                continue
+            code = self._type_lookup[ftype]
+            indices.extend(
+                self.type_order[self.type_indptr[code] : self.type_indptr[code + 1]]
+            )
+        indices.sort()
+        return self._iter(indices, order_by=order_by, reverse=reverse)
+
+    features_of_type = iter_by_type
+
+    def count_features_of_type(self, featuretype):
+        return sum(
+            int(self.type_indptr[c + 1] - self.type_indptr[c])
+            for c in (self._type_lookup.get(x) for x in listify(featuretype))
+            if c is not None
+        )
+
+    def featuretypes(self):
+        return iter(str(x) for x in self.type_names)
+
+    def all_features(self, featuretype=None, order_by=None, reverse=False):
+        return self._iter(range(len(self)), featuretype, order_by, reverse)
+
+    def iter_by_parent_childs(
+        self, featuretype="gene", level=None, order_by=None, reverse=False
+    ):
+        """
+        For each feature of `featuretype`, yield a list of the feature followed
+        by its children.
+        """
+        for parent in self.iter_by_type(featuretype, order_by, reverse):
+            yield [parent] + list(
+                self.children(parent, level=level, order_by=order_by, reverse=reverse)
+            )
+
+    def region(
+        self,
+        region=None,
+        seqid=None,
+        start=None,
+        end=None,
+        strand=None,
+        featuretype=None,
+        completely_within=False,
+    ):
+        """
+        Iterate over features overlapping a region, in coordinate order.
+        `region` may be a feature, a (seqid, start, end) tuple or a string
+        like "chr1:100-200".
+        """
+        if isinstance(region, str):
+            seqid, coords = region.split(":", 1) if ":" in region else (region, "")
+            if coords:
+                start, end = (int(x) for x in coords.replace(",", "").split("-"))
+        elif isinstance(region, (tuple, list)):
+            seqid, start, end = region[:3]
+        elif region is not None:
+            seqid, start, end = region.seqid, region.start, region.end
+
+        code = self._seqid_lookup.get(seqid)
+        if code is None:
+            return
+        lo, hi = self.region_indptr[code], self.region_indptr[code + 1]
+        order = self.region_order[lo:hi]
+        starts, ends = self.starts[order], self.ends[order]
+        qstart = 1 if start is None else start
+        qend = int(ends.max()) if end is None and len(ends) else end
+
+        # Features are sorted by start; none starts before qstart - maxspan
+        left = np.searchsorted(starts, qstart - self.region_maxspan[code], "left")
+        right = np.searchsorted(starts, qend, "right")
+        s, e = starts[left:right], ends[left:right]
+        if completely_within:
+            keep = (s >= qstart) & (e <= qend)
+        else:
+            keep = e >= qstart
+        indices = order[left:right][keep]
+        if strand is not None:
+            indices = indices[self.strands[indices] == strand]
+        for f in self._iter(indices, featuretype):
+            yield f
+
+
+def _csr(rows, cols, n):
+    """
+    Build (indptr, indices) for a sparse adjacency from parallel row and
+    column arrays, keeping the original order of `cols` within each row.
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int64)
+    order = np.argsort(rows, kind="stable")
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n), out=indptr[1:])
+    return indptr, cols[order]
+
+
 def make_attributes(s, gff3=True, keep_attr_order=True):
     """
     In GFF3, the last column is typically:
@@ -484,7 +1002,7 @@ def make_attributes(s, gff3=True, keep_attr_order=True):
 
 def to_range(obj, score=None, id=None, strand=None):
     """
-    Given a gffutils object, convert it to a range object
+    Given a GffLine or gffutils object, convert it to a range object
     """
     if score or id:
         _score = score if score else obj.score
@@ -2199,7 +2717,7 @@ def match_Nth_child(f1c, f2c, N=1, slop=False):
 
 def match_subfeats(f1, f2, dbx1, dbx2, featuretype=None, slop=False):
     """
-    Given 2 gffutils features located in 2 separate gffutils databases,
+    Given 2 features located in 2 separate feature indices,
     iterate through all subfeatures of a certain type and check whether
     they are identical or not
 
@@ -2376,19 +2894,86 @@ def populate_children(outfile, ids, gffile, iter="2", types=None):
     fw.close()
 
 
+class GffSortKey(object):
+    """
+    Sort key for raw GFF lines that keeps the feature hierarchy. Gene groups
+    are sorted on the natural order of seqid, then the start (and longer
+    first) of their root feature. Within a group, each parent comes before
+    its children, and siblings are sorted the same way.
+
+    The parent and span of the features that are the parent of another are
+    read in two passes over the file, so the key holds the genes and
+    transcripts but not their exons. The key is sent once to each worker of
+    the sort.
+    """
+
+    def __init__(self, gffile):
+        parents = set()
+        for atoms in self._rows(gffile):
+            parent = self._ids(atoms[8])[1]
+            if parent:
+                parents.add(parent)
+        self.features = {}
+        for atoms in self._rows(gffile):
+            fid, parent = self._ids(atoms[8])
+            if fid in parents:
+                self.features[fid] = (parent, int(atoms[3]), int(atoms[4]))
+
+    @staticmethod
+    def _rows(gffile):
+        with must_open(gffile) as fp:
+            for row in fp:
+                if row.rstrip() == FastaTag:
+                    break
+                if row[0] == "#":
+                    continue
+                atoms = row.rstrip("\n").split("\t", 8)
+                if len(atoms) == 9:
+                    yield atoms
+
+    @staticmethod
+    def _ids(attributes):
+        fid = parent = ""
+        for field in attributes.split(";"):
+            field = field.strip()
+            if field.startswith("ID="):
+                fid = field[3:]
+            elif field.startswith("Parent="):
+                parent = field[7:].split(",", 1)[0]
+        return fid, parent
+
+    def __call__(self, row):
+        atoms = row.rstrip("\n").split("\t", 8)
+        if len(atoms) < 9:
+            return natsort_key(atoms[0]), ()
+        fid, parent = self._ids(atoms[8])
+        path = [(int(atoms[3]), -int(atoms[4]), fid)]
+        seen = {fid}
+        while parent in self.features and parent not in seen:
+            seen.add(parent)
+            grandparent, start, end = self.features[parent]
+            path.append((start, -end, parent))
+            parent = grandparent
+        return natsort_key(atoms[0]), tuple(reversed(path))
+
+
 def sort(args):
     """
     %prog sort gffile
 
-    Sort gff file using plain old unix sort based on [chromosome, start coordinate].
-    or topologically based on hierarchy of features using the gt (genometools) toolkit
+    Sort gff file based on [chromosome, start coordinate] of each gene, with
+    the features of the gene in topological order, parents before their
+    children. The default `native` method is an external merge sort with
+    bounded memory. Alternatively use plain old unix sort, or sort
+    topologically based on hierarchy of features using the gt (genometools)
+    toolkit.
     """
-    valid_sort_methods = ("unix", "topo")
+    valid_sort_methods = ("native", "unix", "topo")
 
     p = OptionParser(sort.__doc__)
     p.add_argument(
         "--method",
-        default="unix",
+        default="native",
         choices=valid_sort_methods,
         help="Specify sort method",
     )
@@ -2397,9 +2982,16 @@ def sort(args):
         dest="inplace",
         default=False,
         action="store_true",
-        help="If doing a unix sort, perform sort inplace",
+        help="If doing a native or unix sort, perform sort inplace",
+    )
+    p.add_argument(
+        "--buffer_size",
+        default=256,
+        type=int,
+        help="Size of sorted runs kept in memory, in MB",
     )
     p.set_tmpdir()
+    p.set_cpus(cpus=1)
     p.set_outfile()
     p.set_home("gt")
     opts, args = p.parse_args(args)
@@ -2410,22 +3002,43 @@ def sort(args):
     (gffile,) = args
     sortedgff = opts.outfile
     if opts.inplace:
-        if opts.method == "topo" or (
-            opts.method == "unix" and gffile in ("-", "stdin")
-        ):
+        if opts.method == "topo" or gffile in ("-", "stdin"):
             logger.error(
                 "Cannot perform inplace sort when method is `topo`"
-                + " or method is `unix` and input is `stdin` stream"
+                + " or input is `stdin` stream"
             )
             sys.exit()
 
-    if opts.method == "unix":
+    if opts.method == "native":
+        if gffile in ("-", "stdin"):
+            from shutil import copyfileobj
+            from tempfile import mkstemp
+
+            # The sort key reads the hierarchy before the sort reads the lines
+            fd, gffile = mkstemp(suffix=".gff", dir=opts.tmpdir)
+            with os.fdopen(fd, "w") as fw:
+                copyfileobj(sys.stdin, fw)
+            tmpgff = gffile
+        else:
+            tmpgff = None
+        sorter = FileSorter(
+            gffile,
+            key=GffSortKey(gffile),
+            tmpdir=opts.tmpdir,
+            cpus=opts.cpus,
+            buffer_size=opts.buffer_size * 1024 * 1024,
+            stop_line=FastaTag,
+        )
+        sorter.sort(gffile if opts.inplace else sortedgff)
+        if tmpgff:
+            cleanup(tmpgff)
+    elif opts.method == "unix":
         cmd = "sort"
         cmd += " -k1,1 -k4,4n {0}".format(gffile)
         if opts.tmpdir:
             cmd += " -T {0}".format(opts.tmpdir)
         if opts.inplace:
-            cmd += " -o {0}".gffile
+            cmd += " -o {0}".format(gffile)
             sortedgff = None
         sh(cmd, outfile=sortedgff)
     elif opts.method == "topo":
@@ -3140,20 +3753,9 @@ def bed(args):
 
 def make_index(gff_file):
     """
-    Make a sqlite database for fast retrieval of features.
+    Make a binary index (see `GffIndex`) for fast retrieval of features.
     """
-    import gffutils
-
-    db_file = gff_file + ".db"
-
-    if need_update(gff_file, db_file):
-        cleanup(db_file)
-        logger.debug("Indexing `%s`", gff_file)
-        gffutils.create_db(gff_file, db_file, merge_strategy="create_unique")
-    else:
-        logger.debug("Load index `%s`", gff_file)
-
-    return gffutils.FeatureDB(db_file)
+    return GffIndex(gff_file)
 
 
 def get_parents(gff_file, parents):
@@ -3331,8 +3933,6 @@ def load(args):
     desc_attr = opts.desc_attribute
     sep = opts.sep
 
-    import gffutils
-
     g = make_index(gff_file)
     f = Fasta(fasta_file, index=False)
     seqlen = {}
@@ -3350,7 +3950,7 @@ def load(args):
             if fparent:
                 try:
                     g_fparent = g[fparent]
-                except gffutils.exceptions.FeatureNotFoundError:
+                except KeyError:
                     logger.error("%s not found in index .. skipped", fparent)
                     continue
                 if desc_attr in g_fparent.attributes:
@@ -3530,20 +4130,20 @@ def get_coords(feature, site, fLen, seqlen, feat, children_list, gffdb):
     """
     Subroutine takes feature, site, length, reference sequence length,
     parent mRNA feature (GffLine object), list of child feature types
-    and a GFFutils.GFFDB object as the input
+    and a GffIndex object as the input
 
     If upstream of TSS is requested, use the parent feature coords
     to extract the upstream sequence
 
     If upstream of TrSS is requested,  iterates through all the
-    children (CDS features stored in the sqlite GFFDB) and use child
+    children (CDS features stored in the GffIndex) and use child
     feature coords to extract the upstream sequence
 
     If downstream of TES is requested, use parent feature coords to
     extract the downstream sequence
 
     If downstream of TrES is requested,  iterates through all the
-    children (CDS features stored in the sqlite GFFDB) and use child
+    children (CDS features stored in the GffIndex) and use child
     feature coords to extract the downstream sequence
 
     If success, returns the start and stop coordinates
@@ -8,12 +8,17 @@ This script simply parses the lines in SAM into human readable fields.
 http://samtools.sourceforge.net/SAM1.pdf
 """
 
-from collections import defaultdict
+from bisect import bisect_left
+from collections import Counter, defaultdict, deque, namedtuple
 from itertools import groupby
+from math import ceil
+from multiprocessing import Pool
 import os
 import os.path as op
 import sys
 
+import numpy as np
+
 from ..apps.base import (
     PIPE,
     ActionDispatcher,
@@ -140,6 +145,291 @@ class GenomeCoverageFile(LineFile):
             yield seqid, counts * 1.0 / length
 
 
+class BamShard(namedtuple("BamShard", "contig start end")):
+    """
+    Half-open region `contig:start-end` of a BAM, the unit of work of
+    `map_bam_shards()`.
+    """
+
+    __slots__ = ()
+
+    def __str__(self):
+        return "{}:{}-{}".format(self.contig, self.start + 1, self.end)
+
+    def fetch(self, bam, **kwargs):
+        """
+        Reads that start in this shard, so that reads crossing a boundary are
+        seen by one shard only.
+        """
+        for read in bam.fetch(self.contig, self.start, self.end, **kwargs):
+            if read.reference_start >= self.start:
+                yield read
+
+
+def shard_bam(bamfile, nshards=1, max_size=None, contigs=None):
+    """
+    Split the references of an indexed BAM into about `nshards` regions of
+    balanced work, in header order. Work is estimated by the mapped reads
+    per contig from the BAM index, or by the contig length if the index has
+    no statistics; reads are assumed evenly spread within a contig. Shards
+    are also no longer than `max_size` if given.
+    """
+    import pysam
+
+    with pysam.AlignmentFile(bamfile) as bam:
+        sizes = list(zip(bam.references, bam.lengths))
+        try:
+            mapped = dict((x.contig, x.mapped) for x in bam.get_index_statistics())
+        except ValueError:
+            mapped = {}
+    if contigs is not None:
+        contigs = set(contigs)
+        sizes = [(c, l) for c, l in sizes if c in contigs]
+    if not sum(mapped.get(c, 0) for c, l in sizes):
+        mapped = dict(sizes)
+    total = sum(mapped.get(c, 0) for c, l in sizes)
+    target = max(total / max(nshards, 1), 1)
+
+    shards = []
+    for contig, length in sizes:
+        n = int(ceil(mapped.get(contig, 0) / target))
+        if max_size:
+            n = max(n, int(ceil(length / max_size)))
+        n = min(max(n, 1), length) if length else 1
+        bounds = np.linspace(0, length, n + 1).astype(int)
+        shards.extend(BamShard(contig, a, b) for a, b in zip(bounds[:-1], bounds[1:]))
+    return shards
+
+
+def _init_bam_worker(bamfile):
+    global _worker_bam
+    import pysam
+
+    _worker_bam = pysam.AlignmentFile(bamfile)
+
+
+def _run_bam_task(arg):
+    func, task = arg
+    return func(_worker_bam, task)
+
+
+def map_bam_shards(func, bamfile, tasks, cpus=1):
+    """
+    Call `func(bam, task)` for each task (typically a `BamShard` from
+    `shard_bam()`) over a process pool, where each worker keeps its own open
+    handle to the BAM. `func` must be a module-level function. Results are
+    yielded in the order of the tasks, as soon as they are ready; at most two
+    tasks per worker are in flight, so finished results do not pile up when
+    the consumer is slower than the workers.
+    """
+    import pysam
+
+    tasks = list(tasks)
+    cpus = min(cpus, len(tasks))
+    if cpus <= 1:
+        with pysam.AlignmentFile(bamfile) as bam:
+            for task in tasks:
+                yield func(bam, task)
+        return
+
+    with Pool(cpus, initializer=_init_bam_worker, initargs=(bamfile,)) as pool:
+        pending = deque()
+        for task in tasks:
+            pending.append(pool.apply_async(_run_bam_task, ((func, task),)))
+            if len(pending) > 2 * cpus:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+
+def region_depth(bam, contig, start, end, split=False, batch_size=65536):
+    """
+    Per-base depth along `contig:start-end` of an open BAM, accumulated from
+    read spans (or aligned blocks with `split=True`) with a difference array.
+    The spans are buffered in arrays of `batch_size`, so memory is bounded by
+    the length of the region regardless of the number of reads.
+    """
+    length = end - start
+    d = np.zeros(length + 1, dtype=np.int64)
+    starts = np.empty(batch_size, dtype=np.int64)
+    ends = np.empty(batch_size, dtype=np.int64)
+    n = 0
+
+    def flush(n):
+        np.add.at(d, np.clip(starts[:n] - start, 0, length), 1)
+        np.subtract.at(d, np.clip(ends[:n] - start, 0, length), 1)
+
+    for read in bam.fetch(contig, start, end):
+        if read.is_unmapped:
+            continue
+        blocks = (
+            read.get_blocks()
+            if split
+            else ((read.reference_start, read.reference_end),)
+        )
+        for bstart, bend in blocks:
+            starts[n] = bstart
+            ends[n] = bend
+            n += 1
+            if n == batch_size:
+                flush(n)
+                n = 0
+    flush(n)
+    return np.cumsum(d[:length])
+
+
+def contig_depth(bamfile, contig, length, split=False):
+    """
+    Per-base depth along one contig, see `region_depth()`.
+    """
+    import pysam
+
+    with pysam.AlignmentFile(bamfile) as bam:
+        return region_depth(bam, contig, 0, length, split=split)
+
+
+def shard_depth_worker(bam, task):
+    shard, split = task
+    return shard, region_depth(bam, shard.contig, shard.start, shard.end, split)
+
+
+def iter_shard_depth(bamfile, cpus=1, split=False, contigs=None, max_size=10000000):
+    """
+    Compute per-base depth of an indexed BAM over balanced shards in
+    parallel. Yields (shard, depth) for each shard, in the header order.
+    Shards are no longer than `max_size`, which bounds the memory of each
+    depth array however long the contigs are.
+    """
+    shards = shard_bam(bamfile, nshards=cpus * 4, max_size=max_size, contigs=contigs)
+    tasks = [(x, split) for x in shards]
+    yield from map_bam_shards(shard_depth_worker, bamfile, tasks, cpus=cpus)
+
+
+def depth_runs(depth):
+    """
+    Run-length encode the depth array into (starts, ends, values) of covered
+    intervals, as in bedgraph (or pyBigWig.addEntries).
+    """
+    change = np.flatnonzero(np.diff(depth)) + 1
+    starts = np.concatenate(([0], change))
+    ends = np.concatenate((change, [len(depth)]))
+    values = depth[starts]
+    keep = values > 0
+    return starts[keep], ends[keep], values[keep]
+
+
+def iter_bam_coverage(bamfile, cpus=1, split=False):
+    """
+    Compute depth of all contigs in an indexed BAM, in parallel over shards.
+    Yields (contig, length, (starts, ends, values)) in the header order. Only
+    the runs of each contig are kept, not its per-base depth.
+    """
+    shards = iter_shard_depth(bamfile, cpus=cpus, split=split)
+    for contig, parts in groupby(shards, key=lambda x: x[0].contig):
+        runs, length = [], 0
+        for shard, depth in parts:
+            length = shard.end
+            if len(depth):
+                starts, ends, values = depth_runs(depth)
+                runs.append((starts + shard.start, ends + shard.start, values))
+        if not runs:
+            empty = np.zeros(0, dtype=np.int64)
+            yield contig, length, (empty, empty, empty)
+            continue
+        starts, ends, values = (np.concatenate(x) for x in zip(*runs))
+        # Join the runs cut at the shard boundaries
+        keep = np.ones(len(starts), dtype=bool)
+        keep[1:] = (starts[1:] != ends[:-1]) | (values[1:] != values[:-1])
+        first = np.flatnonzero(keep)
+        last = np.concatenate((first[1:] - 1, [len(starts) - 1]))
+        yield contig, length, (starts[first], ends[last], values[first])
+
+
+def load_features(gtf, type="exon", id_attribute="gene_id"):
+    """
+    Group features of `type` by seqid, as sorted (starts, ends, ids) with
+    0-based half-open coordinates.
+    """
+    from .gff import Gff
+
+    features = defaultdict(list)
+    for g in Gff(gtf):
+        if g.type != type:
+            continue
+        features[g.seqid].append((g.start - 1, g.end, g.get_attr(id_attribute)))
+    return {seqid: sorted(x) for seqid, x in features.items()}
+
+
+def feature_count_worker(arg):
+    """
+    Count reads on one contig by the features they overlap, following
+    `htseq-count` union mode: reads that overlap features of more than one id
+    are ambiguous. Mates are counted once, through the first read of a pair,
+    or through the mapped read when its mate is unmapped.
+    """
+    import pysam
+
+    bamfile, contig, features, min_mapq = arg
+    counts = Counter()
+    starts = [x[0] for x in features]
+    maxlen = max((e - s for s, e, _ in features), default=0)
+    with pysam.AlignmentFile(bamfile) as bam:
+        for read in bam.fetch(contig):
+            if read.is_unmapped or read.is_secondary or read.is_supplementary:
+                continue
+            if read.is_paired and read.is_read2 and not read.mate_is_unmapped:
+                continue
+            if read.has_tag("NH") and read.get_tag("NH") > 1:
+                counts["__alignment_not_unique"] += 1
+                continue
+            if read.mapping_quality < min_mapq:
+                counts["__too_low_aQual"] += 1
+                continue
+            ids = set()
+            for start, end in read.get_blocks():
+                i = bisect_left(starts, start - maxlen)
+                while i < len(features) and features[i][0] < end:
+                    fstart, fend, fid = features[i]
+                    if fend > start:
+                        ids.add(fid)
+                    i += 1
+            if not ids:
+                counts["__no_feature"] += 1
+            elif len(ids) > 1:
+                counts["__ambiguous"] += 1
+            else:
+                counts[ids.pop()] += 1
+    return counts
+
+
+def count_features(
+    bamfile, gtf, type="exon", id_attribute="gene_id", min_mapq=10, cpus=1
+):
+    """
+    Count reads per feature id in an indexed BAM, in parallel over contigs.
+    """
+    import pysam
+
+    features = load_features(gtf, type=type, id_attribute=id_attribute)
+    with pysam.AlignmentFile(bamfile) as bam:
+        contigs = bam.references
+        unmapped = bam.unmapped
+    tasks = [(bamfile, x, features.get(x, []), min_mapq) for x in contigs]
+    counts = Counter({fid: 0 for x in features.values() for _, _, fid in x})
+    if cpus == 1:
+        results = map(feature_count_worker, tasks)
+    else:
+        pool = Pool(cpus)
+        results = pool.imap_unordered(feature_count_worker, tasks)
+    for c in results:
+        counts.update(c)
+    if cpus != 1:
+        pool.close()
+        pool.join()
+    counts["__not_aligned"] += unmapped
+    return counts
+
+
 def get_prefix(readfile, dbfile):
     rdpf = op.basename(readfile).replace(".gz", "").rsplit(".", 1)[0]
     dbpf = op.basename(dbfile).split(".")[0]
@@ -228,7 +518,7 @@ def main():
         ("coverage", "calculate depth for BAM file"),
         ("vcf", "call SNPs on a set of bam files"),
         ("mapped", "extract mapped/unmapped reads from samfile"),
-        ("count", "count the number of reads mapped using htseq"),
+        ("count", "count the number of reads mapped to each gene"),
         ("merge", "merge bam files"),
         # Convenience function
         ("index", "convert to bam, sort and then index"),
@@ -404,10 +694,17 @@ def count(args):
     """
     %prog count bamfile gtf
 
-    Count the number of reads mapped using `htseq-count`.
+    Count the number of reads mapped to each gene, like `htseq-count` (union
+    mode, unstranded). BAM file needs to be sorted and indexed.
     """
     p = OptionParser(count.__doc__)
     p.add_argument("--type", default="exon", help="Only count feature type")
+    p.add_argument(
+        "--id_attribute", default="gene_id", help="Attribute to group features by"
+    )
+    p.add_argument(
+        "--minaqual", default=10, type=int, help="Skip reads below mapping quality"
+    )
     p.set_cpus(cpus=8)
     opts, args = p.parse_args(args)
 
@@ -415,25 +712,28 @@ def count(args):
         sys.exit(not p.print_help())
 
     bamfile, gtf = args
-    cpus = opts.cpus
     pf = bamfile.split(".")[0]
     countfile = pf + ".count"
-    if not need_update(bamfile, countfile):
+    params = (opts.type, opts.id_attribute, opts.minaqual)
+    if not need_update((bamfile, gtf), countfile, params=params):
         return
 
-    nsorted = pf + "_nsorted"
-    nsortedbam, nsortedsam = nsorted + ".bam", nsorted + ".sam"
-    if need_update(bamfile, nsortedsam):
-        cmd = "samtools sort -@ {0} -n {1} {2}".format(cpus, bamfile, nsorted)
-        sh(cmd)
-        cmd = "samtools view -@ {0} -h {1}".format(cpus, nsortedbam)
-        sh(cmd, outfile=nsortedsam)
-
-    if need_update(nsortedsam, countfile):
-        cmd = "htseq-count --stranded=no --minaqual=10"
-        cmd += " -t {0}".format(opts.type)
-        cmd += " {0} {1}".format(nsortedsam, gtf)
-        sh(cmd, outfile=countfile)
+    counts = count_features(
+        bamfile,
+        gtf,
+        type=opts.type,
+        id_attribute=opts.id_attribute,
+        min_mapq=opts.minaqual,
+        cpus=opts.cpus,
+    )
+    special = [x for x in counts if x.startswith("__")]
+    with open(countfile, "w") as fw:
+        for fid in sorted(x for x in counts if not x.startswith("__")):
+            print("\t".join((fid, str(counts[fid]))), file=fw)
+        for key in sorted(special):
+            print("\t".join((key, str(counts[key]))), file=fw)
+    logger.debug("Counts written to `%s`", countfile)
+    return countfile
 
 
 def coverage(args):
@@ -441,7 +741,8 @@ def coverage(args):
     %prog coverage fastafile bamfile
 
     Calculate coverage for BAM file. BAM file will be sorted unless with
-    --nosort.
+    --nosort. Depth is computed per contig in parallel with --cpus, and
+    written as bedgraph, bigwig, or the mean coverage of each contig.
     """
     p = OptionParser(coverage.__doc__)
     p.add_argument(
@@ -453,6 +754,13 @@ def coverage(args):
     p.add_argument(
         "--nosort", default=False, action="store_true", help="Do not sort BAM"
     )
+    p.add_argument(
+        "--split",
+        default=False,
+        action="store_true",
+        help="Count aligned blocks only, not deletions or introns",
+    )
+    p.set_cpus(cpus=1)
     p.set_outfile()
     opts, args = p.parse_args(args)
 
@@ -467,39 +775,81 @@ def coverage(args):
         bamfile = index([bamfile, "--fasta={0}".format(fastafile)])
 
     pf = bamfile.rsplit(".", 2)[0]
-    sizesfile = Sizes(fastafile).filename
-    cmd = "genomeCoverageBed -ibam {0} -g {1}".format(bamfile, sizesfile)
-    if format in ("bedgraph", "bigwig"):
-        cmd += " -bg"
-        bedgraphfile = pf + ".bedgraph"
-        sh(cmd, outfile=bedgraphfile)
-
-        if format == "bedgraph":
-            return bedgraphfile
+    covs = iter_bam_coverage(bamfile, cpus=opts.cpus, split=opts.split)
 
+    if format == "bigwig":
         bigwigfile = pf + ".bigwig"
-        cmd = "bedGraphToBigWig {0} {1} {2}".format(bedgraphfile, sizesfile, bigwigfile)
-        sh(cmd)
+        write_bigwig(covs, bigwigfile, pf, Sizes(fastafile).filename)
         return bigwigfile
 
-    coveragefile = pf + ".coverage"
-    if need_update(fastafile, coveragefile):
-        sh(cmd, outfile=coveragefile)
+    if format == "bedgraph":
+        bedgraphfile = pf + ".bedgraph"
+        write_bedgraph(covs, bedgraphfile)
+        return bedgraphfile
 
-    gcf = GenomeCoverageFile(coveragefile)
     fw = must_open(opts.outfile, "w")
-    for seqid, cov in gcf.iter_coverage_seqid():
-        print("\t".join((seqid, "{0:.1f}".format(cov))), file=fw)
+    total_bases = total_length = 0
+    for seqid, length, (starts, ends, values) in covs:
+        bases = int(((ends - starts) * values).sum())
+        total_bases += bases
+        total_length += length
+        print("\t".join((seqid, "{0:.1f}".format(bases * 1.0 / length))), file=fw)
+    if total_length:
+        cov = total_bases * 1.0 / total_length
+        print("\t".join(("genome", "{0:.1f}".format(cov))), file=fw)
     fw.close()
 
 
+def write_bedgraph(covs, bedgraphfile):
+    """
+    Write the output of `iter_bam_coverage()` as bedgraph.
+    """
+    with open(bedgraphfile, "w") as fw:
+        for seqid, length, (starts, ends, values) in covs:
+            for start, end, value in zip(starts, ends, values):
+                print("{0}\t{1}\t{2}\t{3}".format(seqid, start, end, value), file=fw)
+    return bedgraphfile
+
+
+def write_bigwig(covs, bigwigfile, pf, sizesfile):
+    """
+    Write the output of `iter_bam_coverage()` as bigwig, with pyBigWig if
+    installed, or through bedGraphToBigWig.
+    """
+    try:
+        import pyBigWig
+    except ImportError:
+        bedgraphfile = write_bedgraph(covs, pf + ".bedgraph")
+        cmd = "bedGraphToBigWig {0} {1} {2}".format(bedgraphfile, sizesfile, bigwigfile)
+        sh(cmd)
+        return bigwigfile
+
+    covs = list(covs)
+    bw = pyBigWig.open(bigwigfile, "w")
+    bw.addHeader([(seqid, length) for seqid, length, _ in covs])
+    for seqid, length, (starts, ends, values) in covs:
+        if len(starts):
+            bw.addEntries(
+                seqid,
+                starts.tolist(),
+                ends=ends.tolist(),
+                values=values.astype(float).tolist(),
+            )
+    bw.close()
+    return bigwigfile
+
+
 def fpkm(args):
     """
     %prog fpkm fastafile *.bam
 
-    Calculate FPKM values from BAM file.
+    Calculate FPKM values of each sequence in fastafile from BAM files, using
+    the read counts in the BAM index.
     """
+    import pysam
+
     p = OptionParser(fpkm.__doc__)
+    p.set_outfile()
     opts, args = p.parse_args(args)
 
     if len(args) < 2:
@@ -507,34 +857,23 @@ def fpkm(args):
 
     fastafile = args[0]
     bamfiles = args[1:]
-    # Create a DUMMY gff file for cuffdiff
-    gffile = fastafile.rsplit(".", 1)[0] + ".gff"
-    if need_update(fastafile, gffile):
-        fw = open(gffile, "w")
-        f = Fasta(fastafile, lazy=True)
-        for key, size in f.itersizes_ordered():
-            print(
-                "\t".join(
-                    str(x)
-                    for x in (
-                        key,
-                        "dummy",
-                        "transcript",
-                        1,
-                        size,
-                        ".",
-                        ".",
-                        ".",
-                        "ID=" + key,
-                    )
-                ),
-                file=fw,
-            )
-        fw.close()
-        logger.debug("Dummy GFF created: {0}".format(gffile))
-
-    cmd = "cuffdiff {0} {1}".format(gffile, " ".join(bamfiles))
-    sh(cmd)
+    sizes = Sizes(fastafile).mapping
+    fw = must_open(opts.outfile, "w")
+    print("\t".join(["seqid", "length"] + bamfiles), file=fw)
+    mapped = {}
+    for bamfile in bamfiles:
+        with pysam.AlignmentFile(bamfile) as bam:
+            stats = bam.get_index_statistics()
+        total = sum(x.mapped for x in stats) or 1
+        mapped[bamfile] = ({x.contig: x.mapped for x in stats}, total)
+    for seqid, size in sizes.items():
+        values = []
+        for bamfile in bamfiles:
+            counts, total = mapped[bamfile]
+            fpkm = counts.get(seqid, 0) * 1e9 / (size * total)
+            values.append("{0:.3f}".format(fpkm))
+        print("\t".join([seqid, str(size)] + values), file=fw)
+    fw.close()
 
 
 def pairs(args):
@@ -6,14 +6,26 @@ Variant call format.
 """
 
 from collections import defaultdict
-from itertools import groupby
+import hashlib
+from itertools import groupby, islice
+import os
 import os.path as op
+import pickle
 import sys
+import tempfile
 
+import numpy as np
 from pyfaidx import Fasta
 from pyliftover import LiftOver
 
-from ..apps.base import ActionDispatcher, OptionParser, logger, need_update, sh
+from ..apps.base import (
+    ActionDispatcher,
+    OptionParser,
+    logger,
+    need_update,
+    sh,
+    user_cache_dir,
+)
 from ..utils.cbook import percentage
 from .base import must_open
 from .sizes import Sizes
@@ -51,6 +63,214 @@ class VcfLine:
         )
 
 
+def parse_ints(buf, starts, ends, width=12):
+    """
+    Parse the non-negative integers in `buf[starts:ends]` (byte array, any
+    shape of starts/ends) without leaving NumPy. Fields that are empty or not
+    all digits get -1.
+    """
+    idx = starts[..., None] + np.arange(width)
+    inside = idx < ends[..., None]
+    digits = buf[np.minimum(idx, len(buf) - 1)].astype(np.int64) - 48
+    isdigit = inside & (digits >= 0) & (digits <= 9)
+    ndigits = np.cumprod(isdigit, axis=-1).sum(axis=-1)
+    power = ndigits[..., None] - 1 - np.arange(width)
+    values = np.where(power >= 0, digits * 10 ** np.maximum(power, 0), 0).sum(axis=-1)
+    valid = (ndigits > 0) & (ndigits == ends - starts)
+    return np.where(valid, values, -1)
+
+
+class VcfBatch(object):
+    """
+    A batch of VCF records, kept as one byte buffer with the field boundaries
+    located by tabs, so that columns (and sample columns) can be picked
+    without splitting every line.
+    """
+
+    def __init__(self, rows, columns=None):
+        text = "".join(x if x.endswith("\n") else x + "\n" for x in rows)
+        self.data = text.encode()
+        # Padding so that lookups past the last field stay in the buffer
+        self.buf = buf = np.frombuffer(self.data + b"\0" * 4, dtype=np.uint8)
+        newlines = np.flatnonzero(buf == 10)
+        tabs = np.flatnonzero(buf == 9)
+        nrecords = len(newlines)
+        ntabs = len(tabs) // nrecords
+        if ntabs * nrecords != len(tabs) or ntabs < 7:
+            raise ValueError("Records have different number of columns")
+        tabs = tabs.reshape(nrecords, ntabs)
+        linestarts = np.concatenate(([0], newlines[:-1] + 1))
+        self.starts = np.hstack((linestarts[:, None], tabs + 1))
+        self.ends = np.hstack((tabs, newlines[:, None]))
+        self.columns = np.arange(9, ntabs + 1) if columns is None else columns + 9
+
+    def __len__(self):
+        return self.starts.shape[0]
+
+    def field(self, k):
+        data = self.data
+        return [data[a:b].decode() for a, b in zip(self.starts[:, k], self.ends[:, k])]
+
+    @property
+    def seqid(self):
+        return self.field(0)
+
+    @property
+    def pos(self):
+        return parse_ints(self.buf, self.starts[:, 1], self.ends[:, 1])
+
+    @property
+    def rsid(self):
+        return self.field(2)
+
+    @property
+    def ref(self):
+        return self.field(3)
+
+    @property
+    def alt(self):
+        return self.field(4)
+
+    def cells(self):
+        return self.starts[:, self.columns], self.ends[:, self.columns]
+
+    def genotypes(self):
+        """
+        Decode GT of the selected samples into int8 allele indices of shape
+        (records, samples, 2), -1 for missing. Haploid calls are repeated.
+        """
+        buf = self.buf
+        starts, ends = self.cells()
+        c = [buf[np.minimum(starts + i, len(buf) - 1)] for i in range(4)]
+        isdigit = [(x >= 48) & (x <= 57) for x in c]
+        a = np.where(isdigit[0], c[0].astype(np.int16) - 48, -1)
+        diploid = (c[1] == 47) | (c[1] == 124)  # '/' or '|'
+        b = np.where(diploid, np.where(isdigit[2], c[2].astype(np.int16) - 48, -1), a)
+        gt = np.stack((a, b), axis=-1).astype(np.int8)
+
+        # Multi-digit alleles or polyploid calls, decode the text instead
+        slow = (isdigit[0] & isdigit[1]) | (diploid & isdigit[2] & isdigit[3])
+        slow |= diploid & ((c[3] == 47) | (c[3] == 124))
+        for i, j in zip(*np.nonzero(slow)):
+            call = self.data[starts[i, j] : ends[i, j]].decode().split(":")[0]
+            alleles = call.replace("|", "/").split("/")[:2]
+            alleles = [min(int(x), 127) if x.isdigit() else -1 for x in alleles]
+            gt[i, j] = alleles * (3 - len(alleles))
+        return gt
+
+    def nsubfields(self):
+        """
+        Number of colon-separated fields in each selected sample cell.
+        """
+        starts, ends = self.cells()
+        colons = np.flatnonzero(self.buf == 58)
+        return np.searchsorted(colons, ends) - np.searchsorted(colons, starts) + 1
+
+    def format_ints(self, index):
+        """
+        Integer values of the `index`-th FORMAT field (e.g. DP) of the selected
+        sample cells, -1 for missing values.
+        """
+        starts, ends = self.cells()
+        colons = np.append(np.flatnonzero(self.buf == 58), len(self.buf))
+        first = np.searchsorted(colons, starts)
+        if index:
+            fstarts = colons[np.minimum(first + index - 1, len(colons) - 1)] + 1
+        else:
+            fstarts = starts
+        fends = np.minimum(colons[np.minimum(first + index, len(colons) - 1)], ends)
+        present = fstarts <= ends
+        fstarts = np.minimum(fstarts, ends)
+        return np.where(present, parse_ints(self.buf, fstarts, fends), -1)
+
+
+class VcfReader(object):
+    """
+    Streaming reader of plain or compressed VCF. Iterate to get `VcfLine`
+    records, or use `iter_batches()` to get `VcfBatch` with genotypes decoded
+    in NumPy arrays. With `region` (seqid or seqid:start-end), a bgzipped VCF
+    with a tabix (.tbi) or CSI (.csi) index is queried through the index,
+    others are scanned. `samples` selects a subset of the samples by name.
+    Use as a context manager, or call `close()`, to close the file.
+    """
+
+    def __init__(self, filename, region=None, samples=None, batchsize=1000):
+        self.filename = filename
+        self.batchsize = batchsize
+        self.meta = []
+        self.header = []
+        self.fp = fp = must_open(filename)
+        for row in fp:
+            if row.startswith("##"):
+                self.meta.append(row.rstrip("\n"))
+                continue
+            if row.startswith("#"):
+                self.header = row.rstrip("\n").split("\t")
+                break
+        self.samples = self.header[9:]
+        if samples is None:
+            self.columns = None
+        else:
+            index = dict((x, i) for i, x in enumerate(self.samples))
+            self.columns = np.array([index[x] for x in samples], dtype=int)
+            self.samples = list(samples)
+
+        self.region = None
+        if region:
+            seqid, _, start_end = region.partition(":")
+            start, _, end = start_end.replace(",", "").partition("-")
+            self.region = seqid, int(start or 1), int(end) if end else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.fp is not sys.stdin:
+            self.fp.close()
+
+    @property
+    def index(self):
+        for suffix in (".tbi", ".csi"):
+            if op.exists(self.filename + suffix):
+                return self.filename + suffix
+
+    def iter_rows(self):
+        if self.region is None:
+            yield from self.fp
+            return
+
+        seqid, start, end = self.region
+        if self.index:
+            import pysam
+
+            with pysam.TabixFile(self.filename, index=self.index) as tf:
+                if seqid not in tf.contigs:
+                    return
+                yield from tf.fetch(seqid, start - 1, end)
+            return
+
+        for row in self.fp:
+            rseqid, pos, _ = row.split("\t", 2)
+            pos = int(pos)
+            if rseqid == seqid and pos >= start and (end is None or pos <= end):
+                yield row
+
+    def __iter__(self):
+        for row in self.iter_rows():
+            yield VcfLine(row)
+
+    def iter_batches(self):
+        rows = self.iter_rows()
+        while True:
+            batch = list(islice(rows, self.batchsize))
+            if not batch:
+                break
+            yield VcfBatch(batch, self.columns)
+
+
 class UniqueLiftover(object):
     def __init__(self, chainfile):
         """
@@ -67,7 +287,7 @@ class UniqueLiftover(object):
         :return:
         """
 
-        self.liftover = LiftOver(chainfile)
+        self.liftover = load_liftover(chainfile)
 
     def liftover_cpra(self, chromosome, position, verbose=False):
         """
@@ -116,6 +336,51 @@ class UniqueLiftover(object):
         return None, None
 
 
+def liftover_cachefile(chainfile):
+    """
+    Path of the pickled LiftOver of the chain file in the user cache dir,
+    keyed by the path, size and mtime of the chain file.
+    """
+    st = os.stat(chainfile)
+    key = "{0}\0{1}\0{2}".format(op.abspath(chainfile), st.st_size, st.st_mtime_ns)
+    digest = hashlib.sha1(key.encode()).hexdigest()
+    return op.join(user_cache_dir("liftover"), digest + ".pkl")
+
+
+def load_liftover(chainfile):
+    """
+    Load the chain file, or the pickled LiftOver from a previous run, which is
+    a lot faster than parsing the chains again. The pickles are only read
+    from the user cache dir, never from next to the chain file.
+    """
+    try:
+        cachefile = liftover_cachefile(chainfile)
+    except OSError as e:
+        logger.debug("No liftover cache ({})".format(e))
+        return LiftOver(chainfile)
+
+    if op.exists(cachefile):
+        try:
+            with open(cachefile, "rb") as fp:
+                return pickle.load(fp)
+        except (OSError, EOFError, pickle.UnpicklingError) as e:
+            logger.debug("Cannot load `{}` ({}), rebuilding".format(cachefile, e))
+
+    liftover = LiftOver(chainfile)
+    # Write to a temp file first, so that a crash does not leave a partial cache
+    tmpfile = None
+    try:
+        fd, tmpfile = tempfile.mkstemp(dir=op.dirname(cachefile), suffix=".tmp")
+        with os.fdopen(fd, "wb") as fw:
+            pickle.dump(liftover, fw, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpfile, cachefile)
+    except (OSError, pickle.PicklingError, RecursionError) as e:
+        logger.debug("Cannot write `{}` ({})".format(cachefile, e))
+        if tmpfile and op.exists(tmpfile):
+            os.remove(tmpfile)
+    return liftover
+
+
 CM = dict(
     list(
         zip([str(x) for x in range(1, 23)], ["chr{0}".format(x) for x in range(1, 23)])
@@ -196,22 +461,17 @@ def uniq(args):
         sys.exit(not p.print_help())
 
     (vcffile,) = args
-    fp = must_open(vcffile)
-    data = []
-    for row in fp:
-        if row[0] == "#":
-            print(row.strip())
-            continue
-        v = VcfLine(row)
-        data.append(v)
-
-    for pos, vv in groupby(data, lambda x: x.pos):
-        vv = list(vv)
-        if len(vv) == 1:
-            print(vv[0])
-            continue
-        bestv = max(vv, key=lambda x: float(parse_qs(x.info)["R2"][0]))
-        print(bestv)
+    with VcfReader(vcffile) as reader:
+        for row in reader.meta + ["\t".join(reader.header)]:
+            print(row)
+
+        for pos, vv in groupby(reader, lambda x: x.pos):
+            vv = list(vv)
+            if len(vv) == 1:
+                print(vv[0])
+                continue
+            bestv = max(vv, key=lambda x: float(parse_qs(x.info)["R2"][0]))
+            print(bestv)
 
 
 def sample(args):
@@ -230,7 +490,7 @@ def sample(args):
 
     vcffile, ratio = args
     ratio = float(ratio)
-    fp = open(vcffile)
+    fp = must_open(vcffile)
     pf = vcffile.rsplit(".", 1)[0]
     kept = pf + ".kept.vcf"
     withheld = pf + ".withheld.vcf"
@@ -475,14 +735,12 @@ def refallele(args):
         sys.exit(not p.print_help())
 
     (vcffile,) = args
-    fp = open(vcffile)
-    for row in fp:
-        if row[0] == "#":
-            continue
-        atoms = row.split()
-        marker = "{0}:{1}".format(*atoms[:2])
-        ref = atoms[3]
-        print("\t".join((marker, ref)))
+    with VcfReader(vcffile) as reader:
+        for row in reader.iter_rows():
+            atoms = row.split("\t", 4)
+            marker = "{0}:{1}".format(*atoms[:2])
+            ref = atoms[3]
+            print("\t".join((marker, ref)))
 
 
 def location(args):
@@ -563,7 +821,6 @@ def summary(args):
 
     fp = open(txtfile)
     header = next(fp).split()  # Header
-    snps = defaultdict(list)  # contig => list of loci
     combinations = defaultdict(int)
     intraSNPs = interSNPs = 0
     distinctSet = set()  # set of genes that show A-B pattern
@@ -575,7 +832,6 @@ def summary(args):
         locus, intra, inter = atoms
         ctg, pos = locus.rsplit(".", 1)
         pos = int(pos)
-        snps[ctg].append(pos)
         snpcounts[ctg] += 1
 
         if intra == "X":
@@ -597,7 +853,7 @@ def summary(args):
         logger.debug("SNP locations written to `{0}`.".format(opts.bed))
         bedfw.close()
 
-    nsites = sum(len(x) for x in snps.values())
+    nsites = sum(snpcounts.values())
     sizes = Sizes(fastafile)
     bpsize = sizes.totalsize
     snprate = lambda a: a * 1000.0 / bpsize
@@ -605,7 +861,9 @@ def summary(args):
         fastafile, len(sizes), thousands(bpsize)
     )
     m += "A total of {0} SNPs within {1} contigs ({2} bp).\n".format(
-        nsites, len(snps), thousands(sum(sizes.mapping[x] for x in snps.keys()))
+        nsites,
+        len(snpcounts),
+        thousands(sum(sizes.mapping[x] for x in snpcounts.keys())),
     )
     m += "SNP rate: {0:.1f}/Kb, ".format(snprate(nsites))
     m += "IntraSNPs: {0} ({1:.1f}/Kb), InterSNPs: {2} ({3:.1f}/Kb)".format(
@@ -638,7 +896,7 @@ def summary(args):
     assert sum(snpcounts.values()) == nsites
     assert sum(goodsnpcounts.values()) == distinctSNPs
 
-    for ctg in sorted(snps.keys()):
+    for ctg in sorted(snpcounts.keys()):
         snpcount = snpcounts[ctg]
         goodsnpcount = goodsnpcounts[ctg]
         print("\t".join(str(x) for x in (ctg, snpcount, goodsnpcount)), file=fw)
@@ -676,13 +934,69 @@ def encode_genotype(s, mindepth=3, depth_index=2, nohet=False):
     return "-"
 
 
+# Genotype codes 0, 1, 2 and -1 (missing) as in the MSTmap input
+GENOTYPE_CODES = "AXB-"
+
+
+def genotype_codes(batch, mindepth=3, depth_index=2, nohet=False):
+    """
+    Vectorized `encode_genotype()` over a `VcfBatch`, returns an int8 matrix
+    of shape (records, samples), indexing into GENOTYPE_CODES.
+
+    Unlike `encode_genotype()`, which only knows `0/0`, `0/1` and `1/1`, the
+    allele order and phasing are ignored: `1/0`, `0|1` and `1|0` are
+    heterozygous, and `0|0` and `1|1` are homozygous.
+    """
+    gt = batch.genotypes()
+    a, b = gt[..., 0], gt[..., 1]
+    codes = np.full(a.shape, -1, dtype=np.int8)
+    codes[(a == 0) & (b == 0)] = 0
+    if not nohet:
+        codes[((a == 0) & (b == 1)) | ((a == 1) & (b == 0))] = 1
+    codes[(a == 1) & (b == 1)] = 2
+    # Only calls with depth information are checked against mindepth
+    lowdepth = (batch.nsubfields() >= 3) & (batch.format_ints(depth_index) < mindepth)
+    codes[lowdepth] = -1
+    return codes
+
+
+def encode_genotypes(batch, mindepth=3, depth_index=2, nohet=False):
+    """
+    Same as `genotype_codes()`, as an array of single-letter codes.
+    """
+    codes = genotype_codes(
+        batch, mindepth=mindepth, depth_index=depth_index, nohet=nohet
+    )
+    return np.array(list(GENOTYPE_CODES))[codes]
+
+
+def iter_genotype_matrix(
+    vcffile, mindepth=3, depth_index=2, nohet=False, samples=None, batchsize=1000
+):
+    """
+    Stream the VCF as genotype matrices, yields (markers, codes) for each
+    batch of records, where markers are `seqid.pos` and codes are from
+    `genotype_codes()`.
+    """
+    with VcfReader(vcffile, samples=samples, batchsize=batchsize) as reader:
+        for batch in reader.iter_batches():
+            codes = genotype_codes(
+                batch, mindepth=mindepth, depth_index=depth_index, nohet=nohet
+            )
+            markers = [
+                "{0}.{1}".format(seqid, pos)
+                for seqid, pos in zip(batch.seqid, batch.pos)
+            ]
+            yield markers, codes
+
+
 def mstmap(args):
     """
     %prog mstmap bcffile/vcffile > matrixfile
 
     Convert bcf/vcf format to mstmap input.
     """
-    from jcvi.assembly.geneticmap import MSTMatrix
+    from jcvi.assembly.geneticmap import write_mstmap
 
     p = OptionParser(mstmap.__doc__)
     p.add_argument(
@@ -751,42 +1065,31 @@ def mstmap(args):
 
     ptype = "DH" if opts.dh else "RIL6"
     nohet = ptype == "DH"
-    fp = open(vcffile)
-    genotypes = []
-    for row in fp:
-        if row[:2] == "##":
-            continue
-        atoms = row.split()
-        if row[0] == "#":
-            ind = [x.split(sep)[0] for x in atoms[9:]]
-            nind = len(ind)
-            mh = ["locus_name"] + ind
-            continue
-
-        marker = "{0}.{1}".format(*atoms[:2])
-
-        geno = atoms[9:]
-        geno = [
-            encode_genotype(
-                x, mindepth=opts.mindepth, depth_index=depth_index, nohet=nohet
-            )
-            for x in geno
-        ]
-        assert len(geno) == nind
-        f = 1.0 / nind
-
-        if geno.count("A") * f < freq:
-            continue
-        if geno.count("B") * f < freq:
-            continue
-        if geno.count("-") * f > opts.missing_threshold:
-            continue
-
-        genotype = [marker] + geno
-        genotypes.append(genotype)
-
-    mm = MSTMatrix(genotypes, mh, ptype, opts.missing_threshold)
-    mm.write(opts.outfile, header=(not opts.noheader))
+    with VcfReader(vcffile) as reader:
+        ind = [x.split(sep)[0] for x in reader.samples]
+    nind = len(ind)
+    mh = ["locus_name"] + ind
+    f = 1.0 / nind
+    letters = np.array(list(GENOTYPE_CODES))
+
+    def iter_rows():
+        for markers, codes in iter_genotype_matrix(
+            vcffile, mindepth=opts.mindepth, depth_index=depth_index, nohet=nohet
+        ):
+            keep = (codes == 0).sum(axis=1) * f >= freq
+            keep &= (codes == 2).sum(axis=1) * f >= freq
+            keep &= (codes == -1).sum(axis=1) * f <= opts.missing_threshold
+            for i in np.flatnonzero(keep):
+                yield [markers[i]] + letters[codes[i]].tolist()
+
+    write_mstmap(
+        iter_rows(),
+        mh,
+        ptype,
+        opts.missing_threshold,
+        filename=opts.outfile,
+        header=(not opts.noheader),
+    )
 
 
 def liftover(args):
@@ -807,7 +1110,7 @@ def liftover(args):
     oldvcf, chainfile, newvcf = args
     ul = UniqueLiftover(chainfile)
     num_excluded = 0
-    fp = open(oldvcf)
+    fp = must_open(oldvcf)
     fw = open(newvcf, "w")
     for row in fp:
         row = row.strip()
@@ -2,7 +2,7 @@
 # -*- coding: UTF-8 -*-
 
 import copy
-from functools import partial
+from functools import lru_cache, partial
 from os import remove
 import os.path as op
 import re
@@ -11,7 +11,6 @@ from typing import List, Optional, Tuple, Union
 
 import matplotlib as mpl
 import numpy as np
-import seaborn as sns
 
 mpl.use("Agg")
 
@@ -61,8 +60,9 @@ GRAPHIC_FORMATS = (
 )
 
 
+@lru_cache(maxsize=None)
 def is_tex_available() -> bool:
-    """Check if latex command is available"""
+    """Check if latex command is available, probed once per process"""
     return bool(which("latex")) and bool(which("lp"))
 
 
@@ -441,6 +441,8 @@ def setup_theme(
     usetex: bool = True,
 ):
     try:
+        import seaborn as sns
+
         extra_rc = {
             "lines.linewidth": 1,
             "lines.markeredgewidth": 1,
@@ -541,7 +543,10 @@ def plot_heatmap(
         cmap (str | Colormap, optional): Colormap. Defaults to None, which uses cubehelix.
         binsize (int, optional): Resolution of the heatmap.
     """
-    cmap = cmap or sns.cubehelix_palette(rot=0.5, as_cmap=True)
+    if cmap is None:
+        import seaborn as sns
+
+        cmap = sns.cubehelix_palette(rot=0.5, as_cmap=True)
     ax.imshow(M, cmap=cmap, interpolation="none")
     _, xmax = ax.get_xlim()
     xlim = (0, xmax)
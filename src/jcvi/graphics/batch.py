@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+Render many figures in parallel, from a manifest of jcvi.graphics commands.
+"""
+
+from collections import deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from importlib import import_module
+from inspect import signature
+import shlex
+import signal
+import sys
+import threading
+import time
+from typing import List
+
+from ..apps.base import ActionDispatcher, OptionParser, logger
+from ..formats.base import must_open
+
+RenderJob = namedtuple("RenderJob", "lineno module args")
+RenderResult = namedtuple("RenderResult", "job ok elapsed error")
+
+
+def main():
+
+    actions = (("render", "render the figure jobs in a manifest in parallel"),)
+    p = ActionDispatcher(actions)
+    p.dispatch(globals())
+
+
+def read_manifest(manifest: str) -> List[RenderJob]:
+    """
+    Read the figure jobs, one per line, each as a jcvi.graphics command line
+    without the `python -m` prefix, e.g.
+
+    dotplot grape.peach.anchors --qbed grape.bed --sbed peach.bed -o grape.peach.pdf
+    jcvi.graphics.landscape depth data.regions.bed.gz
+
+    Short module names are looked up in jcvi.graphics. Empty lines and lines
+    starting with `#` are skipped.
+    """
+    jobs = []
+    with must_open(manifest) as fp:
+        for lineno, row in enumerate(fp, 1):
+            if not row.strip() or row.startswith("#"):
+                continue
+            module, *args = shlex.split(row)
+            if "." not in module:
+                module = "jcvi.graphics." + module
+            jobs.append(RenderJob(lineno, module, args))
+    return jobs
+
+
+def get_entry(module):
+    """
+    Find the command line entry point of the module, either `main(args)`,
+    `<name>_main(args)`, or `main()` that reads `sys.argv`.
+    """
+    name = module.__name__.rsplit(".", 1)[-1]
+    func = getattr(module, "main", None) or getattr(module, name + "_main")
+    return func, bool(signature(func).parameters)
+
+
+def _init_render_worker(modules):
+    """
+    Import matplotlib and the figure modules once per worker.
+    """
+    from .base import plt  # noqa: F401
+
+    for module in modules:
+        try:
+            import_module(module)
+        except Exception:  # Reported by the job itself
+            pass
+
+
+def render_job(job: RenderJob) -> RenderResult:
+    """
+    Run one figure job as if it were called from the command line. Errors,
+    including the `sys.exit()` of a failed option parse, are caught and
+    returned so that one bad job does not stop the batch.
+    """
+    from .base import mpl, plt
+
+    start = time.time()
+    argv = sys.argv
+    ok, error = True, ""
+    try:
+        with mpl.rc_context():
+            module = import_module(job.module)
+            func, takes_args = get_entry(module)
+            sys.argv = [module.__file__] + job.args
+            if takes_args:
+                func(job.args)
+            else:
+                func()
+    except SystemExit as e:
+        if e.code not in (None, 0, False):
+            code = int(e.code) if isinstance(e.code, int) else e.code
+            ok, error = False, f"exit status {code}"
+    except Exception as e:
+        ok, error = False, f"{type(e).__name__}: {e}"
+    finally:
+        sys.argv = argv
+        plt.close("all")
+    return RenderResult(job, ok, time.time() - start, error)
+
+
+def render_pool(cpus: int, modules: List[str]) -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(
+        cpus, initializer=_init_render_worker, initargs=(modules,)
+    )
+
+
+def render_isolated(job: RenderJob, modules: List[str]) -> RenderResult:
+    """
+    Run one job in a worker process of its own, and report the job as failed
+    if the worker dies.
+    """
+    start = time.time()
+    executor = render_pool(1, modules)
+    try:
+        return executor.submit(render_job, job).result()
+    except BrokenProcessPool:
+        return RenderResult(job, False, time.time() - start, "worker process died")
+    finally:
+        executor.shutdown()
+
+
+def render_batch(jobs: List[RenderJob], cpus: int = 1):
+    """
+    Render the jobs over a pool of worker processes, each importing
+    matplotlib once. Results are yielded as soon as each job finishes.
+
+    At most `cpus` jobs run at a time. If a worker dies, e.g. from a crash
+    in a C extension or running out of memory, the jobs that were running
+    are rerun one at a time in a process of their own, so that only the job
+    that killed its worker is reported as failed, and a new pool takes the
+    remaining jobs.
+    """
+    cpus = min(cpus, len(jobs))
+    if cpus <= 1:
+        for job in jobs:
+            yield render_job(job)
+        return
+
+    modules = sorted(set(x.module for x in jobs))
+    pending = deque(jobs)
+    running = {}
+    # jcvi restores the default SIGPIPE action, which would kill this process
+    # when the pool writes to the pipe of a dead worker
+    sigpipe = None
+    if threading.current_thread() is threading.main_thread():
+        sigpipe = signal.signal(signal.SIGPIPE, signal.SIG_IGN)
+    executor = render_pool(cpus, modules)
+    try:
+        while pending or running:
+            while pending and len(running) < cpus:
+                job = pending.popleft()
+                running[executor.submit(render_job, job)] = job
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            broken = False
+            for future in done:
+                job = running.pop(future)
+                try:
+                    yield future.result()
+                except BrokenProcessPool:
+                    running[future] = job
+                    broken = True
+            if not broken:
+                continue
+            suspects = sorted(running.values(), key=lambda x: x.lineno)
+            logger.warning(
+                "Render worker died, rerun lines %s one at a time",
+                ",".join(str(x.lineno) for x in suspects),
+            )
+            running.clear()
+            executor.shutdown()
+            for job in suspects:
+                yield render_isolated(job, modules)
+            executor = render_pool(cpus, modules)
+    finally:
+        executor.shutdown()
+        if sigpipe is not None:
+            signal.signal(signal.SIGPIPE, sigpipe)
+
+
+def render(args):
+    """
+    %prog render manifest.txt
+
+    Render the figure jobs in the manifest, one jcvi.graphics command per line
+    (module name, then arguments), in a pool of worker processes, e.g.
+
+    dotplot a.b.anchors --qbed a.bed --sbed b.bed -o a.b.pdf
+    karyotype seqids layout -o karyotype.pdf
+
+    A failed job is reported and does not stop the others. The status of each
+    job is written to --outfile as a tab-separated table.
+    """
+    p = OptionParser(render.__doc__)
+    p.set_cpus()
+    p.set_outfile()
+    opts, args = p.parse_args(args)
+
+    if len(args) != 1:
+        sys.exit(not p.print_help())
+
+    (manifest,) = args
+    jobs = read_manifest(manifest)
+    logger.info("Render %d figure jobs with %d workers", len(jobs), opts.cpus)
+
+    results = []
+    for i, result in enumerate(render_batch(jobs, cpus=opts.cpus), 1):
+        job = result.job
+        if result.ok:
+            logger.info(
+                "[%d/%d] Line %d `%s` done (%.1fs)",
+                i,
+                len(jobs),
+                job.lineno,
+                job.module,
+                result.elapsed,
+            )
+        else:
+            logger.error(
+                "[%d/%d] Line %d `%s` failed: %s",
+                i,
+                len(jobs),
+                job.lineno,
+                job.module,
+                result.error,
+            )
+        results.append(result)
+
+    results.sort(key=lambda x: x.job.lineno)
+    with must_open(opts.outfile, "w") as fw:
+        for r in results:
+            status = "ok" if r.ok else "failed"
+            row = (r.job.lineno, r.job.module, status, f"{r.elapsed:.1f}", r.error)
+            print("\t".join(str(x) for x in row), file=fw)
+
+    failed = sum(not x.ok for x in results)
+    if failed:
+        logger.error("%d of %d figure jobs failed", failed, len(jobs))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
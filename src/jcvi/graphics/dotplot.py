@@ -31,7 +31,10 @@ import os.path as op
 from random import sample
 import string
 import sys
-from typing import Optional
+from typing import Optional, Tuple
+
+from matplotlib.colors import Normalize, to_rgb
+import numpy as np
 
 from ..apps.base import OptionParser, logger, need_update
 from ..compara.base import AnchorFile
@@ -237,6 +240,81 @@ def downsample(data, sample_number: int = 10000):
     return data
 
 
+def density_image(
+    qi: np.ndarray,
+    si: np.ndarray,
+    xsize: int,
+    ysize: int,
+    bins: Tuple[int, int],
+    values: Optional[np.ndarray] = None,
+    rgb: Optional[np.ndarray] = None,
+    colors: Optional[np.ndarray] = None,
+    cmap="copper",
+    vmin: float = 0,
+    vmax: float = 1,
+) -> np.ndarray:
+    """
+    Aggregate all anchor points into a 2-D histogram of `bins` = (nx, ny)
+    pixels, returned as an RGBA image of shape (ny, nx, 4). Each pixel is
+    colored by the mean of `values` through the colormap, or, when `rgb` is
+    given, by the mean block color where `rgb[colors]` is the color of each
+    point. Opacity grows with the log of the number of anchors in the pixel.
+    """
+    nx, ny = bins
+    xb = np.minimum(qi.astype(np.int64) * nx // max(xsize, 1), nx - 1)
+    yb = np.minimum(si.astype(np.int64) * ny // max(ysize, 1), ny - 1)
+    flat = yb * nx + xb
+    size = nx * ny
+    counts = np.bincount(flat, minlength=size)
+    hit = counts > 0
+    n = counts[hit]
+
+    image = np.zeros((size, 4))
+    if rgb is not None:
+        for k in range(3):
+            total = np.bincount(flat, weights=rgb[colors, k], minlength=size)
+            image[hit, k] = total[hit] / n
+    else:
+        if values is None:
+            values = np.zeros(len(flat))
+        total = np.bincount(flat, weights=values, minlength=size)
+        norm = Normalize(vmin=vmin, vmax=vmax, clip=True)
+        image[hit, :3] = plt.get_cmap(cmap)(norm(total[hit] / n))[:, :3]
+    if n.size:
+        image[hit, 3] = 0.25 + 0.75 * np.log1p(n) / np.log1p(n.max())
+    return image.reshape(ny, nx, 4)
+
+
+def draw_density(
+    ax,
+    qi: np.ndarray,
+    si: np.ndarray,
+    xsize: int,
+    ysize: int,
+    dpi: Optional[float] = None,
+    **kwargs,
+):
+    """
+    Draw the anchor density as a single image layer, one bin per output pixel
+    of the axes (and no finer than one gene).
+    """
+    fig = ax.get_figure()
+    scale = (dpi or fig.dpi) / fig.dpi
+    bbox = ax.get_window_extent()
+    nx = max(1, min(int(bbox.width * scale), xsize))
+    ny = max(1, min(int(bbox.height * scale), ysize))
+    logger.debug("Aggregate %d anchors into %dx%d bins", len(qi), nx, ny)
+    image = density_image(qi, si, xsize, ysize, (nx, ny), **kwargs)
+    ax.imshow(
+        image,
+        extent=(0, xsize, ysize, 0),
+        origin="upper",
+        interpolation="nearest",
+        aspect="auto",
+        zorder=1,
+    )
+
+
 def dotplot(
     anchorfile: str,
     qbed,
@@ -261,9 +339,13 @@ def dotplot(
     stdpf: bool = True,
     chpf: bool = True,
     usetex: bool = True,
+    density: bool = False,
+    dpi: Optional[float] = None,
 ):
     """
-    Draw a dotplot from an anchor file.
+    Draw a dotplot from an anchor file. With `density`, all anchors are binned
+    at the output resolution (see `draw_density()`) instead of plotting a
+    random subset of `sample_number` points.
     """
     fp = open(anchorfile, encoding="utf-8")
     # add genome names
@@ -279,17 +361,15 @@ def dotplot(
     qorder = qbed.order
     sorder = sbed.order
 
-    data = []
+    qis, sis, values, blocks = [], [], [], []
     if cmap_text:
         logger.debug("Capping values within [%.1f, %.1f]", vmin, vmax)
 
     block_id = 0
-    block_color = None
     for row in fp:
         atoms = row.split()
         if row[0] == "#":
             block_id += 1
-            block_color = palette.get(block_id, "k") if palette else None
             continue
 
         # first two columns are query and subject, and an optional third column
@@ -317,24 +397,59 @@ def dotplot(
         if subject not in sorder:
             continue
 
-        qi, q = qorder[query]
-        si, s = sorder[subject]
-
-        nv = block_color or value
-        data.append((qi, si, nv))
-        if is_self:  # Mirror image
-            data.append((si, qi, nv))
-
-    npairs = len(data)
-    data = downsample(data, sample_number=sample_number)
-    x, y, c = zip(*data)
+        qis.append(qorder[query][0])
+        sis.append(sorder[subject][0])
+        values.append(value)
+        blocks.append(block_id)
+
+    qi = np.array(qis, dtype=np.int64)
+    si = np.array(sis, dtype=np.int64)
+    values = np.array(values, dtype=float)
+    blocks = np.array(blocks, dtype=np.int64)
+    if is_self:  # Mirror image
+        qi, si = np.concatenate((qi, si)), np.concatenate((si, qi))
+        values = np.concatenate((values, values))
+        blocks = np.concatenate((blocks, blocks))
+    xsize, ysize = len(qbed), len(sbed)
 
+    # Block colors, indexed by block id
+    block_colors = None
     if palette:
-        ax.scatter(x, y, c=c, edgecolors="none", s=2, lw=0)
-    else:
-        ax.scatter(
-            x, y, c=c, edgecolors="none", s=2, lw=0, cmap=cmap, vmin=vmin, vmax=vmax
+        block_colors = [palette.get(x, "k") for x in range(block_id + 1)]
+
+    npairs = len(qi)
+    if density:
+        rgb = np.array([to_rgb(x) for x in block_colors]) if palette else None
+        draw_density(
+            ax,
+            qi,
+            si,
+            xsize,
+            ysize,
+            dpi=dpi,
+            values=values,
+            rgb=rgb,
+            colors=blocks,
+            cmap=cmap,
+            vmin=vmin,
+            vmax=vmax,
         )
+    if synteny or not density:
+        if palette:
+            c = [block_colors[x] for x in blocks]
+        else:
+            c = values.tolist()
+        data = list(zip(qi.tolist(), si.tolist(), c))
+    if not density:
+        data = downsample(data, sample_number=sample_number)
+        x, y, c = zip(*data)
+
+        if palette:
+            ax.scatter(x, y, c=c, edgecolors="none", s=2, lw=0)
+        else:
+            ax.scatter(
+                x, y, c=c, edgecolors="none", s=2, lw=0, cmap=cmap, vmin=vmin, vmax=vmax
+            )
 
     if synteny:
         clusters = batch_scan(data, qbed, sbed)
@@ -343,7 +458,6 @@ def dotplot(
     if cmap_text:
         draw_cmap(root, cmap_text, vmin, vmax, cmap=cmap)
 
-    xsize, ysize = len(qbed), len(sbed)
     logger.debug("xsize=%d ysize=%d", xsize, ysize)
     qbreaks = qbed.get_breaks()
     sbreaks = sbed.get_breaks()
@@ -434,6 +548,12 @@ def dotplot_main(args):
         default=10000,
         help="Maximum number of data points to plot",
     )
+    p.add_argument(
+        "--density",
+        default=False,
+        action="store_true",
+        help="Bin all anchors at the output resolution instead of plotting --nmax points",
+    )
     p.add_argument(
         "--minfont",
         type=int,
@@ -536,6 +656,8 @@ def dotplot_main(args):
         stdpf=(not opts.nostdpf),
         chpf=(not opts.nochpf),
         usetex=iopts.usetex,
+        density=opts.density,
+        dpi=iopts.dpi,
     )
 
     image_name = opts.outfile or (op.splitext(anchorfile)[0] + "." + opts.format)
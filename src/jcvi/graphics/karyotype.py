@@ -36,7 +36,7 @@ from .base import (
 )
 from .chromosome import Chromosome, HorizontalChromosome
 from .glyph import TextCircle
-from .synteny import Shade, ymid_offset
+from .synteny import Shade, draw_shades, ymid_offset
 
 
 class LayoutLine(object):
@@ -309,13 +309,13 @@ class ShadeManager(object):
     def draw_blocks(
         self, ax, blocks, atrack, btrack, samearc: Optional[str], heightpad=0
     ):
+        P, Q, highlights = [], [], []
         for a, b, c, d, _, _, highlight in blocks:
             p = atrack.get_coords(a), atrack.get_coords(b)
             q = btrack.get_coords(c), btrack.get_coords(d)
             if p[0] is None or q[0] is None:
                 continue
 
-            ymid_pad = ymid_offset(samearc)
             if heightpad:
                 if atrack.y < btrack.y:
                     p[0][1] = p[1][1] = atrack.y + heightpad
@@ -323,22 +323,24 @@ class ShadeManager(object):
                 else:
                     p[0][1] = p[1][1] = atrack.y - heightpad
                     q[0][1] = q[1][1] = btrack.y + heightpad
-
-            zorder = 2 if highlight else 1
-            lw = 1 if highlight else 0
-            Shade(
-                ax,
-                p,
-                q,
-                ymid_pad,
-                highlight=highlight,
-                alpha=1,
-                fc="gainsboro",
-                ec="gainsboro",
-                lw=lw,
-                zorder=zorder,
-                style=self.style,
-            )
+            P.append(p)
+            Q.append(q)
+            highlights.append(highlight)
+
+        # All blocks between the pair of tracks go into one collection per color
+        draw_shades(
+            ax,
+            P,
+            Q,
+            ymid_offset(samearc),
+            highlights=highlights,
+            alpha=1,
+            fc="gainsboro",
+            ec="gainsboro",
+            lw=0,
+            zorder=1,
+            style=self.style,
+        )
 
 
 class Karyotype(object):
@@ -12,12 +12,11 @@ import sys
 from typing import Dict, List, Optional, Tuple
 
 import numpy as np
-import seaborn as sns
 
 from ..algorithms.matrix import moving_sum
 from ..apps.base import ActionDispatcher, OptionParser, logger
 from ..formats.base import BaseFile, DictFile, LineFile, must_open
-from ..formats.bed import Bed, bins, get_nbins
+from ..formats.bed import Bed, bins, get_nbins, read_bins
 from ..formats.sizes import Sizes
 from ..utils.cbook import autoscale, human_size, percentage
 from .base import (
@@ -70,17 +69,29 @@ class BinLine:
 
 
 class BinFile(LineFile):
+    """
+    Binned values from `formats.bed.bins`. The mapping is chr => (values,
+    bases) arrays, loaded directly from .bins.npz, or parsed from the older
+    text .bins format.
+    """
+
     def __init__(self, filename):
         super().__init__(filename)
-        self.mapping = defaultdict(list)
+        if filename.endswith(".npz"):
+            self.mapping = read_bins(filename)
+            return
 
+        rows = defaultdict(list)
         fp = open(filename, encoding="utf-8")
         for row in fp:
             b = BinLine(row)
             self.append(b)
-            chr, len, binlen = b.chr, b.len, b.binlen
-            self.mapping[chr].append((len, binlen))
+            rows[b.chr].append((b.len, b.binlen))
         fp.close()
+        self.mapping = OrderedDict(
+            (chr, tuple(np.array(x, dtype=float) for x in zip(*mn)))
+            for chr, mn in rows.items()
+        )
 
 
 class ChrInfoLine:
@@ -201,6 +212,8 @@ def mosdepth(args):
     Plot depth vs. coverage per chromosome. Inspired by mosdepth plot. See also:
     https://github.com/brentp/mosdepth
     """
+    import seaborn as sns
+
     sns.set_style("darkgrid")
 
     p = OptionParser(mosdepth.__doc__)
@@ -686,8 +699,7 @@ def get_beds(s: List[str], binned: bool = False) -> List[str]:
 
 
 def linearray(binfile, chr, window, shift):
-    mn = binfile.mapping[chr]
-    m, _ = zip(*mn)
+    m, _ = binfile.mapping[chr]
 
     m = np.array(m, dtype=float)
     w = window // shift
@@ -1158,8 +1170,7 @@ def stackarray(binfile: BinFile, chr: str, window: int, shift: int):
     """
     Get stack array from binfile for the given chr.
     """
-    mn = binfile.mapping[chr]
-    m, n = zip(*mn)
+    m, n = binfile.mapping[chr]
 
     m = np.array(m, dtype=float)
     n = np.array(n, dtype=float)
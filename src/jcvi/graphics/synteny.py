@@ -21,6 +21,7 @@ import sys
 from typing import List, Optional
 
 from matplotlib import transforms
+from matplotlib.collections import PathCollection
 from matplotlib.path import Path
 import numpy as np
 
@@ -122,6 +123,105 @@ class Layout(AbstractLayout):
         self.assign_colors(seed=seed)
 
 
+M, C4, L, CP = Path.MOVETO, Path.CURVE4, Path.LINETO, Path.CLOSEPOLY
+SHADE_CODES = {
+    "curve": np.array([M, C4, C4, C4, L, C4, C4, C4, CP], dtype=Path.code_type),
+    "line": np.array([M, L, L, L, CP], dtype=Path.code_type),
+}
+
+
+def shade_vertices(a, b, ymid_pad: float = 0.0, style: str = "curve") -> np.ndarray:
+    """
+    Vertices of the shades between the segments in a and b, both of shape
+    (n, 2, 2) as in ((start_x, start_y), (end_x, end_y)). Returns an array of
+    shape (n, k, 2), to be used with `SHADE_CODES[style]`.
+    """
+    a = np.asarray(a, dtype=float).reshape(-1, 2, 2)
+    b = np.asarray(b, dtype=float).reshape(-1, 2, 2)
+    a1, a2, b1, b2 = a[:, 0], a[:, 1], b[:, 0], b[:, 1]
+    if style == "curve":
+        ymid1 = (a1[:, 1] + b1[:, 1]) / 2 + ymid_pad
+        ymid2 = (a2[:, 1] + b2[:, 1]) / 2 + ymid_pad
+        xy = lambda x, y: np.stack((x, y), axis=-1)
+        verts = (
+            a1,
+            xy(a1[:, 0], ymid1),
+            xy(b1[:, 0], ymid1),
+            b1,
+            b2,
+            xy(b2[:, 0], ymid2),
+            xy(a2[:, 0], ymid2),
+            a2,
+            a1,
+        )
+    else:
+        verts = (a1, b1, b2, a2, a1)
+    return np.stack(verts, axis=1)
+
+
+def draw_shades(
+    ax,
+    a,
+    b,
+    ymid_pad: float = 0.0,
+    highlights=None,
+    style="curve",
+    ec="k",
+    fc="k",
+    alpha=0.2,
+    lw=1,
+    zorder=1,
+):
+    """Batched version of `Shade`, all shades between a[i] and b[i] are drawn
+    as one PathCollection per color. Each shade stays a separate path, so that
+    overlapping shades of opposite orientation are each filled.
+
+    Args:
+        ax: matplotlib Axes
+        a (list of segments): Each as ((start_x, start_y), (end_x, end_y)),
+        segments with a missing coordinate are skipped
+        b (list of segments): Same as a
+        ymid_pad (float): Adjustment to y-mid position of Bezier controls, curve style only
+        highlights (list, optional): Highlight color (or None) for each shade,
+        highlighted shades are drawn in that color on top, with line width of 1.
+        style (str, optional): Style. Defaults to "curve", must be one of
+        ("curve", "line")
+        ec (str, optional): Edge color. Defaults to "k".
+        fc (str, optional): Face color. Defaults to "k".
+        alpha (float, optional): Transparency. Defaults to 0.2.
+        lw (int, optional): Line width. Defaults to 1.
+        zorder (int, optional): Z-order. Defaults to 1.
+
+    Returns:
+        List of PathCollection added to the axes.
+    """
+    fc = fc or "gainsboro"  # Default block color is grayish
+    assert style in Shade.Styles, f"style must be one of {Shade.Styles}"
+    if not len(a):
+        return []
+    verts = shade_vertices(a, b, ymid_pad, style)
+    valid = ~np.isnan(verts[:, :, 0]).any(axis=1)
+    if highlights is None:
+        highlights = [None] * len(verts)
+
+    groups = {}
+    for i in np.flatnonzero(valid):
+        groups.setdefault(highlights[i] or None, []).append(i)
+
+    codes = SHADE_CODES[style]
+    collections = []
+    for highlight, idx in groups.items():
+        paths = [Path(verts[i], codes) for i in idx]
+        if highlight:
+            kwargs = dict(ec=highlight, fc=highlight, lw=1, zorder=zorder + 1)
+        else:
+            kwargs = dict(ec=ec, fc=fc, lw=lw, zorder=zorder)
+        pc = PathCollection(paths, alpha=alpha, **kwargs)
+        ax.add_collection(pc)
+        collections.append(pc)
+    return collections
+
+
 class Shade(object):
     """
     Draw a shade between two tracks.
@@ -161,33 +261,12 @@ class Shade(object):
         """
         fc = fc or "gainsboro"  # Default block color is grayish
         assert style in self.Styles, f"style must be one of {self.Styles}"
-        a1, a2 = a
-        b1, b2 = b
-        ax1, ay1 = a1
-        ax2, ay2 = a2
-        bx1, by1 = b1
-        bx2, by2 = b2
+        (ax1, _), (ax2, _) = a
+        (bx1, _), (bx2, _) = b
         if ax1 is None or ax2 is None or bx1 is None or bx2 is None:
             return
-        M, C4, L, CP = Path.MOVETO, Path.CURVE4, Path.LINETO, Path.CLOSEPOLY
-        if style == "curve":
-            ymid1 = (ay1 + by1) / 2 + ymid_pad
-            ymid2 = (ay2 + by2) / 2 + ymid_pad
-            pathdata = [
-                (M, a1),
-                (C4, (ax1, ymid1)),
-                (C4, (bx1, ymid1)),
-                (C4, b1),
-                (L, b2),
-                (C4, (bx2, ymid2)),
-                (C4, (ax2, ymid2)),
-                (C4, a2),
-                (CP, a1),
-            ]
-        else:
-            pathdata = [(M, a1), (L, b1), (L, b2), (L, a2), (CP, a1)]
-        codes, verts = zip(*pathdata)
-        path = Path(verts, codes)
+        verts = shade_vertices(a, b, ymid_pad, style)[0]
+        path = Path(verts, SHADE_CODES[style])
         if highlight:
             ec = fc = highlight
 
@@ -515,24 +594,26 @@ class Synteny(object):
 
         for i, j, blockcolor, samearc in lo.edges:
             ymid_pad = ymid_offset(samearc, pad)
-            for ga, gb, h in bf.iter_pairs(i, j):
-                a, b = gg[(i, ga)], gg[(j, gb)]
-                Shade(
-                    root, a, b, ymid_pad, fc=blockcolor, lw=0, alpha=1, style=shadestyle
-                )
+            pairs = [(gg[(i, ga)], gg[(j, gb)]) for ga, gb, h in bf.iter_pairs(i, j)]
+            draw_shades(
+                root,
+                [a for a, b in pairs],
+                [b for a, b in pairs],
+                ymid_pad,
+                fc=blockcolor,
+                lw=0,
+                alpha=1,
+                style=shadestyle,
+            )
 
+            a, b, highlights = [], [], []
             for ga, gb, h in bf.iter_pairs(i, j, highlight=True):
-                a, b = gg[(i, ga)], gg[(j, gb)]
-                Shade(
-                    root,
-                    a,
-                    b,
-                    ymid_pad,
-                    alpha=1,
-                    highlight=h,
-                    zorder=2,
-                    style=shadestyle,
-                )
+                a.append(gg[(i, ga)])
+                b.append(gg[(j, gb)])
+                highlights.append(h)
+            draw_shades(
+                root, a, b, ymid_pad, highlights=highlights, alpha=1, style=shadestyle
+            )
 
         if scalebar:
             logger.info("Build scalebar (scale=%.3f)", scale)
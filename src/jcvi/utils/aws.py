@@ -5,20 +5,22 @@
 AWS-related methods.
 """
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from configparser import NoOptionError, NoSectionError
 from datetime import datetime
 import fnmatch
+from functools import lru_cache
 import getpass
+import hashlib
+import io
 import json
-from multiprocessing import Pool
 import os
 import os.path as op
 import sys
+import threading
 import time
 
-import boto3
-from botocore.exceptions import ClientError, ParamValidationError
-
 from ..apps.base import (
     ActionDispatcher,
     OptionParser,
@@ -32,6 +34,12 @@ from ..formats.base import BaseFile, SetFile, timestamp
 from .console import console
 
 AWS_CREDS_PATH = "%s/.aws/credentials" % (op.expanduser("~"),)
+S3_THREADS = int(os.environ.get("JCVI_S3_THREADS", 8))
+S3_PART_SIZE = int(os.environ.get("JCVI_S3_PART_SIZE", 8 * 1024 * 1024))
+S3_MIN_PART_SIZE = 5 * 1024 * 1024
+S3_CACHE_ENV = "JCVI_S3_CACHE"
+S3_CACHE_SIZE_ENV = "JCVI_S3_CACHE_SIZE"
+S3_CACHE_SIZE = 10 * 1024**3
 
 
 class InstanceSkeleton(BaseFile):
@@ -144,6 +152,8 @@ def start(args):
 
     Launch ec2 instance through command line.
     """
+    import boto3
+
     p = OptionParser(start.__doc__)
     p.add_argument(
         "--ondemand",
@@ -257,6 +267,8 @@ def stop(args):
 
     Stop EC2 instance.
     """
+    import boto3
+
     p = OptionParser(stop.__doc__)
     p.add_argument("--profile", default="mvrad-datasci-role", help="Profile name")
     opts, args = p.parse_args(args)
@@ -353,7 +365,7 @@ def rm(args):
 def worker(work):
     c, target, force = work
     if force or not op.exists(target):
-        pull_from_s3(c, target)
+        download_s3(c, target, threads=1)
 
 
 def cp(args):
@@ -393,10 +405,8 @@ def cp(args):
                 tc = op.basename(c)
         tasks.append((c, tc, force))
 
-    worker_pool = Pool(cpus)
-    worker_pool.map(worker, tasks)
-    worker_pool.close()
-    worker_pool.join()
+    with ThreadPoolExecutor(cpus) as executor:
+        list(executor.map(worker, tasks))
 
 
 def ls(args):
@@ -452,6 +462,344 @@ def pull_from_s3(s3_store, file_name=None, overwrite=True):
     return op.abspath(file_name)
 
 
+@lru_cache(maxsize=None)
+def get_s3_client(max_pool_connections=None):
+    """
+    Shared S3 client, whose connection pool is sized for the reader and writer
+    threads. boto3 clients are thread-safe.
+    """
+    import boto3
+    from botocore.config import Config
+
+    config = Config(
+        max_pool_connections=max_pool_connections or max(S3_THREADS * 2, 10),
+        retries={"max_attempts": 10, "mode": "adaptive"},
+    )
+    return boto3.client("s3", config=config)
+
+
+def parse_s3(address):
+    """
+    Split s3://bucket/key into (bucket, key).
+    """
+    address = s3ify(address)
+    bucket, _, key = address[len("s3://") :].partition("/")
+    return bucket, key
+
+
+class S3Cache(object):
+    """
+    Local content-addressed cache of S3 object ranges, keyed by the object
+    ETag and the byte range, so the same content is shared across names. The
+    least recently used files are evicted once the cache grows past
+    `max_size` bytes. The root and the size default to $JCVI_S3_CACHE and
+    $JCVI_S3_CACHE_SIZE.
+    """
+
+    def __init__(self, root=None, max_size=None):
+        self.root = root or os.environ.get(S3_CACHE_ENV)
+        if not self.root:
+            raise ValueError("No S3 cache directory, set ${0}".format(S3_CACHE_ENV))
+        self.max_size = max_size or int(
+            os.environ.get(S3_CACHE_SIZE_ENV, S3_CACHE_SIZE)
+        )
+        self._size = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def digest(etag, start, end):
+        return hashlib.sha1("{0}:{1}-{2}".format(etag, start, end).encode()).hexdigest()
+
+    def path(self, digest):
+        return op.join(self.root, digest[:2], digest)
+
+    def get(self, digest):
+        path = self.path(digest)
+        try:
+            with open(path, "rb") as fp:
+                data = fp.read()
+        except FileNotFoundError:
+            return None
+        os.utime(path)  # mark as recently used
+        return data
+
+    def put(self, digest, data):
+        path = self.path(digest)
+        os.makedirs(op.dirname(path), exist_ok=True)
+        tmpfile = "{0}.{1}.tmp".format(path, threading.get_ident())
+        with open(tmpfile, "wb") as fw:
+            fw.write(data)
+        os.replace(tmpfile, path)
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._files())
+            else:
+                self._size += len(data)
+            if self._size > self.max_size:
+                self.evict()
+
+    def _files(self):
+        for dirpath, _, filenames in os.walk(self.root):
+            for f in filenames:
+                path = op.join(dirpath, f)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, st.st_size, st.st_mtime
+
+    def evict(self):
+        """
+        Remove least recently used files until the cache is 90% of max_size.
+        """
+        files = sorted(self._files(), key=lambda x: x[2])
+        size = sum(x[1] for x in files)
+        target = self.max_size * 0.9
+        for path, fsize, _ in files:
+            if size <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= fsize
+        logger.debug("S3 cache `%s` evicted to %d bytes", self.root, size)
+        self._size = size
+
+
+def _default_cache():
+    """
+    The S3 cache is opt-in, used only when $JCVI_S3_CACHE is set.
+    """
+    return S3Cache() if os.environ.get(S3_CACHE_ENV) else None
+
+
+class S3Reader(io.RawIOBase):
+    """
+    Seekable binary stream over an S3 object, read with ranged GETs of
+    `part_size` bytes that are fetched ahead on `threads` threads. Ranges are
+    kept in `cache`, or in an `S3Cache` under $JCVI_S3_CACHE if it is set,
+    unless `cache=False`.
+    """
+
+    def __init__(self, address, threads=None, part_size=None, cache=None):
+        super().__init__()
+        self.bucket, self.key = parse_s3(address)
+        self.client = get_s3_client()
+        head = self.client.head_object(Bucket=self.bucket, Key=self.key)
+        self.size = head["ContentLength"]
+        self.etag = head["ETag"].strip('"')
+        self.threads = threads or S3_THREADS
+        self.part_size = part_size or S3_PART_SIZE
+        self.cache = _default_cache() if cache is None else (cache or None)
+        self._executor = ThreadPoolExecutor(self.threads)
+        self._pos = 0
+        self._reset()
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def _fetch(self, start):
+        end = min(start + self.part_size, self.size)
+        digest = None
+        if self.cache is not None:
+            digest = S3Cache.digest(self.etag, start, end)
+            data = self.cache.get(digest)
+            if data is not None:
+                return data
+        response = self.client.get_object(
+            Bucket=self.bucket,
+            Key=self.key,
+            Range="bytes={0}-{1}".format(start, end - 1),
+            IfMatch=self.etag,
+        )
+        data = response["Body"].read()
+        if digest is not None:
+            try:
+                self.cache.put(digest, data)
+            except OSError as e:
+                logger.debug("Cannot cache S3 range: %s", e)
+        return data
+
+    def _reset(self):
+        for _, future in getattr(self, "_pending", ()):
+            future.cancel()
+        self._pending = deque()
+        self._next_start = self._pos - self._pos % self.part_size
+        self._block = b""
+        self._block_start = self._next_start
+
+    def _fill(self):
+        while len(self._pending) < self.threads and self._next_start < self.size:
+            start = self._next_start
+            self._pending.append((start, self._executor.submit(self._fetch, start)))
+            self._next_start += self.part_size
+
+    def readinto(self, b):
+        view = memoryview(b)
+        n = 0
+        while n < len(view) and self._pos < self.size:
+            within = self._pos - self._block_start
+            if within >= len(self._block):
+                self._fill()
+                self._block_start, future = self._pending.popleft()
+                self._block = future.result()
+                self._fill()
+                continue
+            k = min(len(view) - n, len(self._block) - within)
+            view[n : n + k] = self._block[within : within + k]
+            self._pos += k
+            n += k
+        return n
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self._pos = max(offset, 0)
+        if not self._block_start <= self._pos < self._block_start + len(self._block):
+            self._reset()
+        return self._pos
+
+    def close(self):
+        if self.closed:
+            return
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        super().close()
+
+
+class S3Writer(io.RawIOBase):
+    """
+    Binary stream that uploads to S3, using a multipart upload with parts of
+    `part_size` bytes sent on `threads` threads once the data outgrows one
+    part. The object is complete only after `close()`.
+    """
+
+    def __init__(self, address, threads=None, part_size=None):
+        super().__init__()
+        self.bucket, self.key = parse_s3(address)
+        self.client = get_s3_client()
+        self.threads = threads or S3_THREADS
+        self.part_size = max(part_size or S3_PART_SIZE, S3_MIN_PART_SIZE)
+        self._executor = ThreadPoolExecutor(self.threads)
+        self._buffer = bytearray()
+        self._parts = []
+        self._upload_id = None
+        self._written = 0
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self._written
+
+    def write(self, b):
+        self._buffer.extend(b)
+        self._written += len(b)
+        while len(self._buffer) >= self.part_size:
+            self._upload_part(bytes(self._buffer[: self.part_size]))
+            del self._buffer[: self.part_size]
+        return len(b)
+
+    def _upload_part(self, data):
+        if self._upload_id is None:
+            response = self.client.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key, ServerSideEncryption="AES256"
+            )
+            self._upload_id = response["UploadId"]
+        number = len(self._parts) + 1
+        future = self._executor.submit(
+            self.client.upload_part,
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self._upload_id,
+            PartNumber=number,
+            Body=data,
+        )
+        self._parts.append((number, future))
+        # Bound the memory held by parts in flight
+        pending = [f for _, f in self._parts if not f.done()]
+        if len(pending) > self.threads * 2:
+            pending[0].result()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self._upload_id is None:
+                self.client.put_object(
+                    Bucket=self.bucket,
+                    Key=self.key,
+                    Body=bytes(self._buffer),
+                    ServerSideEncryption="AES256",
+                )
+            else:
+                if self._buffer:
+                    self._upload_part(bytes(self._buffer))
+                parts = [
+                    {"PartNumber": number, "ETag": future.result()["ETag"]}
+                    for number, future in self._parts
+                ]
+                self.client.complete_multipart_upload(
+                    Bucket=self.bucket,
+                    Key=self.key,
+                    UploadId=self._upload_id,
+                    MultipartUpload={"Parts": parts},
+                )
+        except Exception:
+            if self._upload_id is not None:
+                self.client.abort_multipart_upload(
+                    Bucket=self.bucket, Key=self.key, UploadId=self._upload_id
+                )
+            raise
+        finally:
+            self._buffer.clear()
+            self._executor.shutdown()
+            super().close()
+
+
+def open_s3(address, mode="r", threads=None, part_size=None, encoding="utf-8"):
+    """
+    Stream an S3 object without staging it locally, in text mode unless
+    `mode` has "b". Compressed objects (.gz, .bz2, .zst) are decompressed on
+    the fly.
+    """
+    from ..formats.compress import compression_type, open_compressed
+
+    if "r" in mode:
+        raw = S3Reader(address, threads=threads, part_size=part_size)
+        handle = io.BufferedReader(raw, raw.part_size)
+    else:
+        raw = S3Writer(address, threads=threads, part_size=part_size)
+        handle = io.BufferedWriter(raw, raw.part_size)
+    if compression_type(address):
+        return open_compressed(address, mode, encoding=encoding, fileobj=handle)
+    if "b" in mode:
+        return handle
+    return io.TextIOWrapper(handle, encoding=encoding)
+
+
+def download_s3(address, file_name, threads=None):
+    """
+    Download an S3 object with concurrent ranged GETs on the shared client.
+    """
+    from boto3.s3.transfer import TransferConfig
+
+    bucket, key = parse_s3(address)
+    config = TransferConfig(
+        multipart_chunksize=S3_PART_SIZE, max_concurrency=threads or S3_THREADS
+    )
+    get_s3_client().download_file(bucket, key, file_name, Config=config)
+    return op.abspath(file_name)
+
+
 def sync_from_s3(s3_store, target_dir=None):
     s3_store = s3_store.rstrip("/")
     s3_store = s3ify(s3_store)
@@ -705,6 +1053,9 @@ def validate(args, config):
 
 
 def get_credentials(profile, args, config):
+    import boto3
+    from botocore.exceptions import ClientError, ParamValidationError
+
     mfa_token = console.input(
         "Enter AWS MFA code for device [%s] "
         "(renewing for %s seconds): " % (args.device, args.duration)
@@ -0,0 +1,177 @@
+"""
+Named timers (spans) for the stages of an action, and the profiler behind the
+`--profile_report` option of every action.
+
+Wrap a stage in a span, and count the items it processes:
+
+>>> with span("blast.parse") as stage:
+...     for row in fp:
+...         stage.add()
+
+Spans nest, and their timings are aggregated by path. Spans that take longer
+than `SPAN_LOG_SECONDS` are logged, so slow stages show up in the logs without
+profiling.
+"""
+
+from collections import defaultdict
+from contextlib import contextmanager
+import json
+import sys
+from time import perf_counter
+from typing import Callable, Dict, List, Optional, Tuple
+
+from ..apps.base import logger
+
+SPAN_LOG_SECONDS = 1.0
+
+# Calls, seconds and items of each span, by path
+SPAN_STATS: Dict[Tuple[str, ...], List[float]] = defaultdict(lambda: [0, 0.0, 0])
+_stack: List["Span"] = []
+
+
+class Span(object):
+    __slots__ = ("name", "path", "items")
+
+    def __init__(self, name: str, path: Tuple[str, ...]):
+        self.name = name
+        self.path = path
+        self.items = 0
+
+    def add(self, n: int = 1):
+        self.items += n
+
+
+@contextmanager
+def span(name: str):
+    """
+    Time the enclosed block under `name`, nested in the enclosing span.
+    """
+    path = (_stack[-1].path if _stack else ()) + (name,)
+    s = Span(name, path)
+    _stack.append(s)
+    start = perf_counter()
+    try:
+        yield s
+    finally:
+        elapsed = perf_counter() - start
+        _stack.pop()
+        stats = SPAN_STATS[path]
+        stats[0] += 1
+        stats[1] += elapsed
+        stats[2] += s.items
+        if elapsed >= SPAN_LOG_SECONDS:
+            if s.items:
+                logger.debug(
+                    "Span `%s` took %.2fs (%d items, %.0f/s)",
+                    name,
+                    elapsed,
+                    s.items,
+                    s.items / elapsed,
+                )
+            else:
+                logger.debug("Span `%s` took %.2fs", name, elapsed)
+
+
+def span_report() -> List[dict]:
+    """
+    Aggregated spans, with the self time that is not in any child span.
+    """
+    child_seconds = defaultdict(float)
+    for path, (_, seconds, _) in SPAN_STATS.items():
+        if len(path) > 1:
+            child_seconds[path[:-1]] += seconds
+    return [
+        {
+            "path": "/".join(path),
+            "calls": calls,
+            "seconds": round(seconds, 6),
+            "self_seconds": round(max(seconds - child_seconds[path], 0), 6),
+            "items": items,
+        }
+        for path, (calls, seconds, items) in sorted(SPAN_STATS.items())
+    ]
+
+
+def peak_rss() -> Dict[str, float]:
+    """
+    Peak resident memory in MB, of this process and of its waited children.
+    """
+    try:
+        import resource
+    except ImportError:  # Windows
+        return {}
+
+    scale = 1 if sys.platform == "darwin" else 1024  # ru_maxrss is in KB on Linux
+    usage = {
+        "self": resource.getrusage(resource.RUSAGE_SELF),
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN),
+    }
+    return {k: round(v.ru_maxrss * scale / 2**20, 1) for k, v in usage.items()}
+
+
+def top_functions(profiler, n: int = 30) -> List[dict]:
+    """
+    The functions with the highest cumulative time in a cProfile.Profile.
+    """
+    import pstats
+
+    stats = pstats.Stats(profiler).stats
+    rows = sorted(stats.items(), key=lambda x: -x[1][3])[:n]
+    return [
+        {
+            "function": "{0}:{1}({2})".format(*key),
+            "calls": nc,
+            "tottime": round(tt, 6),
+            "cumtime": round(ct, 6),
+        }
+        for key, (_, nc, tt, ct, _) in rows
+    ]
+
+
+def write_report(
+    report: str, name: str, argv: List[str], elapsed: float, profiler=None
+):
+    """
+    Write the JSON report, the spans as folded stacks for flamegraph tools
+    (`report.folded`, self time in ms) and the cProfile stats (`report.prof`).
+    """
+    spans = span_report()
+    data = {
+        "action": name,
+        "argv": argv,
+        "seconds": round(elapsed, 6),
+        "peak_rss_mb": peak_rss(),
+        "spans": spans,
+    }
+    prefix = report[: -len(".json")] if report.endswith(".json") else report
+    if profiler is not None:
+        profiler.dump_stats(prefix + ".prof")
+        data["top_functions"] = top_functions(profiler)
+    with open(report, "w", encoding="utf-8") as fw:
+        json.dump(data, fw, indent=2)
+    with open(prefix + ".folded", "w", encoding="utf-8") as fw:
+        for s in spans:
+            ms = int(round(s["self_seconds"] * 1000))
+            if ms:
+                print("{0} {1}".format(s["path"].replace("/", ";"), ms), file=fw)
+    logger.info("Profile of `%s` written to `%s`", name, report)
+
+
+def run_profiled(
+    func: Callable, args: List[str], report: str, name: Optional[str] = None
+):
+    """
+    Run the action func(args) under cProfile, in a top-level span, and write
+    the report even if the action fails or exits.
+    """
+    import cProfile
+
+    name = name or func.__name__
+    SPAN_STATS.clear()
+    profiler = cProfile.Profile()
+    start = perf_counter()
+    try:
+        with span(name):
+            return profiler.runcall(func, args)
+    finally:
+        write_report(report, name, args, perf_counter() - start, profiler)
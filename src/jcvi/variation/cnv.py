@@ -13,12 +13,10 @@ from multiprocessing import Pool
 import os.path as op
 from random import choice
 import sys
+from typing import TYPE_CHECKING
 
 import numpy as np
 import numpy.ma as ma
-import pandas as pd
-from pybedtools import BedTool, cleanup, set_tempdir
-import pysam
 
 from ..algorithms.formula import get_kmeans
 from ..apps.base import (
@@ -28,12 +26,16 @@ from ..apps.base import (
     logger,
     mkdir,
     popen,
-    sh,
 )
 from ..apps.grid import MakeManager
+from ..formats.base import must_open
+from ..formats.sam import contig_depth, iter_shard_depth
 from ..utils.aws import glob_s3, push_to_s3, sync_from_s3
 from ..utils.cbook import percentage
 
+if TYPE_CHECKING:
+    import pandas as pd
+
 autosomes = [f"chr{x}" for x in range(1, 23)]
 sexsomes = ["chrX", "chrY"]
 allsomes = autosomes + sexsomes
@@ -73,6 +75,130 @@ class CopyNumberSegment(object):
         )
 
 
+class LogSpaceHMM(object):
+    """
+    Gaussian HMM over copy number states that share a uniform transition
+    model: stay with probability `1 - (n - 1) * mu`, jump to any other state
+    with probability `mu`. Decoding runs in log space on NumPy arrays, over
+    several samples at once (rows of a stacked matrix); missing (NaN) bins are
+    skipped, as if they were removed from the sequence.
+    """
+
+    def __init__(self, means, mu, sigma):
+        n = len(means)
+        self.n = n
+        self.means = np.asarray(means, dtype=float)
+        self.logstart = np.full(n, -np.log(n))
+        self.logmu = np.log(mu)
+        self.logstay = np.log(1 - (n - 1) * mu)
+        assert self.logstay >= self.logmu, "mu too large for {} states".format(n)
+        # log(stay - mu), used when summing over previous states
+        self.logdiff = np.log(1 - n * mu) if n * mu < 1 else -np.inf
+        # Emission table constants by copy number state (sigma is the variance)
+        self.lognorm = -0.5 * np.log(2 * np.pi * sigma)
+        self.invvar = 0.5 / sigma
+
+    def log_emission(self, X):
+        """
+        Log-likelihood of observations X (any shape) under each state, with
+        the states on a new last axis; NaN observations get 0.
+        """
+        X = np.nan_to_num(np.asarray(X, dtype=float))[..., None]
+        return self.lognorm - (X - self.means) ** 2 * self.invvar
+
+    def chunks(self, S, T):
+        """
+        Split the T bins in chunks so that the emissions of a chunk of all S
+        samples stay within ~32 MB.
+        """
+        size = max(1, (1 << 22) // (S * self.n))
+        return [(i, min(i + size, T)) for i in range(0, T, size)]
+
+    def viterbi(self, X):
+        """
+        Most likely state path for each row of X. Returns int array of the
+        same shape, with -1 at missing bins.
+        """
+        X = np.atleast_2d(X)
+        S, T = X.shape
+        mask = ~np.isfinite(X)
+        delta = np.tile(self.logstart, (S, 1))
+        started = np.zeros(S, dtype=bool)
+        best = np.zeros((T, S), dtype=np.int64)
+        # The only choice at each step is stay (True) or jump from `best`
+        stay = np.zeros((T, S, (self.n + 7) // 8), dtype=np.uint8)
+        rows = np.arange(S)
+        for a, b in self.chunks(S, T):
+            logB = self.log_emission(X[:, a:b])
+            for t in range(a, b):
+                m = mask[:, t]
+                ibest = delta.argmax(axis=1)
+                vstay = delta + self.logstay
+                vjump = (delta[rows, ibest] + self.logmu)[:, None]
+                st = (vstay >= vjump) | m[:, None]
+                trans = np.where(
+                    started[:, None], np.maximum(vstay, vjump), self.logstart
+                )
+                delta = np.where(m[:, None], delta, trans + logB[:, t - a])
+                best[t] = ibest
+                stay[t] = np.packbits(st, axis=1)
+                started |= ~m
+
+        Z = np.empty((S, T), dtype=np.int64)
+        z = delta.argmax(axis=1)
+        Z[:, -1] = z
+        for t in range(T - 1, 0, -1):
+            st = np.unpackbits(stay[t], axis=1, count=self.n)[rows, z]
+            z = np.where(st, z, best[t])
+            Z[:, t - 1] = z
+        Z[mask] = -1
+        return Z
+
+    def transition_sum(self, logp):
+        """
+        log(sum_i exp(logp_i + logA_ij)) for all j, using A = mu + (stay - mu) I.
+        """
+        total = np.logaddexp.reduce(logp, axis=1)[:, None] + self.logmu
+        return np.logaddexp(total, logp + self.logdiff)
+
+    def forward_backward(self, X):
+        """
+        Posterior state probabilities for each row of X. Returns the log-
+        likelihood per row and the posteriors in an array of shape (S, T, n),
+        with NaN at missing bins.
+        """
+        X = np.atleast_2d(X)
+        S, T = X.shape
+        mask = ~np.isfinite(X)
+        n = self.n
+        alpha = np.empty((T, S, n))
+        a_t = np.tile(self.logstart, (S, 1))
+        started = np.zeros(S, dtype=bool)
+        for a, b in self.chunks(S, T):
+            logB = self.log_emission(X[:, a:b])
+            for t in range(a, b):
+                m = mask[:, t][:, None]
+                trans = np.where(
+                    started[:, None], self.transition_sum(a_t), self.logstart
+                )
+                a_t = np.where(m, a_t, trans + logB[:, t - a])
+                alpha[t] = a_t
+                started |= ~mask[:, t]
+        logprob = np.logaddexp.reduce(a_t, axis=1)
+
+        post = np.empty((S, T, n))
+        b_t = np.zeros((S, n))
+        for a, b in self.chunks(S, T)[::-1]:
+            logB = self.log_emission(X[:, a:b])
+            for t in range(b - 1, a - 1, -1):
+                post[:, t] = alpha[t] + b_t - logprob[:, None]
+                m = mask[:, t][:, None]
+                b_t = np.where(m, b_t, self.transition_sum(logB[:, t - a] + b_t))
+        post = np.exp(post)
+        post[mask] = np.nan
+        return logprob, post
+
+
 class CopyNumberHMM(object):
     def __init__(
         self, workdir, betadir="beta", mu=0.003, sigma=10, step=0.1, threshold=0.2
@@ -88,15 +214,39 @@ class CopyNumberHMM(object):
         self.threshold = threshold
 
     def run(self, samplekey, chrs=allsomes):
+        return self.run_batch([samplekey], chrs=chrs)[samplekey]
+
+    def run_batch(self, samplekeys, chrs=allsomes):
+        """
+        Segment several samples, one chromosome at a time with all samples
+        stacked in the same matrix. Returns events by sample.
+        """
         if isinstance(chrs, str):
             chrs = [chrs]
-        allevents = []
+        allevents = dict((x, []) for x in samplekeys)
         for chr in chrs:
-            X, Z, clen, events = self.run_one(samplekey, chr)
-            allevents.extend(events)
+            Xs = [self.load(x, chr) for x in samplekeys]
+            tlen = max(len(X) for X in Xs)
+            stacked = np.full((len(Xs), tlen), np.nan)
+            for X, row in zip(Xs, stacked):
+                row[: len(X)] = X
+            Zs = self.predict(stacked)
+            for samplekey, X, Z in zip(samplekeys, Xs, Zs):
+                events = self.call_events(chr, X, Z[: len(X)])
+                allevents[samplekey].extend(events)
         return allevents
 
     def run_one(self, samplekey, chr):
+        X = self.load(samplekey, chr)
+        Z = self.predict(X)
+        events = self.call_events(chr, X, Z)
+        return X, Z, X.shape[0], events
+
+    def load(self, samplekey, chr):
+        """
+        Copy numbers normalized by the baseline, with NaN at bins where the
+        baseline is too variable.
+        """
         cov = np.fromfile(
             "{}/{}-cn/{}.{}.cn".format(self.workdir, samplekey, samplekey, chr)
         )
@@ -116,9 +266,9 @@ class CopyNumberHMM(object):
         normalized = cov / beta
         fixed = normalized.copy()
         fixed[np.where(std > self.threshold)] = np.nan
-        X = fixed
-        Z = self.predict(X)
+        return fixed
 
+    def call_events(self, chr, fixed, Z):
         med_cn = np.median(fixed[np.isfinite(fixed)])
         print(chr, med_cn)
 
@@ -138,7 +288,7 @@ class CopyNumberHMM(object):
         for mean_cn, rr, segment in events:
             print(segment)
 
-        return X, Z, clen, events
+        return events
 
     def tag(self, chr, mean_cn, rr, med_cn, realbins, base=2):
         around_0 = around_value(mean_cn, 0)
@@ -180,40 +330,20 @@ class CopyNumberHMM(object):
         return segment
 
     def initialize(self, mu, sigma, step):
-        from hmmlearn import hmm
-
-        # Initial population probability
+        # Uniform start, the means of the components are the copy numbers;
+        # instead of fitting it from the data, we directly set the estimated
+        # parameters
         n = int(10 / step)
-        startprob = 1.0 / n * np.ones(n)
-        transmat = mu * np.ones((n, n))
-        np.fill_diagonal(transmat, 1 - (n - 1) * mu)
-
-        # The means of each component
         means = np.arange(0, step * n, step)
-        means.resize((n, 1, 1))
-        # The covariance of each component
-        covars = sigma * np.ones((n, 1, 1))
-
-        # Build an HMM instance and set parameters
-        model = hmm.GaussianHMM(n_components=n, covariance_type="full")
-
-        # Instead of fitting it from the data, we directly set the estimated
-        # parameters, the means and covariance of the components
-        model.startprob_ = startprob
-        model.transmat_ = transmat
-        model.means_ = means
-        model.covars_ = covars
-        return model
+        return LogSpaceHMM(means, mu=mu, sigma=sigma)
 
     def predict(self, X):
-        # Handle missing values
-        X = ma.masked_invalid(X)
-        mask = X.mask
-        dX = ma.compressed(X).reshape(-1, 1)
-        dZ = self.model.predict(dX)
-        Z = np.array([np.nan for _ in range(X.shape[0])])
-        Z[~mask] = dZ
-        Z = ma.masked_invalid(Z)
+        """
+        Copy number path of X, masked at missing values. X can be a single
+        sample or a matrix of stacked samples.
+        """
+        Z = self.model.viterbi(X).reshape(np.shape(X))
+        Z = ma.masked_less(Z, 0)
 
         return Z * self.step
 
@@ -396,13 +526,21 @@ def gcdepth(args):
         -bed $1.regions.bed.gz \\
         | pigz -c > $1.regions.gc.bed.gz
     ```
+
+    Alternatively, with --sampledir the windows are computed directly from the
+    .cib files of the sample and the GC arrays in --gcdir (see `cib` and `cn`).
     """
     import hashlib
 
+    import pandas as pd
+
     from jcvi.algorithms.formula import MAD_interval
     from jcvi.graphics.base import latex, plt, savefig, set2
 
     p = OptionParser(gcdepth.__doc__)
+    p.add_argument("--sampledir", help="Read depth from .cib files in this folder")
+    p.add_argument("--gcdir", default="gc", help="Directory containing the GC arrays")
+    p.add_argument("--binsize", default=1000, type=int, help="Window size")
     opts, args = p.parse_args(args)
 
     if len(args) != 2:
@@ -410,24 +548,32 @@ def gcdepth(args):
 
     sample_name, tag = args
     # The tag is used to add to title, also provide a random (hashed) color
-    coloridx = int(hashlib.sha256(tag).hexdigest(), 16) % len(set2)
+    coloridx = int(hashlib.sha256(tag.encode()).hexdigest(), 16) % len(set2)
     color = set2[coloridx]
 
-    # mosdepth outputs a table that we can use to plot relationship
-    gcbedgz = sample_name + ".regions.gc.bed.gz"
-    df = pd.read_csv(gcbedgz, delimiter="\t")
-    mf = df.loc[:, ("4_usercol", "6_pct_gc")]
-    mf.columns = ["depth", "gc"]
+    if opts.sampledir:
+        gcs, depths = [], []
+        for seqid, gc, cib in iter_gc_depth(
+            opts.sampledir, sample_name, gcdir=opts.gcdir, n=opts.binsize
+        ):
+            nitems = min(gc.shape[0], cib.shape[0])
+            gcs.append(gc[:nitems] / 100.0)
+            depths.append(cib[:nitems])
+        mf = pd.DataFrame({"depth": np.concatenate(depths), "gc": np.concatenate(gcs)})
+    else:
+        # mosdepth outputs a table that we can use to plot relationship
+        gcbedgz = sample_name + ".regions.gc.bed.gz"
+        df = pd.read_csv(gcbedgz, delimiter="\t")
+        mf = df.loc[:, ("4_usercol", "6_pct_gc")]
+        mf.columns = ["depth", "gc"]
 
     # We discard any bins that are gaps
     mf = mf[(mf["depth"] > 0.001) | (mf["gc"] > 0.001)]
 
     # Create GC bins
-    gcbins = defaultdict(list)
-    for i, row in mf.iterrows():
-        gcp = int(round(row["gc"] * 100))
-        gcbins[gcp].append(row["depth"])
-    gcd = sorted((k * 0.01, MAD_interval(v)) for (k, v) in gcbins.items())
+    gcp = np.rint(mf["gc"].to_numpy() * 100).astype(int)
+    gcbins = mf["depth"].groupby(gcp)
+    gcd = sorted((k * 0.01, MAD_interval(v.to_numpy())) for (k, v) in gcbins)
     gcd_x, gcd_y = zip(*gcd)
     m, lo, hi = zip(*gcd_y)
 
@@ -473,6 +619,8 @@ def exonunion(args):
     $ zcat gencode.v26.annotation.gtf.gz |  awk 'OFS="\t" {if ($3=="exon")
     {print $1,$4-1,$5,$10,$12,$14,$16,$7}}' | tr -d '";'
     """
+    from pybedtools import BedTool
+
     p = OptionParser(exonunion.__doc__)
     opts, args = p.parse_args(args)
 
@@ -531,6 +679,7 @@ def parse_segments(vcffile):
     from io import StringIO
 
     from cyvcf2 import VCF
+    from pybedtools import BedTool
 
     output = StringIO()
     for v in VCF(vcffile):
@@ -578,6 +727,8 @@ def gcn(args):
 
     Compile gene copy njumber based on CANVAS results.
     """
+    from pybedtools import set_tempdir
+
     p = OptionParser(gcn.__doc__)
     p.set_cpus()
     p.set_tmpdir(tmpdir="tmp")
@@ -602,6 +753,8 @@ def gcn(args):
 
 def vcf_to_df_worker(arg):
     """Convert CANVAS vcf to a dict, single thread"""
+    from pybedtools import BedTool, cleanup
+
     canvasvcf, exonbed, i = arg
     logger.debug("Working on job {}: {}".format(i, canvasvcf))
     samplekey = op.basename(canvasvcf).split(".")[0].rsplit("_", 1)[0]
@@ -639,6 +792,8 @@ def vcf_to_df_worker(arg):
 
 def vcf_to_df(canvasvcfs, exonbed, cpus):
     """Compile a number of vcf files into tsv file for easy manipulation"""
+    import pandas as pd
+
     df = pd.DataFrame()
     p = Pool(processes=cpus)
     results = []
@@ -673,6 +828,8 @@ def coverage(args):
 
     The plot is a simple line plot using matplotlib.
     """
+    import pandas as pd
+
     from jcvi.graphics.base import savefig
 
     p = OptionParser(coverage.__doc__)
@@ -796,16 +953,17 @@ def compare(args):
 
 def bam_to_cib(arg):
     bamfile, seq, samplekey = arg
-    bam = pysam.AlignmentFile(bamfile, "rb")
     name, length = seq["SN"], seq["LN"]
     logger.debug("Computing depth for {} (length={})".format(name, length))
-    pileup = bam.pileup(name)
-    a = np.ones(length, dtype=np.int8) * -128
-    for x in pileup:
-        a[x.reference_pos] = min(x.nsegments, 255) - 128
+    depth = contig_depth(bamfile, name, length)
+    write_cib(depth, samplekey, name)
+
 
+def write_cib(depth, samplekey, name, mode="wb"):
+    a = (np.minimum(depth, 255) - 128).astype(np.int8)
     cibfile = op.join(samplekey, "{}.{}.cib".format(samplekey, name))
-    a.tofile(cibfile)
+    with open(cibfile, mode) as fw:
+        a.tofile(fw)
     logger.debug("Depth written to `{}`".format(cibfile))
 
 
@@ -815,6 +973,8 @@ def cib(args):
 
     Convert BAM to CIB (a binary storage of int8 per base).
     """
+    import pysam
+
     p = OptionParser(cib.__doc__)
     p.add_argument("--prefix", help="Report seqids with this prefix only")
     p.set_cpus()
@@ -826,20 +986,17 @@ def cib(args):
     bamfile, samplekey = args
     mkdir(samplekey)
     bam = pysam.AlignmentFile(bamfile, "rb")
-    refs = [x for x in bam.header["SQ"]]
+    refs = [x["SN"] for x in bam.header["SQ"]]
     prefix = opts.prefix
     if prefix:
-        refs = [x for x in refs if x["SN"].startswith(prefix)]
+        refs = [x for x in refs if x.startswith(prefix)]
 
-    task_args = []
-    for r in refs:
-        task_args.append((bamfile, r, samplekey))
-    cpus = min(opts.cpus, len(task_args))
+    cpus = opts.cpus
     logger.debug("Use {} cpus".format(cpus))
-
-    p = Pool(processes=cpus)
-    for _ in p.imap(bam_to_cib, task_args):
-        continue
+    # Shards come in order, each contig is written a shard at a time
+    for shard, depth in iter_shard_depth(bamfile, cpus=cpus, contigs=refs):
+        mode = "ab" if shard.start else "wb"
+        write_cib(depth, samplekey, shard.contig, mode=mode)
 
 
 def batchcn(args):
@@ -882,12 +1039,13 @@ def batchcn(args):
 
 def hmm(args):
     """
-    %prog hmm workdir sample_key
+    %prog hmm workdir sample_key [sample_key ...]
 
     Run CNV segmentation caller. The workdir must contain a subfolder called
     `sample_key-cn` that contains CN for each chromosome. A `beta` directory
     that contains scaler for each bin must also be present in the current
-    directory.
+    directory. Multiple samples are segmented together, in batches of
+    --batchsize samples.
     """
     p = OptionParser(hmm.__doc__)
     p.add_argument("--mu", default=0.003, type=float, help="Transition probability")
@@ -903,30 +1061,38 @@ def hmm(args):
         type=float,
         help="Standard deviation must be < this in the baseline population",
     )
+    p.add_argument(
+        "--batchsize", default=32, type=int, help="Number of samples per batch"
+    )
     opts, args = p.parse_args(args)
 
-    if len(args) != 2:
+    if len(args) < 2:
         sys.exit(not p.print_help())
 
-    workdir, sample_key = args
+    workdir, sample_keys = args[0], args[1:]
     model = CopyNumberHMM(
         workdir=workdir, mu=opts.mu, sigma=opts.sigma, threshold=opts.threshold
     )
-    events = model.run(sample_key)
     params = ".mu-{}.sigma-{}.threshold-{}".format(opts.mu, opts.sigma, opts.threshold)
-    hmmfile = op.join(workdir, sample_key + params + ".seg")
-    fw = open(hmmfile, "w")
-    nevents = 0
-    for mean_cn, rr, event in events:
-        if event is None:
-            continue
-        print(" ".join((event.bedline, sample_key)), file=fw)
-        nevents += 1
-    fw.close()
-    logger.debug(
-        "A total of {} aberrant events written to `{}`".format(nevents, hmmfile)
-    )
-    return hmmfile
+    hmmfiles = []
+    for i in range(0, len(sample_keys), opts.batchsize):
+        batch = sample_keys[i : i + opts.batchsize]
+        allevents = model.run_batch(batch)
+        for sample_key in batch:
+            hmmfile = op.join(workdir, sample_key + params + ".seg")
+            fw = open(hmmfile, "w")
+            nevents = 0
+            for mean_cn, rr, event in allevents[sample_key]:
+                if event is None:
+                    continue
+                print(" ".join((event.bedline, sample_key)), file=fw)
+                nevents += 1
+            fw.close()
+            logger.debug(
+                "A total of {} aberrant events written to `{}`".format(nevents, hmmfile)
+            )
+            hmmfiles.append(hmmfile)
+    return hmmfiles[0] if len(hmmfiles) == 1 else hmmfiles
 
 
 def batchccn(args):
@@ -935,6 +1101,8 @@ def batchccn(args):
 
     Run CCN script in batch. Write makefile.
     """
+    import pandas as pd
+
     p = OptionParser(batchccn.__doc__)
     opts, args = p.parse_args(args)
 
@@ -1025,47 +1193,179 @@ def is_matching_gz(origfile, gzfile):
     return getfilesize(origfile) == getfilesize(gzfile)
 
 
+class WindowSum(object):
+    """
+    Sums over consecutive windows of n values, for values that are fed in
+    chunks. Only complete windows are reported.
+    """
+
+    def __init__(self, n):
+        self.n = n
+        self.carry = np.zeros(0, dtype=np.int64)
+        self.sums = []
+
+    def add(self, a):
+        n = self.n
+        a = np.concatenate((self.carry, a))
+        k = len(a) // n * n
+        if k:
+            cs = np.cumsum(a[:k], dtype=np.int64)[n - 1 :: n]
+            self.sums.append(np.diff(cs, prepend=0))
+        self.carry = a[k:]
+
+    @property
+    def result(self):
+        if not self.sums:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate(self.sums)
+
+
+def iter_cib(cibfile, chunksize=1 << 24):
+    """
+    Yield per-base depth from a .cib file (int8 storing depth - 128) in
+    chunks. Plain files are memory-mapped, .gz files are streamed.
+    """
+    if cibfile.endswith(".gz"):
+        with must_open(cibfile, "rb") as fp:
+            while True:
+                buf = fp.read(chunksize)
+                if not buf:
+                    break
+                yield np.frombuffer(buf, dtype=np.int8).astype(np.int16) + 128
+        return
+
+    cib = np.memmap(cibfile, dtype=np.int8, mode="r")
+    for i in range(0, len(cib), chunksize):
+        yield cib[i : i + chunksize].astype(np.int16) + 128
+
+
+def iter_fasta_arrays(fastafile, blocksize=1 << 24):
+    """
+    Stream a (possibly compressed) FASTA file, yielding (seqid, bases) with
+    bases as uint8 arrays of at most about `blocksize`, newlines removed.
+    """
+    seqid = None
+    buf = b""
+    with must_open(fastafile, "rb") as fp:
+        while True:
+            block = fp.read(blocksize)
+            eof = not block
+            buf += block
+            while buf:
+                if buf[:1] == b">":
+                    nl = buf.find(b"\n")
+                    if nl < 0:
+                        break
+                    seqid = buf[1:nl].split()[0].decode()
+                    buf = buf[nl + 1 :]
+                    continue
+                h = buf.find(b"\n>")
+                if h >= 0:
+                    seq, buf = buf[: h + 1], buf[h + 1 :]
+                elif eof:
+                    seq, buf = buf, b""
+                else:
+                    # Keep the last byte, which may be the newline before ">"
+                    seq, buf = buf[:-1], buf[-1:]
+                if seqid is not None and seq:
+                    a = np.frombuffer(seq, dtype=np.uint8)
+                    yield seqid, a[(a != 10) & (a != 13)]
+                if h < 0:
+                    break
+            if eof:
+                break
+
+
 def load_cib(cibfile, n=1000):
+    """
+    Mean depth in consecutive windows of n bases from the .cib (or .cib.gz)
+    file, read in chunks.
+    """
     cibgzfile = cibfile + ".gz"
-    # When we try unzip if cib not found, or cib does not match cibgz
+    # Read the gz if cib not found, or cib does not match cibgz
     if not op.exists(cibfile) or not is_matching_gz(cibfile, cibgzfile):
         if op.exists(cibgzfile):
             cibfile = cibgzfile
-    if cibfile.endswith(".gz"):
-        sh("pigz -d -k -f {}".format(cibfile))
-        cibfile = cibfile.replace(".gz", "")
     if not op.exists(cibfile):
         return
 
-    cib = np.fromfile(cibfile, dtype=np.int8) + 128
-    rm = pd.rolling_mean(cib, n, min_periods=n / 2)
-    a = rm[n - 1 :: n].copy()
-    del cib
-    del rm
-    return a
+    ws = WindowSum(n)
+    for depth in iter_cib(cibfile):
+        ws.add(depth)
+    return ws.result / n
 
 
-def build_gc_array(fastafile="/mnt/ref/hg38.upper.fa", gcdir="gc", n=1000):
-    from pyfasta import Fasta
+GC_BASES = np.zeros(256, dtype=bool)
+GC_BASES[list(b"GCgcSs")] = True
+N_BASES = np.zeros(256, dtype=bool)
+N_BASES[list(b"Nn")] = True
 
-    f = Fasta(fastafile)
+
+def build_gc_array(fastafile="/mnt/ref/hg38.upper.fa", gcdir="gc", n=1000):
+    """
+    Write the GC% of consecutive windows of n bases for each chromosome into
+    gcdir, in one streaming pass over the FASTA.
+    """
     mkdir(gcdir)
+    windows = {}
+    for seqid, bases in iter_fasta_arrays(fastafile):
+        if seqid not in allsomes:
+            continue
+        if seqid not in windows:
+            windows[seqid] = (WindowSum(n), WindowSum(n))
+        gc, rr = windows[seqid]
+        gc.add(GC_BASES[bases])
+        rr.add(~N_BASES[bases])
+
     for seqid in allsomes:
-        if seqid not in f:
+        if seqid not in windows:
             logger.debug("Seq {} not found. Continue anyway.".format(seqid))
             continue
-        c = np.array(f[seqid])
-        gc = (c == "G") | (c == "C")  # If base is GC
-        rr = ~(c == "N")  # If base is real
-        mgc = pd.rolling_sum(gc, n, min_periods=n / 2)[n - 1 :: n]
-        mrr = pd.rolling_sum(rr, n, min_periods=n / 2)[n - 1 :: n]
-        gc_pct = np.rint(mgc * 100 / mrr)
+        gc, rr = (x.result for x in windows[seqid])
+        gc_pct = np.rint(np.divide(gc * 100, rr, out=np.zeros(len(gc)), where=rr > 0))
         gc_pct = np.asarray(gc_pct, dtype=np.uint8)
         arfile = op.join(gcdir, "{}.{}.gc".format(seqid, n))
         gc_pct.tofile(arfile)
         print(seqid, gc_pct, arfile, file=sys.stderr)
 
 
+def iter_gc_depth(sampledir, sample_key, gcdir="gc", n=1000):
+    """
+    Yield (seqid, gc, depth) of windows of n bases for each chromosome, from
+    the gc arrays by `build_gc_array()` and the .cib files of the sample.
+    """
+    for seqid in allsomes:
+        gcfile = op.join(gcdir, "{}.{}.gc".format(seqid, n))
+        if not op.exists(gcfile):
+            logger.error("File {} not found. Continue anyway.".format(gcfile))
+            continue
+        gc = np.fromfile(gcfile, dtype=np.uint8)
+        cibfile = op.join(sampledir, "{}.{}.cib".format(sample_key, seqid))
+        cib = load_cib(cibfile, n=n)
+        if cib is None:
+            logger.error("File {} not found. Continue anyway.".format(cibfile))
+            continue
+        print(seqid, gc.shape[0], cib.shape[0], file=sys.stderr)
+        yield seqid, gc, cib
+
+
+def gc_medians(gc, depth):
+    """
+    Median of the nonzero depth for each GC%, as an array indexed by GC%
+    (NaN where there is no data).
+    """
+    med = np.full(256, np.nan)
+    keep = depth > 0
+    gc, depth = gc[keep], depth[keep]
+    order = np.lexsort((depth, gc))
+    gc, depth = gc[order], depth[order]
+    values, starts, counts = np.unique(gc, return_index=True, return_counts=True)
+    lo = depth[starts + (counts - 1) // 2]
+    hi = depth[starts + counts // 2]
+    med[values] = (lo + hi) / 2
+    return med
+
+
 def cn(args):
     """
     %prog cn workdir 102340_NA12878 \
@@ -1128,35 +1428,20 @@ def cn(args):
         sync_from_s3("s3://hli-mv-data-science/htang/ccn/gc", target_dir=gcdir)
 
     # Build GC correction table
-    gc_bin = defaultdict(list)
-    gc_med = {}
-    coverage = []
-
-    for seqid in allsomes:
-        gcfile = op.join(gcdir, "{}.{}.gc".format(seqid, n))
-        if not op.exists(gcfile):
-            logger.error("File {} not found. Continue anyway.".format(gcfile))
-            continue
-        gc = np.fromfile(gcfile, dtype=np.uint8)
-        cibfile = op.join(sampledir, "{}.{}.cib".format(sample_key, seqid))
-        cib = load_cib(cibfile)
-        print(seqid, gc.shape[0], cib.shape[0], file=sys.stderr)
+    coverage = list(iter_gc_depth(sampledir, sample_key, gcdir=gcdir, n=n))
+    gcs, depths = [], []
+    for seqid, gc, cib in coverage:
         if seqid in autosomes:
-            for gci, k in zip(gc, cib):
-                gc_bin[gci].append(k)
-        coverage.append((seqid, gc, cib))
-
-    for gci, k in gc_bin.items():
-        nonzero_k = [x for x in k if x]
-        gc_med[gci] = med = np.median(nonzero_k) / 2
-        print(gci, len(nonzero_k), med, file=sys.stderr)
+            nitems = min(gc.shape[0], cib.shape[0])
+            gcs.append(gc[:nitems])
+            depths.append(cib[:nitems])
+    gc_med = gc_medians(np.concatenate(gcs), np.concatenate(depths)) / 2
 
     mkdir(cndir)
-    apply_fun = np.vectorize(gc_med.get)
     # Apply the GC correction over coverage
     for seqid, gc, cib in coverage:
         nitems = cib.shape[0]
-        beta = apply_fun(gc[:nitems])
+        beta = gc_med[gc[:nitems]]
         beta_cn = cib / beta
         cnfile = op.join(cndir, "{}.{}.cn".format(sample_key, seqid))
         beta_cn.tofile(cnfile)
@@ -1193,6 +1478,8 @@ def validate(args):
 
     Plot RDR/BAF/CN for validation of CNV calls in `sample.vcf.gz`.
     """
+    import pandas as pd
+
     p = OptionParser(validate.__doc__)
     p.add_argument(
         "--no-rdr-logy",
@@ -1292,7 +1579,7 @@ def validate(args):
     logger.info("Report written to `%s`", htmlfile)
 
 
-def get_segments(rfx: pd.DataFrame):
+def get_segments(rfx: "pd.DataFrame"):
     """
     Return a holoviews object for segments.
     """
@@ -1333,11 +1620,13 @@ def get_segments(rfx: pd.DataFrame):
 
 
 def get_model_and_dataframe(
-    vcffile: str, sizes: pd.DataFrame
-) -> tuple[dict, pd.DataFrame]:
+    vcffile: str, sizes: "pd.DataFrame"
+) -> tuple[dict, "pd.DataFrame"]:
     """
     Get the model and dataframe from the VCF file.
     """
+    import pandas as pd
+
     model = get_purity_and_model(vcffile)
     records = get_CNV_records(vcffile)
     rf = pd.DataFrame(x.__dict__ for x in records)
@@ -1347,12 +1636,14 @@ def get_model_and_dataframe(
     return model, rfx
 
 
-def get_hg19_chr_sizes_and_xlim() -> tuple[pd.DataFrame, tuple[int, int]]:
+def get_hg19_chr_sizes_and_xlim() -> tuple["pd.DataFrame", tuple[int, int]]:
     """
     Get chromosome sizes for hg19
     """
     from io import StringIO
 
+    import pandas as pd
+
     # hg19
     s = """
     chr	size
@@ -1432,6 +1723,8 @@ def wes_vs_wgs(args):
 
     Compare WES and WGS CNVs.
     """
+    import pandas as pd
+
     p = OptionParser(wes_vs_wgs.__doc__)
     p.add_argument(
         "--no-rdr-logy",
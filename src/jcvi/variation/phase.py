@@ -5,15 +5,17 @@
 Read-based phasing.
 """
 
+from bisect import bisect_right
+from collections import defaultdict
 import sys
 
 try:
     import vcf
 except ImportError:
     pass
-import pysam
 
 from ..apps.base import ActionDispatcher, OptionParser, logger
+from ..formats.sam import map_bam_shards, shard_bam
 
 
 class CPRA:
@@ -84,6 +86,7 @@ def prepare(args):
     """
     p = OptionParser(prepare.__doc__)
     p.add_argument("--accuracy", default=0.85, help="Sequencing per-base accuracy")
+    p.set_cpus(cpus=1)
     opts, args = p.parse_args(args)
 
     if len(args) != 2:
@@ -104,10 +107,32 @@ def prepare(args):
         "A total of %d bi-allelic SNVs imported from `%s`", len(variants), vcffile
     )
 
-    bamfile = pysam.AlignmentFile(bamfile, "rb")
+    # Group the variants by the BAM shards that contain them
+    cpus = opts.cpus
+    shards = shard_bam(bamfile, nshards=cpus * 4, contigs=set(v.chr for v in variants))
+    starts = defaultdict(list)
+    for i, shard in enumerate(shards):
+        starts[shard.contig].append((shard.start, i))
+    tasks = [([], right, wrong) for shard in shards]
+    for v in variants:
+        if v.chr not in starts:
+            continue
+        contig_starts = starts[v.chr]
+        j = bisect_right(contig_starts, (v.pos - 1, len(shards))) - 1
+        tasks[contig_starts[j][1]][0].append(v)
+
+    tasks = [x for x in tasks if x[0]]
+    for lines in map_bam_shards(prepare_worker, bamfile, tasks, cpus=cpus):
+        for line in lines:
+            print(line)
+
+
+def prepare_worker(bam, task):
+    variants, right, wrong = task
+    lines = []
     for v in variants:
         pos = v.pos - 1
-        for column in bamfile.pileup(v.chr, pos, pos + 1, truncate=True):
+        for column in bam.pileup(v.chr, pos, pos + 1, truncate=True):
             for read in column.pileups:
                 query_position = read.query_position
                 if query_position is None:
@@ -121,12 +146,13 @@ def prepare(args):
                     other_base = a
                 else:
                     continue
-                print(
+                lines.append(
                     " ".join(
                         str(x)
                         for x in (v, read_name, query_base, right, other_base, wrong)
                     )
                 )
+    return lines
 
 
 if __name__ == "__main__":
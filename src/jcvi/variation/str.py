@@ -351,6 +351,140 @@ class LobSTRvcf(dict):
         return ",".join([self.evidence.get(c, "-1,-1") for c in self.columns])
 
 
+class ChunkedMatrix(object):
+    """
+    Sample x locus matrix stored as a directory of NumPy chunks, so that the
+    cohort can grow by appending samples and be read back by locus range
+    without going through the full matrix.
+
+    The directory contains `meta.json` (dtype, shape and chunk sizes),
+    `samples` and `loci` (one id per line), and chunk `{i}.{j}.npy` holding
+    rows `i * R:(i + 1) * R` and columns `j * C:(j + 1) * C`, where `R, C =
+    chunks`.
+    """
+
+    def __init__(
+        self, path, nloci=None, dtype=np.int32, chunks=(256, 16384), loci=None
+    ):
+        self.path = path
+        self.metafile = op.join(path, "meta.json")
+        if op.exists(self.metafile):
+            with open(self.metafile) as fp:
+                self.meta = json.load(fp)
+            return
+
+        assert nloci is not None, "Need `nloci` to create store `{}`".format(path)
+        mkdir(path)
+        self.meta = {
+            "dtype": np.dtype(dtype).str,
+            "nsamples": 0,
+            "nloci": nloci,
+            "chunks": list(chunks),
+        }
+        if loci is not None:
+            assert len(loci) == nloci
+            with open(op.join(path, "loci"), "w") as fw:
+                print("\n".join(loci), file=fw)
+        self.write_meta()
+
+    def write_meta(self):
+        tmpfile = self.metafile + ".tmp"
+        with open(tmpfile, "w") as fw:
+            json.dump(self.meta, fw)
+        os.replace(tmpfile, self.metafile)
+
+    @property
+    def dtype(self):
+        return np.dtype(self.meta["dtype"])
+
+    @property
+    def shape(self):
+        return self.meta["nsamples"], self.meta["nloci"]
+
+    @property
+    def chunks(self):
+        return tuple(self.meta["chunks"])
+
+    def read_ids(self, name):
+        filename = op.join(self.path, name)
+        if not op.exists(filename):
+            return None
+        with open(filename) as fp:
+            return [x.strip() for x in fp][: self.shape[name == "loci"]]
+
+    @property
+    def samples(self):
+        return self.read_ids("samples")
+
+    @property
+    def loci(self):
+        return self.read_ids("loci")
+
+    def chunkfile(self, i, j):
+        return op.join(self.path, "{}.{}.npy".format(i, j))
+
+    def append(self, m, samples=None):
+        """
+        Append rows (samples) to the matrix. Only the last, partially filled,
+        row of chunks is rewritten.
+        """
+        m = np.atleast_2d(np.asarray(m, dtype=self.dtype))
+        nsamples, nloci = self.shape
+        assert m.shape[1] == nloci, "Expect {} loci, got {}".format(nloci, m.shape[1])
+        R, C = self.chunks
+        start, end = nsamples, nsamples + m.shape[0]
+        for i in range(start // R, ceil(end / R)):
+            lo, hi = max(start, i * R), min(end, (i + 1) * R)
+            rows = m[lo - start : hi - start]
+            for j in range(ceil(nloci / C)):
+                block = rows[:, j * C : (j + 1) * C]
+                if lo > i * R:
+                    chunk = np.load(self.chunkfile(i, j))[: lo - i * R]
+                    block = np.vstack((chunk, block))
+                np.save(self.chunkfile(i, j), block)
+
+        if samples is not None:
+            assert len(samples) == m.shape[0]
+            with open(op.join(self.path, "samples"), "a") as fw:
+                print("\n".join(samples), file=fw)
+        # Update the shape last, so that an interrupted append is ignored
+        self.meta["nsamples"] = end
+        self.write_meta()
+
+    def read(self, samples=slice(None), loci=slice(None)):
+        """
+        Read a block of the matrix, `samples` and `loci` are slices.
+        """
+        nsamples, nloci = self.shape
+        sstart, sstop, _ = samples.indices(nsamples)
+        lstart, lstop, _ = loci.indices(nloci)
+        R, C = self.chunks
+        out = np.empty((sstop - sstart, lstop - lstart), dtype=self.dtype)
+        for i in range(sstart // R, ceil(sstop / R)):
+            rs, re = max(sstart, i * R), min(sstop, (i + 1) * R)
+            for j in range(lstart // C, ceil(lstop / C)):
+                cs, ce = max(lstart, j * C), min(lstop, (j + 1) * C)
+                chunk = np.load(self.chunkfile(i, j), mmap_mode="r")
+                out[rs - sstart : re - sstart, cs - lstart : ce - lstart] = chunk[
+                    rs - i * R : re - i * R, cs - j * C : ce - j * C
+                ]
+        return out
+
+    def locus_ranges(self):
+        C = self.chunks[1]
+        nloci = self.shape[1]
+        return [(i, min(i + C, nloci)) for i in range(0, nloci, C)]
+
+    def sample_ranges(self):
+        R = self.chunks[0]
+        nsamples = self.shape[0]
+        return [(i, min(i + R, nsamples)) for i in range(0, nsamples, R)]
+
+
+def is_store(filename):
+    return op.isdir(filename) and op.exists(op.join(filename, "meta.json"))
+
+
 def main():
 
     actions = (
@@ -358,7 +492,7 @@ def main():
         ("bin", "convert tsv to binary format"),
         ("filtervcf", "filter lobSTR VCF"),
         ("compilevcf", "compile vcf results into master spreadsheet"),
-        ("mergecsv", "combine csv into binary array"),
+        ("mergecsv", "combine csv into binary array or matrix store"),
         ("meta", "compute allele frequencies and write to meta"),
         ("data", "filter data based on the meta calls"),
         ("mask", "compute P-values based on meta calls and data"),
@@ -630,16 +764,25 @@ def meta(args):
 
     af_file = "allele_freq"
     if need_update(binfile, af_file):
-        df, m, samples, loci = read_binfile(binfile, sampleids, strids)
-        nalleles = len(samples)
         fw = must_open(af_file, "w")
-        for i, locus in enumerate(loci):
-            a = m[:, i]
-            counts = alleles_to_counts(a)
-            af = counts_to_af(counts)
-            seqid = locus.split("_")[0]
-            remove = counts_filter(counts, nalleles, seqid, cutoff=cutoff)
-            print("\t".join((locus, af, remove)), file=fw)
+        if is_store(binfile):
+            store = ChunkedMatrix(binfile)
+            loci = [x.strip() for x in open(strids)]
+            nalleles = store.shape[0]
+            chunks = iter_store_counts(binfile, opts.cpus)
+        else:
+            df, m, samples, loci = read_binfile(binfile, sampleids, strids)
+            nalleles = len(samples)
+            chunks = [column_counts(m)]
+        i = 0
+        for counts_list in chunks:
+            for counts in counts_list:
+                locus = loci[i]
+                af = counts_to_af(counts)
+                seqid = locus.split("_")[0]
+                remove = counts_filter(counts, nalleles, seqid, cutoff=cutoff)
+                print("\t".join((locus, af, remove)), file=fw)
+                i += 1
         fw.close()
 
     logger.debug("Load gene intersections from `{}`".format(wobed))
@@ -671,6 +814,38 @@ def alleles_to_counts(a):
     return counts
 
 
+def column_counts(m):
+    """
+    Allele counts for each column of the matrix, same as `alleles_to_counts()`
+    on each column.
+    """
+    xb = m % 1000
+    ncols = m.shape[1]
+    cols = np.broadcast_to(np.arange(ncols, dtype=np.int64), xb.shape)
+    keep = xb != 999  # also -1 % 1000
+    keys, counts = np.unique(cols[keep] * 1000 + xb[keep], return_counts=True)
+    res = [{} for _ in range(ncols)]
+    for k, c in zip(keys.tolist(), counts.tolist()):
+        res[k // 1000][k % 1000] = c
+    return res
+
+
+def store_counts_worker(arg):
+    binfile, start, end = arg
+    return column_counts(ChunkedMatrix(binfile).read(loci=slice(start, end)))
+
+
+def iter_store_counts(binfile, cpus):
+    """
+    Allele counts of the columns of the store, as one list per locus range,
+    computed in a pool of `cpus` processes.
+    """
+    ranges = ChunkedMatrix(binfile).locus_ranges()
+    run_args = [(binfile, start, end) for start, end in ranges]
+    with Pool(processes=max(min(cpus, len(ranges)), 1)) as p:
+        yield from p.imap(store_counts_worker, run_args)
+
+
 def counts_to_af(counts):
     return "{" + ",".join("{}:{}".format(k, v) for k, v in sorted(counts.items())) + "}"
 
@@ -688,10 +863,14 @@ def bin(args):
     """
     %prog bin data.tsv
 
-    Conver tsv to binary format.
+    Conver tsv to binary format, either a chunked matrix store (data.store) or
+    a flat array (data.bin).
     """
     p = OptionParser(bin.__doc__)
     p.add_argument("--dtype", choices=("float32", "int32"), help="dtype of the matrix")
+    p.add_argument(
+        "--format", default="store", choices=("store", "bin"), help="Output format"
+    )
     opts, args = p.parse_args(args)
 
     if len(args) != 1:
@@ -706,7 +885,25 @@ def bin(args):
 
     print("dtype: {}".format(dtype), file=sys.stderr)
     fp = open(tsvfile)
-    next(fp)
+    header = next(fp)
+    if opts.format == "store":
+        loci = header.rstrip("\n").split("\t")[1:]
+        storefile = tsvfile.rsplit(".", 1)[0] + ".store"
+        store = ChunkedMatrix(storefile, nloci=len(loci), dtype=dtype, loci=loci)
+        batchsize = store.chunks[0]
+        samples, arrays = [], []
+        for row in fp:
+            sample, row = row.split("\t", 1)
+            samples.append(sample)
+            arrays.append(np.fromstring(row, sep="\t", dtype=dtype))
+            if len(arrays) == batchsize:
+                store.append(np.vstack(arrays), samples)
+                samples, arrays = [], []
+        if arrays:
+            store.append(np.vstack(arrays), samples)
+        print("Store shape: {}".format(store.shape), file=sys.stderr)
+        return
+
     arrays = []
     for i, row in enumerate(fp):
         a = np.fromstring(row, sep="\t", dtype=dtype)
@@ -743,6 +940,46 @@ def convert_to_percentile(arg):
     return i, pp
 
 
+def percentile_block(m, percentiles):
+    """
+    Vectorized `convert_to_percentile()` over the columns of the matrix, given
+    the percentile dict of each column. Alleles not in the dict get 1.
+    """
+    ncols = m.shape[1]
+    keys, values = [], []
+    for j, percentile in enumerate(percentiles):
+        for k, v in percentile.items():
+            keys.append(j * 1000 + k)
+            values.append(float(v))
+    if not keys:
+        return np.ones(m.shape, dtype=np.float32)
+    keys = np.array(keys, dtype=np.int64)
+    order = np.argsort(keys)
+    keys = keys[order]
+    values = np.array(values, dtype=np.float32)[order]
+
+    x = np.arange(ncols, dtype=np.int64) * 1000 + m
+    idx = np.searchsorted(keys, x)
+    idx[idx == len(keys)] = 0
+    found = (m >= 0) & (m < 1000) & (keys[idx] == x)
+    return np.where(found, values[idx], 1).astype(np.float32)
+
+
+def store_percentile_worker(arg):
+    """
+    Compute the mask of chunk (i, j) of the store, and save it as the same
+    chunk of the mask store.
+    """
+    binfile, maskstore, i, j, percentiles = arg
+    store = ChunkedMatrix(binfile)
+    nsamples, nloci = store.shape
+    R, C = store.chunks
+    samples = slice(i * R, min((i + 1) * R, nsamples))
+    loci = slice(j * C, min((j + 1) * C, nloci))
+    block = percentile_block(store.read(samples=samples, loci=loci), percentiles)
+    np.save(ChunkedMatrix(maskstore).chunkfile(i, j), block)
+
+
 def write_csv(csvfile, m, index, columns, sep="\t", index_label="SampleKey"):
     fw = open(csvfile, "w")
     print(sep.join([index_label] + columns), file=fw)
@@ -751,6 +988,18 @@ def write_csv(csvfile, m, index, columns, sep="\t", index_label="SampleKey"):
     fw.close()
 
 
+def write_store_csv(
+    csvfile, store, index, columns, fmt="{}", sep="\t", index_label="SampleKey"
+):
+    fw = open(csvfile, "w")
+    print(sep.join([index_label] + columns), file=fw)
+    for start, end in store.sample_ranges():
+        m = store.read(samples=slice(start, end))
+        for i, a in enumerate(m):
+            print(index[start + i] + sep + sep.join(fmt.format(x) for x in a), file=fw)
+    fw.close()
+
+
 def read_meta(metafile):
     df = pd.read_csv(metafile, sep="\t")
     final_columns = []
@@ -781,11 +1030,40 @@ def write_mask(cpus, samples, final_columns, run_args, filename="mask.tsv"):
     write_csv(filename, m, samples, final_columns)
 
 
+def write_store_mask(cpus, binfile, percentiles, maskstore, loci=None):
+    """
+    Compute the mask (P-value) matrix chunk by chunk into another store, with
+    the same chunks as the input store, so that each task holds one chunk.
+    """
+    store = ChunkedMatrix(binfile)
+    nsamples, nloci = store.shape
+    R, C = store.chunks
+    mstore = ChunkedMatrix(
+        maskstore, nloci=nloci, dtype=np.float32, chunks=(R, C), loci=loci
+    )
+    run_args = [
+        (binfile, maskstore, i, j, percentiles[start:end])
+        for i in range(len(store.sample_ranges()))
+        for j, (start, end) in enumerate(store.locus_ranges())
+    ]
+    with Pool(processes=max(min(cpus, len(run_args)), 1)) as p:
+        for _ in p.imap_unordered(store_percentile_worker, run_args):
+            pass
+    samples = store.samples
+    if samples:
+        with open(op.join(maskstore, "samples"), "w") as fw:
+            print("\n".join(samples), file=fw)
+    mstore.meta["nsamples"] = nsamples
+    mstore.write_meta()
+    return mstore
+
+
 def data(args):
     """
     %prog data data.bin samples.ids STR.ids meta.tsv
 
-    Make data.tsv based on meta.tsv.
+    Make data.tsv based on meta.tsv. If data.bin is a chunked matrix store
+    (see `bin` and `mergecsv`), the filtered data is written as a store.
     """
     p = OptionParser(data.__doc__)
     p.add_argument(
@@ -798,6 +1076,9 @@ def data(args):
 
     databin, sampleids, strids, metafile = args
     final_columns, percentiles = read_meta(metafile)
+    if is_store(databin):
+        return data_store(databin, sampleids, strids, final_columns, opts.notsv)
+
     df, m, samples, loci = read_binfile(databin, sampleids, strids)
 
     # Clean the data
@@ -828,7 +1109,7 @@ def data(args):
 
     filtered_bin = "{}.data.bin".format(pf)
     if need_update(databin, filtered_bin):
-        m = df.as_matrix()
+        m = df.to_numpy()
         m.tofile(filtered_bin)
         logger.debug("Filtered binary matrix written to `{}`".format(filtered_bin))
 
@@ -838,6 +1119,47 @@ def data(args):
         df.to_csv(filtered_tsv, sep="\t", index_label="SampleKey")
 
 
+def data_store(databin, sampleids, strids, final_columns, notsv=False):
+    """
+    Chunked version of `data`, keeping the `final_columns` of the store.
+    """
+    store = ChunkedMatrix(databin)
+    samples = store.samples or [x.strip() for x in open(sampleids)]
+    loci = [x.strip() for x in open(strids)]
+    index = dict((x, i) for i, x in enumerate(loci))
+    keep = np.array([index[x] for x in final_columns], dtype=np.int64)
+    logger.debug(
+        "Dropped {} columns; Retained {} columns".format(
+            len(loci) - len(keep), len(keep)
+        )
+    )
+
+    pf = "STRs_{}_SEARCH".format(timestamp())
+    filteredstrids = "{}.STR.ids".format(pf)
+    fw = open(filteredstrids, "w")
+    print("\n".join(final_columns), file=fw)
+    fw.close()
+
+    filtered_store = "{}.data.store".format(pf)
+    filtered = ChunkedMatrix(
+        filtered_store,
+        nloci=len(keep),
+        dtype=store.dtype,
+        chunks=store.chunks,
+        loci=final_columns,
+    )
+    for start, end in store.sample_ranges():
+        m = store.read(samples=slice(start, end))[:, keep]
+        m %= 1000  # Get the larger of the two alleles
+        m[m == 999] = -1  # Missing data
+        filtered.append(m, samples[start:end])
+    logger.debug("Filtered matrix written to `{}`".format(filtered_store))
+
+    filtered_tsv = "{}.data.tsv".format(pf)
+    if not notsv:
+        write_store_csv(filtered_tsv, filtered, samples, final_columns)
+
+
 def mask(args):
     """
     %prog mask data.bin samples.ids STR.ids meta.tsv
@@ -848,9 +1170,14 @@ def mask(args):
 
     Compute P-values based on meta and data. The `data.bin` should be the matrix
     containing filtered loci and the output mask.tsv will have the same
-    dimension.
+    dimension. If `data.bin` is a chunked matrix store, the P-values are
+    computed chunk by chunk in parallel into mask.store.
     """
     p = OptionParser(mask.__doc__)
+    p.add_argument(
+        "--notsv", default=False, action="store_true", help="Do not write mask.tsv"
+    )
+    p.set_cpus(cpus=8)
     opts, args = p.parse_args(args)
 
     if len(args) not in (2, 4):
@@ -858,29 +1185,43 @@ def mask(args):
 
     if len(args) == 4:
         databin, sampleids, strids, metafile = args
-        df, m, samples, loci = read_binfile(databin, sampleids, strids)
         mode = "STRs"
+        if is_store(databin):
+            store = ChunkedMatrix(databin)
+            samples = store.samples or [x.strip() for x in open(sampleids)]
+            loci = store.loci or [x.strip() for x in open(strids)]
+        else:
+            df, m, samples, loci = read_binfile(databin, sampleids, strids)
     elif len(args) == 2:
         databin, metafile = args
         df = pd.read_csv(databin, sep="\t", index_col=0)
-        m = df.as_matrix()
+        m = df.to_numpy()
         samples = df.index
         loci = list(df.columns)
         mode = "TREDs"
 
     pf = "{}_{}_SEARCH".format(mode, timestamp())
     final_columns, percentiles = read_meta(metafile)
+    percentiles = [percentiles[locus] for locus in loci]
+
+    if is_store(databin):
+        maskstore = pf + ".mask.store"
+        mstore = write_store_mask(opts.cpus, databin, percentiles, maskstore, loci)
+        logger.debug("Store `{}` written.".format(maskstore))
+        if not opts.notsv:
+            maskfile = pf + ".mask.tsv"
+            write_store_csv(maskfile, mstore, samples, loci, fmt="{:.6f}")
+            logger.debug("File `{}` written.".format(maskfile))
+        return
 
     maskfile = pf + ".mask.tsv"
-    run_args = []
-    for i, locus in enumerate(loci):
-        a = m[:, i]
-        percentile = percentiles[locus]
-        run_args.append((i, a, percentile))
-
     if mode == "TREDs" or need_update(databin, maskfile):
-        cpus = min(8, len(run_args))
-        write_mask(cpus, samples, final_columns, run_args, filename=maskfile)
+        pvalues = percentile_block(m, percentiles)
+        fw = open(maskfile, "w")
+        print("\t".join(["SampleKey"] + final_columns), file=fw)
+        for sample, a in zip(samples, pvalues):
+            print(sample + "\t" + "\t".join("{:.6f}".format(x) for x in a), file=fw)
+        fw.close()
         logger.debug("File `{}` written.".format(maskfile))
 
 
@@ -901,13 +1242,17 @@ def counts_filter(countsd, nalleles, seqid, cutoff=0.5):
 
 
 def read_binfile(binfile, sampleids, strids, dtype=np.int32):
-    m = np.fromfile(binfile, dtype=dtype)
     samples = [x.strip() for x in open(sampleids)]
     loci = [x.strip() for x in open(strids)]
     nsamples, nloci = len(samples), len(loci)
     print("{} x {} entries imported".format(nsamples, nloci), file=sys.stderr)
 
-    m.resize(nsamples, nloci)
+    if is_store(binfile):
+        m = ChunkedMatrix(binfile).read()
+        assert m.shape == (nsamples, nloci), "Store shape {} mismatch".format(m.shape)
+    else:
+        m = np.fromfile(binfile, dtype=dtype)
+        m.resize(nsamples, nloci)
     df = pd.DataFrame(m, index=samples, columns=loci)
     return df, m, samples, loci
 
@@ -916,17 +1261,23 @@ def mergecsv(args):
     """
     %prog mergecsv *.csv
 
-    Combine CSV into binary array.
+    Combine CSV into binary array. By default, samples are appended to the
+    chunked matrix store `data.store`, which can be extended in later runs.
     """
     p = OptionParser(mergecsv.__doc__)
+    p.add_argument(
+        "--format", default="store", choices=("store", "bin"), help="Output format"
+    )
     opts, args = p.parse_args(args)
 
     if len(args) < 1:
         sys.exit(not p.print_help())
 
     csvfiles = args
+    store = None
     arrays = []
     samplekeys = []
+    allsamplekeys = []
     for csvfile in csvfiles:
         samplekey = op.basename(csvfile).split(".")[0]
         a = np.fromfile(csvfile, sep=",", dtype=np.int32)
@@ -937,9 +1288,26 @@ def mergecsv(args):
         arrays.append(a)
         samplekeys.append(samplekey)
         print(samplekey, a, file=sys.stderr)
-    print("Merging", file=sys.stderr)
-    b = np.concatenate(arrays)
-    b.tofile("data.bin")
+        if opts.format != "store":
+            continue
+        if store is None:
+            store = ChunkedMatrix("data.store", nloci=a.shape[0])
+            allsamplekeys = store.samples or []
+        if len(arrays) == store.chunks[0]:
+            store.append(np.vstack(arrays), samplekeys)
+            allsamplekeys += samplekeys
+            arrays, samplekeys = [], []
+
+    if opts.format == "store":
+        if arrays:
+            store.append(np.vstack(arrays), samplekeys)
+            allsamplekeys += samplekeys
+        print("Store shape: {}".format(store.shape), file=sys.stderr)
+        samplekeys = allsamplekeys
+    else:
+        print("Merging", file=sys.stderr)
+        b = np.concatenate(arrays)
+        b.tofile("data.bin")
 
     fw = open("samples", "w")
     print("\n".join(samplekeys), file=fw)
@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+
+from jcvi.annotation.depth import BinFile, count, iter_columns, query
+
+
+def _genome(tmp_path):
+    fastafile = tmp_path / "genome.fasta"
+    fastafile.write_text(">ctg1\n" + "A" * 50 + "\n>ctg2\n" + "C" * 30 + "\n")
+    return str(fastafile)
+
+
+def test_count_perbase(tmp_path, capsys):
+    fastafile = _genome(tmp_path)
+    coveragefile = tmp_path / "reads.coverage"
+    rows = [f"ctg1\t{i + 1}\t{i * 10}" for i in range(50)]
+    rows += [f"ctg2\t{i + 1}\t{i}" for i in range(30)]
+    coveragefile.write_text("\n".join(rows) + "\n")
+
+    binfile = count([str(coveragefile), fastafile])
+    ar = BinFile(binfile).mmarray
+    expected = np.minimum(np.concatenate((np.arange(50) * 10, np.arange(30))), 255)
+    assert np.array_equal(ar, expected)
+    assert BinFile(binfile).offsets == {"ctg1": (0, 50), "ctg2": (50, 30)}
+
+    query([binfile, "ctg2", "11"])
+    assert capsys.readouterr().out.split() == ["ctg2", "11", "10"]
+
+
+def test_iter_columns(tmp_path):
+    coveragefile = tmp_path / "reads.coverage"
+    coveragefile.write_text("ctg1 1 5\nctg_long_name\t2\t7\nctg2\t3\t0")
+    blocks = list(iter_columns(str(coveragefile), (np.int64, np.int64), blocksize=8))
+    names = np.concatenate([x[0] for x in blocks])
+    counts = np.concatenate([x[2] for x in blocks])
+    assert len(blocks) == 3
+    assert list(names) == [b"ctg1", b"ctg_long_name", b"ctg2"]
+    assert list(counts) == [5, 7, 0]
+
+    bedgraph = tmp_path / "reads.bedgraph"
+    bedgraph.write_text(
+        'track type=bedGraph name="reads"\n'
+        "browser position ctg1:1-10\n"
+        "ctg1\t0\t10\t3\n"
+        "# comment\n"
+        "ctg2\t5\t8\t1\n"
+    )
+    for blocksize in (16, 1024):
+        blocks = list(iter_columns(str(bedgraph), (np.int64,) * 3, blocksize=blocksize))
+        names = np.concatenate([x[0] for x in blocks])
+        values = np.concatenate([x[3] for x in blocks])
+        assert list(names) == [b"ctg1", b"ctg2"]
+        assert list(values) == [3, 1]
+
+
+def test_count_bedgraph(tmp_path):
+    fastafile = _genome(tmp_path)
+    bedgraph = tmp_path / "reads.bedgraph"
+    bedgraph.write_text("ctg1\t0\t10\t3\nctg1\t10\t50\t300\nctg2\t5\t8\t1\n")
+
+    binfile = count([str(bedgraph), fastafile])
+    ar = BinFile(binfile).mmarray
+    assert list(ar[:12]) == [3] * 10 + [255] * 2
+    assert list(ar[50:60]) == [0] * 5 + [1] * 3 + [0] * 2
+
+
+def test_count_bam(tmp_path):
+    pysam = pytest.importorskip("pysam")
+    fastafile = _genome(tmp_path)
+    unsorted = str(tmp_path / "unsorted.bam")
+    header = {
+        "HD": {"VN": "1.0"},
+        "SQ": [{"SN": "ctg1", "LN": 50}, {"SN": "ctg2", "LN": 30}],
+    }
+    with pysam.AlignmentFile(unsorted, "wb", header=header) as fw:
+        for i, (tid, start) in enumerate(((0, 5), (0, 10), (1, 0))):
+            a = pysam.AlignedSegment()
+            a.query_name = f"r{i}"
+            a.query_sequence = "A" * 10
+            a.reference_id = tid
+            a.reference_start = start
+            a.mapping_quality = 60
+            a.cigarstring = "10M"
+            a.query_qualities = pysam.qualitystring_to_array("I" * 10)
+            fw.write(a)
+    bamfile = str(tmp_path / "reads.bam")
+    pysam.sort("-o", bamfile, unsorted)
+    pysam.index(bamfile)
+
+    binfile = count([bamfile, fastafile])
+    ar = BinFile(binfile).mmarray
+    assert list(ar[:21]) == [0] * 5 + [1] * 5 + [2] * 5 + [1] * 5 + [0]
+    assert list(ar[50:61]) == [1] * 10 + [0]
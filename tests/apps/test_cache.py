@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import os
+import time
+
+
+def test_build_cache(tmp_path, monkeypatch):
+    from jcvi.apps.base import need_update
+    from jcvi.apps.cache import BuildCache, get_build_cache
+
+    monkeypatch.setenv("JCVI_CACHE", str(tmp_path / "cache"))
+    infile = tmp_path / "a.txt"
+    outfile = tmp_path / "a.out"
+    a, b = str(infile), str(outfile)
+    infile.write_text("ACGT\n")
+
+    assert need_update(a, b, params=1)
+    outfile.write_text("4\n")
+    get_build_cache().commit()
+
+    # Touching the input breaks the mtime checks, but not the contents
+    time.sleep(0.01)
+    os.utime(a)
+    assert not need_update(a, b, params=1)
+
+    # Outputs are restored from the cache
+    os.remove(b)
+    assert not need_update(a, b, params=1)
+    assert outfile.read_text() == "4\n"
+
+    # New params or inputs need a new run
+    assert need_update(a, b, params=2)
+    time.sleep(0.01)
+    outfile.write_text("5\n")
+    infile.write_text("ACGTT\n")
+    assert need_update(a, b, params=1)
+
+    # Only the step that was run is recorded, and read back by a new process
+    get_build_cache().commit()
+    cache = BuildCache(str(tmp_path / "cache"))
+    assert len(cache.steps) == 2
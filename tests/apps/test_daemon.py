@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import json
+import os.path as op
+import subprocess
+import sys
+import time
+
+
+def test_daemon(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    socketfile = str(tmp_path / "jcvi.sock")
+    monkeypatch.setenv("JCVI_DAEMON_SOCKET", socketfile)
+    with open("ref.fasta", "w") as fw:
+        print(">chr1\nACGTACGTAC\n>chr2\nTTTT", file=fw)
+
+    def jcvi_daemon(*args, **kwargs):
+        return subprocess.run(
+            [sys.executable, "-m", "jcvi.apps.daemon"] + list(args),
+            capture_output=True,
+            text=True,
+            **kwargs,
+        )
+
+    # Without the daemon the action runs in the client
+    result = jcvi_daemon("run", "formats.fasta", "extract", "ref.fasta", "chr2")
+    assert result.returncode == 0 and result.stdout == ">chr2\nTTTT\n"
+
+    daemon = subprocess.Popen([sys.executable, "-m", "jcvi.apps.daemon", "start"])
+    try:
+        for _ in range(100):
+            if op.exists(socketfile):
+                break
+            time.sleep(0.1)
+        for query in ("chr1:2-5", "chr2"):
+            result = jcvi_daemon("run", "formats.fasta", "extract", "ref.fasta", query)
+            assert result.returncode == 0
+        assert result.stdout == ">chr2\nTTTT\n"
+
+        # Outfiles are relative to the client working directory
+        (tmp_path / "sub").mkdir()
+        result = jcvi_daemon(
+            "run",
+            "formats.fasta",
+            "extract",
+            "../ref.fasta",
+            "chr1:2-5",
+            "-o",
+            "out.fasta",
+            cwd="sub",
+        )
+        assert open("sub/out.fasta").read() == ">chr1:2-5\nCGTA\n"
+
+        result = jcvi_daemon("run", "formats.bed", "nosuchaction")
+        assert result.returncode == 1
+        assert "not a valid ACTION" in result.stderr
+
+        status = json.loads(jcvi_daemon("status").stdout)
+        assert status["pid"] == daemon.pid
+        assert status["requests"] == 4
+        assert status["cache"]["hits"] == 2
+    finally:
+        jcvi_daemon("stop")
+        daemon.wait(timeout=10)
+    assert not op.exists(socketfile)
+
+
+def test_default_socket(tmp_path, monkeypatch):
+    import os
+    import socket
+    import stat
+    import tempfile
+
+    import pytest
+
+    from jcvi.apps.daemon import default_socket, peer_uid, private_dir
+
+    monkeypatch.delenv("JCVI_DAEMON_SOCKET", raising=False)
+    monkeypatch.delenv("XDG_RUNTIME_DIR", raising=False)
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    socketfile = default_socket()
+    rundir = op.dirname(socketfile)
+    assert op.dirname(rundir) == str(tmp_path)
+    assert stat.S_IMODE(os.stat(rundir).st_mode) == 0o700
+
+    # A directory that others can get into is refused
+    os.chmod(rundir, 0o755)
+    with pytest.raises(PermissionError):
+        default_socket()
+    # So is a symlink, even to a private directory
+    os.chmod(rundir, 0o700)
+    os.symlink(rundir, tmp_path / "link")
+    with pytest.raises(PermissionError):
+        private_dir(str(tmp_path / "link"))
+
+    a, b = socket.socketpair(socket.AF_UNIX)
+    with a, b:
+        assert peer_uid(a) in (None, os.getuid())
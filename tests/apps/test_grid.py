@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import os
+import os.path as op
+import shutil
+import subprocess
+
+import pytest
+
+from jcvi.apps.grid import (
+    ClusterExecutor,
+    LocalExecutor,
+    MakeManager,
+    Scheduler,
+    StatusDB,
+    TaskGraph,
+    WriteJobs,
+    read_tasks,
+    stream_map,
+)
+
+
+class FakeScheduler(Scheduler):
+    """
+    Runs each array job right away, in the order of the array indices. Like
+    SGE, the index of jobs that are not arrays is `undefined`.
+    """
+
+    name = "fake"
+    index_var = "FAKE_TASK_ID"
+
+    def __init__(self):
+        self.sizes = []
+
+    def submit(self, script, name, size=1, **kwargs):
+        self.sizes.append(size)
+        for i in range(1, size + 1):
+            env = dict(os.environ, FAKE_TASK_ID=str(i) if size > 1 else "undefined")
+            subprocess.call(["sh", script], env=env)
+        return str(len(self.sizes))
+
+    def active(self, jobids):
+        return set()
+
+
+def test_task_graph():
+    graph = TaskGraph()
+    graph.add("b", "cat a.txt > b.txt", inputs="a.txt", outputs="b.txt")
+    graph.add("a", "echo a > a.txt", outputs="a.txt")
+    graph.add("c", "echo c", deps=["a", "b"])
+    assert graph.dependencies() == {"a": set(), "b": {"a"}, "c": {"a", "b"}}
+    assert graph.toposort() == ["a", "b", "c"]
+
+    graph.add("d", "echo d", deps="e")
+    with pytest.raises(ValueError, match="unknown tasks: e"):
+        graph.toposort()
+    graph.add("e", "echo e", deps="d")
+    with pytest.raises(ValueError, match="Cyclic dependencies among: d, e"):
+        graph.toposort()
+
+
+def test_local_executor(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    workdir = str(tmp_path / "work")
+    graph = TaskGraph()
+    graph.add("a", "echo a > a.txt", outputs="a.txt")
+    graph.add("b", shutil.copyfile, args=("a.txt", "b.txt"), inputs="a.txt")
+    graph.add("c", "exit 3", deps="b", retries=1)
+    graph.add("d", "echo d > d.txt", deps="c")
+    states = LocalExecutor(cpus=2, workdir=workdir).run(graph)
+    assert states == {"a": "done", "b": "done", "c": "failed", "d": "skipped"}
+    assert open("b.txt").read() == "a\n"
+    rows = {x[0]: x for x in StatusDB(op.join(workdir, "status.db")).rows()}
+    assert rows["c"][1:5] == ("failed", 2, "local", 3)
+
+    # Rerun only the tasks that are not done
+    graph["c"].cmd = "true"
+    os.remove("a.txt")
+    states = LocalExecutor(cpus=2, workdir=workdir).run(graph)
+    assert set(states.values()) == {"done"}
+    assert op.exists("d.txt") and not op.exists("a.txt")
+
+
+def test_make_manager_resume(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    workdir = str(tmp_path / "work")
+    mm = MakeManager()
+    mm.add("", "a.txt", "echo a > a.txt")
+    mm.run(executor=LocalExecutor(workdir=workdir))
+    assert open("a.txt").read() == "a\n"
+
+    # Another set of rules with the same numbers shares the status database
+    mm = MakeManager()
+    mm.add("", "b.txt", "echo b > b.txt")
+    mm.run(executor=LocalExecutor(workdir=workdir))
+    assert open("b.txt").read() == "b\n"
+
+
+def test_cluster_executor(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    graph = TaskGraph()
+    for i in range(5):
+        graph.add(f"t{i}", f"echo {i} > t{i}.txt", runtime=1)
+    graph.add("cp", shutil.copyfile, args=("t0.txt", "cp.txt"), deps="t0")
+    graph.add("bad", "exit 1", deps="t4")
+    scheduler = FakeScheduler()
+    executor = ClusterExecutor(
+        scheduler, workdir=str(tmp_path / "work"), batch_runtime=2, poll_interval=0
+    )
+    states = executor.run(graph)
+    # Tiny tasks are packed two at a time into one array job
+    assert scheduler.sizes == [3, 2]
+    assert states.pop("bad") == "failed"
+    assert set(states.values()) == {"done"}
+    assert open("cp.txt").read() == "0\n"
+
+    # A batch of one chunk is not submitted as an array
+    graph = TaskGraph()
+    graph.add("one", "echo 1 > one.txt")
+    states = executor.run(graph)
+    assert scheduler.sizes[-1] == 1
+    assert states == {"one": "done"} and open("one.txt").read() == "1\n"
+
+
+def test_read_tasks(tmp_path):
+    tasksfile = tmp_path / "tasks.txt"
+    tasksfile.write_text("echo a\necho b\necho a\n")
+    names = list(read_tasks(str(tasksfile)))
+    assert len(set(names)) == 3
+
+    # Names follow the commands, not the line numbers
+    tasksfile.write_text("echo c\necho a\necho b\n")
+    graph = read_tasks(str(tasksfile))
+    assert list(graph)[1:] == names[:2]
+    assert graph[names[1]].cmd == "echo b"
+
+
+@pytest.mark.parametrize("batch_size", [1, 4])
+def test_stream_map(tmp_path, batch_size):
+    pulled = []
+
+    def items():
+        for i in range(100):
+            pulled.append(i)
+            yield -i
+
+    results = stream_map(abs, items(), cpus=2, batch_size=batch_size, max_inflight=3)
+    assert next(results) == 0
+    # Only the batches in flight are read from the input
+    assert len(pulled) <= 3 * batch_size
+    assert list(results) == list(range(1, 100))
+
+    results = stream_map(abs, items(), cpus=3, ordered=False, batch_size=batch_size)
+    assert sorted(results) == list(range(100))
+
+    outfile = tmp_path / "out.txt"
+    WriteJobs(str, range(100), str(outfile), cpus=3, batch_size=batch_size).run()
+    assert outfile.read_text().split() == [str(x) for x in range(100)]
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+Import-time budgets of the module entry points, measured with `-X importtime`
+in a fresh interpreter. Heavy dependencies must only be imported inside the
+actions that need them.
+"""
+
+import subprocess
+import sys
+from typing import Dict
+
+import pytest
+
+# Dependencies that must not be imported by the module itself
+LAZY_DEPENDENCIES = {
+    "jcvi.apps.base": ("rich", "natsort", "http.client"),
+    "jcvi.formats.base": ("Bio.SeqIO", "rich"),
+    "jcvi.formats.bed": ("matplotlib", "seaborn"),
+    "jcvi.graphics.base": ("seaborn", "scipy.stats", "pandas"),
+    "jcvi.assembly.geneticmap": ("matplotlib", "seaborn"),
+    "jcvi.utils.aws": ("boto3", "botocore"),
+    "jcvi.variation.cnv": ("pandas", "pybedtools", "pysam", "boto3", "matplotlib"),
+}
+
+# Cumulative import time budgets in milliseconds, a few times the typical
+# figures so that only real regressions fail
+BUDGETS = {
+    "jcvi.apps.base": 300,
+    "jcvi.formats.base": 800,
+    "jcvi.formats.bed": 1200,
+    "jcvi.graphics.base": 3000,
+    "jcvi.variation.cnv": 2500,
+}
+
+
+def import_times(module: str) -> Dict[str, int]:
+    """
+    Cumulative import time (in microseconds) of every module imported by
+    `import module`, from a fresh interpreter.
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for row in proc.stderr.splitlines():
+        if not row.startswith("import time:") or "cumulative" in row:
+            continue
+        _, cumulative, name = row.split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+@pytest.mark.parametrize("module", sorted(LAZY_DEPENDENCIES))
+def test_lazy_dependencies(module):
+    times = import_times(module)
+    assert module in times
+    eager = [x for x in LAZY_DEPENDENCIES[module] if x in times]
+    assert not eager, f"{module} imports {eager} at module level"
+
+
+@pytest.mark.parametrize("module,budget", sorted(BUDGETS.items()))
+def test_import_budget(module, budget):
+    # Best of three, to smooth over a cold file system cache
+    elapsed = min(import_times(module)[module] for _ in range(3)) / 1000
+    assert elapsed < budget, f"{module} took {elapsed:.0f}ms to import"
@@ -0,0 +1,27 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import array
+
+import numpy as np
+import pytest
+
+chic = pytest.importorskip("jcvi.assembly.chic")
+
+
+@pytest.mark.parametrize("objective", ["M", "P", "Q"])
+def test_score_evaluate_large_genome(objective):
+    # The cumulative sizes pass 2^31, contigs 0 and 3 are too far apart to count
+    sizes = np.array([10, 2100000000, 2100000000, 10], dtype=np.intc)
+    if objective == "M":
+        matrix = np.zeros((4, 4), dtype=np.intc)
+        matrix[0, 3] = 5
+    elif objective == "P":
+        matrix = np.zeros((4, 4, 2), dtype=np.intc)
+        matrix[0, 3] = (5, 100)
+    else:
+        matrix = np.full((4, 4, 12), -1, dtype=np.intc)
+        matrix[0, 3] = 5
+    tour = array.array("i", [0, 1, 2, 3])
+    score_evaluate = getattr(chic, "score_evaluate_" + objective)
+    assert score_evaluate(tour, sizes, matrix) == (0.0,)
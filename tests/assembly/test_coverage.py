@@ -0,0 +1,19 @@
+import numpy as np
+
+from jcvi.assembly.coverage import Coverage
+
+
+def test_get_depth(tmp_path):
+    bedfile = tmp_path / "reads.bed"
+    bedfile.write_text("ctg1\t2\t6\nctg1\t4\t12\nctg1\t10\t15\nctg1\t20\t25\n")
+    sizesfile = tmp_path / "genome.sizes"
+    sizesfile.write_text("ctg1\t10\nctg2\t5\n")
+
+    cov = Coverage(str(bedfile), str(sizesfile))
+    assert cov.get_depth("ctg1").tolist() == [0, 0, 1, 1, 2, 2, 1, 1, 1, 1]
+    assert np.array_equal(cov.get_depth("ctg2"), np.zeros(5))
+    assert list(cov.iter_bedgraph()) == [
+        ("ctg1", 2, 4, 1),
+        ("ctg1", 4, 6, 2),
+        ("ctg1", 6, 10, 1),
+    ]
@@ -0,0 +1,77 @@
+from itertools import combinations
+
+import numpy as np
+
+from jcvi.algorithms.formula import calc_ldscore
+from jcvi.assembly.geneticmap import (
+    hamming_distance,
+    ld_matrix,
+    marker_matrix,
+    mstmap_cache,
+    read_subsampled_matrix,
+    row_hamming,
+    write_mstmap,
+)
+
+
+def _genotypes(nmarkers=40, nind=30, seed=0):
+    rs = np.random.RandomState(seed)
+    return ["".join(rs.choice(list("AABBX-"), size=nind)) for _ in range(nmarkers)]
+
+
+def test_hamming():
+    genotypes = _genotypes()
+    M = marker_matrix(genotypes)
+    assert M.shape == (40, 30)
+
+    d = row_hamming(M[:-1], M[1:], ignore="-")
+    for i in range(len(genotypes) - 1):
+        assert d[i] == hamming_distance(genotypes[i], genotypes[i + 1], ignore="-")
+
+
+def test_ld_matrix():
+    genotypes = _genotypes(seed=1) + ["-" * 30]
+    R = ld_matrix(marker_matrix(genotypes), block=9)
+    for i, j in combinations(range(len(genotypes)), 2):
+        expected = calc_ldscore(genotypes[i], genotypes[j])
+        assert np.isclose(R[i, j], expected)
+        assert np.isclose(R[j, i], expected)
+
+
+def test_mstmap_cache(tmp_path):
+    genotypes = _genotypes(nmarkers=12, nind=8, seed=2)
+    mstmap = tmp_path / "map.txt"
+    rows = ["locus_name\tseqid\tposition\t" + "\t".join(f"s{i}" for i in range(8))]
+    for i, g in enumerate(genotypes):
+        rows.append(f"chr1.{i + 1}\tchr1\t{i + 1}\t" + "\t".join(g))
+    mstmap.write_text("\n".join(rows) + "\n")
+
+    G, ids = mstmap_cache(str(mstmap))
+    assert np.array_equal(G, marker_matrix(genotypes))
+    assert list(ids) == [f"chr1.{i + 1}".encode() for i in range(12)]
+
+    M, markerbedfile, nmarkers = read_subsampled_matrix(str(mstmap), 100)
+    assert nmarkers == 12
+    assert np.allclose(M, ld_matrix(marker_matrix(genotypes)))
+    assert open(markerbedfile).readline() == "chr1\t0\t1\tchr1.1\n"
+    # Second call reads the cached matrix back
+    M2, _, _ = read_subsampled_matrix(str(mstmap), 100)
+    assert np.array_equal(M, M2)
+
+
+def test_write_mstmap(tmp_path):
+    genotypes = _genotypes(nmarkers=5, nind=4, seed=3)
+    header = ["locus_name"] + [f"s{i}" for i in range(4)]
+    rows = ([f"chr1.{i + 1}"] + list(g) for i, g in enumerate(genotypes))
+    outfile = tmp_path / "map.txt"
+    assert write_mstmap(rows, header, "DH", 0.25, filename=str(outfile)) == 5
+    lines = outfile.read_text().splitlines()
+    assert "number_of_loci 5" in lines
+    assert "number_of_individual 4" in lines
+    i = lines.index("\t".join(header))
+    assert lines[i + 1 :] == [
+        "\t".join([f"chr1.{j + 1}"] + list(g)) for j, g in enumerate(genotypes)
+    ]
+
+    write_mstmap(iter([]), header, "DH", 0.25, filename=str(outfile), header=False)
+    assert outfile.read_text() == "\t".join(header) + "\n"
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+Compare the latest benchmark run against the history, and flag the benchmarks
+whose throughput dropped by more than --threshold.
+
+Each run of the benchmarks is saved as JSON in the history directory:
+
+$ pytest tests/benchmarks --benchmark-autosave --benchmark-storage=.benchmarks
+$ python tests/benchmarks/compare.py .benchmarks
+
+Throughput is the number of items per second at the fastest round, or rounds
+per second for benchmarks that do not record items. The baseline of each
+benchmark is the median throughput over the previous --window runs. Exits
+with status 1 if any benchmark regressed.
+"""
+
+import argparse
+import json
+import os
+import os.path as op
+from statistics import median
+import sys
+
+
+def find_runs(paths):
+    """
+    JSON files saved by pytest-benchmark, in the paths or under the directories.
+    """
+    filenames = []
+    for path in paths:
+        if op.isdir(path):
+            for dirpath, _, files in os.walk(path):
+                filenames.extend(
+                    op.join(dirpath, x) for x in files if x.endswith(".json")
+                )
+        else:
+            filenames.append(path)
+    runs = []
+    for filename in filenames:
+        with open(filename, encoding="utf-8") as fp:
+            data = json.load(fp)
+        if "benchmarks" in data:
+            runs.append((data.get("datetime", ""), filename, data))
+    runs.sort(key=lambda x: x[:2])
+    return runs
+
+
+def throughputs(data):
+    """
+    Items (or rounds) per second of each benchmark in a run, by full name.
+    """
+    result = {}
+    for b in data["benchmarks"]:
+        fastest = b["stats"]["min"]
+        if fastest <= 0:
+            continue
+        items = b.get("extra_info", {}).get("items", 1)
+        result[b["fullname"]] = items / fastest
+    return result
+
+
+def compare(runs, threshold=0.1, window=1):
+    """
+    Return rows of (name, baseline, current, change) for the latest run, and
+    the names that regressed.
+    """
+    *history, (_, _, latest) = runs
+    history = [throughputs(data) for _, _, data in history[-window:]]
+    rows, regressed = [], []
+    for name, current in sorted(throughputs(latest).items()):
+        previous = [x[name] for x in history if name in x]
+        if not previous:
+            rows.append((name, None, current, None))
+            continue
+        baseline = median(previous)
+        change = current / baseline - 1
+        rows.append((name, baseline, current, change))
+        if change < -threshold:
+            regressed.append(name)
+    return rows, regressed
+
+
+def main(args=None):
+    p = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    p.add_argument("paths", nargs="+", help="Benchmark JSON files or directories")
+    p.add_argument(
+        "--threshold",
+        default=0.1,
+        type=float,
+        help="Flag throughput drops larger than this fraction",
+    )
+    p.add_argument(
+        "--window",
+        default=1,
+        type=int,
+        help="Number of previous runs in the baseline",
+    )
+    opts = p.parse_args(args)
+
+    runs = find_runs(opts.paths)
+    if len(runs) < 2:
+        sys.exit(
+            "Need at least two benchmark runs to compare, found {0}".format(len(runs))
+        )
+
+    rows, regressed = compare(runs, opts.threshold, opts.window)
+    print("Latest run: {0}".format(runs[-1][1]))
+    for name, baseline, current, change in rows:
+        if baseline is None:
+            print("{0}\t{1:.1f}/s\tnew".format(name, current))
+            continue
+        flag = "\tREGRESSION" if name in regressed else ""
+        print(
+            "{0}\t{1:.1f}/s\t{2:.1f}/s\t{3:+.1%}{4}".format(
+                name, baseline, current, change, flag
+            )
+        )
+    if regressed:
+        print(
+            "{0} benchmarks regressed by more than {1:.0%}".format(
+                len(regressed), opts.threshold
+            ),
+            file=sys.stderr,
+        )
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import os
+
+import pytest
+
+# Rounds per benchmark, kept small so the benchmarks also run in the test suite
+ROUNDS = int(os.environ.get("JCVI_BENCHMARK_ROUNDS", "3"))
+
+
+@pytest.fixture
+def throughput(benchmark):
+    """
+    Time func(*args) and record the number of items it processes, so the
+    comparison script can report items per second. `setup` is called before
+    each round, and returns fresh args for functions that modify their input.
+    """
+
+    def run(func, *args, items, setup=None):
+        benchmark.extra_info["items"] = items
+        if setup is not None:
+            return benchmark.pedantic(
+                func, setup=lambda: (setup(), {}), rounds=ROUNDS, iterations=1
+            )
+        return benchmark.pedantic(func, args=args, rounds=ROUNDS, iterations=1)
+
+    return run
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+Synthetic data for the benchmarks. All generators are seeded, so every run
+times the same inputs. `n` is the number of genes, records or points.
+"""
+
+import os
+import random
+
+from jcvi.utils.range import Range
+
+SEED = 42
+NCHR = 10
+GENE_SPACING = 5000
+BLOCK_SIZE = 50
+
+# Scales of the benchmarks, e.g. JCVI_BENCHMARK_SCALES=1000,10000,100000
+SCALES = [
+    int(x) for x in os.environ.get("JCVI_BENCHMARK_SCALES", "1000,10000").split(",")
+]
+
+
+def gene_names(prefix, n):
+    return ["{0}{1:07d}".format(prefix, i) for i in range(n)]
+
+
+def write_bed(filename, prefix, n, nchr=NCHR):
+    """
+    Genes evenly spaced on `nchr` chromosomes, sorted by position.
+    """
+    rng = random.Random(SEED)
+    per_chr = max(n // nchr, 1)
+    with open(filename, "w") as fw:
+        for i, accn in enumerate(gene_names(prefix, n)):
+            seqid = "{0}chr{1:02d}".format(prefix, i // per_chr + 1)
+            start = (i % per_chr) * GENE_SPACING + rng.randint(1, 1000)
+            end = start + rng.randint(500, 3000)
+            strand = rng.choice("+-")
+            print(seqid, start, end, accn, 0, strand, sep="\t", file=fw)
+    return filename
+
+
+def write_blast(filename, qprefix, sprefix, n, noise=0.2):
+    """
+    Tabular BLAST hits between two gene sets, mostly along collinear blocks of
+    BLOCK_SIZE genes (some inverted), plus a fraction of random hits.
+    """
+    rng = random.Random(SEED)
+    qgenes, sgenes = gene_names(qprefix, n), gene_names(sprefix, n)
+    hits = []
+    for block_start in range(0, n, BLOCK_SIZE):
+        block = list(range(block_start, min(block_start + BLOCK_SIZE, n)))
+        targets = block[::-1] if rng.random() < 0.3 else block
+        hits.extend(zip(block, targets))
+    hits.extend((rng.randrange(n), rng.randrange(n)) for _ in range(int(n * noise)))
+    with open(filename, "w") as fw:
+        for qi, si in hits:
+            pctid = rng.uniform(70, 100)
+            hitlen = rng.randint(100, 1000)
+            qstart = rng.randint(1, 500)
+            sstart = rng.randint(1, 500)
+            evalue = 10 ** -rng.randint(5, 100)
+            print(
+                qgenes[qi],
+                sgenes[si],
+                "{0:.2f}".format(pctid),
+                hitlen,
+                rng.randint(0, 20),
+                rng.randint(0, 5),
+                qstart,
+                qstart + hitlen - 1,
+                sstart,
+                sstart + hitlen - 1,
+                "{0:.1g}".format(evalue),
+                "{0:.1f}".format(hitlen * pctid / 50),
+                sep="\t",
+                file=fw,
+            )
+    return filename
+
+
+def gff_lines(n, exons=4):
+    """
+    GFF3 lines for n/(exons + 2) gene models, each with a gene, an mRNA and
+    the exons.
+    """
+    rng = random.Random(SEED)
+    lines = []
+    start = 1
+    for i in range(max(n // (exons + 2), 1)):
+        gene = "gene{0:07d}".format(i)
+        mrna = gene + ".1"
+        strand = rng.choice("+-")
+        bounds = [start]
+        for _ in range(exons * 2 - 1):
+            bounds.append(bounds[-1] + rng.randint(50, 500))
+        end = bounds[-1]
+        prefix = "chr1\tbench\t{0}\t{1}\t{2}\t.\t{3}\t.\t"
+        lines.append(prefix.format("gene", start, end, strand) + "ID=" + gene)
+        lines.append(
+            prefix.format("mRNA", start, end, strand)
+            + "ID={0};Parent={1};Name={0}".format(mrna, gene)
+        )
+        for j in range(exons):
+            lines.append(
+                prefix.format("exon", bounds[2 * j], bounds[2 * j + 1], strand)
+                + "ID={0}.exon{1};Parent={0}".format(mrna, j + 1)
+            )
+        start = end + rng.randint(1000, 5000)
+    return lines
+
+
+def write_fasta(filename, n, length=1000, width=60):
+    rng = random.Random(SEED)
+    with open(filename, "w") as fw:
+        for i in range(n):
+            seq = "".join(rng.choices("ACGT", k=length))
+            print(">seq{0:07d}".format(i), file=fw)
+            for j in range(0, length, width):
+                print(seq[j : j + width], file=fw)
+    return filename
+
+
+def write_anchors(filename, qprefix, sprefix, n):
+    """
+    Anchors file with blocks of BLOCK_SIZE pairs.
+    """
+    rng = random.Random(SEED)
+    qgenes, sgenes = gene_names(qprefix, n), gene_names(sprefix, n)
+    with open(filename, "w") as fw:
+        for block_start in range(0, n, BLOCK_SIZE):
+            print("###", file=fw)
+            for i in range(block_start, min(block_start + BLOCK_SIZE, n)):
+                print(qgenes[i], sgenes[i], rng.randint(50, 2000), sep="\t", file=fw)
+    return filename
+
+
+def points(n, noise=0.2):
+    """
+    (qi, si, score) tuples along collinear diagonals, plus random points, as
+    the input to synteny_scan().
+    """
+    rng = random.Random(SEED)
+    pts = []
+    for block_start in range(0, n, BLOCK_SIZE):
+        offset = rng.randrange(n)
+        for i in range(block_start, min(block_start + BLOCK_SIZE, n)):
+            pts.append((i, offset + i - block_start, rng.randint(50, 2000)))
+    pts.extend(
+        (rng.randrange(n), rng.randrange(n), rng.randint(50, 2000))
+        for _ in range(int(n * noise))
+    )
+    return pts
+
+
+def clusters(n):
+    """
+    Clusters of anchors ((chr, qi), (chr, si), score) as the input to
+    quota.solve_lp(), with overlapping blocks that compete for the quota.
+    """
+    rng = random.Random(SEED)
+    result = []
+    for _ in range(max(n // BLOCK_SIZE, 1)):
+        qstart, sstart = rng.randrange(n), rng.randrange(n)
+        size = rng.randint(5, BLOCK_SIZE)
+        result.append(
+            [
+                (("q", qstart + i), ("s", sstart + i), rng.randint(50, 2000))
+                for i in range(size)
+            ]
+        )
+    return result
+
+
+def ranges(n, nchr=NCHR):
+    rng = random.Random(SEED)
+    result = []
+    for i in range(n):
+        start = rng.randrange(n * 10)
+        end = start + rng.randint(1, 100)
+        seqid = "chr{0:02d}".format(rng.randrange(nchr) + 1)
+        result.append(Range(seqid, start, end, rng.randint(1, 100), i))
+    return result
+
+
+def write_clm(prefix, ntigs, npairs):
+    """
+    CLM file with `npairs` contig pairs in all four orientations, and the
+    matching IDS file. Returns the name of the CLM file.
+    """
+    rng = random.Random(SEED)
+    tigs = ["tig{0:05d}".format(i) for i in range(ntigs)]
+    with open(prefix + ".ids", "w") as fw:
+        print("#Contig\tRECounts\tLength", file=fw)
+        for tig in tigs:
+            print(
+                tig,
+                rng.randint(10, 1000),
+                rng.randint(10000, 500000),
+                sep="\t",
+                file=fw,
+            )
+    clmfile = prefix + ".clm"
+    with open(clmfile, "w") as fw:
+        for _ in range(npairs):
+            a, b = rng.sample(tigs, 2)
+            nlinks = rng.randint(1, 40)
+            for ao in "+-":
+                for bo in "+-":
+                    dists = " ".join(
+                        str(rng.randint(100, 1000000)) for _ in range(nlinks)
+                    )
+                    print(
+                        "{0}{1} {2}{3}".format(a, ao, b, bo),
+                        nlinks,
+                        dists,
+                        sep="\t",
+                        file=fw,
+                    )
+    return clmfile
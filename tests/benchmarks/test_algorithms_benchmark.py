@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import array
+import random
+
+import numpy as np
+import pytest
+
+from .datagen import (
+    SCALES,
+    SEED,
+    clusters,
+    points,
+    ranges,
+    write_bed,
+    write_blast,
+    write_clm,
+)
+
+
+@pytest.mark.benchmark(group="synteny_scan")
+@pytest.mark.parametrize("n", SCALES)
+def test_synteny_scan(throughput, n):
+    from jcvi.compara.synteny import synteny_scan
+
+    pts = points(n)
+
+    def setup():
+        # synteny_scan() sorts the points in place
+        return (pts[:], 20, 20, 5)
+
+    result = throughput(synteny_scan, items=len(pts), setup=setup)
+    assert result and all(len(x) >= 5 for x in result)
+
+
+@pytest.mark.benchmark(group="batch_scan")
+@pytest.mark.parametrize("n", SCALES)
+def test_batch_scan(throughput, tmp_path, n):
+    from jcvi.compara.synteny import batch_scan, read_blast
+    from jcvi.formats.bed import Bed
+
+    qorder = Bed(write_bed(str(tmp_path / "a.bed"), "a", n)).order
+    sorder = Bed(write_bed(str(tmp_path / "b.bed"), "b", n)).order
+    blastfile = write_blast(str(tmp_path / "a.b.blast"), "a", "b", n)
+
+    def scan():
+        filtered_blast = read_blast(blastfile, qorder, sorder)
+        return batch_scan(filtered_blast, xdist=20, ydist=20, N=5)
+
+    assert throughput(scan, items=n)
+
+
+@pytest.mark.benchmark(group="quota LP")
+@pytest.mark.parametrize("n", SCALES)
+def test_quota_solve_lp(throughput, tmp_path, n):
+    from jcvi.compara.quota import solve_lp
+
+    cl = clusters(n)
+    work_dir = str(tmp_path / "work")
+
+    def solve():
+        return solve_lp(cl, (1, 1), work_dir=work_dir)
+
+    selected = throughput(solve, items=len(cl))
+    assert 0 < len(selected) <= len(cl)
+
+
+@pytest.mark.benchmark(group="range_chain")
+@pytest.mark.parametrize("n", SCALES)
+def test_range_chain(throughput, n):
+    from jcvi.utils.range import range_chain
+
+    rr = ranges(n)
+    selected, score = throughput(range_chain, rr, items=n)
+    assert score == sum(x.score for x in selected)
+
+
+@pytest.mark.benchmark(group="lis")
+@pytest.mark.parametrize("n", SCALES)
+def test_longest_increasing_subsequence(throughput, n):
+    from jcvi.algorithms.lis import longest_increasing_subsequence
+
+    rng = random.Random(SEED)
+    xs = [rng.randrange(n) for _ in range(n)]
+    lis = throughput(longest_increasing_subsequence, xs, items=n)
+    assert lis == sorted(lis)
+
+
+@pytest.mark.benchmark(group="lis")
+@pytest.mark.parametrize("n", SCALES)
+def test_heaviest_increasing_subsequence(throughput, n):
+    from jcvi.algorithms.lis import heaviest_increasing_subsequence
+
+    # The weights that can be reached grow with the input, keep the inputs short
+    rng = random.Random(SEED)
+    a = [(rng.randrange(n), rng.randint(1, 5)) for _ in range(n // 10)]
+    his, weight = throughput(heaviest_increasing_subsequence, a, items=len(a))
+    assert weight == sum(w for _, w in his)
+
+
+@pytest.mark.benchmark(group="CLMFile parsing")
+@pytest.mark.parametrize("n", SCALES)
+def test_clmfile(throughput, tmp_path, n):
+    from jcvi.assembly.hic import CLMFile
+
+    npairs = n // 10
+    clmfile = write_clm(str(tmp_path / "a"), max(n // 50, 10), npairs)
+    clm = throughput(CLMFile, clmfile, items=npairs * 4)
+    assert clm.contacts
+
+
+@pytest.mark.benchmark(group="chic scoring")
+@pytest.mark.parametrize("n", SCALES)
+@pytest.mark.parametrize("objective", ["M", "P", "Q"])
+def test_chic_score(throughput, n, objective):
+    from jcvi.assembly import chic
+
+    # The cythonized scores take C int arrays
+    ntigs = min(n // 10, 2000)
+    rng = np.random.default_rng(SEED)
+    sizes = rng.integers(10000, 500000, ntigs).astype(np.intc)
+    if objective == "M":
+        matrix = rng.integers(0, 50, (ntigs, ntigs)).astype(np.intc)
+    elif objective == "P":
+        matrix = rng.integers(0, 50, (ntigs, ntigs, 2)).astype(np.intc)
+    else:
+        matrix = rng.integers(0, 5, (ntigs, ntigs, 12)).astype(np.intc)
+    tour = array.array("i", rng.permutation(ntigs).tolist())
+    score_evaluate = getattr(chic, "score_evaluate_" + objective)
+
+    (score,) = throughput(score_evaluate, tour, sizes, matrix, items=ntigs)
+    assert score > 0
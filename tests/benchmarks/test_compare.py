@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import json
+
+from .compare import main
+
+
+def write_run(filename, datetime, seconds):
+    benchmarks = [
+        {
+            "fullname": name,
+            "stats": {"min": t},
+            "extra_info": {"items": 1000},
+        }
+        for name, t in seconds.items()
+    ]
+    with open(filename, "w") as fw:
+        json.dump({"datetime": datetime, "benchmarks": benchmarks}, fw)
+
+
+def test_compare(tmp_path, capsys):
+    write_run(tmp_path / "0001.json", "2024-01-01T00:00:00", {"a": 1.0, "b": 1.0})
+    write_run(tmp_path / "0002.json", "2024-01-02T00:00:00", {"a": 0.98, "b": 0.5})
+    assert main([str(tmp_path)]) == 0
+    out = capsys.readouterr().out
+    assert "+100.0%" in out and "REGRESSION" not in out
+
+    write_run(tmp_path / "0003.json", "2024-01-03T00:00:00", {"a": 2.0, "c": 1.0})
+    assert main([str(tmp_path), "--threshold", "0.2", "--window", "2"]) == 1
+    out = capsys.readouterr().out
+    assert "a\t1010.2/s\t500.0/s\t-50.5%\tREGRESSION" in out
+    assert "c\t1000.0/s\tnew" in out
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import random
+
+import pytest
+
+from .datagen import (
+    SCALES,
+    SEED,
+    gff_lines,
+    write_anchors,
+    write_bed,
+    write_blast,
+    write_fasta,
+)
+
+
+@pytest.mark.benchmark(group="Bed load and order")
+@pytest.mark.parametrize("n", SCALES)
+def test_bed_order(throughput, tmp_path, n):
+    from jcvi.formats.bed import Bed
+
+    bedfile = write_bed(str(tmp_path / "a.bed"), "a", n)
+
+    def load():
+        return Bed(bedfile).order
+
+    order = throughput(load, items=n)
+    assert len(order) == n
+
+
+@pytest.mark.benchmark(group="Blast iteration")
+@pytest.mark.parametrize("n", SCALES)
+def test_blast_iter(throughput, tmp_path, n):
+    from jcvi.formats.blast import Blast
+
+    blastfile = write_blast(str(tmp_path / "a.b.blast"), "a", "b", n)
+    nhits = sum(1 for _ in open(blastfile))
+
+    def iterate():
+        return sum(b.hitlen for b in Blast(blastfile))
+
+    assert throughput(iterate, items=nhits) > 0
+
+
+@pytest.mark.benchmark(group="GffLine parsing")
+@pytest.mark.parametrize("n", SCALES)
+def test_gffline(throughput, n):
+    from jcvi.formats.gff import GffLine
+
+    lines = gff_lines(n)
+
+    def parse():
+        return [GffLine(x) for x in lines]
+
+    features = throughput(parse, items=len(lines))
+    assert features[-1].type == "exon"
+
+
+@pytest.mark.benchmark(group="Fasta random access")
+@pytest.mark.parametrize("n", SCALES)
+def test_fasta_random_access(throughput, tmp_path, n):
+    from jcvi.formats.fasta import Fasta
+
+    fastafile = write_fasta(str(tmp_path / "a.fasta"), n)
+    f = Fasta(fastafile, index=True)
+    keys = list(f.keys())
+    random.Random(SEED).shuffle(keys)
+
+    def fetch():
+        return sum(len(f[k]) for k in keys)
+
+    assert throughput(fetch, items=n) == n * 1000
+
+
+@pytest.mark.benchmark(group="AnchorFile I/O")
+@pytest.mark.parametrize("n", SCALES)
+def test_anchorfile(throughput, tmp_path, n):
+    from jcvi.compara.base import AnchorFile
+
+    anchorfile = write_anchors(str(tmp_path / "a.b.anchors"), "a", "b", n)
+    outfile = str(tmp_path / "out.anchors")
+
+    def read_write():
+        af = AnchorFile(anchorfile)
+        af.print_to_file(outfile)
+        return af
+
+    af = throughput(read_write, items=n)
+    assert sum(len(x) for x in af.blocks) == n
+    assert open(outfile).read() == open(anchorfile).read()
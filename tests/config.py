@@ -22,6 +22,7 @@ import time
 import yaml
 
 from importlib import import_module
+from shutil import copytree, ignore_patterns
 from shutil import rmtree as rmdir_
 from typing import Optional, Tuple
 
@@ -116,12 +117,16 @@ def test_script(
     start_time = time.time()
 
     tmp_dir = tempfile.mkdtemp()
+    # Run on a copy of the inputs, so that indices and other files written
+    # next to the inputs do not end up in the repo
+    input_dir = op.join(tmp_dir, "__DIR__")
+    copytree(work_dir, input_dir, ignore=ignore_patterns("references", "tests.yml"))
 
     opts, args = "", ""
     if options:
-        opts = _fname_resolver(options, tmp_dir=tmp_dir, work_dir=work_dir)
+        opts = _fname_resolver(options, tmp_dir=tmp_dir, work_dir=input_dir)
     if arguments:
-        args = _fname_resolver(arguments, tmp_dir=tmp_dir, work_dir=work_dir)
+        args = _fname_resolver(arguments, tmp_dir=tmp_dir, work_dir=input_dir)
 
     stdout, stderr = op.join(tmp_dir, "stdout"), op.join(tmp_dir, "stderr")
 
@@ -139,7 +144,7 @@ def test_script(
 
     if not fail:
         for output, reference in zip(outputs, references):
-            output = _fname_resolver(output, tmp_dir=tmp_dir, work_dir=work_dir)
+            output = _fname_resolver(output, tmp_dir=tmp_dir, work_dir=input_dir)
 
             if not op.exists(output):
                 fail = True
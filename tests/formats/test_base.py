@@ -4,7 +4,13 @@ import pytest
 
 from pathlib import Path
 
-from jcvi.formats.base import FileMerger  # adjust import
+from jcvi.formats.base import (
+    FileCache,
+    FileMerger,
+    FileSorter,
+    FileSplitter,
+    RecordIndex,
+)
 
 
 def w(path: Path, data: bytes):
@@ -127,3 +133,104 @@ def test_overwrite_false_raises(tmp_path: Path):
     FileMerger([a], out).merge()
     with pytest.raises(FileExistsError):
         FileMerger([b], out).merge(overwrite=False)
+
+
+def _int_key(line):
+    return int(line.split("\t")[1])
+
+
+@pytest.mark.parametrize("cpus", [1, 2])
+def test_file_sorter_multiple_runs(tmp_path: Path, cpus):
+    import random
+
+    values = list(range(200)) * 2
+    random.Random(42).shuffle(values)
+    src = tmp_path / "in.txt"
+    src.write_text(
+        "#header\n"
+        + "".join("r\t{}\n".format(x) for x in values)
+        + "##FASTA\n>tail\nACGT\n"
+    )
+    out = tmp_path / "out.txt"
+    sorter = FileSorter(
+        str(src),
+        key=_int_key,
+        cpus=cpus,
+        buffer_size=100,
+        max_runs=3,
+        stop_line="##FASTA",
+        unique=True,
+    )
+    sorter.sort(str(out))
+    lines = out.read_text().splitlines()
+    assert lines[0] == "#header"
+    assert lines[1:-3] == ["r\t{}".format(x) for x in range(200)]
+    assert lines[-3:] == ["##FASTA", ">tail", "ACGT"]
+
+
+def test_file_sorter_inplace(tmp_path: Path):
+    src = tmp_path / "in.txt"
+    src.write_text("r\t3\nr\t1\nr\t2")
+    FileSorter(str(src), key=_int_key).sort(str(src))
+    assert src.read_text() == "r\t1\nr\t2\nr\t3\n"
+
+
+def test_file_sorter_unique_keys(tmp_path: Path):
+    # Uniqueness is on the keys, as in `sort -u -k2,2n`
+    src = tmp_path / "in.txt"
+    src.write_text("a\t2\nb\t1\nc\t2\n")
+    FileSorter(str(src), key=_int_key, unique=True).sort(str(src))
+    assert src.read_text() == "b\t1\na\t2\n"
+
+
+@pytest.mark.parametrize("chunk_size", [64, 1 << 20])
+@pytest.mark.parametrize("mode", ["batch", "cycle", "optimal"])
+def test_file_splitter_offsets(tmp_path, monkeypatch, mode, chunk_size):
+    monkeypatch.setattr(RecordIndex, "chunk_size", chunk_size)
+    records = [
+        f"@r{i}\n{'A' * (i % 13 + 1)}\n+\n{'I' * (i % 13 + 1)}\n" for i in range(100)
+    ]
+    fastq = tmp_path / "reads.fastq"
+    w(fastq, "".join(records).encode())
+
+    index = RecordIndex(str(fastq), "fastq")
+    assert len(index) == 100
+    assert (fastq.parent / "reads.fastq.offsets").exists()
+    assert list(RecordIndex(str(fastq), "fastq").offsets) == list(index.offsets)
+
+    fs = FileSplitter(
+        str(fastq), outputdir=str(tmp_path / "out"), format="fastq", mode=mode, cpus=2
+    )
+    fs.split(3, force=True)
+    parts = [Path(x).read_text() for x in fs.names]
+    assert sorted("".join(parts).splitlines(keepends=True)) == sorted(
+        "".join(records).splitlines(keepends=True)
+    )
+    if mode == "batch":
+        assert parts[0] == "".join(records[:34])
+    elif mode == "cycle":
+        assert parts[1] == "".join(records[1::3])
+
+
+def test_file_cache(tmp_path: Path):
+    from jcvi.formats.bed import Bed
+
+    a, b = tmp_path / "a.bed", tmp_path / "b.bed"
+    w(a, b"chr1\t10\t20\tg2\nchr1\t0\t5\tg1\n")
+    w(b, b"chr2\t0\t5\tg3\n")
+    cache = FileCache(maxsize=1)
+    bed = cache.get(Bed, str(a))
+    assert [x.accn for x in bed] == ["g1", "g2"]
+    bed.pop()  # Callers get a copy
+    assert len(cache.get(Bed, str(a))) == 2
+    assert cache.stats()["hits"] == 1
+
+    # Changed files are parsed again
+    w(a, b"chr1\t0\t5\tg1\n")
+    os.utime(a, ns=(0, 0))
+    assert len(cache.get(Bed, str(a))) == 1
+
+    # Least recently used entries are evicted
+    cache.get(Bed, str(b))
+    cache.get(Bed, str(a))
+    assert cache.stats() == {"entries": 1, "maxsize": 1, "hits": 1, "misses": 4}
@@ -9,3 +9,50 @@ def test_summary():
     os.chdir(op.join(op.dirname(__file__), "data"))
     summary(["custom.bed"])
     os.chdir(cwd)
+
+
+def test_bin_bed(tmp_path):
+    import numpy as np
+
+    from jcvi.formats.bed import bin_bed, read_bins, write_bins
+
+    rng = np.random.default_rng(1)
+    seqlen, binsize = 10050, 100
+    starts = rng.integers(0, seqlen - 1, 300)
+    ends = np.minimum(starts + rng.integers(1, 400, 300), seqlen)
+    bedfile = tmp_path / "a.bed"
+    bedfile.write_text(
+        "".join(
+            f"chr1\t{s}\t{e}\tf{i}\t{i % 5}\n"
+            for i, (s, e) in enumerate(zip(starts, ends))
+        )
+    )
+    gapfile = tmp_path / "gaps.bed"
+    gapfile.write_text("chr1\t1000\t1550\nchr1\t5000\t5100\n")
+
+    covered = np.zeros(seqlen, dtype=bool)
+    for s, e in zip(starts, ends):
+        covered[s:e] = True
+    gap = np.zeros(seqlen, dtype=bool)
+    gap[1000:1550] = gap[5000:5100] = True
+    nbins = 101
+
+    binned = bin_bed(
+        str(bedfile), {"chr1": seqlen}, binsize, "span", subtract=str(gapfile)
+    )
+    values, bases = binned["chr1"]
+    expected = np.add.reduceat(covered & ~gap, np.arange(0, seqlen, binsize))
+    assert np.array_equal(values, expected)
+    assert np.array_equal(bases, np.add.reduceat(~gap, np.arange(0, seqlen, binsize)))
+
+    # Count of (unmerged) features touching each bin
+    binned = bin_bed(str(bedfile), {"chr1": seqlen}, binsize, "count", merge=False)
+    expected = np.zeros(nbins)
+    for s, e in zip(starts, ends):
+        expected[s // binsize : (e - 1) // binsize + 1] += 1
+    assert np.array_equal(binned["chr1"][0], expected)
+
+    binfile = write_bins(str(tmp_path / "a.bins.npz"), binned, binsize, "count")
+    loaded = read_bins(binfile)
+    assert np.array_equal(loaded["chr1"][0], expected)
+    assert len(loaded["chr1"][1]) == nbins
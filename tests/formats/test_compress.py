@@ -0,0 +1,129 @@
+import bz2
+import gzip
+import os
+
+import pytest
+
+from jcvi.formats.base import must_open
+from jcvi.formats.compress import (
+    BgzfReader,
+    BgzfWriter,
+    is_bgzf,
+    open_compressed,
+    read_gzi,
+    write_gzi,
+)
+
+
+def _lines(n=50000):
+    return "".join("chr{0}\t{1}\t{2}\n".format(i % 7, i, i * 3) for i in range(n))
+
+
+@pytest.mark.parametrize("threads", [1, 3])
+def test_bgzf_roundtrip(tmp_path, threads):
+    data = os.urandom(100000) + _lines().encode()
+    filename = str(tmp_path / "data.gz")
+    with open_compressed(filename, "wb", threads=threads, index=True) as fw:
+        fw.write(data)
+    assert is_bgzf(filename)
+    # Readable as regular gzip
+    with gzip.open(filename, "rb") as fp:
+        assert fp.read() == data
+    with open_compressed(filename, "rb", threads=threads) as fp:
+        assert fp.read() == data
+
+    entries = read_gzi(filename + ".gzi")
+    assert len(entries) > 1
+    reader = BgzfReader(filename, threads=threads)
+    assert reader.build_index() == entries
+    reader.close()
+
+
+def test_bgzf_seek(tmp_path):
+    data = _lines().encode()
+    filename = str(tmp_path / "data.gz")
+    writer = BgzfWriter(filename, threads=2)
+    writer.write(data)
+    writer.close()
+
+    reader = BgzfReader(filename, threads=2)
+    for offset in (0, 12345, 65280, 200001, len(data) - 10):
+        reader.seek(offset)
+        assert reader.tell() == offset
+        assert reader.read(10) == data[offset : offset + 10]
+
+    reader.seek(100000)
+    voffset = reader.tell_virtual()
+    expected = reader.read(100)
+    reader.seek(0)
+    reader.seek_virtual(voffset)
+    assert reader.read(100) == expected
+    reader.close()
+
+
+def test_bgzf_tell_stale_index(tmp_path):
+    data = _lines().encode()
+    filename = str(tmp_path / "data.gz")
+    with open_compressed(filename, "wb") as fw:
+        fw.write(data)
+    reader = BgzfReader(filename)
+    coffset, uoffset = reader.build_index()[2]
+    reader.close()
+
+    # An index without the block, the offset is found by scanning the headers
+    write_gzi(filename + ".gzi", [(0, 0)])
+    reader = BgzfReader(filename)
+    reader.seek_virtual(coffset << 16)
+    assert reader.tell() == uoffset
+    assert reader.read(10) == data[uoffset : uoffset + 10]
+    with pytest.raises(ValueError):
+        reader._uoffset_of(coffset + 1)
+    reader.close()
+
+
+def test_process_stream_returncode(tmp_path):
+    from jcvi.formats.compress import ProcessStream
+
+    filename = str(tmp_path / "a.txt")
+    with open(filename, "w") as fw:
+        fw.write("a\n")
+    with ProcessStream(["cat"], filename, "r") as fp:
+        assert fp.read() == b"a\n"
+    fp = ProcessStream(["cat"], str(tmp_path / "missing.txt"), "r")
+    with pytest.raises(OSError):
+        fp.read()
+    fp.close()
+
+
+def test_must_open_compressed(tmp_path):
+    text = _lines(1000)
+    for suffix in (".gz", ".bz2"):
+        filename = str(tmp_path / ("a.txt" + suffix))
+        with must_open(filename, "wt") as fw:
+            fw.write(text)
+        with must_open(filename) as fp:
+            assert fp.read() == text
+        # Compressed outputs are binary by default, as with gzip.open()
+        with must_open(filename, "w") as fw:
+            fw.write(text.encode())
+        with must_open(filename, "rb") as fp:
+            assert fp.read() == text.encode()
+
+    plain = tmp_path / "b.txt.gz"
+    with gzip.open(plain, "wt") as fw:
+        fw.write("plain\n")
+    compressed = tmp_path / "c.txt.bz2"
+    with bz2.open(compressed, "wt") as fw:
+        fw.write("bzip2\n")
+    assert not is_bgzf(str(plain))
+    fp = must_open([str(plain), str(compressed)])
+    assert list(fp) == ["plain\n", "bzip2\n"]
+
+
+def test_must_open_zstd(tmp_path):
+    pytest.importorskip("zstandard")
+    filename = str(tmp_path / "a.txt.zst")
+    with must_open(filename, "wt") as fw:
+        fw.write("zstd\n")
+    with must_open(filename) as fp:
+        assert fp.read() == "zstd\n"
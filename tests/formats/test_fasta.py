@@ -23,3 +23,16 @@ def test_iter_clean_fasta():
         assert records == [("seq1", "ACGTxyz*"), ("seq2", "GCC")]
 
     m.assert_called_once_with("test.fasta", "r")
+
+
+def test_write_gaps_bed(tmp_path):
+    from jcvi.formats.fasta import write_gaps_bed
+
+    fastafile = tmp_path / "genome.fasta"
+    fastafile.write_text(">chr2\nACNNNNGT\n>chr1\nNNACGTNNNNNNTT\n")
+    prefix = str(tmp_path / "genome")
+    write_gaps_bed(str(fastafile), prefix, 3, cpus=2)
+    assert (tmp_path / "genome.gaps.bed").read_text().splitlines() == [
+        "chr1\t6\t12\tgap.00001\t6",
+        "chr2\t2\t6\tgap.00002\t4",
+    ]
@@ -71,3 +71,135 @@ def test_make_attributes(attr, gff3, expected):
 def test_parent_key(gff3_line, parent_key, expected):
     gff3_line = GffLine(gff3_line, parent_key=parent_key)
     assert gff3_line.parent == expected
+
+
+def test_gff_index(tmp_path):
+    import os.path as op
+    from shutil import copyfile
+
+    from jcvi.formats.gff import GffIndex
+
+    gff_file = str(tmp_path / "sample.gff")
+    copyfile(op.join(op.dirname(__file__), "gff.py/inputs/sample.gff"), gff_file)
+    g = GffIndex(gff_file)
+
+    mrnas = [x.id for x in g.children("AT2G01008", 1)]
+    assert mrnas == ["AT2G01008.1"]
+    exons = list(g.children("AT2G01008", featuretype="exon", order_by="start"))
+    assert [(x.start, x.stop) for x in exons] == [
+        (1025, 1272),
+        (1458, 1510),
+        (1873, 2810),
+    ]
+    assert g.children_bp("AT2G01008.1", child_featuretype="exon") == 248 + 53 + 938
+    assert [x.id for x in g.parents("AT2G01008.1", featuretype="gene")] == ["AT2G01008"]
+    assert g["AT2G01008"].featuretype == "gene"
+    # Attributes in the order the keys first appear in the file, as gffutils
+    assert str(g["AT2G01008"]).endswith(
+        "ID=AT2G01008;Name=AT2G01008;Note=protein_coding_gene"
+    )
+    with pytest.raises(KeyError):
+        g["DOES_NOT_EXIST"]
+
+    genes = list(g.iter_by_type("gene"))
+    assert len(genes) == g.count_features_of_type("gene")
+    within = list(g.region(("Chr2", 1000, 1300), featuretype="exon"))
+    assert [(x.start, x.end) for x in within] == [(1025, 1272)]
+    assert list(g.region("Chr2:1300-1400", featuretype="exon")) == []
+
+    # Reload from the sidecar gives the same answers
+    assert GffIndex(gff_file).children_bp("AT2G01008.1") == 248 + 53 + 938
+
+
+def test_gff_index_cache_dir(tmp_path, monkeypatch):
+    import os
+    import os.path as op
+    from shutil import copyfile
+
+    from jcvi.formats.gff import GffIndex
+
+    gff_file = str(tmp_path / "sample.gff")
+    copyfile(op.join(op.dirname(__file__), "gff.py/inputs/sample.gff"), gff_file)
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    monkeypatch.setattr(GffIndex, "_writable", lambda self: False)
+    g = GffIndex(gff_file)
+    # The input dir is read-only, the index goes to the user cache dir
+    assert g.idxfile.startswith(str(tmp_path / "cache"))
+    assert op.exists(g.idxfile) and not op.exists(gff_file + ".idx.npz")
+    assert GffIndex(gff_file).children_bp("AT2G01008.1") == 248 + 53 + 938
+    assert sorted(os.listdir(tmp_path)) == ["cache", "sample.gff"]
+
+
+@pytest.mark.parametrize("bgzf", [False, True])
+def test_gff_index_gz(tmp_path, monkeypatch, bgzf):
+    import gzip
+    import os.path as op
+
+    from jcvi.formats import compress
+    from jcvi.formats.gff import GffIndex
+
+    with open(op.join(op.dirname(__file__), "gff.py/inputs/sample.gff"), "rb") as fp:
+        data = fp.read()
+    gff_file = str(tmp_path / "sample.gff.gz")
+    if bgzf:
+        # Small blocks, so that features are spread over many blocks
+        monkeypatch.setattr(compress, "BGZF_BLOCK_SIZE", 1000)
+        with compress.BgzfWriter(gff_file, threads=1) as fw:
+            fw.write(data)
+        assert compress.is_bgzf(gff_file)
+    else:
+        with gzip.open(gff_file, "wb") as fw:
+            fw.write(data)
+
+    g = GffIndex(gff_file)
+    with g._open() as fp:
+        assert fp.seekable()
+    exons = list(g.children("AT2G01008", featuretype="exon", order_by="start"))
+    assert [(x.start, x.stop) for x in exons] == [
+        (1025, 1272),
+        (1458, 1510),
+        (1873, 2810),
+    ]
+    assert g["AT2G01008"].featuretype == "gene"
+    assert [x.id for x in g.parents("AT2G01008.1", featuretype="gene")] == ["AT2G01008"]
+
+
+def test_gff_sort_topological(tmp_path):
+    from jcvi.formats.gff import GffSortKey, sort
+
+    rows = [
+        ("gene", 200, 300, "ID=g2"),
+        ("exon", 50, 100, "Parent=m2"),
+        ("mRNA", 50, 900, "ID=m2;Parent=g1"),
+        ("exon", 500, 1000, "Parent=m1"),
+        ("gene", 1, 1000, "ID=g1"),
+        ("mRNA", 1, 1000, "ID=m1;Parent=g1"),
+        ("exon", 1, 100, "Parent=m1"),
+        ("mRNA", 200, 300, "ID=m3;Parent=g2"),
+    ]
+    gffile = tmp_path / "a.gff"
+    gffile.write_text(
+        "##gff-version 3\n"
+        + "".join("chr1\t.\t{0}\t{1}\t{2}\t.\t+\t.\t{3}\n".format(*x) for x in rows)
+    )
+    outfile = tmp_path / "a.sorted.gff"
+    sort([str(gffile), "-o", str(outfile)])
+    lines = outfile.read_text().splitlines()
+    assert lines[0] == "##gff-version 3"
+    assert [x.split("\t", 8)[8] for x in lines[1:]] == [
+        "ID=g1",
+        "ID=m1;Parent=g1",
+        "Parent=m1",
+        "Parent=m1",
+        "ID=m2;Parent=g1",
+        "Parent=m2",
+        "ID=g2",
+        "ID=m3;Parent=g2",
+    ]
+
+    # Only the features with children are kept in the key
+    assert sorted(GffSortKey(str(gffile)).features) == ["g1", "g2", "m1", "m2"]
+    # Runs of one line each, sorted in worker processes
+    outfile2 = tmp_path / "a.sorted2.gff"
+    sort([str(gffile), "-o", str(outfile2), "--cpus=2", "--buffer_size=0"])
+    assert outfile2.read_text() == outfile.read_text()
@@ -0,0 +1,150 @@
+import numpy as np
+import pytest
+
+pysam = pytest.importorskip("pysam")
+
+from jcvi.formats.sam import (
+    BamShard,
+    contig_depth,
+    count_features,
+    coverage,
+    depth_runs,
+    iter_bam_coverage,
+    iter_shard_depth,
+    map_bam_shards,
+    region_depth,
+    shard_bam,
+)
+
+
+def _make_bam(tmp_path, reads=None):
+    header = {
+        "HD": {"VN": "1.0"},
+        "SQ": [{"SN": "ctg1", "LN": 100}, {"SN": "ctg2", "LN": 40}],
+    }
+    reads = reads or [
+        (0, 10, "10M"),
+        (0, 15, "5M10N5M"),
+        (0, 60, "10M"),
+        (1, 0, "10M"),
+    ]
+    unsorted = str(tmp_path / "unsorted.bam")
+    with pysam.AlignmentFile(unsorted, "wb", header=header) as fw:
+        for i, (tid, start, cigar, *flag) in enumerate(reads):
+            a = pysam.AlignedSegment()
+            a.query_name = f"r{i}"
+            a.flag = flag[0] if flag else 0
+            a.query_sequence = "A" * 10
+            a.reference_id = tid
+            a.reference_start = start
+            a.mapping_quality = 60
+            a.cigarstring = cigar
+            a.query_qualities = pysam.qualitystring_to_array("I" * 10)
+            fw.write(a)
+    bamfile = str(tmp_path / "reads.bam")
+    pysam.sort("-o", bamfile, unsorted)
+    pysam.index(bamfile)
+    return bamfile
+
+
+def test_depth_runs():
+    starts, ends, values = depth_runs(np.array([0, 1, 1, 2, 0, 0, 3]))
+    assert list(zip(starts, ends, values)) == [(1, 3, 1), (3, 4, 2), (6, 7, 3)]
+
+
+def count_reads(bam, shard):
+    return shard, [read.query_name for read in shard.fetch(bam)]
+
+
+@pytest.mark.parametrize("cpus", [1, 3])
+def test_shard_bam(tmp_path, cpus):
+    bamfile = _make_bam(tmp_path)
+    with pysam.AlignmentFile(bamfile) as bam:
+        depth = region_depth(bam, "ctg1", 5, 40, split=True, batch_size=2)
+    assert list(depth) == [0] * 5 + [1] * 5 + [2] * 5 + [0] * 10 + [1] * 5 + [0] * 5
+    shards = shard_bam(bamfile, nshards=4)
+    # ctg1 holds 3 of the 4 reads, so gets 3 of the 4 shards
+    assert [x.contig for x in shards] == ["ctg1"] * 3 + ["ctg2"]
+    assert shards[0] == BamShard("ctg1", 0, 33)
+    assert shards[-1] == BamShard("ctg2", 0, 40)
+    assert len(shard_bam(bamfile, nshards=1, max_size=30)) == 6
+
+    results = list(map_bam_shards(count_reads, bamfile, shards, cpus=cpus))
+    assert [x[0] for x in results] == shards
+    names = [name for shard, names in results for name in names]
+    assert sorted(names) == ["r0", "r1", "r2", "r3"]
+
+    depths = list(iter_shard_depth(bamfile, cpus=cpus, split=True, max_size=30))
+    assert max(len(depth) for shard, depth in depths) <= 30
+    for contig, length in (("ctg1", 100), ("ctg2", 40)):
+        expected = contig_depth(bamfile, contig, length, split=True)
+        parts = [depth for shard, depth in depths if shard.contig == contig]
+        assert np.array_equal(np.concatenate(parts), expected)
+
+
+@pytest.mark.parametrize("cpus", [1, 2])
+def test_iter_bam_coverage(tmp_path, cpus):
+    bamfile = _make_bam(tmp_path)
+    covs = {c: runs for c, _, runs in iter_bam_coverage(bamfile, cpus=cpus)}
+    starts, ends, values = covs["ctg1"]
+    assert list(zip(starts, ends, values)) == [
+        (10, 15, 1),
+        (15, 20, 2),
+        (20, 35, 1),
+        (60, 70, 1),
+    ]
+
+    covs = {c: runs for c, _, runs in iter_bam_coverage(bamfile, split=True)}
+    starts, ends, values = covs["ctg1"]
+    assert list(zip(starts, ends, values)) == [
+        (10, 15, 1),
+        (15, 20, 2),
+        (30, 35, 1),
+        (60, 70, 1),
+    ]
+
+
+def test_coverage_and_count(tmp_path):
+    bamfile = _make_bam(tmp_path)
+    fastafile = tmp_path / "genome.fasta"
+    fastafile.write_text(">ctg1\n" + "A" * 100 + "\n>ctg2\n" + "A" * 40 + "\n")
+    outfile = tmp_path / "reads.mean"
+    coverage(
+        [
+            str(fastafile),
+            bamfile,
+            "--nosort",
+            "--format=coverage",
+            f"--outfile={outfile}",
+        ]
+    )
+    assert outfile.read_text().split("\n")[:2] == ["ctg1\t0.4", "ctg2\t0.2"]
+
+    gtf = tmp_path / "genes.gtf"
+    gtf.write_text(
+        'ctg1\tt\texon\t1\t12\t.\t+\t.\tgene_id "g1"; transcript_id "t1";\n'
+        'ctg1\tt\texon\t14\t40\t.\t+\t.\tgene_id "g2"; transcript_id "t2";\n'
+    )
+    counts = count_features(bamfile, str(gtf), min_mapq=10, cpus=2)
+    assert counts["g2"] == 1
+    assert counts["__ambiguous"] == 1
+    assert counts["__no_feature"] == 2
+
+
+def test_count_features_mates(tmp_path):
+    # Second reads are counted only when their mate is unmapped
+    paired, read2, mate_unmapped = 0x1, 0x80, 0x8
+    reads = [
+        (0, 0, "10M", paired | 0x40),
+        (0, 2, "10M", paired | read2),
+        (0, 20, "10M", paired | read2 | mate_unmapped),
+    ]
+    bamfile = _make_bam(tmp_path, reads)
+    gtf = tmp_path / "genes.gtf"
+    gtf.write_text(
+        'ctg1\tt\texon\t1\t12\t.\t+\t.\tgene_id "g1"; transcript_id "t1";\n'
+        'ctg1\tt\texon\t21\t40\t.\t+\t.\tgene_id "g2"; transcript_id "t2";\n'
+    )
+    counts = count_features(bamfile, str(gtf), min_mapq=10)
+    assert counts["g1"] == 1
+    assert counts["g2"] == 1
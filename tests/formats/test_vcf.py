@@ -0,0 +1,103 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("pyfaidx")
+pytest.importorskip("pyliftover")
+
+from jcvi.formats.vcf import VcfReader, encode_genotype, encode_genotypes, g2x
+
+VCF = """##fileformat=VCFv4.1
+##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">
+#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tS1.a\tS2.b\tS3.c
+chr1\t100\t.\tA\tG\t50\t.\tDP=9;Note=é\tGT:PL:DP:GQ\t0/0:0,9,99:9:20\t0/1:9,0,99:2:20\t1/1:99,9,0:12:20
+chr1\t250\trs1\tC\tT\t50\t.\t.\tGT:PL:DP\t./.:.:.\t1|0:9,0,99:7\t0/0:0,9,99:30
+chr2\t80\t.\tG\tA,C,T,GA,GC,GT,GG,AA,CC,TT\t50\t.\t.\tGT:DP\t0/10:4\t1:5\t10/2:8
+chr2\t90\t.\tG\tA\t50\t.\t.\tGT\t0/0\t1/1\t.
+"""
+
+
+def _write(tmp_path):
+    vcffile = tmp_path / "test.vcf"
+    vcffile.write_text(VCF)
+    return str(vcffile)
+
+
+def test_vcf_batches(tmp_path):
+    vcffile = _write(tmp_path)
+    reader = VcfReader(vcffile, batchsize=3)
+    assert reader.samples == ["S1.a", "S2.b", "S3.c"]
+    batches = list(reader.iter_batches())
+    assert [len(x) for x in batches] == [3, 1]
+
+    batch = batches[0]
+    assert batch.seqid == ["chr1", "chr1", "chr2"]
+    assert batch.pos.tolist() == [100, 250, 80]
+    assert batch.rsid == [".", "rs1", "."]
+    assert batch.genotypes().tolist() == [
+        [[0, 0], [0, 1], [1, 1]],
+        [[-1, -1], [1, 0], [0, 0]],
+        [[0, 10], [1, 1], [10, 2]],
+    ]
+    assert batch.format_ints(2).tolist() == [[9, 2, 12], [-1, 7, 30], [-1, -1, -1]]
+    assert batch.format_ints(1).tolist()[2] == [4, 5, 8]
+
+    rows = [x.split("\t") for x in VCF.splitlines() if x[0] != "#"]
+    codes = np.vstack([encode_genotypes(x) for x in batches])
+    for row, code in zip(rows, codes):
+        expected = [
+            encode_genotype(x) if x.split(":")[0] in g2x and x[4:5] != "." else None
+            for x in row[9:]
+        ]
+        for e, c in zip(expected, code):
+            if e is not None:
+                assert e == c
+
+    with VcfReader(vcffile, samples=["S3.c", "S1.a"]) as reader:
+        (batch,) = list(reader.iter_batches())
+    assert reader.fp.closed
+    assert batch.genotypes()[:, :, 0].tolist() == [[1, 0], [0, -1], [10, 0], [-1, 0]]
+
+    # Phased and 1/0 calls are encoded regardless of the allele order
+    assert codes[1].tolist() == ["-", "X", "A"]
+
+
+def test_vcf_region(tmp_path):
+    pysam = pytest.importorskip("pysam")
+    vcffile = _write(tmp_path)
+    positions = [v.pos for v in VcfReader(vcffile, region="chr1:200-300")]
+    assert positions == [250]
+
+    gzfile = pysam.tabix_index(vcffile, preset="vcf", force=True)
+    reader = VcfReader(gzfile, region="chr2")
+    assert reader.index == gzfile + ".tbi"
+    assert [v.pos for v in reader] == [80, 90]
+    assert [v.pos for v in VcfReader(gzfile, region="chr3")] == []
+
+
+def test_load_liftover(tmp_path, monkeypatch):
+    import os
+    import os.path as op
+
+    from jcvi.formats.vcf import liftover_cachefile, load_liftover
+
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    chainfile = tmp_path / "a.chain"
+    chainfile.write_text(
+        "chain 1000 chr1 1000 + 0 1000 chrA 1100 + 100 1100 1\n1000\n\n"
+    )
+    chainfile = str(chainfile)
+    cachefile = liftover_cachefile(chainfile)
+    assert cachefile.startswith(str(tmp_path / "cache"))
+    assert load_liftover(chainfile).convert_coordinate("chr1", 10)[0][:2] == (
+        "chrA",
+        110,
+    )
+    assert os.listdir(op.dirname(cachefile)) == [op.basename(cachefile)]
+    assert load_liftover(chainfile).convert_coordinate("chr1", 20)[0][1] == 120
+    # Nothing is written next to the chain file
+    assert sorted(os.listdir(tmp_path)) == ["a.chain", "cache"]
+
+    # A corrupt cache is rebuilt
+    with open(cachefile, "wb") as fw:
+        fw.write(b"junk")
+    assert load_liftover(chainfile).convert_coordinate("chr1", 10)[0][1] == 110
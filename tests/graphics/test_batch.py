@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import os
+import os.path as op
+
+import pytest
+
+from jcvi.graphics.batch import read_manifest, render, render_batch
+
+
+def test_render_batch(tmp_path):
+    manifest = tmp_path / "manifest.txt"
+    manifest.write_text(
+        "# figures\n"
+        f"karyotype seqids layout --notex -o {tmp_path / 'karyotype.png'}\n"
+        "\n"
+        "karyotype\n"
+        "jcvi.graphics.nosuchmodule foo\n"
+    )
+    jobs = read_manifest(str(manifest))
+    assert [(x.lineno, x.module) for x in jobs] == [
+        (2, "jcvi.graphics.karyotype"),
+        (4, "jcvi.graphics.karyotype"),
+        (5, "jcvi.graphics.nosuchmodule"),
+    ]
+
+    cwd = os.getcwd()
+    os.chdir(op.join(op.dirname(__file__), "data"))
+    try:
+        results = sorted(render_batch(jobs, cpus=2), key=lambda x: x.job.lineno)
+        with pytest.raises(SystemExit):
+            render([str(manifest), "-o", str(tmp_path / "report.tsv")])
+    finally:
+        os.chdir(cwd)
+
+    assert [x.ok for x in results] == [True, False, False]
+    assert results[1].error == "exit status 1"
+    assert results[2].error.startswith("ModuleNotFoundError")
+    assert op.exists(tmp_path / "karyotype.png")
+    report = (tmp_path / "report.tsv").read_text().splitlines()
+    assert [x.split("\t")[2] for x in report] == ["ok", "failed", "failed"]
+
+
+def test_render_batch_worker_dies(tmp_path, monkeypatch):
+    from jcvi.graphics.batch import RenderJob
+
+    (tmp_path / "figok.py").write_text("def main(args):\n    pass\n")
+    (tmp_path / "figcrash.py").write_text(
+        "import os\n\n\ndef main(args):\n    os._exit(3)\n"
+    )
+    monkeypatch.syspath_prepend(str(tmp_path))
+    modules = ["figok", "figcrash", "figok", "figok", "figok"]
+    jobs = [RenderJob(i, x, []) for i, x in enumerate(modules, 1)]
+    results = sorted(render_batch(jobs, cpus=2), key=lambda x: x.job.lineno)
+    assert [x.job.lineno for x in results] == [1, 2, 3, 4, 5]
+    assert [x.ok for x in results] == [True, False, True, True, True]
+    assert results[1].error == "worker process died"
@@ -22,3 +22,23 @@ def test_downsample():
     assert len(few_data) == 10
     assert len(downsample(few_data)) == 10
     assert len(downsample(few_data, 1)) == 1
+
+
+def test_density_image():
+    import numpy as np
+    from jcvi.graphics.dotplot import density_image
+
+    qi = np.array([0, 1, 9, 9, 9])
+    si = np.array([0, 0, 19, 19, 10])
+    values = np.array([0.0, 1.0, 1.0, 1.0, 0.5])
+    image = density_image(qi, si, 10, 20, (5, 4), values=values, vmax=1)
+    assert image.shape == (4, 5, 4)
+    alpha = image[..., 3]
+    assert (alpha > 0).sum() == 3
+    assert alpha[0, 0] == alpha[3, 4] == 1 > alpha[2, 4] > 0.25
+
+    rgb = np.array([[0, 0, 0], [1, 0, 0], [0, 0, 1]], dtype=float)
+    colors = np.array([1, 2, 1, 1, 2])
+    image = density_image(qi, si, 10, 20, (5, 4), rgb=rgb, colors=colors)
+    assert np.allclose(image[0, 0, :3], [0.5, 0, 0.5])
+    assert np.allclose(image[3, 4, :3], [1, 0, 0])
@@ -57,3 +57,58 @@ def test_main():
     image_name = synteny_main(["blocks", "grape_peach.bed", "blocks.layout"])
     assert op.exists(image_name)
     os.chdir(cwd)
+
+
+def test_draw_shades():
+    import matplotlib.pyplot as plt
+    import numpy as np
+
+    from jcvi.graphics.synteny import SHADE_CODES, Shade, draw_shades, shade_vertices
+
+    a = [((0.1, 0.8), (0.2, 0.8)), ((0.3, 0.8), (0.4, 0.8)), ((None, None), (0.5, 0.8))]
+    b = [((0.2, 0.2), (0.3, 0.2)), ((0.6, 0.2), (0.5, 0.2)), ((0.7, 0.2), (0.8, 0.2))]
+    verts = shade_vertices(a[:2], b[:2], ymid_pad=0.1)
+    assert verts.shape == (2, len(SHADE_CODES["curve"]), 2)
+    assert tuple(verts[0, 1]) == (0.1, 0.6)
+    assert shade_vertices(a[:2], b[:2], style="line").shape == (2, 5, 2)
+
+    fig, ax = plt.subplots()
+    a.append(((0.5, 0.8), (0.6, 0.8)))
+    b.append(((0.1, 0.2), (0.2, 0.2)))
+    collections = draw_shades(ax, a, b, highlights=[None, "r", None, None], fc="g")
+    # One collection per color, of the shades with valid coordinates
+    assert [len(x.get_paths()) for x in collections] == [2, 1]
+    assert [x.get_zorder() for x in collections] == [1, 2]
+    assert np.allclose(
+        collections[0].get_paths()[1].vertices, shade_vertices(a[3:], b[3:])[0]
+    )
+    for collection in collections:
+        collection.remove()
+
+    Shade(ax, a[0], b[0], 0.1)
+    (patch,) = ax.patches
+    assert np.allclose(patch.get_path().vertices, verts[0])
+    plt.close(fig)
+
+
+def test_draw_shades_overlap():
+    import matplotlib.pyplot as plt
+    import numpy as np
+
+    from jcvi.graphics.synteny import draw_shades
+
+    # Two overlapping ribbons, the second with its segments reversed
+    a = [((0.1, 0.9), (0.6, 0.9)), ((0.9, 0.9), (0.4, 0.9))]
+    b = [((0.1, 0.1), (0.6, 0.1)), ((0.9, 0.1), (0.4, 0.1))]
+    fig = plt.figure(figsize=(1, 1), dpi=100)
+    ax = fig.add_axes((0, 0, 1, 1))
+    ax.set_xlim(0, 1)
+    ax.set_ylim(0, 1)
+    ax.set_axis_off()
+    draw_shades(ax, a, b, style="line", ec="none", fc="k", alpha=1)
+    fig.canvas.draw()
+    image = np.asarray(fig.canvas.buffer_rgba())
+    plt.close(fig)
+    # The overlap is filled like the parts covered by one shade
+    assert tuple(image[50, 20]) != (255, 255, 255, 255)
+    assert tuple(image[50, 50]) == tuple(image[50, 20]) == tuple(image[50, 80])
@@ -0,0 +1,81 @@
+import gzip
+import os
+
+import pytest
+
+moto = pytest.importorskip("moto")
+
+from jcvi.formats.base import must_open
+from jcvi.utils.aws import S3Cache, S3Reader, S3Writer, get_s3_client
+
+
+@pytest.fixture
+def bucket(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    with moto.mock_aws():
+        get_s3_client.cache_clear()
+        get_s3_client().create_bucket(Bucket="jcvi")
+        yield "s3://jcvi"
+    get_s3_client.cache_clear()
+
+
+def test_s3_reader_ranges(bucket, tmp_path):
+    data = os.urandom(300000)
+    get_s3_client().put_object(Bucket="jcvi", Key="a.bin", Body=data)
+    cache = S3Cache(root=str(tmp_path / "cache"), max_size=200000)
+    reader = S3Reader(bucket + "/a.bin", threads=3, part_size=65536, cache=cache)
+    assert reader.read() == data
+    reader.seek(123456)
+    assert reader.read(1000) == data[123456:124456]
+    reader.seek(-10, os.SEEK_END)
+    assert reader.read() == data[-10:]
+    reader.close()
+
+    # Cache is bounded and still serves the same content
+    cached = sum(len(files) for _, _, files in os.walk(cache.root))
+    assert 0 < cached <= 3
+    reader = S3Reader(bucket + "/a.bin", threads=2, part_size=65536, cache=cache)
+    assert reader.read() == data
+    reader.close()
+
+
+def test_s3_writer_multipart(bucket):
+    data = os.urandom(12 * 1024 * 1024)
+    writer = S3Writer(bucket + "/big.bin", threads=2, part_size=5 * 1024 * 1024)
+    writer.write(data)
+    writer.close()
+    body = get_s3_client().get_object(Bucket="jcvi", Key="big.bin")["Body"].read()
+    assert body == data
+
+
+def test_s3_cache_opt_in(bucket, monkeypatch, tmp_path):
+    get_s3_client().put_object(Bucket="jcvi", Key="a.txt", Body=b"ACGT")
+    monkeypatch.delenv("JCVI_S3_CACHE", raising=False)
+    with S3Reader(bucket + "/a.txt") as reader:
+        assert reader.cache is None
+        assert reader.read() == b"ACGT"
+
+    cachedir = tmp_path / "cache"
+    monkeypatch.setenv("JCVI_S3_CACHE", str(cachedir))
+    with S3Reader(bucket + "/a.txt") as reader:
+        assert reader.cache.root == str(cachedir)
+        assert reader.read() == b"ACGT"
+    assert sum(len(files) for _, _, files in os.walk(cachedir)) == 1
+
+
+def test_must_open_s3(bucket, monkeypatch, tmp_path):
+    monkeypatch.setenv("JCVI_S3_CACHE", str(tmp_path / "cache"))
+    text = "".join("line{0}\n".format(i) for i in range(10000))
+    for name in ("a.txt", "a.txt.gz"):
+        with must_open(bucket + "/" + name, "wt") as fw:
+            fw.write(text)
+        with must_open(bucket + "/" + name) as fp:
+            assert fp.read() == text
+
+    get_s3_client().put_object(
+        Bucket="jcvi", Key="b.txt.gz", Body=gzip.compress(text.encode())
+    )
+    with must_open(bucket + "/b.txt.gz") as fp:
+        assert fp.readline() == "line0\n"
@@ -0,0 +1,59 @@
+import json
+import sys
+
+from jcvi.apps.base import ActionDispatcher, OptionParser, pop_profile_report
+from jcvi.utils.profiler import SPAN_STATS, run_profiled, span, span_report
+
+
+def test_pop_profile_report():
+    args = ["a.blast", "--profile_report", "p.json", "--pctid=90"]
+    assert pop_profile_report(args) == ("p.json", ["a.blast", "--pctid=90"])
+    args = ["--profile_report=p.json", "a.blast"]
+    assert pop_profile_report(args) == ("p.json", ["a.blast"])
+    assert pop_profile_report(["a.blast"]) == (None, ["a.blast"])
+
+
+def test_profile_report_option(monkeypatch):
+    def options(args):
+        p = OptionParser(options.__doc__)
+        parsed.append(any("--profile_report" in x.option_strings for x in p._actions))
+
+    # Only parsers of the actions run by ActionDispatcher take the option
+    parsed = []
+    options([])
+    monkeypatch.setattr(sys, "argv", ["jcvi/test.py", "options"])
+    ActionDispatcher((("options", "list the options"),)).dispatch(locals())
+    options([])
+    assert parsed == [False, True, False]
+
+
+def test_span():
+    SPAN_STATS.clear()
+    for _ in range(2):
+        with span("outer"):
+            with span("inner") as stage:
+                stage.add(5)
+    report = {x["path"]: x for x in span_report()}
+    assert report["outer"]["calls"] == report["outer/inner"]["calls"] == 2
+    assert report["outer/inner"]["items"] == 10
+    outer = report["outer"]
+    assert outer["self_seconds"] <= outer["seconds"]
+
+
+def action(args):
+    with span("stage") as stage:
+        stage.add(len(args))
+        sum(range(1000))
+
+
+def test_run_profiled(tmp_path):
+    report = tmp_path / "profile.json"
+    run_profiled(action, ["a", "b"], str(report), name="test action")
+    data = json.loads(report.read_text())
+    assert data["action"] == "test action"
+    assert data["argv"] == ["a", "b"]
+    spans = {x["path"]: x for x in data["spans"]}
+    assert spans["test action/stage"]["items"] == 2
+    assert any(x["function"].endswith("(action)") for x in data["top_functions"])
+    assert (tmp_path / "profile.prof").exists()
+    assert (tmp_path / "profile.folded").exists()
@@ -0,0 +1,136 @@
+import gzip
+
+import numpy as np
+
+from jcvi.variation.cnv import (
+    LogSpaceHMM,
+    WindowSum,
+    build_gc_array,
+    gc_medians,
+    gcdepth,
+    iter_fasta_arrays,
+    load_cib,
+)
+
+
+def test_window_sum():
+    a = np.arange(1003)
+    ws = WindowSum(10)
+    for i in range(0, len(a), 7):
+        ws.add(a[i : i + 7])
+    expected = a[:1000].reshape(-1, 10).sum(axis=1)
+    assert np.array_equal(ws.result, expected)
+
+
+def test_load_cib(tmp_path):
+    depth = np.random.RandomState(0).randint(0, 256, size=25000)
+    cib = (depth - 128).astype(np.int8)
+    cibfile = str(tmp_path / "s.chr1.cib")
+    expected = depth[:25000].reshape(-1, 1000).mean(axis=1)
+    cib.tofile(cibfile)
+    assert np.allclose(load_cib(cibfile), expected)
+    with gzip.open(cibfile + ".gz", "wb") as fw:
+        fw.write(cib.tobytes())
+    assert np.allclose(load_cib(cibfile + ".gz"), expected)
+    assert load_cib(str(tmp_path / "missing.cib")) is None
+
+
+def test_build_gc_array(tmp_path):
+    fastafile = str(tmp_path / "ref.fa.gz")
+    with gzip.open(fastafile, "wt") as fw:
+        fw.write(">chr1 description\nGGCCAATT\nNNNN\nGCAT\n>chrX\nATATAT\nGG\n")
+    seqs = {}
+    for seqid, bases in iter_fasta_arrays(fastafile, blocksize=5):
+        seqs[seqid] = seqs.get(seqid, b"") + bases.tobytes()
+    assert seqs == {"chr1": b"GGCCAATTNNNNGCAT", "chrX": b"ATATATGG"}
+
+    gcdir = str(tmp_path / "gc")
+    build_gc_array(fastafile, gcdir=gcdir, n=4)
+    gc = np.fromfile(f"{gcdir}/chr1.4.gc", dtype=np.uint8)
+    assert gc.tolist() == [100, 0, 0, 50]
+    gc = np.fromfile(f"{gcdir}/chrX.4.gc", dtype=np.uint8)
+    assert gc.tolist() == [0, 50]
+
+
+def test_gcdepth_sampledir(tmp_path, monkeypatch):
+    rs = np.random.RandomState(0)
+    gcdir, sampledir = tmp_path / "gc", tmp_path / "s"
+    gcdir.mkdir()
+    sampledir.mkdir()
+    rs.randint(30, 60, size=50).astype(np.uint8).tofile(gcdir / "chr1.100.gc")
+    depth = rs.randint(10, 50, size=5000)
+    (depth - 128).astype(np.int8).tofile(sampledir / "s.chr1.cib")
+
+    monkeypatch.chdir(tmp_path)
+    gcdepth(
+        ["s", "test", f"--sampledir={sampledir}", f"--gcdir={gcdir}", "--binsize=100"]
+    )
+    assert (tmp_path / "s.gcdepth.png").exists()
+
+
+def test_gc_medians():
+    gc = np.array([40, 40, 40, 41, 41, 42])
+    depth = np.array([3.0, 1.0, 2.0, 4.0, 6.0, 0.0])
+    med = gc_medians(gc, depth)
+    assert med[40] == 2 and med[41] == 5
+    assert np.isnan(med[42])
+
+
+def _viterbi_reference(model, x):
+    # Plain full-matrix Viterbi over the observed bins only
+    n = model.n
+    logA = np.full((n, n), model.logmu)
+    np.fill_diagonal(logA, model.logstay)
+    obs = np.isfinite(x)
+    logB = model.log_emission(x[obs])
+    delta = model.logstart + logB[0]
+    back = []
+    for e in logB[1:]:
+        scores = delta[:, None] + logA
+        back.append(scores.argmax(axis=0))
+        delta = scores.max(axis=0) + e
+    z = [delta.argmax()]
+    for bp in back[::-1]:
+        z.append(bp[z[-1]])
+    path = np.full(len(x), -1)
+    path[obs] = z[::-1]
+    return path
+
+
+def _forward_reference(model, x):
+    from scipy.special import logsumexp
+
+    n = model.n
+    logA = np.full((n, n), model.logmu)
+    np.fill_diagonal(logA, model.logstay)
+    logB = model.log_emission(x[np.isfinite(x)])
+    alpha = model.logstart + logB[0]
+    for e in logB[1:]:
+        alpha = logsumexp(alpha[:, None] + logA, axis=0) + e
+    return logsumexp(alpha)
+
+
+def test_log_space_hmm():
+    rs = np.random.RandomState(1)
+    means = np.arange(0, 5, 0.5)
+    model = LogSpaceHMM(means, mu=0.01, sigma=0.1)
+    truth = np.repeat(rs.randint(0, len(means), size=8), 25)
+    X = np.vstack(
+        [means[truth] + rs.normal(scale=0.4, size=len(truth)) for _ in range(3)]
+    )
+    X[0, :5] = np.nan
+    X[1, 50:60] = np.nan
+    X[2, -3:] = np.nan
+
+    Z = model.viterbi(X)
+    assert Z.shape == X.shape
+    for x, z in zip(X, Z):
+        assert np.array_equal(z, _viterbi_reference(model, x))
+        assert np.array_equal(model.viterbi(x)[0], z)
+
+    logprob, post = model.forward_backward(X)
+    for x, lp, p in zip(X, logprob, post):
+        assert np.isclose(lp, _forward_reference(model, x))
+        obs = np.isfinite(x)
+        assert np.allclose(p[obs].sum(axis=1), 1)
+        assert np.isnan(p[~obs]).all()
@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("pyfasta")
+
+from jcvi.variation.str import (
+    ChunkedMatrix,
+    alleles_to_counts,
+    column_counts,
+    convert_to_percentile,
+    counts_to_percentile,
+    percentile_block,
+    read_binfile,
+    write_store_mask,
+)
+
+
+def test_chunked_matrix(tmp_path):
+    rs = np.random.RandomState(0)
+    m = rs.randint(-1, 30, size=(23, 17)).astype(np.int32)
+    path = str(tmp_path / "data.store")
+    store = ChunkedMatrix(path, nloci=17, chunks=(5, 4))
+    samples = ["S{}".format(i) for i in range(23)]
+    for start, end in ((0, 3), (3, 4), (4, 16), (16, 23)):
+        store.append(m[start:end], samples[start:end])
+
+    store = ChunkedMatrix(path)
+    assert store.shape == (23, 17)
+    assert store.samples == samples
+    assert np.array_equal(store.read(), m)
+    assert np.array_equal(
+        store.read(samples=slice(2, 13), loci=slice(3, 9)), m[2:13, 3:9]
+    )
+    blocks = [store.read(loci=slice(a, b)) for a, b in store.locus_ranges()]
+    assert np.array_equal(np.hstack(blocks), m)
+
+    sampleids = tmp_path / "samples"
+    sampleids.write_text("\n".join(samples) + "\n")
+    strids = tmp_path / "STR.ids"
+    strids.write_text("\n".join("L{}".format(i) for i in range(17)) + "\n")
+    df, mm, _, _ = read_binfile(path, str(sampleids), str(strids))
+    assert np.array_equal(mm, m)
+
+
+def test_column_counts_percentile():
+    rs = np.random.RandomState(1)
+    m = rs.randint(0, 20, size=(50, 6)) * 1000 + rs.randint(0, 20, size=(50, 6))
+    m[rs.rand(50, 6) < 0.1] = -1
+    m[0, 0] = 999
+    counts = column_counts(m)
+    for i in range(m.shape[1]):
+        assert counts[i] == dict(alleles_to_counts(m[:, i]))
+
+    m %= 1000
+    m[m == 999] = -1
+    percentiles = [counts_to_percentile(c) for c in counts]
+    pvalues = percentile_block(m, percentiles)
+    for i in range(m.shape[1]):
+        _, expected = convert_to_percentile((1, m[:, i], percentiles[i]))
+        assert ["{:.6f}".format(x) for x in pvalues[:, i]] == [
+            x.decode() for x in expected
+        ]
+
+
+def test_write_store_mask(tmp_path):
+    rs = np.random.RandomState(2)
+    m = rs.randint(-1, 10, size=(12, 9)).astype(np.int32)
+    path = str(tmp_path / "data.store")
+    store = ChunkedMatrix(path, nloci=9, chunks=(5, 4))
+    store.append(m, ["S{}".format(i) for i in range(12)])
+
+    percentiles = [counts_to_percentile(c) for c in column_counts(m)]
+    maskstore = str(tmp_path / "mask.store")
+    mstore = write_store_mask(2, path, percentiles, maskstore)
+    assert mstore.chunks == (5, 4)
+    mstore = ChunkedMatrix(maskstore)
+    assert mstore.shape == (12, 9)
+    assert np.array_equal(mstore.read(), percentile_block(m, percentiles))